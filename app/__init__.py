@@ -17,7 +17,33 @@ def create_app(config_class=None):
     db.init_app(app)
     login_manager.init_app(app)
 
-    from app.models.user import User
+    from app.services.log_writer import init_log_writer, enqueue_log
+    from app.services.shop_cache import init_shop_cache, get_shop_cache
+    from app.services.product_router import init_product_router
+    from app.services.recent_orders import init_recent_orders
+    from app.services.http_client import init_http_client
+    from app.services.status_cache import init_status_cache
+    from app.services.card91 import init_handpick_coalescer, init_card91_catalog
+    from app.utils.pagination import init_count_cache
+    from app.services.sql_profiler import init_sql_profiler
+    from app.services.order_alerts import init_order_alerts
+    from app.services.notification import init_notification_dispatcher
+    from app.services.direct_charge import init_direct_charge
+    init_log_writer(app)
+    init_shop_cache(app)
+    init_product_router(app)
+    init_recent_orders(app)
+    init_http_client(app)
+    init_status_cache(app)
+    init_handpick_coalescer(app)
+    init_card91_catalog(app)
+    init_count_cache(app)
+    init_sql_profiler(app)
+    init_order_alerts(app)
+    init_notification_dispatcher(app)
+    init_direct_charge(app)
+
+    from app.models.user import User, clear_permission_cache
     # 导入所有模型以确保 db.create_all() 能正确创建所有表
     from app.models import Product, OrderEvent  # noqa: F401
 
@@ -25,6 +51,10 @@ def create_app(config_class=None):
     def load_user(user_id):
         return db.session.get(User, int(user_id))
 
+    @app.before_request
+    def reset_permission_cache():
+        clear_permission_cache()
+
     from app.routes.auth import auth_bp
     from app.routes.shop import shop_bp
     from app.routes.order import order_bp
@@ -54,10 +84,10 @@ def create_app(config_class=None):
     # API日志中间件 - 记录所有 /api/ 请求
     @app.after_request
     def log_api_request(response):
-        if request.path.startswith('/api/') and 'new-order-count' not in request.path:
+        if (request.path.startswith('/api/') and 'new-order-count' not in request.path
+                and 'order-events' not in request.path):
             try:
                 from app.models.api_log import ApiLog
-                from app.models.shop import Shop
 
                 # 判断接口类型
                 if '/api/game/direct' in request.path:
@@ -87,11 +117,12 @@ def create_app(config_class=None):
                 form_data = request.form.to_dict()
                 customer_id = form_data.get('customerId', '')
                 if customer_id:
-                    shop = Shop.query.filter_by(game_customer_id=str(customer_id), is_enabled=1).first()
+                    shop = get_shop_cache().by_game_customer_id(customer_id)
                     if shop:
                         shop_id = shop.id
 
-                log = ApiLog(
+                enqueue_log(
+                    ApiLog,
                     shop_id=shop_id,
                     api_type=api_type,
                     request_method=request.method,
@@ -102,10 +133,7 @@ def create_app(config_class=None):
                     response_body=resp_body,
                     ip_address=request.remote_addr or request.headers.get('X-Forwarded-For', ''),
                 )
-                db.session.add(log)
-                db.session.commit()
             except Exception as e:
-                db.session.rollback()
                 import logging
                 logging.getLogger(__name__).error(f"API日志记录失败: {e}")
         return response
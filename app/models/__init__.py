@@ -6,6 +6,21 @@ from app.models.operation_log import OperationLog
 from app.models.api_log import ApiLog
 from app.models.product import Product
 from app.models.order_event import OrderEvent
+from app.models.fulfillment_job import FulfillmentJob
+from app.models.callback_outbox import CallbackOutbox
+from app.models.order_search import OrderSearchToken
+from app.models.order_stats import OrderStatHourly, OrderStatDaily, OrderPendingCount
+from app.models.export_job import ExportJob
+from app.models.bulk_job import BulkJob
+from app.models.card_inventory import CardInventory
+from app.models.card_pool_batch import CardPoolBatch
+from app.models.direct_charge import DirectChargeTask
+from app.models.handpick_record import HandPickRecord
+from app.models.schema_migration import SchemaMigration
 
 __all__ = ['Shop', 'Order', 'User', 'UserShopPermission', 'NotificationLog',
-           'OperationLog', 'ApiLog', 'Product', 'OrderEvent']
+           'OperationLog', 'ApiLog', 'Product', 'OrderEvent',
+           'FulfillmentJob', 'CallbackOutbox', 'OrderSearchToken',
+           'OrderStatHourly', 'OrderStatDaily', 'OrderPendingCount', 'ExportJob',
+           'BulkJob', 'CardInventory', 'CardPoolBatch', 'DirectChargeTask', 'HandPickRecord',
+           'SchemaMigration']
@@ -17,6 +17,10 @@ class ApiLog(db.Model):
     ip_address = db.Column(db.String(50), comment='请求IP')
     create_time = db.Column(db.DateTime, default=datetime.now)
 
+    __table_args__ = (
+        db.Index('idx_api_type_id', 'api_type', 'id'),
+    )
+
     def to_dict(self):
         return {
             'id': self.id,
@@ -0,0 +1,98 @@
+"""订单批量操作任务模型。
+
+订单列表的批量通知成功 / 批量退款 / 批量91卡券发货写入一条批量任务，
+少量订单在请求中直接执行，其余由 worker.py 定时领取，按店铺分组并发回调京东，
+分批提交并写回进度，页面轮询任务进度。
+"""
+import json
+from datetime import datetime
+from app.extensions import db
+
+
+class BulkJob(db.Model):
+    """订单批量操作任务表。"""
+    __tablename__ = 'bulk_jobs'
+
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id', ondelete='SET NULL'), nullable=True, comment='创建人ID')
+    username = db.Column(db.String(50), comment='创建人用户名')
+    ip_address = db.Column(db.String(50), comment='创建人IP（写入操作日志）')
+
+    action = db.Column(db.String(30), nullable=False, comment='操作：notify_success/refund/card91_deliver')
+    order_ids = db.Column(db.Text, nullable=False, comment='订单ID列表JSON')
+
+    # 状态：0=排队中 1=执行中 2=已完成 3=失败
+    status = db.Column(db.SmallInteger, nullable=False, default=0, comment='任务状态')
+    total = db.Column(db.Integer, nullable=False, default=0, comment='订单数')
+    processed = db.Column(db.Integer, nullable=False, default=0, comment='已处理订单数')
+    succeeded = db.Column(db.Integer, nullable=False, default=0, comment='成功数')
+    failed = db.Column(db.Integer, nullable=False, default=0, comment='失败数')
+    failures = db.Column(db.Text, comment='失败明细JSON [{id, reason}]')
+    error = db.Column(db.String(500), comment='任务失败原因')
+
+    locked_by = db.Column(db.String(100), comment='执行该任务的进程标识')
+    locked_at = db.Column(db.DateTime, comment='最近一次心跳时间（超时未刷新则标记失败）')
+    create_time = db.Column(db.DateTime, default=datetime.now)
+    start_time = db.Column(db.DateTime, comment='开始时间')
+    finish_time = db.Column(db.DateTime, comment='完成时间')
+
+    __table_args__ = (
+        db.Index('idx_bulk_status', 'status', 'id'),
+        db.Index('idx_bulk_user', 'user_id', 'id'),
+    )
+
+    STATUS_PENDING = 0
+    STATUS_RUNNING = 1
+    STATUS_DONE = 2
+    STATUS_FAILED = 3
+
+    STATUS_MAP = {0: '排队中', 1: '执行中', 2: '已完成', 3: '失败'}
+
+    ACTION_MAP = {
+        'notify_success': '批量通知成功',
+        'refund': '批量退款',
+        'card91_deliver': '批量91卡券发货',
+    }
+
+    @property
+    def status_label(self):
+        return self.STATUS_MAP.get(self.status, '未知')
+
+    @property
+    def action_label(self):
+        return self.ACTION_MAP.get(self.action, self.action)
+
+    @property
+    def order_id_list(self):
+        return json.loads(self.order_ids or '[]')
+
+    @property
+    def failure_list(self):
+        return json.loads(self.failures or '[]')
+
+    @property
+    def progress(self):
+        """执行进度百分比。"""
+        if self.status == self.STATUS_DONE:
+            return 100
+        if not self.total:
+            return 0
+        return min(int(self.processed * 100 / self.total), 99)
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'action': self.action,
+            'action_label': self.action_label,
+            'status': self.status,
+            'status_label': self.status_label,
+            'total': self.total,
+            'processed': self.processed,
+            'succeeded': self.succeeded,
+            'failed': self.failed,
+            'progress': self.progress,
+            'failures': self.failure_list,
+            'error': self.error,
+            'create_time': self.create_time.strftime('%Y-%m-%d %H:%M:%S') if self.create_time else '',
+            'finish_time': self.finish_time.strftime('%Y-%m-%d %H:%M:%S') if self.finish_time else '',
+        }
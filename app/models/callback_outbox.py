@@ -0,0 +1,70 @@
+"""京东回调发件箱模型。
+
+回调京东失败时，在把订单 notify_status 置为失败的同一事务中写入一条发件箱记录，
+由定时任务（worker.py 中的 APScheduler）按指数退避自动重发，直到成功或达到最大次数。
+"""
+from datetime import datetime
+from app.extensions import db
+
+
+class CallbackOutbox(db.Model):
+    """回调发件箱表。
+
+    每个订单每种回调类型只有一条记录（唯一索引），再次失败时重置为待发送。
+    """
+    __tablename__ = 'callback_outbox'
+
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+
+    order_id = db.Column(db.Integer, db.ForeignKey('orders.id', ondelete='CASCADE'),
+                         nullable=False, comment='订单ID')
+    shop_id = db.Column(db.Integer, nullable=False, comment='店铺ID（按店铺批量发送）')
+
+    # 回调类型：deliver=发货成功（直充成功/卡密发货） refund=退款
+    callback_type = db.Column(db.String(20), nullable=False, comment='回调类型')
+
+    # 状态：0=待发送 1=发送中 2=已成功 3=已放弃
+    status = db.Column(db.SmallInteger, nullable=False, default=0, comment='发送状态')
+    attempts = db.Column(db.Integer, nullable=False, default=0, comment='已重发次数')
+    max_attempts = db.Column(db.Integer, nullable=False, default=8, comment='最大重发次数')
+    next_retry_time = db.Column(db.DateTime, default=datetime.now, comment='下次重发时间')
+
+    locked_by = db.Column(db.String(100), comment='领取该记录的批次标识')
+    locked_at = db.Column(db.DateTime, comment='领取时间')
+    last_error = db.Column(db.String(500), comment='最近一次失败原因')
+
+    create_time = db.Column(db.DateTime, default=datetime.now)
+    update_time = db.Column(db.DateTime, default=datetime.now, onupdate=datetime.now)
+
+    order = db.relationship('Order', backref=db.backref('callback_outbox', lazy='dynamic'))
+
+    STATUS_PENDING = 0
+    STATUS_SENDING = 1
+    STATUS_DONE = 2
+    STATUS_DEAD = 3
+
+    STATUS_MAP = {0: '待发送', 1: '发送中', 2: '已成功', 3: '已放弃'}
+    CALLBACK_TYPE_MAP = {'deliver': '发货成功', 'refund': '退款'}
+
+    __table_args__ = (
+        db.UniqueConstraint('order_id', 'callback_type', name='uk_order_callback'),
+        db.Index('idx_outbox_status_retry', 'status', 'next_retry_time'),
+    )
+
+    @property
+    def status_label(self):
+        return self.STATUS_MAP.get(self.status, '未知')
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'order_id': self.order_id,
+            'shop_id': self.shop_id,
+            'callback_type': self.callback_type,
+            'status': self.status,
+            'status_label': self.status_label,
+            'attempts': self.attempts,
+            'max_attempts': self.max_attempts,
+            'last_error': self.last_error or '',
+            'next_retry_time': self.next_retry_time.strftime('%Y-%m-%d %H:%M:%S') if self.next_retry_time else None,
+        }
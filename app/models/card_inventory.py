@@ -0,0 +1,42 @@
+"""91卡券本地库存模型。
+
+商品开启本地库存后，worker.py 定时从91卡券预先提卡，卡密加密后保存在本表；
+发卡时用一条条件 UPDATE 原子领取可用卡密，库存不足时退回远程 HandPick。
+"""
+from datetime import datetime
+from app.extensions import db
+
+
+class CardInventory(db.Model):
+    """91卡券本地库存表（一行一张卡密）。"""
+    __tablename__ = 'card_inventory'
+
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    product_id = db.Column(db.Integer, db.ForeignKey('products.id', ondelete='CASCADE'),
+                           nullable=False, comment='商品ID')
+    shop_id = db.Column(db.Integer, nullable=False, comment='提卡店铺ID')
+    card_type_id = db.Column(db.String(100), nullable=False, comment='91卡券卡种ID')
+    card_data = db.Column(db.Text, nullable=False, comment='卡密JSON（AES-GCM加密）')
+    batch_id = db.Column(db.String(64), comment='补货批次（HandPick 提卡单号）')
+
+    # 状态：0=可用 1=已领取 2=无法解密（密钥不符或数据损坏，已隔离）
+    status = db.Column(db.SmallInteger, nullable=False, default=0, comment='状态')
+    order_id = db.Column(db.Integer, db.ForeignKey('orders.id', ondelete='SET NULL'), comment='领取订单ID')
+
+    create_time = db.Column(db.DateTime, default=datetime.now)
+    claim_time = db.Column(db.DateTime, comment='领取时间')
+
+    __table_args__ = (
+        db.Index('idx_inventory_claim', 'product_id', 'status', 'id'),
+        db.Index('idx_inventory_order', 'order_id'),
+    )
+
+    STATUS_AVAILABLE = 0
+    STATUS_CLAIMED = 1
+    STATUS_INVALID = 2
+
+    STATUS_MAP = {0: '可用', 1: '已领取', 2: '无法解密'}
+
+    @property
+    def status_label(self):
+        return self.STATUS_MAP.get(self.status, '未知')
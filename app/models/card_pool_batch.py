@@ -0,0 +1,43 @@
+"""91卡券本地库存补货批次模型。
+
+补货 HandPick 超时或入库提交失败时，91卡券可能已经按提卡单号出卡。每批提卡前先写入
+本表，结果不确定的批次在下一次补货时用同一个提卡单号重放，取回同一批卡密。
+"""
+from datetime import datetime
+from app.extensions import db
+
+
+class CardPoolBatch(db.Model):
+    """91卡券本地库存补货批次表（一行一个提卡单号）。"""
+    __tablename__ = 'card_pool_batches'
+
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    batch_id = db.Column(db.String(64), nullable=False, unique=True, comment='提卡单号（handPickOrderId）')
+    product_id = db.Column(db.Integer, db.ForeignKey('products.id', ondelete='CASCADE'),
+                           nullable=False, comment='商品ID')
+    shop_id = db.Column(db.Integer, nullable=False, comment='提卡店铺ID')
+    card_type_id = db.Column(db.String(100), nullable=False, comment='91卡券卡种ID')
+    quantity = db.Column(db.Integer, nullable=False, comment='提卡数量')
+
+    # 状态：0=提卡中（结果不确定，下次补货重放提卡单号） 1=已入库 2=失败（91卡券明确拒绝）
+    status = db.Column(db.SmallInteger, nullable=False, default=0, comment='状态')
+    received = db.Column(db.Integer, nullable=False, default=0, comment='入库张数')
+    attempts = db.Column(db.Integer, nullable=False, default=0, comment='提卡次数')
+    last_error = db.Column(db.String(500), comment='最近一次失败信息')
+
+    create_time = db.Column(db.DateTime, default=datetime.now)
+    update_time = db.Column(db.DateTime, default=datetime.now, onupdate=datetime.now)
+
+    __table_args__ = (
+        db.Index('idx_pool_batch_status', 'status', 'product_id'),
+    )
+
+    STATUS_PENDING = 0
+    STATUS_DONE = 1
+    STATUS_FAILED = 2
+
+    STATUS_MAP = {0: '提卡中', 1: '已入库', 2: '失败'}
+
+    @property
+    def status_label(self):
+        return self.STATUS_MAP.get(self.status, '未知')
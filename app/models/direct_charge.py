@@ -0,0 +1,69 @@
+"""直充任务模型。
+
+京东推送的直充订单匹配到直充商品（发货方式=2）时，与订单同一事务写入一条直充任务，
+由 worker.py 定时领取：提交上游充值供应商 -> 批量查询充值结果 -> 回调京东。
+"""
+from datetime import datetime
+from app.extensions import db
+
+
+class DirectChargeTask(db.Model):
+    """直充任务表（每个订单一条）。"""
+    __tablename__ = 'direct_charge_tasks'
+
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    order_id = db.Column(db.Integer, db.ForeignKey('orders.id', ondelete='CASCADE'),
+                         nullable=False, comment='订单ID')
+    shop_id = db.Column(db.Integer, nullable=False, comment='店铺ID')
+    product_id = db.Column(db.Integer, comment='匹配到的商品配置ID')
+    supplier = db.Column(db.String(50), nullable=False, comment='供应商类型（商品的直充API类型）')
+    supplier_order_no = db.Column(db.String(100), comment='供应商订单号')
+
+    # 状态：0=待提交 1=提交中 2=充值中 3=充值成功 4=充值失败
+    status = db.Column(db.SmallInteger, nullable=False, default=0, comment='任务状态')
+    attempts = db.Column(db.Integer, nullable=False, default=0, comment='已提交次数')
+    max_attempts = db.Column(db.Integer, nullable=False, default=3, comment='最大提交次数')
+    polls = db.Column(db.Integer, nullable=False, default=0, comment='已查询次数')
+    next_run_time = db.Column(db.DateTime, default=datetime.now, comment='下次提交/查询时间')
+
+    locked_by = db.Column(db.String(64), comment='领取批次标识')
+    locked_at = db.Column(db.DateTime, comment='领取时间')
+    last_error = db.Column(db.String(500), comment='最近一次上游返回信息')
+
+    create_time = db.Column(db.DateTime, default=datetime.now)
+    submit_time = db.Column(db.DateTime, comment='首次提交时间')
+    finish_time = db.Column(db.DateTime, comment='完成时间')
+
+    order = db.relationship('Order', backref=db.backref('direct_charge_tasks', lazy='dynamic'))
+
+    __table_args__ = (
+        db.UniqueConstraint('order_id', name='uk_direct_charge_order'),
+        db.Index('idx_direct_charge_status_run', 'status', 'next_run_time'),
+    )
+
+    STATUS_PENDING = 0
+    STATUS_SUBMITTING = 1
+    STATUS_CHARGING = 2
+    STATUS_SUCCESS = 3
+    STATUS_FAILED = 4
+
+    STATUS_MAP = {0: '待提交', 1: '提交中', 2: '充值中', 3: '充值成功', 4: '充值失败'}
+
+    @property
+    def status_label(self):
+        return self.STATUS_MAP.get(self.status, '未知')
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'order_id': self.order_id,
+            'supplier': self.supplier,
+            'supplier_order_no': self.supplier_order_no or '',
+            'status': self.status,
+            'status_label': self.status_label,
+            'attempts': self.attempts,
+            'polls': self.polls,
+            'last_error': self.last_error or '',
+            'submit_time': self.submit_time.strftime('%Y-%m-%d %H:%M:%S') if self.submit_time else None,
+            'finish_time': self.finish_time.strftime('%Y-%m-%d %H:%M:%S') if self.finish_time else None,
+        }
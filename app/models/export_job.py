@@ -0,0 +1,78 @@
+"""订单导出任务模型。
+
+大批量导出（超过 EXPORT_SYNC_MAX_ROWS 行或 XLSX 格式）不在请求中同步生成，
+而是写入一条导出任务，由 worker.py 定时领取，流式写入本地文件并记录进度，
+完成后在“导出任务”页面下载。
+"""
+from datetime import datetime
+from app.extensions import db
+
+
+class ExportJob(db.Model):
+    """订单导出任务表。"""
+    __tablename__ = 'export_jobs'
+
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id', ondelete='SET NULL'), nullable=True, comment='创建人ID')
+    username = db.Column(db.String(50), comment='创建人用户名')
+
+    export_format = db.Column(db.String(10), nullable=False, default='csv', comment='文件格式：csv/csv.gz/xlsx')
+    filters = db.Column(db.Text, comment='筛选条件JSON（与订单列表参数一致）')
+
+    # 状态：0=排队中 1=导出中 2=已完成 3=失败 4=文件已过期
+    status = db.Column(db.SmallInteger, nullable=False, default=0, comment='任务状态')
+    total_rows = db.Column(db.Integer, comment='预计行数')
+    processed_rows = db.Column(db.Integer, nullable=False, default=0, comment='已导出行数')
+
+    file_name = db.Column(db.String(200), comment='下载文件名')
+    file_path = db.Column(db.String(500), comment='本地文件路径')
+    file_size = db.Column(db.BigInteger, comment='文件大小（字节）')
+    error = db.Column(db.String(500), comment='失败原因')
+
+    locked_by = db.Column(db.String(100), comment='执行该任务的进程标识')
+    locked_at = db.Column(db.DateTime, comment='最近一次心跳时间（超时未刷新则重新排队）')
+    create_time = db.Column(db.DateTime, default=datetime.now)
+    start_time = db.Column(db.DateTime, comment='开始时间')
+    finish_time = db.Column(db.DateTime, comment='完成时间')
+
+    __table_args__ = (
+        db.Index('idx_export_status', 'status', 'id'),
+        db.Index('idx_export_user', 'user_id', 'id'),
+    )
+
+    STATUS_PENDING = 0
+    STATUS_RUNNING = 1
+    STATUS_DONE = 2
+    STATUS_FAILED = 3
+    STATUS_EXPIRED = 4
+
+    STATUS_MAP = {0: '排队中', 1: '导出中', 2: '已完成', 3: '失败', 4: '已过期'}
+
+    @property
+    def status_label(self):
+        return self.STATUS_MAP.get(self.status, '未知')
+
+    @property
+    def progress(self):
+        """导出进度百分比。"""
+        if self.status == self.STATUS_DONE:
+            return 100
+        if not self.total_rows:
+            return 0
+        return min(int(self.processed_rows * 100 / self.total_rows), 99)
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'export_format': self.export_format,
+            'status': self.status,
+            'status_label': self.status_label,
+            'total_rows': self.total_rows,
+            'processed_rows': self.processed_rows,
+            'progress': self.progress,
+            'file_name': self.file_name,
+            'file_size': self.file_size,
+            'error': self.error,
+            'create_time': self.create_time.strftime('%Y-%m-%d %H:%M:%S') if self.create_time else '',
+            'finish_time': self.finish_time.strftime('%Y-%m-%d %H:%M:%S') if self.finish_time else '',
+        }
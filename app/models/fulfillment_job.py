@@ -0,0 +1,71 @@
+"""发货任务队列模型。
+
+京东推单接口只负责把卡密订单的自动发货任务写入本表（与订单同一事务），
+由独立的发货 worker 进程（worker.py）领取执行：91卡券提卡 -> 回调京东。
+"""
+from datetime import datetime
+from app.extensions import db
+
+
+class FulfillmentJob(db.Model):
+    """发货任务表。
+
+    每个订单每种任务类型只有一条记录（唯一索引），失败按退避时间重试，
+    超过最大次数后置为失败，由人工在订单详情中处理。
+    """
+    __tablename__ = 'fulfillment_jobs'
+
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+
+    order_id = db.Column(db.Integer, db.ForeignKey('orders.id', ondelete='CASCADE'),
+                         nullable=False, comment='订单ID')
+    shop_id = db.Column(db.Integer, nullable=False, comment='店铺ID（用于按店铺限流）')
+    product_id = db.Column(db.Integer, comment='匹配到的商品配置ID')
+
+    # 任务类型：card91_deliver=91卡券提卡发货
+    job_type = db.Column(db.String(50), nullable=False, default='card91_deliver', comment='任务类型')
+
+    # 任务状态：0=待执行 1=执行中 2=已完成 3=已失败
+    status = db.Column(db.SmallInteger, nullable=False, default=0, comment='任务状态')
+    attempts = db.Column(db.Integer, nullable=False, default=0, comment='已执行次数')
+    max_attempts = db.Column(db.Integer, nullable=False, default=5, comment='最大执行次数')
+    next_run_time = db.Column(db.DateTime, default=datetime.now, comment='下次可执行时间')
+
+    locked_by = db.Column(db.String(100), comment='执行该任务的worker标识')
+    locked_at = db.Column(db.DateTime, comment='领取时间')
+    last_error = db.Column(db.String(500), comment='最近一次错误')
+
+    create_time = db.Column(db.DateTime, default=datetime.now)
+    update_time = db.Column(db.DateTime, default=datetime.now, onupdate=datetime.now)
+
+    order = db.relationship('Order', backref=db.backref('fulfillment_jobs', lazy='dynamic'))
+
+    STATUS_PENDING = 0
+    STATUS_RUNNING = 1
+    STATUS_DONE = 2
+    STATUS_FAILED = 3
+
+    STATUS_MAP = {0: '待执行', 1: '执行中', 2: '已完成', 3: '已失败'}
+
+    __table_args__ = (
+        db.UniqueConstraint('order_id', 'job_type', name='uk_order_job'),
+        db.Index('idx_job_status_run', 'status', 'next_run_time'),
+    )
+
+    @property
+    def status_label(self):
+        return self.STATUS_MAP.get(self.status, '未知')
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'order_id': self.order_id,
+            'shop_id': self.shop_id,
+            'job_type': self.job_type,
+            'status': self.status,
+            'status_label': self.status_label,
+            'attempts': self.attempts,
+            'max_attempts': self.max_attempts,
+            'last_error': self.last_error or '',
+            'next_run_time': self.next_run_time.strftime('%Y-%m-%d %H:%M:%S') if self.next_run_time else None,
+        }
@@ -0,0 +1,44 @@
+"""91卡券提卡记录模型。
+
+91卡券按 handPickOrderId 幂等：同一个提卡单号重复请求返回同一批卡密。合并提卡的批次号
+取决于哪些订单恰好进入同一批次，重试时无法重新算出，因此每次 HandPick 之前先把
+提卡单号及其覆盖的订单写入本表，订单重试时按记录重放同一个提卡单号。
+"""
+from datetime import datetime
+from app.extensions import db
+
+
+class HandPickRecord(db.Model):
+    """91卡券提卡记录表（一行一个订单）。"""
+    __tablename__ = 'card91_handpick_records'
+
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    shop_id = db.Column(db.Integer, nullable=False, comment='店铺ID')
+    card_type_id = db.Column(db.String(100), nullable=False, comment='91卡券卡种ID')
+    order_no = db.Column(db.String(64), nullable=False, comment='订单号')
+    quantity = db.Column(db.Integer, nullable=False, comment='本单数量')
+
+    batch_id = db.Column(db.String(64), nullable=False, comment='提卡单号（handPickOrderId）')
+    batch_num = db.Column(db.Integer, nullable=False, comment='该提卡单号的提卡数量')
+    pick_offset = db.Column(db.Integer, nullable=False, default=0, comment='本单在批次卡密中的起始位置')
+
+    # 状态：0=提卡中（结果不确定，重试时重放提卡单号） 1=已提卡 2=逐单提卡（批次被明确拒绝，按订单号提卡）
+    status = db.Column(db.SmallInteger, nullable=False, default=0, comment='状态')
+
+    create_time = db.Column(db.DateTime, default=datetime.now)
+    update_time = db.Column(db.DateTime, default=datetime.now, onupdate=datetime.now)
+
+    __table_args__ = (
+        db.UniqueConstraint('shop_id', 'card_type_id', 'order_no', name='uk_handpick_order'),
+        db.Index('idx_handpick_batch', 'batch_id'),
+    )
+
+    STATUS_PENDING = 0
+    STATUS_DONE = 1
+    STATUS_SINGLE = 2
+
+    STATUS_MAP = {0: '提卡中', 1: '已提卡', 2: '逐单提卡'}
+
+    @property
+    def status_label(self):
+        return self.STATUS_MAP.get(self.status, '未知')
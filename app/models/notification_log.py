@@ -1,3 +1,4 @@
+import json
 from datetime import datetime
 from app.extensions import db
 
@@ -8,6 +9,8 @@ class NotificationLog(db.Model):
     id = db.Column(db.Integer, primary_key=True, autoincrement=True)
     order_id = db.Column(db.Integer, db.ForeignKey('orders.id', ondelete='CASCADE'), nullable=False, comment='订单ID')
     shop_id = db.Column(db.Integer, db.ForeignKey('shops.id', ondelete='CASCADE'), nullable=False, comment='店铺ID')
+    # 汇总通知覆盖的订单ID列表JSON（order_id 为其中第一个），单个订单的通知为空
+    order_ids = db.Column(db.Text, comment='汇总通知覆盖的订单ID列表JSON')
 
     notify_type = db.Column(db.String(20), nullable=False, comment='通知类型：dingtalk/wecom')
     notify_status = db.Column(db.SmallInteger, default=0, comment='通知状态：0=失败 1=成功')
@@ -22,6 +25,10 @@ class NotificationLog(db.Model):
     def notify_type_label(self):
         return '钉钉' if self.notify_type == 'dingtalk' else '企业微信'
 
+    @property
+    def covered_order_ids(self):
+        return json.loads(self.order_ids) if self.order_ids else [self.order_id]
+
     @property
     def status_label(self):
         return '成功' if self.notify_status == 1 else '失败'
@@ -30,6 +37,7 @@ class NotificationLog(db.Model):
         return {
             'id': self.id,
             'order_id': self.order_id,
+            'order_ids': self.covered_order_ids,
             'shop_id': self.shop_id,
             'notify_type': self.notify_type,
             'notify_type_label': self.notify_type_label,
@@ -47,6 +47,10 @@ class Order(db.Model):
 
     __table_args__ = (
         db.Index('idx_jd_order_shop', 'jd_order_no', 'shop_id', unique=True),
+        db.Index('idx_produce_account', 'produce_account'),
+        db.Index('idx_order_shop_id', 'shop_id', 'id'),
+        db.Index('idx_order_status_id', 'order_status', 'id'),
+        db.Index('idx_order_sku_time', 'shop_id', 'sku_id', 'create_time'),
     )
 
     @property
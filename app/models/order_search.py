@@ -0,0 +1,21 @@
+"""订单搜索分词表模型。
+
+订单列表/导出的关键字搜索过去是四个前导通配 LIKE '%kw%' 的 OR，无法使用索引。
+这里为 order_no / jd_order_no / product_info / produce_account 维护 n-gram 分词：
+中文按 2 字、其他字符按 3 字符切分，一个订单的每个不同分词一行。
+分词规则和维护逻辑见 app/services/order_search.py。
+"""
+from app.extensions import db
+
+
+class OrderSearchToken(db.Model):
+    """订单搜索分词表（token, order_id）。"""
+    __tablename__ = 'order_search_tokens'
+
+    token = db.Column(db.String(32), primary_key=True, comment='n-gram 分词')
+    order_id = db.Column(db.Integer, db.ForeignKey('orders.id', ondelete='CASCADE'),
+                         primary_key=True, comment='订单ID')
+
+    __table_args__ = (
+        db.Index('idx_search_order', 'order_id'),
+    )
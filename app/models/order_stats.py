@@ -0,0 +1,64 @@
+"""订单统计汇总表模型。
+
+统计报表过去每次打开都要对 orders 全表 COUNT / SUM / GROUP BY，耗时随订单量线性增长。
+这里按 店铺 × 店铺类型 × 订单类型 × 订单状态 维护小时级、天级两张汇总表，
+订单的时间维度取下单时间（create_time），状态流转时在原时间桶内从旧状态移到新状态。
+另外按店铺维护未处理（待处理 + 处理中）订单数，供新订单提醒的角标使用。
+维护逻辑见 app/services/order_stats.py，重建用 python migrations/rebuild_stats.py。
+"""
+from datetime import datetime
+from app.extensions import db
+
+
+class OrderStatHourly(db.Model):
+    """订单小时汇总表。"""
+    __tablename__ = 'order_stats_hourly'
+
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    stat_hour = db.Column(db.DateTime, nullable=False, comment='统计小时（整点）')
+    shop_id = db.Column(db.Integer, db.ForeignKey('shops.id', ondelete='CASCADE'),
+                        nullable=False, comment='店铺ID')
+    shop_type = db.Column(db.SmallInteger, nullable=False, comment='店铺类型')
+    order_type = db.Column(db.SmallInteger, nullable=False, comment='订单类型')
+    order_status = db.Column(db.SmallInteger, nullable=False, comment='订单状态')
+    order_count = db.Column(db.Integer, nullable=False, default=0, comment='订单数')
+    total_amount = db.Column(db.BigInteger, nullable=False, default=0, comment='订单金额（分）')
+    update_time = db.Column(db.DateTime, default=datetime.now, onupdate=datetime.now)
+
+    __table_args__ = (
+        db.UniqueConstraint('stat_hour', 'shop_id', 'shop_type', 'order_type', 'order_status',
+                            name='uk_stat_hour'),
+        db.Index('idx_stat_hour_shop', 'shop_id', 'stat_hour'),
+    )
+
+
+class OrderStatDaily(db.Model):
+    """订单天汇总表。"""
+    __tablename__ = 'order_stats_daily'
+
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    stat_date = db.Column(db.Date, nullable=False, comment='统计日期')
+    shop_id = db.Column(db.Integer, db.ForeignKey('shops.id', ondelete='CASCADE'),
+                        nullable=False, comment='店铺ID')
+    shop_type = db.Column(db.SmallInteger, nullable=False, comment='店铺类型')
+    order_type = db.Column(db.SmallInteger, nullable=False, comment='订单类型')
+    order_status = db.Column(db.SmallInteger, nullable=False, comment='订单状态')
+    order_count = db.Column(db.Integer, nullable=False, default=0, comment='订单数')
+    total_amount = db.Column(db.BigInteger, nullable=False, default=0, comment='订单金额（分）')
+    update_time = db.Column(db.DateTime, default=datetime.now, onupdate=datetime.now)
+
+    __table_args__ = (
+        db.UniqueConstraint('stat_date', 'shop_id', 'shop_type', 'order_type', 'order_status',
+                            name='uk_stat_date'),
+        db.Index('idx_stat_date_shop', 'shop_id', 'stat_date'),
+    )
+
+
+class OrderPendingCount(db.Model):
+    """店铺未处理订单数（订单状态为待处理 / 处理中）。"""
+    __tablename__ = 'order_pending_counts'
+
+    shop_id = db.Column(db.Integer, db.ForeignKey('shops.id', ondelete='CASCADE'),
+                        primary_key=True, autoincrement=False, comment='店铺ID')
+    pending_count = db.Column(db.Integer, nullable=False, default=0, comment='未处理订单数')
+    update_time = db.Column(db.DateTime, default=datetime.now, onupdate=datetime.now)
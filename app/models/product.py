@@ -1,6 +1,6 @@
 """商品管理模型。
 
-每个商品可绑定一个店铺，并配置对应的发货方式（91卡券卡密 / 直充预留）。
+每个商品可绑定一个店铺，并配置对应的发货方式（91卡券卡密 / 直充供应商）。
 商品维度：一个SKU对应一个发货配置。
 """
 from datetime import datetime
@@ -12,7 +12,7 @@ class Product(db.Model):
 
     用于记录店铺商品信息和对应的自动发货配置。
     当京东推送订单时，系统根据 shop_id + sku_id 匹配商品，
-    若配置了91卡券则自动提卡发货。
+    若配置了91卡券则自动提卡发货，配置了直充供应商则自动提交上游充值。
     """
     __tablename__ = 'products'
 
@@ -28,18 +28,22 @@ class Product(db.Model):
     sku_id = db.Column(db.String(100), comment='京东SKU ID（精确匹配订单SKU）')
     sku_name = db.Column(db.String(200), comment='SKU名称/套餐名称')
 
-    # 发货方式：0=手动 1=91卡券卡密 2=直充（预留）
+    # 发货方式：0=手动 1=91卡券卡密 2=直充
     deliver_type = db.Column(db.SmallInteger, default=0,
-                              comment='发货方式：0=手动 1=91卡券卡密 2=直充API预留')
+                              comment='发货方式：0=手动 1=91卡券卡密 2=直充API')
 
     # 91卡券配置（发货方式=1时有效）
     card91_card_type_id = db.Column(db.String(100), comment='91卡券卡种ID')
     card91_card_type_name = db.Column(db.String(200), comment='91卡券卡种名称')
     card91_plan_id = db.Column(db.String(100), comment='91卡券方案ID（可选）')
 
-    # 直充API预留（发货方式=2时使用，后续扩展）
-    direct_charge_api_type = db.Column(db.String(50), comment='直充API类型（预留）')
-    direct_charge_api_config = db.Column(db.Text, comment='直充API配置JSON（预留）')
+    # 直充供应商（发货方式=2时有效，见 app/services/direct_charge_suppliers.py）
+    direct_charge_api_type = db.Column(db.String(50), comment='直充供应商类型')
+    direct_charge_api_config = db.Column(db.Text, comment='直充供应商配置JSON')
+
+    # 91卡券本地库存：开启后由 worker.py 预先提卡，发卡时优先从本地库存领取
+    card_pool_enabled = db.Column(db.SmallInteger, nullable=False, default=0, comment='是否启用本地库存')
+    card_pool_max = db.Column(db.Integer, comment='本地库存上限（为空使用全局配置）')
 
     # 商品状态
     is_enabled = db.Column(db.SmallInteger, default=1, comment='是否启用：0=禁用 1=启用')
@@ -54,14 +58,14 @@ class Product(db.Model):
 
     # 唯一索引：同一店铺下同一SKU只能有一个配置
     __table_args__ = (
-        db.Index('idx_shop_sku', 'shop_id', 'sku_id'),
+        db.Index('idx_product_match', 'shop_id', 'sku_id', 'is_enabled', 'deliver_type'),
     )
 
     # 发货方式标签映射
     DELIVER_TYPE_MAP = {
         0: '手动发货',
         1: '91卡券卡密',
-        2: '直充API（预留）',
+        2: '直充API',
     }
 
     @property
@@ -89,6 +93,8 @@ class Product(db.Model):
             'card91_card_type_id': self.card91_card_type_id or '',
             'card91_card_type_name': self.card91_card_type_name or '',
             'card91_plan_id': self.card91_plan_id or '',
+            'card_pool_enabled': self.card_pool_enabled or 0,
+            'card_pool_max': self.card_pool_max,
             'is_enabled': self.is_enabled,
             'remark': self.remark or '',
             'create_time': self.create_time.strftime('%Y-%m-%d %H:%M:%S') if self.create_time else None,
@@ -0,0 +1,16 @@
+"""数据库结构迁移版本记录。
+
+每个已执行的迁移（app/services/schema_migrations.py 中的 MIGRATIONS）记录一行，
+python migrations/migrate.py 只执行尚未记录的版本。
+"""
+from datetime import datetime
+from app.extensions import db
+
+
+class SchemaMigration(db.Model):
+    """已执行的结构迁移。"""
+    __tablename__ = 'schema_migrations'
+
+    version = db.Column(db.String(20), primary_key=True, comment='迁移版本号')
+    description = db.Column(db.String(200), comment='迁移说明')
+    applied_time = db.Column(db.DateTime, default=datetime.now, comment='执行时间')
@@ -1,8 +1,24 @@
 from datetime import datetime
+from flask import g, has_request_context
 from flask_login import UserMixin
+from sqlalchemy import event
 from werkzeug.security import generate_password_hash, check_password_hash
 from app.extensions import db
 
+# 店铺权限的请求内缓存：flask.g 上的 {user_id: frozenset(shop_id)}，每个请求开始时清空；
+# 请求之外（worker、脚本）不缓存
+_PERMISSION_CACHE = 'shop_permission_sets'
+
+
+def clear_permission_cache(user_id=None):
+    """清除当前请求缓存的店铺权限（批量修改用户权限后调用），user_id 为空时全部清除。"""
+    if not has_request_context():
+        return
+    if user_id is None:
+        g.pop(_PERMISSION_CACHE, None)
+    else:
+        g.get(_PERMISSION_CACHE, {}).pop(user_id, None)
+
 
 class User(UserMixin, db.Model):
     __tablename__ = 'users'
@@ -44,15 +60,28 @@ class User(UserMixin, db.Model):
     def check_password(self, password):
         return check_password_hash(self.password_hash, password)
 
+    def permitted_shop_set(self):
+        """可访问的店铺ID集合（frozenset），同一请求内只查询一次；管理员返回 None。"""
+        if self.is_admin:
+            return None
+        cache = g.setdefault(_PERMISSION_CACHE, {}) if has_request_context() else {}
+        shop_ids = cache.get(self.id)
+        if shop_ids is None:
+            shop_ids = cache[self.id] = frozenset(
+                shop_id for (shop_id,) in
+                db.session.query(UserShopPermission.shop_id).filter_by(user_id=self.id)
+            )
+        return shop_ids
+
     def get_permitted_shop_ids(self):
         if self.is_admin:
             return None  # admin can see all
-        return [p.shop_id for p in self.shop_permissions.all()]
+        return sorted(self.permitted_shop_set())
 
     def has_shop_permission(self, shop_id):
         if self.is_admin:
             return True
-        return self.shop_permissions.filter_by(shop_id=shop_id).first() is not None
+        return shop_id in self.permitted_shop_set()
 
     def to_dict(self):
         return {
@@ -81,3 +110,9 @@ class UserShopPermission(db.Model):
     __table_args__ = (
         db.UniqueConstraint('user_id', 'shop_id', name='uk_user_shop'),
     )
+
+
+@event.listens_for(UserShopPermission, 'after_insert')
+@event.listens_for(UserShopPermission, 'after_delete')
+def _permission_changed(mapper, connection, target):
+    clear_permission_cache(target.user_id)
@@ -5,12 +5,20 @@
 """
 import json
 import logging
-import uuid
+import time
 from datetime import datetime
-from flask import Blueprint, request, jsonify, session
+from flask import Blueprint, request, jsonify, session, Response, current_app, stream_with_context
 
 from flask_login import login_required, current_user
 from app.extensions import db
+from app.services.log_writer import enqueue_log
+from app.services.shop_cache import get_shop_cache
+from app.services.order_ingest import generate_order_no, ingest_order
+from app.services.fulfillment import find_card91_product, build_card91_job
+from app.services.direct_charge import find_direct_charge_product, build_direct_charge_task
+from app.services.recent_orders import get_recent_orders
+from app.services.order_stats import pending_counts
+from app.services.order_alerts import get_order_alerts, EVENT_NEW
 from app.models.order import Order
 from app.models.shop import Shop
 from app.services.notification import send_order_notification, send_test_notification
@@ -34,23 +42,19 @@ def create_order():
     req_headers = str(dict(request.headers))
 
     def _save_api_log(shop_id, response_status, response_body):
-        try:
-            from app.models.api_log import ApiLog
-            log = ApiLog(
-                shop_id=shop_id,
-                api_type='create_order',
-                request_method=request.method,
-                request_url=request.url,
-                request_headers=req_headers[:2000],
-                request_body=req_body[:4000],
-                response_status=response_status,
-                response_body=str(response_body)[:4000],
-                ip_address=request.remote_addr,
-            )
-            db.session.add(log)
-            db.session.commit()
-        except Exception as ex:
-            logger.warning(f'记录API日志失败: {ex}')
+        from app.models.api_log import ApiLog
+        enqueue_log(
+            ApiLog,
+            shop_id=shop_id,
+            api_type='create_order',
+            request_method=request.method,
+            request_url=request.url,
+            request_headers=req_headers[:2000],
+            request_body=req_body[:4000],
+            response_status=response_status,
+            response_body=str(response_body)[:4000],
+            ip_address=request.remote_addr,
+        )
 
     data = request.get_json()
     if not data:
@@ -59,7 +63,7 @@ def create_order():
         return resp, 400
 
     shop_code = data.get('shop_code')
-    shop = Shop.query.filter_by(shop_code=shop_code, is_enabled=1).first()
+    shop = get_shop_cache().by_code(shop_code)
     if not shop:
         resp = jsonify(success=False, message='店铺不存在或已禁用')
         _save_api_log(None, 400, '店铺不存在或已禁用')
@@ -85,13 +89,15 @@ def create_order():
             _save_api_log(shop.id, 403, '签名验证失败')
             return jsonify(success=False, message='签名验证失败'), 403
 
-    order_no = f"ORD{datetime.now().strftime('%Y%m%d%H%M%S')}{uuid.uuid4().hex[:8].upper()}"
-
-    # 防重复：检查相同 jd_order_no + shop_id
     jd_order_no = data.get('jd_order_no', '')
-    existing = Order.query.filter_by(jd_order_no=jd_order_no, shop_id=shop.id).first()
-    if existing:
-        return jsonify(success=False, message='订单已存在，请勿重复提交', order_no=existing.order_no)
+
+    # 重复提交直接应答（近期订单索引，不查库）
+    recent_orders = get_recent_orders()
+    existing_no = recent_orders.get(jd_order_no, shop.id)
+    if existing_no:
+        return jsonify(success=False, message='订单已存在，请勿重复提交', order_no=existing_no)
+
+    order_no = generate_order_no()
 
     order = Order(
         order_no=order_no,
@@ -108,69 +114,32 @@ def create_order():
         notify_url=data.get('notify_url'),
     )
 
-    db.session.add(order)
+    # 卡密订单的91卡券自动发货 / 直充订单的上游自动充值：任务与订单同一事务写入，由 worker.py 异步执行
+    jobs = []
+    if order.order_type == 2:
+        product = find_card91_product(shop.id, order.sku_id)
+        if product and shop.card91_api_key:
+            jobs.append(build_card91_job(order, shop, product))
+    elif order.order_type == 1:
+        product = find_direct_charge_product(shop.id, order.sku_id)
+        if product:
+            jobs.append(build_direct_charge_task(order, shop, product))
+
+    # 订单、创建事件与发货任务一次提交；防重复依赖 (jd_order_no, shop_id) 唯一索引
     try:
-        db.session.commit()
-    except Exception:
+        result = ingest_order(
+            order,
+            f'订单创建，京东订单号：{jd_order_no}，类型：{"直充" if order.order_type==1 else "卡密"}',
+            related=jobs,
+        )
+    except Exception as e:
         db.session.rollback()
-        # 并发情况下可能产生唯一约束冲突，再次查询
-        existing = Order.query.filter_by(jd_order_no=jd_order_no, shop_id=shop.id).first()
-        if existing:
-            return jsonify(success=False, message='订单已存在，请勿重复提交', order_no=existing.order_no)
+        logger.error(f"订单创建失败: {e}")
         _save_api_log(shop.id, 500, '订单创建失败')
         return jsonify(success=False, message='订单创建失败'), 500
-
-    # 记录订单创建事件
-    try:
-        from app.models.order_event import OrderEvent
-        create_event = OrderEvent(
-            order_id=order.id,
-            order_no=order.order_no,
-            event_type='order_created',
-            event_desc=f'订单创建，京东订单号：{jd_order_no}，类型：{"直充" if order.order_type==1 else "卡密"}',
-            result='info',
-        )
-        db.session.add(create_event)
-        db.session.commit()
-    except Exception as e:
-        logger.warning(f"记录订单创建事件失败: {e}")
-
-    # 91卡券自动发货（卡密订单，根据商品配置deliver_type=1时自动提卡）
-    if order.order_type == 2:
-        try:
-            from app.models.product import Product
-            from app.models.order_event import OrderEvent
-            product = None
-            if order.sku_id:
-                product = Product.query.filter_by(
-                    shop_id=shop.id, sku_id=order.sku_id, is_enabled=1, deliver_type=1
-                ).first()
-            if product and shop.card91_api_key:
-                from app.services.card91 import card91_auto_deliver
-                from app.services.jd_game import callback_game_card_deliver
-                from app.services.jd_general import callback_general_card_deliver
-                ok, msg, cards = card91_auto_deliver(shop, order, product)
-                fetch_event = OrderEvent(
-                    order_id=order.id,
-                    order_no=order.order_no,
-                    event_type='card91_fetch',
-                    event_desc=f'91卡券自动提卡：{msg}',
-                    result='success' if ok else 'failed',
-                )
-                db.session.add(fetch_event)
-                if ok:
-                    order.set_card_info(cards)
-                    if shop.shop_type == 1:
-                        success, callback_msg = callback_game_card_deliver(shop, order, cards)
-                    else:
-                        success, callback_msg = callback_general_card_deliver(shop, order, cards)
-                    if success:
-                        order.order_status = 2
-                        order.notify_status = 1
-                        order.notify_time = datetime.now()
-                db.session.commit()
-        except Exception as e:
-            logger.error(f"91卡券自动发货失败: {e}")
+    recent_orders.put(jd_order_no, shop.id, result.order.order_no)
+    if not result.created:
+        return jsonify(success=False, message='订单已存在，请勿重复提交', order_no=result.order.order_no)
 
     # 如果店铺启用了通知，发送订单通知
     try:
@@ -237,21 +206,67 @@ def new_order_count():
     session[last_check_key] = now.isoformat()
 
     query = Order.query.filter(Order.create_time > last_check)
-    if not current_user.is_admin:
-        permitted_ids = current_user.get_permitted_shop_ids()
-        if permitted_ids:
-            query = query.filter(Order.shop_id.in_(permitted_ids))
-        else:
+    shop_ids = current_user.get_permitted_shop_ids()
+    if shop_ids is not None:
+        if not shop_ids:
             return jsonify(count=0)
+        query = query.filter(Order.shop_id.in_(shop_ids))
 
     count = query.count()
-    # 未处理订单数
-    pending_query = Order.query.filter(Order.order_status.in_([0, 1]))
-    if not current_user.is_admin:
-        permitted_ids = current_user.get_permitted_shop_ids()
-        if permitted_ids:
-            pending_query = pending_query.filter(Order.shop_id.in_(permitted_ids))
-        else:
-            return jsonify(count=count, pending=0)
-    pending = pending_query.count()
+    # 未处理订单数（读店铺未处理订单数表）
+    pending = sum(pending_counts(shop_ids).values())
     return jsonify(count=count, pending=pending)
+
+
+def _sse(event, data):
+    return f'event: {event}\ndata: {json.dumps(data)}\n\n'
+
+
+@api_bp.route('/order-events', methods=['GET'])
+@login_required
+def order_events():
+    """新订单提醒推送（text/event-stream），连接数已满时返回 503，页面改用 /new-order-count 轮询。
+
+    事件：
+        orders  {"count": 新订单数}
+        pending {"pending": 未处理订单数}
+    """
+    hub = get_order_alerts()
+    sub = hub.subscribe()
+    if sub is None:
+        return jsonify(success=False, message='推送连接数已满'), 503
+
+    shop_ids = current_user.permitted_shop_set()
+    config = current_app.config
+    stream_seconds = config.get('SSE_STREAM_SECONDS', 55)
+    heartbeat = config.get('SSE_HEARTBEAT_SECONDS', 15)
+    retry_ms = config.get('SSE_RETRY_MS', 3000)
+    # 登录校验和权限查询已在会话中开启事务；推送期间不再访问数据库（未处理订单数由
+    # hub 在独立上下文中读取），先归还连接，避免每个推送连接占用一个数据库连接和长事务快照
+    db.session.close()
+
+    def stream():
+        try:
+            yield f'retry: {retry_ms}\n\n'
+            yield _sse('pending', {'pending': hub.pending_for(shop_ids)})
+            deadline = time.monotonic() + stream_seconds
+            while True:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return
+                events = sub.get(timeout=min(remaining, heartbeat))
+                if not events:
+                    yield ': ping\n\n'
+                    continue
+                visible = [e for e in events if shop_ids is None or e[1] in shop_ids]
+                if not visible:
+                    continue
+                new_count = len({e[2] for e in visible if e[0] == EVENT_NEW})
+                if new_count:
+                    yield _sse('orders', {'count': new_count})
+                yield _sse('pending', {'pending': hub.pending_for(shop_ids)})
+        finally:
+            hub.unsubscribe(sub)
+
+    return Response(stream_with_context(stream()), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
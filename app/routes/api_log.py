@@ -5,6 +5,8 @@ from flask_login import login_required, current_user
 from app.extensions import db
 from app.models.api_log import ApiLog
 from app.models.shop import Shop
+from app.services.log_archive import archive_paginate
+from app.utils.pagination import keyset_paginate
 
 api_log_bp = Blueprint('api_log', __name__)
 
@@ -26,15 +28,24 @@ def admin_required(f):
 @login_required
 @admin_required
 def log_list():
-    page = request.args.get('page', 1, type=int)
     per_page = 30
 
-    query = ApiLog.query
-
     shop_id = request.args.get('shop_id', type=int)
     api_type = request.args.get('api_type', '').strip()
     start_date = request.args.get('start_date', '').strip()
     end_date = request.args.get('end_date', '').strip()
+    shops = Shop.query.order_by(Shop.shop_name).all()
+
+    # 已归档的历史日志（按日期读取归档文件）
+    if request.args.get('source') == 'archive':
+        def match(row):
+            return (not shop_id or row.get('shop_id') == shop_id) and \
+                (not api_type or row.get('api_type') == api_type)
+        pagination, archive_range = archive_paginate('api_logs', start_date, end_date, match, per_page)
+        return render_template('api_log/list.html', logs=pagination.items, pagination=pagination,
+                               shops=shops, archive_range=archive_range)
+
+    query = ApiLog.query
 
     if shop_id:
         query = query.filter(ApiLog.shop_id == shop_id)
@@ -51,8 +62,7 @@ def log_list():
         except ValueError:
             pass
 
-    pagination = query.order_by(ApiLog.id.desc()).paginate(page=page, per_page=per_page, error_out=False)
+    pagination = keyset_paginate(query, ApiLog.id, per_page)
     logs = pagination.items
-    shops = Shop.query.order_by(Shop.shop_name).all()
 
     return render_template('api_log/list.html', logs=logs, pagination=pagination, shops=shops)
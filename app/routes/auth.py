@@ -3,6 +3,7 @@ from flask import Blueprint, render_template, redirect, url_for, request, flash,
 from flask_login import login_user, logout_user, login_required, current_user
 
 from app.extensions import db
+from app.services.log_writer import enqueue_log
 from app.models.user import User
 from app.utils.captcha import generate_captcha
 
@@ -65,21 +66,17 @@ def login():
                 db.session.commit()
 
                 # 记录登录日志
-                try:
-                    from app.models.operation_log import OperationLog
-                    log = OperationLog(
-                        user_id=user.id,
-                        username=user.username,
-                        action='login',
-                        target_type='user',
-                        target_id=user.id,
-                        detail=f'用户 {user.username} 登录成功',
-                        ip_address=request.remote_addr,
-                    )
-                    db.session.add(log)
-                    db.session.commit()
-                except Exception:
-                    pass
+                from app.models.operation_log import OperationLog
+                enqueue_log(
+                    OperationLog,
+                    user_id=user.id,
+                    username=user.username,
+                    action='login',
+                    target_type='user',
+                    target_id=user.id,
+                    detail=f'用户 {user.username} 登录成功',
+                    ip_address=request.remote_addr,
+                )
 
                 login_user(user)
                 next_page = request.args.get('next')
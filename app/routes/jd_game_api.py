@@ -10,19 +10,22 @@ data字段使用UTF-8字符集进行Base64编码，内含业务JSON数据。
 import base64
 import json
 import logging
-import uuid
 from datetime import datetime
 from flask import Blueprint, request, jsonify
 
-from app.extensions import db
 from app.models.order import Order
-from app.models.shop import Shop
 from app.services.jd_game import (
     verify_game_sign,
     callback_game_direct_success,
-    callback_game_card_deliver,
 )
 from app.services.notification import send_order_notification
+from app.services.log_writer import enqueue_log
+from app.services.shop_cache import get_shop_cache
+from app.services.order_ingest import generate_order_no, ingest_order
+from app.services.fulfillment import find_card91_product, build_card91_job
+from app.services.direct_charge import find_direct_charge_product, build_direct_charge_task
+from app.services.recent_orders import get_recent_orders
+from app.services.status_cache import get_status_cache
 
 logger = logging.getLogger(__name__)
 
@@ -77,19 +80,20 @@ def _error_response(message='失败'):
 
 
 def _find_shop_by_request(data):
-    """根据请求数据查找店铺"""
+    """根据请求数据查找店铺（走店铺缓存，不查库）"""
     # 京东可能传 customerId / shop_code / venderId
     customer_id = data.get('customerId') or data.get('customer_id')
     shop_code = data.get('shop_code')
     vender_id = data.get('venderId') or data.get('vender_id')
 
+    cache = get_shop_cache()
     shop = None
     if customer_id:
-        shop = Shop.query.filter_by(game_customer_id=str(customer_id), is_enabled=1).first()
+        shop = cache.by_game_customer_id(customer_id)
     if not shop and shop_code:
-        shop = Shop.query.filter_by(shop_code=shop_code, is_enabled=1).first()
+        shop = cache.by_code(shop_code)
     if not shop and vender_id:
-        shop = Shop.query.filter_by(shop_code=str(vender_id), is_enabled=1).first()
+        shop = cache.by_code(vender_id)
 
     return shop
 
@@ -111,26 +115,19 @@ def game_direct_order():
     返回: {"retCode": "100", "retMessage": "接收成功"}
     """
     raw = request.form.to_dict() or request.get_json(silent=True) or {}
-    # 保存原始请求到数据库
-    try:
-        import json as _json
-        from app.models.api_log import ApiLog
-        _log = ApiLog(
-            api_type='game_direct_inbound',
-            request_method=request.method,
-            request_url=request.url,
-            request_headers=str(dict(request.headers))[:2000],
-            request_body=_json.dumps(raw, ensure_ascii=False)[:4000],
-            response_status=0,
-            response_body='pending',
-            ip_address=request.remote_addr,
-        )
-        db.session.add(_log)
-        db.session.commit()
-        _log_id = _log.id
-    except Exception as _e:
-        _log_id = None
-        logger.warning(f"保存请求日志失败: {_e}")
+    # 保存原始请求（异步批量落库）
+    from app.models.api_log import ApiLog
+    enqueue_log(
+        ApiLog,
+        api_type='game_direct_inbound',
+        request_method=request.method,
+        request_url=request.url,
+        request_headers=str(dict(request.headers))[:2000],
+        request_body=json.dumps(raw, ensure_ascii=False)[:4000],
+        response_status=0,
+        response_body='pending',
+        ip_address=request.remote_addr,
+    )
     logger.info(f"=== 京东直充推送原始数据: {raw}")
 
     if not raw:
@@ -147,7 +144,7 @@ def game_direct_order():
     # 匹配店铺（用外层的customerId）
     shop = _find_shop_by_request(raw)
     if not shop:
-        shop = Shop.query.filter_by(shop_type=1, is_enabled=1).first()
+        shop = get_shop_cache().first_game_shop()
 
     if not shop:
         return _error_response('店铺不存在或已禁用')
@@ -167,11 +164,12 @@ def game_direct_order():
     if not jd_order_no:
         return _error_response('缺少订单号')
 
-    # 防重复
-    if Order.query.filter_by(jd_order_no=jd_order_no).first():
+    # 重复推单直接应答（近期订单索引，不查库）
+    recent_orders = get_recent_orders()
+    if recent_orders.get(jd_order_no, shop.id):
         return _success_response('订单已存在')
 
-    order_no = f"ORD{datetime.now().strftime('%Y%m%d%H%M%S')}{uuid.uuid4().hex[:8].upper()}"
+    order_no = generate_order_no()
 
     order = Order(
         order_no=order_no,
@@ -188,25 +186,24 @@ def game_direct_order():
         notify_url='',
     )
 
-    db.session.add(order)
-    db.session.commit()
+    # 直充自动充值：匹配直充商品（deliver_type=2），直充任务与订单同一事务写入，
+    # 由 worker.py 提交上游供应商并在充值成功后回调京东
+    jobs = []
+    product = find_direct_charge_product(shop.id, order.sku_id)
+    if product:
+        jobs.append(build_direct_charge_task(order, shop, product))
+
+    # 订单、创建事件与直充任务一次提交，依赖唯一索引防重复
+    result = ingest_order(
+        order,
+        f'游戏点卡直充订单创建，京东订单号：{jd_order_no}，金额：{order.amount/100:.2f}元，账号：{order.produce_account or "无"}',
+        related=jobs,
+    )
+    recent_orders.put(jd_order_no, shop.id, result.order.order_no)
+    if not result.created:
+        return _success_response('订单已存在')
     logger.info(f"直充订单接收成功: jd={jd_order_no}, local={order_no}, amount={order.amount}, account={order.produce_account}")
 
-    # 记录订单创建事件
-    try:
-        from app.models.order_event import OrderEvent
-        create_event = OrderEvent(
-            order_id=order.id,
-            order_no=order.order_no,
-            event_type='order_created',
-            event_desc=f'游戏点卡直充订单创建，京东订单号：{jd_order_no}，金额：{order.amount/100:.2f}元，账号：{order.produce_account or "无"}',
-            result='info',
-        )
-        db.session.add(create_event)
-        db.session.commit()
-    except Exception as e:
-        logger.warning(f"记录订单创建事件失败: {e}")
-
     try:
         send_order_notification(order, shop)
     except Exception:
@@ -248,9 +245,19 @@ def game_direct_query():
     if not jd_order_no:
         return _error_response('缺少订单号')
 
+    # 响应体按订单缓存，订单状态变更时失效
+    payload = get_status_cache().get_or_compute(
+        'game_query', jd_order_no, lambda: _game_direct_query_payload(jd_order_no))
+    if payload is None:
+        return _error_response('订单不存在')
+    return jsonify(payload)
+
+
+def _game_direct_query_payload(jd_order_no):
+    """构建直充查询响应体，订单不存在返回 None"""
     order = Order.query.filter_by(jd_order_no=jd_order_no).first()
     if not order:
-        return _error_response('订单不存在')
+        return None
 
     # 状态映射：内部状态 -> JD游戏点卡直充状态
     # 0=充值中（待处理/处理中），1=充值成功，2=充值失败
@@ -263,11 +270,11 @@ def game_direct_query():
 
     logger.info(f"直充查询: jd_order={jd_order_no}, local_status={order.order_status}, jd_status={jd_status}")
 
-    return jsonify(
-        retCode='100',
-        retMessage='查询成功',
-        data=data_response
-    )
+    return {
+        'retCode': '100',
+        'retMessage': '查询成功',
+        'data': data_response,
+    }
 
 
 @jd_game_api_bp.route('/card', methods=['POST'])
@@ -278,24 +285,19 @@ def game_card_order():
     京东推送格式: customerId=xxx&data=base64(JSON)&sign=xxx&timestamp=xxx
     """
     raw = request.form.to_dict() or request.get_json(silent=True) or {}
-    # 保存原始请求到数据库
-    try:
-        import json as _json
-        from app.models.api_log import ApiLog
-        _log = ApiLog(
-            api_type='game_card_inbound',
-            request_method=request.method,
-            request_url=request.url,
-            request_headers=str(dict(request.headers))[:2000],
-            request_body=_json.dumps(raw, ensure_ascii=False)[:4000],
-            response_status=0,
-            response_body='pending',
-            ip_address=request.remote_addr,
-        )
-        db.session.add(_log)
-        db.session.commit()
-    except Exception as _e:
-        logger.warning(f"保存请求日志失败: {_e}")
+    # 保存原始请求（异步批量落库）
+    from app.models.api_log import ApiLog
+    enqueue_log(
+        ApiLog,
+        api_type='game_card_inbound',
+        request_method=request.method,
+        request_url=request.url,
+        request_headers=str(dict(request.headers))[:2000],
+        request_body=json.dumps(raw, ensure_ascii=False)[:4000],
+        response_status=0,
+        response_body='pending',
+        ip_address=request.remote_addr,
+    )
     logger.info(f"=== 京东卡密推送原始数据: {raw}")
 
     if not raw:
@@ -310,7 +312,7 @@ def game_card_order():
 
     shop = _find_shop_by_request(raw)
     if not shop:
-        shop = Shop.query.filter_by(shop_type=1, is_enabled=1).first()
+        shop = get_shop_cache().first_game_shop()
 
     if not shop:
         return _error_response('店铺不存在或已禁用')
@@ -329,10 +331,12 @@ def game_card_order():
     if not jd_order_no:
         return _error_response('缺少订单号')
 
-    if Order.query.filter_by(jd_order_no=jd_order_no).first():
+    # 重复推单直接应答（近期订单索引，不查库）
+    recent_orders = get_recent_orders()
+    if recent_orders.get(jd_order_no, shop.id):
         return _success_response('订单已存在')
 
-    order_no = f"ORD{datetime.now().strftime('%Y%m%d%H%M%S')}{uuid.uuid4().hex[:8].upper()}"
+    order_no = generate_order_no()
 
     order = Order(
         order_no=order_no,
@@ -349,76 +353,24 @@ def game_card_order():
         notify_url='',
     )
 
-    db.session.add(order)
-    db.session.commit()
+    # 91卡券自动发货：匹配商品配置（deliver_type=1），发货任务与订单同一事务写入，
+    # 由发货 worker 异步提卡并回调京东，推单接口立即应答
+    jobs = []
+    product = find_card91_product(shop.id, order.sku_id)
+    if product and shop.card91_api_key:
+        jobs.append(build_card91_job(order, shop, product))
+
+    # 订单、创建事件与发货任务一次提交，依赖唯一索引防重复
+    result = ingest_order(
+        order,
+        f'游戏点卡卡密订单创建，京东订单号：{jd_order_no}，SKU：{order.sku_id or "无"}，数量：{order.quantity}',
+        related=jobs,
+    )
+    recent_orders.put(jd_order_no, shop.id, result.order.order_no)
+    if not result.created:
+        return _success_response('订单已存在')
     logger.info(f"卡密订单接收成功: jd={jd_order_no}, local={order_no}, amount={order.amount}")
 
-    # 记录订单创建事件
-    try:
-        from app.models.order_event import OrderEvent
-        create_event = OrderEvent(
-            order_id=order.id,
-            order_no=order.order_no,
-            event_type='order_created',
-            event_desc=f'游戏点卡卡密订单创建，京东订单号：{jd_order_no}，SKU：{order.sku_id or "无"}，数量：{order.quantity}',
-            result='info',
-        )
-        db.session.add(create_event)
-        db.session.commit()
-    except Exception as e:
-        logger.warning(f"记录订单创建事件失败: {e}")
-
-    # 91卡券自动发货（根据商品配置，deliver_type=1时自动提卡）
-    try:
-        from app.models.product import Product
-        from app.models.order_event import OrderEvent
-        product = None
-        if order.sku_id:
-            product = Product.query.filter_by(
-                shop_id=shop.id, sku_id=order.sku_id, is_enabled=1, deliver_type=1
-            ).first()
-        if product and shop.card91_api_key:
-            from app.services.card91 import card91_auto_deliver
-            ok, msg, cards = card91_auto_deliver(shop, order, product)
-            fetch_event = OrderEvent(
-                order_id=order.id,
-                order_no=order.order_no,
-                event_type='card91_fetch',
-                event_desc=f'91卡券自动提卡：{msg}',
-                result='success' if ok else 'failed',
-            )
-            db.session.add(fetch_event)
-            if ok:
-                order.set_card_info(cards)
-                success, callback_msg = callback_game_card_deliver(shop, order, cards)
-                if success:
-                    order.order_status = 2
-                    order.deliver_time = datetime.now()
-                    order.notify_status = 1
-                    order.notify_time = datetime.now()
-                    deliver_event = OrderEvent(
-                        order_id=order.id,
-                        order_no=order.order_no,
-                        event_type='card91_deliver',
-                        event_desc=f'91卡券自动发卡成功，共{len(cards)}张',
-                        result='success',
-                    )
-                    db.session.add(deliver_event)
-                    logger.info(f"卡密订单 {order_no} 91卡券自动发货完成")
-                else:
-                    order.notify_status = 2
-                    error_event = OrderEvent(
-                        order_id=order.id,
-                        order_no=order.order_no,
-                        event_type='error',
-                        event_desc=f'91卡券发卡回调失败：{callback_msg}',
-                        result='failed',
-                    )
-                    db.session.add(error_event)
-            db.session.commit()
-    except Exception as e:
-        logger.error(f"91卡券自动发货失败: {e}")
-
     try:
         send_order_notification(order, shop)
     except Exception:
@@ -457,9 +409,18 @@ def game_card_query():
     if not jd_order_no:
         return _error_response('缺少订单号')
 
+    payload = get_status_cache().get_or_compute(
+        'game_card_query', jd_order_no, lambda: _game_card_query_payload(jd_order_no))
+    if payload is None:
+        return _error_response('订单不存在')
+    return jsonify(payload)
+
+
+def _game_card_query_payload(jd_order_no):
+    """构建卡密查询响应体，订单不存在返回 None"""
     order = Order.query.filter_by(jd_order_no=jd_order_no).first()
     if not order:
-        return _error_response('订单不存在')
+        return None
 
     jd_status_map = {
         0: 1, 1: 1, 2: 0, 3: 2, 4: 2, 5: 2,
@@ -481,8 +442,8 @@ def game_card_query():
 
     logger.info(f"卡密查询: jd_order={jd_order_no}, local_status={order.order_status}, jd_status={jd_status}")
 
-    return jsonify(
-        retCode='100',
-        retMessage='查询成功',
-        data=data_response
-    )
+    return {
+        'retCode': '100',
+        'retMessage': '查询成功',
+        'data': data_response,
+    }
@@ -6,15 +6,18 @@
 """
 import json
 import logging
-import uuid
 from datetime import datetime
 from flask import Blueprint, request, jsonify
 
-from app.extensions import db
 from app.models.order import Order
-from app.models.shop import Shop
 from app.services.jd_general import verify_general_sign, generate_general_sign
 from app.services.notification import send_order_notification
+from app.services.shop_cache import get_shop_cache
+from app.services.order_ingest import generate_order_no, ingest_order
+from app.services.fulfillment import find_card91_product, build_card91_job
+from app.services.direct_charge import find_direct_charge_product, build_direct_charge_task
+from app.services.recent_orders import get_recent_orders
+from app.services.status_cache import get_status_cache
 
 logger = logging.getLogger(__name__)
 
@@ -22,23 +25,42 @@ jd_general_api_bp = Blueprint('jd_general_api', __name__)
 
 
 def _find_shop_by_request(data):
-    """根据请求数据查找店铺"""
+    """根据请求数据查找店铺（走店铺缓存，不查库）"""
     # 通用交易文档中字段名为 vendorId（非 venderId）
     vendor_id = data.get('vendorId') or data.get('venderId') or data.get('vendor_id')
     shop_code = data.get('shop_code')
 
+    cache = get_shop_cache()
     shop = None
     if vendor_id:
         # 优先按 general_vendor_id 查找（通用交易商家ID）
-        shop = Shop.query.filter_by(general_vendor_id=str(vendor_id), is_enabled=1).first()
+        shop = cache.by_vendor_id(vendor_id)
         if not shop:
-            shop = Shop.query.filter_by(shop_code=str(vendor_id), is_enabled=1).first()
+            shop = cache.by_code(vendor_id)
     if not shop and shop_code:
-        shop = Shop.query.filter_by(shop_code=shop_code, is_enabled=1).first()
+        shop = cache.by_code(shop_code)
 
     return shop
 
 
+def _accepted_response(shop, jd_order_no, order_no):
+    """接单受理响应（produceStatus=3 处理中），新单与重复推单共用"""
+    timestamp = datetime.now().strftime('%Y%m%d%H%M%S')
+    resp_params = {
+        'jdOrderNo': jd_order_no,
+        'agentOrderNo': order_no,
+        'produceStatus': 3,
+        'code': 'JDO_201',
+        'signType': 'MD5',
+        'timestamp': timestamp,
+    }
+    if shop.general_md5_secret:
+        sign_p = {k: v for k, v in resp_params.items()
+                  if k not in ('sign', 'signType') and v is not None and str(v) != ''}
+        resp_params['sign'] = generate_general_sign(sign_p, shop.general_md5_secret)
+    return jsonify(resp_params)
+
+
 @jd_general_api_bp.route('/distill', methods=['POST'])
 def general_distill():
     """通用交易 - 充值/提取卡密接口
@@ -75,30 +97,21 @@ def general_distill():
 
     jd_order_no = str(data.get('jdOrderNo') or data.get('jdOrderId') or
                       data.get('jd_order_no') or data.get('orderId') or '')
+    # 空订单号会在 (jd_order_no, shop_id) 唯一索引上互相冲突，被当作重复推单应答
+    if not jd_order_no:
+        return jsonify(success=False, code=1, message='缺少订单号'), 400
 
-    # 防重复
-    if jd_order_no and Order.query.filter_by(jd_order_no=jd_order_no).first():
-        existing = Order.query.filter_by(jd_order_no=jd_order_no).first()
-        timestamp = datetime.now().strftime('%Y%m%d%H%M%S')
-        resp_params = {
-            'jdOrderNo': jd_order_no,
-            'agentOrderNo': existing.order_no,
-            'produceStatus': 3,
-            'code': 'JDO_201',
-            'signType': 'MD5',
-            'timestamp': timestamp,
-        }
-        if shop.general_md5_secret:
-            sign_p = {k: v for k, v in resp_params.items()
-                      if k not in ('sign', 'signType') and v is not None and str(v) != ''}
-            resp_params['sign'] = generate_general_sign(sign_p, shop.general_md5_secret)
-        return jsonify(resp_params)
+    # 重复推单直接应答（近期订单索引，不查库）
+    recent_orders = get_recent_orders()
+    existing_no = recent_orders.get(jd_order_no, shop.id)
+    if existing_no:
+        return _accepted_response(shop, jd_order_no, existing_no)
 
     # 判断订单类型：通用交易 bizType=1直充 bizType=2卡密
     biz_type = data.get('bizType') or data.get('biz_type') or data.get('order_type')
     order_type = 2 if str(biz_type) == '2' else 1
 
-    order_no = f"ORD{datetime.now().strftime('%Y%m%d%H%M%S')}{uuid.uuid4().hex[:8].upper()}"
+    order_no = generate_order_no()
 
     amount = int(data.get('totalPrice') or data.get('price') or data.get('amount') or
                  data.get('jdPrice') or 0)
@@ -123,96 +136,33 @@ def general_distill():
         notify_url=notify_url,
     )
 
-    db.session.add(order)
-    db.session.commit()
-
-    # 记录订单创建事件
-    try:
-        from app.models.order_event import OrderEvent
-        create_event = OrderEvent(
-            order_id=order.id,
-            order_no=order.order_no,
-            event_type='order_created',
-            event_desc=f'通用交易订单创建，京东订单号：{jd_order_no}，类型：{"直充" if order_type==1 else "卡密"}，SKU：{sku_id or "无"}',
-            result='info',
-        )
-        db.session.add(create_event)
-        db.session.commit()
-    except Exception as e:
-        logger.warning(f"记录订单创建事件失败: {e}")
-
-    # 91卡券自动发货（卡密订单，根据商品配置deliver_type=1时自动提卡）
+    # 卡密订单的91卡券自动发货 / 直充订单的上游自动充值：任务与订单同一事务写入，由 worker.py 异步执行
+    jobs = []
     if order_type == 2:
-        try:
-            from app.models.product import Product
-            from app.models.order_event import OrderEvent
-            from app.services.jd_general import callback_general_card_deliver
-            product = None
-            if order.sku_id:
-                product = Product.query.filter_by(
-                    shop_id=shop.id, sku_id=order.sku_id, is_enabled=1, deliver_type=1
-                ).first()
-            if product and shop.card91_api_key:
-                from app.services.card91 import card91_auto_deliver
-                ok, msg, cards = card91_auto_deliver(shop, order, product)
-                fetch_event = OrderEvent(
-                    order_id=order.id,
-                    order_no=order.order_no,
-                    event_type='card91_fetch',
-                    event_desc=f'91卡券自动提卡：{msg}',
-                    result='success' if ok else 'failed',
-                )
-                db.session.add(fetch_event)
-                if ok:
-                    order.set_card_info(cards)
-                    success, callback_msg = callback_general_card_deliver(shop, order, cards)
-                    if success:
-                        order.order_status = 2
-                        order.deliver_time = datetime.now()
-                        order.notify_status = 1
-                        order.notify_time = datetime.now()
-                        deliver_event = OrderEvent(
-                            order_id=order.id,
-                            order_no=order.order_no,
-                            event_type='card91_deliver',
-                            event_desc=f'91卡券自动发卡成功，共{len(cards)}张',
-                            result='success',
-                        )
-                        db.session.add(deliver_event)
-                        logger.info(f"通用交易卡密订单 {order.order_no} 91卡券自动发货完成")
-                    else:
-                        order.notify_status = 2
-                        error_event = OrderEvent(
-                            order_id=order.id,
-                            order_no=order.order_no,
-                            event_type='error',
-                            event_desc=f'91卡券发卡回调失败：{callback_msg}',
-                            result='failed',
-                        )
-                        db.session.add(error_event)
-                db.session.commit()
-        except Exception as e:
-            logger.error(f"91卡券自动发货失败: {e}")
+        product = find_card91_product(shop.id, order.sku_id)
+        if product and shop.card91_api_key:
+            jobs.append(build_card91_job(order, shop, product))
+    elif order_type == 1:
+        product = find_direct_charge_product(shop.id, order.sku_id)
+        if product:
+            jobs.append(build_direct_charge_task(order, shop, product))
+
+    # 订单、创建事件与发货任务一次提交，依赖唯一索引防重复
+    result = ingest_order(
+        order,
+        f'通用交易订单创建，京东订单号：{jd_order_no}，类型：{"直充" if order_type==1 else "卡密"}，SKU：{sku_id or "无"}',
+        related=jobs,
+    )
+    recent_orders.put(jd_order_no, shop.id, result.order.order_no)
+    if not result.created:
+        return _accepted_response(shop, jd_order_no, result.order.order_no)
 
     try:
         send_order_notification(order, shop)
     except Exception:
         pass
 
-    timestamp = datetime.now().strftime('%Y%m%d%H%M%S')
-    resp_params = {
-        'jdOrderNo': jd_order_no,
-        'agentOrderNo': order_no,
-        'produceStatus': 3,
-        'code': 'JDO_201',
-        'signType': 'MD5',
-        'timestamp': timestamp,
-    }
-    if shop.general_md5_secret:
-        sign_p = {k: v for k, v in resp_params.items()
-                  if k not in ('sign', 'signType') and v is not None and str(v) != ''}
-        resp_params['sign'] = generate_general_sign(sign_p, shop.general_md5_secret)
-    return jsonify(resp_params)
+    return _accepted_response(shop, jd_order_no, order_no)
 
 
 @jd_general_api_bp.route('/query', methods=['POST', 'GET'])
@@ -233,14 +183,33 @@ def general_query():
     if not jd_order_no:
         return jsonify(success=False, code=1, message='缺少订单号'), 400
 
+    # 响应体（含加密卡密）按订单缓存，订单状态/卡密变更时失效；timestamp 与签名每次重新生成
+    cached = get_status_cache().get_or_compute(
+        'general_query', jd_order_no, lambda: _general_query_payload(jd_order_no))
+    if cached is None:
+        return jsonify(success=False, code=1, message='订单不存在')
+
+    base_params, md5_secret = cached
+    resp_params = dict(base_params)
+    resp_params['timestamp'] = datetime.now().strftime('%Y%m%d%H%M%S')
+
+    if md5_secret:
+        sign_p = {k: v for k, v in resp_params.items()
+                  if k not in ('sign', 'signType') and v is not None and str(v) != ''}
+        resp_params['sign'] = generate_general_sign(sign_p, md5_secret)
+
+    return jsonify(resp_params)
+
+
+def _general_query_payload(jd_order_no):
+    """构建反查响应体（不含 timestamp/sign），返回 (响应参数, 签名密钥)，订单不存在返回 None"""
     order = Order.query.filter_by(jd_order_no=jd_order_no).first()
     if not order:
-        return jsonify(success=False, code=1, message='订单不存在')
+        return None
 
     # 状态映射：订单状态 -> produceStatus 和 code
     status_to_produce = {0: 3, 1: 3, 2: 1, 3: 2, 4: 2}
     status_to_code = {0: 'JDO_201', 1: 'JDO_201', 2: 'JDO_200', 3: 'JDO_302', 4: 'JDO_302'}
-    timestamp = datetime.now().strftime('%Y%m%d%H%M%S')
 
     resp_params = {
         'jdOrderNo': order.jd_order_no,
@@ -248,7 +217,6 @@ def general_query():
         'produceStatus': status_to_produce.get(order.order_status, 3),
         'code': status_to_code.get(order.order_status, 'JDO_201'),
         'signType': 'MD5',
-        'timestamp': timestamp,
     }
 
     if order.order_status == 2 and order.card_info_parsed:
@@ -261,9 +229,5 @@ def general_query():
         else:
             resp_params['product'] = product_json
 
-    if order.shop and order.shop.general_md5_secret:
-        sign_p = {k: v for k, v in resp_params.items()
-                  if k not in ('sign', 'signType') and v is not None and str(v) != ''}
-        resp_params['sign'] = generate_general_sign(sign_p, order.shop.general_md5_secret)
-
-    return jsonify(resp_params)
+    md5_secret = order.shop.general_md5_secret if order.shop else None
+    return resp_params, md5_secret
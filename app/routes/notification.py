@@ -4,7 +4,9 @@ from flask_login import login_required, current_user
 from app.extensions import db
 from app.models.notification_log import NotificationLog
 from app.models.shop import Shop
-from app.services.notification import resend_notification
+from app.services.notification import resend_notification, get_notification_dispatcher
+from app.services.log_archive import archive_paginate
+from app.utils.pagination import keyset_paginate
 
 notification_bp = Blueprint('notification', __name__)
 
@@ -24,14 +26,27 @@ def admin_required(f):
 @login_required
 @admin_required
 def log_list():
-    page = request.args.get('page', 1, type=int)
     per_page = 20
 
-    query = NotificationLog.query
-
     shop_id = request.args.get('shop_id', type=int)
     notify_type = request.args.get('notify_type', '').strip()
     notify_status = request.args.get('notify_status', type=int)
+    shops = Shop.query.order_by(Shop.shop_name).all()
+
+    # 已归档的历史日志（按日期读取归档文件）
+    if request.args.get('source') == 'archive':
+        def match(row):
+            return (not shop_id or row.get('shop_id') == shop_id) and \
+                (not notify_type or row.get('notify_type') == notify_type) and \
+                (notify_status is None or notify_status == -1 or row.get('notify_status') == notify_status)
+        pagination, archive_range = archive_paginate(
+            'notification_logs', request.args.get('start_date', '').strip(),
+            request.args.get('end_date', '').strip(), match, per_page,
+        )
+        return render_template('notification/list.html', logs=pagination.items, pagination=pagination,
+                               shops=shops, archive_range=archive_range)
+
+    query = NotificationLog.query
 
     if shop_id:
         query = query.filter(NotificationLog.shop_id == shop_id)
@@ -40,11 +55,11 @@ def log_list():
     if notify_status is not None and notify_status != -1:
         query = query.filter(NotificationLog.notify_status == notify_status)
 
-    pagination = query.order_by(NotificationLog.id.desc()).paginate(page=page, per_page=per_page, error_out=False)
+    pagination = keyset_paginate(query, NotificationLog.id, per_page)
     logs = pagination.items
 
-    shops = Shop.query.order_by(Shop.shop_name).all()
-    return render_template('notification/list.html', logs=logs, pagination=pagination, shops=shops)
+    return render_template('notification/list.html', logs=logs, pagination=pagination, shops=shops,
+                           dispatcher=get_notification_dispatcher().stats())
 
 
 @notification_bp.route('/resend', methods=['POST'])
@@ -68,3 +83,11 @@ def log_detail(log_id):
     if not log:
         return jsonify(success=False, message='记录不存在'), 404
     return jsonify(log.to_dict())
+
+
+@notification_bp.route('/dispatcher-stats')
+@login_required
+@admin_required
+def dispatcher_stats():
+    """本进程通知分发队列的监控数据。"""
+    return jsonify(get_notification_dispatcher().stats())
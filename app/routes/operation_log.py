@@ -4,6 +4,8 @@ from flask_login import login_required, current_user
 
 from app.extensions import db
 from app.models.operation_log import OperationLog
+from app.services.log_archive import archive_paginate
+from app.utils.pagination import keyset_paginate
 
 operation_log_bp = Blueprint('operation_log', __name__)
 
@@ -25,16 +27,24 @@ def admin_required(f):
 @login_required
 @admin_required
 def log_list():
-    page = request.args.get('page', 1, type=int)
     per_page = 30
 
-    query = OperationLog.query
-
     action = request.args.get('action', '').strip()
     username = request.args.get('username', '').strip()
     start_date = request.args.get('start_date', '').strip()
     end_date = request.args.get('end_date', '').strip()
 
+    # 已归档的历史日志（按日期读取归档文件）
+    if request.args.get('source') == 'archive':
+        def match(row):
+            return (not action or row.get('action') == action) and \
+                (not username or username in (row.get('username') or ''))
+        pagination, archive_range = archive_paginate('operation_logs', start_date, end_date, match, per_page)
+        return render_template('operation_log/list.html', logs=pagination.items, pagination=pagination,
+                               archive_range=archive_range)
+
+    query = OperationLog.query
+
     if action:
         query = query.filter(OperationLog.action == action)
     if username:
@@ -50,7 +60,7 @@ def log_list():
         except ValueError:
             pass
 
-    pagination = query.order_by(OperationLog.id.desc()).paginate(page=page, per_page=per_page, error_out=False)
+    pagination = keyset_paginate(query, OperationLog.id, per_page)
     logs = pagination.items
 
     return render_template('operation_log/list.html', logs=logs, pagination=pagination)
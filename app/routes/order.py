@@ -1,15 +1,32 @@
-import csv
-import io
 import json
+import os
 import uuid
 from datetime import datetime
-from flask import Blueprint, render_template, request, redirect, url_for, flash, jsonify, Response
+from urllib.parse import quote
+from flask import (Blueprint, render_template, request, redirect, url_for, flash, jsonify, Response,
+                   current_app, send_file, stream_with_context)
 from flask_login import login_required, current_user
 
 from app.extensions import db
 from app.models.order import Order
 from app.models.shop import Shop
+from app.models.export_job import ExportJob
+from app.models.bulk_job import BulkJob
 from app.services.notification import send_order_notification
+from app.services.log_writer import enqueue_log
+from app.services.callback_outbox import enqueue_callback
+from app.services.bulk_actions import can_run, create_bulk_job
+from app.services.order_search import apply_order_filters
+from app.services.order_export import (
+    EXPORT_FORMATS,
+    create_export_job,
+    export_filename,
+    export_statement,
+    iter_csv_chunks,
+    iter_export_rows,
+    iter_gzip,
+)
+from app.utils.pagination import keyset_paginate, get_count_cache
 from app.services.jd_game import (
     callback_game_direct_success,
     callback_game_card_deliver,
@@ -36,87 +53,34 @@ NOTIFY_STATUS_FAILED = 2
 
 def _log_operation(user, action, target_type, target_id, detail):
     """记录操作日志辅助函数"""
-    try:
-        from app.models.operation_log import OperationLog
-        log = OperationLog(
-            user_id=user.id,
-            username=user.username,
-            action=action,
-            target_type=target_type,
-            target_id=target_id,
-            detail=detail,
-            ip_address=request.remote_addr,
-        )
-        db.session.add(log)
-        db.session.commit()
-    except Exception as e:
-        logger.warning(f'记录操作日志失败: {e}')
+    from app.models.operation_log import OperationLog
+    enqueue_log(
+        OperationLog,
+        user_id=user.id,
+        username=user.username,
+        action=action,
+        target_type=target_type,
+        target_id=target_id,
+        detail=detail,
+        ip_address=request.remote_addr,
+    )
 
 
 @order_bp.route('/')
 @login_required
 def order_list():
-    page = request.args.get('page', 1, type=int)
     per_page = 20
 
-    query = Order.query
+    permitted_ids = None if current_user.is_admin else current_user.get_permitted_shop_ids()
+    query = apply_order_filters(Order.query, request.args, permitted_ids)
 
-    # Permission filtering
-    if not current_user.is_admin:
-        permitted_ids = current_user.get_permitted_shop_ids()
-        if permitted_ids is not None:
-            query = query.filter(Order.shop_id.in_(permitted_ids)) if permitted_ids else query.filter(db.false())
-
-    # Filters
-    shop_id = request.args.get('shop_id', type=int)
-    shop_type = request.args.get('shop_type', type=int)
-    order_type = request.args.get('order_type', type=int)
-    order_status = request.args.get('order_status', type=int)
-    keyword = request.args.get('keyword', '').strip()
-    jd_order_no = request.args.get('jd_order_no', '').strip()
-    start_date = request.args.get('start_date', '').strip()
-    end_date = request.args.get('end_date', '').strip()
-
-    if shop_id:
-        query = query.filter(Order.shop_id == shop_id)
-    if shop_type:
-        query = query.filter(Order.shop_type == shop_type)
-    if order_type:
-        query = query.filter(Order.order_type == order_type)
-    if order_status is not None and order_status != -1:
-        query = query.filter(Order.order_status == order_status)
-    
-    # 关键字搜索：支持系统订单号、京东订单号、商品名称、充值账号
-    if keyword:
-        query = query.filter(
-            db.or_(
-                Order.order_no.like(f'%{keyword}%'),
-                Order.jd_order_no.like(f'%{keyword}%'),
-                Order.product_info.like(f'%{keyword}%'),
-                Order.produce_account.like(f'%{keyword}%'),
-            )
-        )
-    elif jd_order_no:
-        query = query.filter(Order.jd_order_no.like(f'%{jd_order_no}%'))
-    if start_date:
-        try:
-            query = query.filter(Order.create_time >= datetime.strptime(start_date, '%Y-%m-%d'))
-        except ValueError:
-            pass
-    if end_date:
-        try:
-            query = query.filter(Order.create_time <= datetime.strptime(end_date + ' 23:59:59', '%Y-%m-%d %H:%M:%S'))
-        except ValueError:
-            pass
-
-    pagination = query.order_by(Order.id.desc()).paginate(page=page, per_page=per_page, error_out=False)
+    pagination = keyset_paginate(query, Order.id, per_page)
     orders = pagination.items
 
     # Get shops for filter dropdown
     if current_user.is_admin:
         shops = Shop.query.order_by(Shop.shop_name).all()
     else:
-        permitted_ids = current_user.get_permitted_shop_ids()
         shops = Shop.query.filter(Shop.id.in_(permitted_ids)).order_by(Shop.shop_name).all() if permitted_ids else []
 
     return render_template('order/list.html', orders=orders, pagination=pagination, shops=shops)
@@ -125,85 +89,69 @@ def order_list():
 @order_bp.route('/export')
 @login_required
 def export_orders():
-    """导出订单为CSV"""
-    query = Order.query
-
-    # 权限过滤
-    if not current_user.is_admin:
-        permitted_ids = current_user.get_permitted_shop_ids()
-        if permitted_ids is not None:
-            query = query.filter(Order.shop_id.in_(permitted_ids)) if permitted_ids else query.filter(db.false())
-
-    # 筛选条件（与list一致）
-    shop_id = request.args.get('shop_id', type=int)
-    shop_type = request.args.get('shop_type', type=int)
-    order_type = request.args.get('order_type', type=int)
-    order_status = request.args.get('order_status', type=int)
-    keyword = request.args.get('keyword', '').strip()
-    jd_order_no = request.args.get('jd_order_no', '').strip()
-    start_date = request.args.get('start_date', '').strip()
-    end_date = request.args.get('end_date', '').strip()
-
-    if shop_id:
-        query = query.filter(Order.shop_id == shop_id)
-    if shop_type:
-        query = query.filter(Order.shop_type == shop_type)
-    if order_type:
-        query = query.filter(Order.order_type == order_type)
-    if order_status is not None and order_status != -1:
-        query = query.filter(Order.order_status == order_status)
-    if keyword:
-        query = query.filter(db.or_(
-            Order.order_no.like(f'%{keyword}%'),
-            Order.jd_order_no.like(f'%{keyword}%'),
-            Order.product_info.like(f'%{keyword}%'),
-            Order.produce_account.like(f'%{keyword}%'),
-        ))
-    elif jd_order_no:
-        query = query.filter(Order.jd_order_no.like(f'%{jd_order_no}%'))
-    if start_date:
-        try:
-            query = query.filter(Order.create_time >= datetime.strptime(start_date, '%Y-%m-%d'))
-        except ValueError:
-            pass
-    if end_date:
-        try:
-            query = query.filter(Order.create_time <= datetime.strptime(end_date + ' 23:59:59', '%Y-%m-%d %H:%M:%S'))
-        except ValueError:
-            pass
-
-    def generate_csv():
-        output = io.StringIO()
-        output.write('\ufeff')  # UTF-8 BOM
-        writer = csv.writer(output)
-        writer.writerow(['京东订单号', '系统订单号', '店铺名称', '店铺类型', '订单类型', '订单状态',
-                         '商品信息', '金额(元)', '数量', '充值账号', '创建时间'])
-        yield output.getvalue()
-
-        for o in query.order_by(Order.id.desc()).limit(10000).yield_per(200):
-            row_buf = io.StringIO()
-            csv.writer(row_buf).writerow([
-                o.jd_order_no,
-                o.order_no,
-                o.shop.shop_name if o.shop else '',
-                o.shop_type_label,
-                o.order_type_label,
-                o.order_status_label,
-                o.product_info or '',
-                f'{o.amount / 100:.2f}',
-                o.quantity,
-                o.produce_account or '',
-                o.create_time.strftime('%Y-%m-%d %H:%M:%S') if o.create_time else '',
-            ])
-            yield row_buf.getvalue()
-
-    filename = f'订单导出_{datetime.now().strftime("%Y%m%d_%H%M%S")}.csv'
+    """导出订单（csv / csv.gz 小批量直接下载，大批量或 xlsx 转为后台导出任务）"""
+    export_format = request.args.get('format', 'csv')
+    if export_format not in EXPORT_FORMATS:
+        export_format = 'csv'
+
+    permitted_ids = None if current_user.is_admin else current_user.get_permitted_shop_ids()
+    query = apply_order_filters(Order.query, request.args, permitted_ids)
+    total, approximate = get_count_cache().count(query, Order.id)
+
+    if export_format == 'xlsx' or request.args.get('background') == '1' or \
+            total > current_app.config.get('EXPORT_SYNC_MAX_ROWS', 20000):
+        job = create_export_job(current_user, request.args, export_format,
+                                total_rows=None if approximate else total)
+        flash(f'导出任务 #{job.id} 已创建（约 {total} 条），完成后可在导出任务页面下载', 'success')
+        return redirect(url_for('order.export_jobs'))
+
+    chunks = iter_csv_chunks(iter_export_rows(export_statement(query)))
+    if export_format == 'csv.gz':
+        chunks = iter_gzip(chunks)
+    filename = export_filename(export_format)
     return Response(
-        generate_csv(),
-        mimetype='text/csv; charset=utf-8-sig',
-        headers={'Content-Disposition': f'attachment; filename*=UTF-8\'\'{filename}'}
+        stream_with_context(chunks),
+        mimetype=EXPORT_FORMATS[export_format][0],
+        headers={'Content-Disposition': f'attachment; filename*=UTF-8\'\'{quote(filename)}'}
     )
 
+
+def _visible_export_jobs():
+    query = ExportJob.query
+    if not current_user.is_admin:
+        query = query.filter(ExportJob.user_id == current_user.id)
+    return query
+
+
+@order_bp.route('/exports')
+@login_required
+def export_jobs():
+    """导出任务列表"""
+    jobs = _visible_export_jobs().order_by(ExportJob.id.desc()).limit(50).all()
+    return render_template('order/exports.html', jobs=jobs)
+
+
+@order_bp.route('/exports/<int:job_id>')
+@login_required
+def export_job_status(job_id):
+    """导出任务进度"""
+    job = _visible_export_jobs().filter(ExportJob.id == job_id).first()
+    if not job:
+        return jsonify(success=False, message='任务不存在'), 404
+    return jsonify(success=True, job=job.to_dict())
+
+
+@order_bp.route('/exports/<int:job_id>/download')
+@login_required
+def export_job_download(job_id):
+    """下载导出文件"""
+    job = _visible_export_jobs().filter(ExportJob.id == job_id).first()
+    if not job or job.status != ExportJob.STATUS_DONE or not job.file_path or not os.path.exists(job.file_path):
+        flash('导出文件不存在或已过期', 'danger')
+        return redirect(url_for('order.export_jobs'))
+    return send_file(job.file_path, as_attachment=True, download_name=job.file_name,
+                     mimetype=EXPORT_FORMATS[job.export_format][0])
+
 @order_bp.route('/detail/<int:order_id>')
 @login_required
 def order_detail(order_id):
@@ -293,11 +241,13 @@ def deliver_card(order_id):
             return jsonify(success=True, message='卡密发送成功')
         else:
             order.notify_status = NOTIFY_STATUS_FAILED
+            enqueue_callback(order, 'deliver', message)
             db.session.commit()
             return jsonify(success=False, message=message)
     except Exception as e:
         logger.error(f"订单 {order.order_no} 发卡密失败：{e}")
         order.notify_status = NOTIFY_STATUS_FAILED
+        enqueue_callback(order, 'deliver', e)
         db.session.commit()
         return jsonify(success=False, message=f'发卡密失败：{str(e)}')
 
@@ -403,12 +353,14 @@ def notify_success(order_id):
                 ))
             except Exception:
                 pass
+            enqueue_callback(order, 'deliver', message)
             db.session.commit()
             return jsonify(success=False, message=message)
     
     except Exception as e:
         logger.error(f"订单 {order.order_no} 通知失败：{e}")
         order.notify_status = NOTIFY_STATUS_FAILED
+        enqueue_callback(order, 'deliver', e)
         db.session.commit()
         return jsonify(success=False, message=f'通知失败：{str(e)}')
 
@@ -464,12 +416,14 @@ def notify_refund(order_id):
             return jsonify(success=True, message='退款通知已发送')
         else:
             order.notify_status = NOTIFY_STATUS_FAILED
+            enqueue_callback(order, 'refund', message)
             db.session.commit()
             return jsonify(success=False, message=message)
     
     except Exception as e:
         logger.error(f"订单 {order.order_no} 退款通知失败：{e}")
         order.notify_status = NOTIFY_STATUS_FAILED
+        enqueue_callback(order, 'refund', e)
         db.session.commit()
         return jsonify(success=False, message=f'退款通知失败：{str(e)}')
 
@@ -501,29 +455,20 @@ def card91_deliver(order_id):
     if not shop.card91_api_key:
         return jsonify(success=False, message='该店铺未配置91卡券API密钥')
 
-    # 根据SKU查找商品配置
-    from app.models.product import Product
+    # 根据SKU查找商品配置，未匹配时按商品名称模糊匹配（路由表，不查询数据库）
     from app.models.order_event import OrderEvent
-    from app.services.card91 import card91_auto_deliver
+    from app.services.card_pool import deliver_cards
+    from app.services.product_router import get_product_router
     import json as json_mod
 
-    product = None
-    if order.sku_id:
-        product = Product.query.filter_by(
-            shop_id=shop.id, sku_id=order.sku_id, is_enabled=1, deliver_type=1
-        ).first()
-    if not product and order.product_info:
-        # 按商品名称模糊匹配（截取前20字符防止过长，使用参数化查询）
-        keyword = order.product_info[:20]
-        product = Product.query.filter_by(
-            shop_id=shop.id, deliver_type=1, is_enabled=1
-        ).filter(Product.product_name.contains(keyword)).first()
+    product = get_product_router().match(shop.id, order.sku_id, order.product_info)
 
     if not product:
         return jsonify(success=False, message='未找到匹配的91卡券商品配置，请先在商品管理中设置')
 
-    # 从91卡券提卡
-    ok, msg, cards = card91_auto_deliver(shop, order, product)
+    # 取卡：开启本地库存的商品优先从库存领取，否则从91卡券提卡（同卡种并发提卡会合并为一次请求，明细记入事件）
+    pick_detail = {}
+    ok, msg, cards = deliver_cards(shop, order, product, detail=pick_detail)
 
     # 记录提卡事件
     fetch_event = OrderEvent(
@@ -531,10 +476,11 @@ def card91_deliver(order_id):
         order_no=order.order_no,
         event_type='card91_fetch',
         event_desc=f'91卡券提卡：{msg}',
-        event_data=json_mod.dumps({'product_name': product.product_name,
-                                    'card_type_id': product.card91_card_type_id,
-                                    'quantity': order.quantity,
-                                    'success': ok}, ensure_ascii=False),
+        event_data=json_mod.dumps(dict(pick_detail,
+                                       product_name=product.product_name,
+                                       card_type_id=product.card91_card_type_id,
+                                       quantity=order.quantity,
+                                       success=ok), ensure_ascii=False),
         operator=current_user.username,
         result='success' if ok else 'failed',
     )
@@ -591,12 +537,14 @@ def card91_deliver(order_id):
                 result='failed',
             )
             db.session.add(fail_event)
+            enqueue_callback(order, 'deliver', callback_msg)
             db.session.commit()
             return jsonify(success=False, message=f'卡密已提取但回调京东失败：{callback_msg}')
 
     except Exception as e:
         logger.error(f'91卡券发货回调异常：{e}')
         order.notify_status = NOTIFY_STATUS_FAILED
+        enqueue_callback(order, 'deliver', e)
         db.session.commit()
         return jsonify(success=False, message=f'回调失败：{str(e)}')
 
@@ -649,11 +597,12 @@ def debug_failed(order_id):
     return jsonify(success=True, message='订单已标记为充值失败')
 
 
-@order_bp.route("/batch-notify-success", methods=["POST"])
-@login_required
-def batch_notify_success():
-    """批量通知成功"""
-    if not current_user.is_admin and not current_user.can_deliver:
+def _start_bulk_job(action):
+    """创建批量任务，交给 worker.py 后台执行，页面轮询 /order/bulk-jobs/<id> 获取进度。
+
+    回调 / 提卡按店铺限并发，即使少量订单也可能要串行等待多轮接口超时，不在请求中执行。
+    """
+    if not can_run(current_user, action):
         return jsonify(success=False, message='无操作权限'), 403
 
     data = request.get_json() or {}
@@ -661,44 +610,45 @@ def batch_notify_success():
     if not order_ids:
         return jsonify(success=False, message='请选择订单')
 
-    ok_list, fail_list = [], []
-    for oid in order_ids[:100]:
-        order = db.session.get(Order, oid)
-        if not order:
-            fail_list.append({'id': oid, 'reason': '订单不存在'})
-            continue
-        if not current_user.has_shop_permission(order.shop_id):
-            fail_list.append({'id': oid, 'reason': '无店铺权限'})
-            continue
-        if order.order_status not in (0, 1):
-            fail_list.append({'id': oid, 'reason': '状态不符'})
-            continue
-        if order.order_type != 1:
-            fail_list.append({'id': oid, 'reason': '非直充订单'})
-            continue
-        shop = order.shop
-        if not shop:
-            fail_list.append({'id': oid, 'reason': '店铺不存在'})
-            continue
-        try:
-            if shop.shop_type == 1:
-                success, msg = callback_game_direct_success(shop, order)
-            else:
-                success, msg = callback_general_success(shop, order)
-            if success:
-                order.order_status = 2
-                order.notify_status = NOTIFY_STATUS_SUCCESS
-                order.notify_time = datetime.now()
-                db.session.commit()
-                _log_operation(current_user, 'deliver', 'order', order.id,
-                               f'批量通知成功：订单 {order.jd_order_no}')
-                ok_list.append(oid)
-            else:
-                fail_list.append({'id': oid, 'reason': msg})
-        except Exception as e:
-            fail_list.append({'id': oid, 'reason': str(e)})
+    try:
+        job = create_bulk_job(current_user, action, order_ids, ip_address=request.remote_addr)
+    except ValueError as e:
+        return jsonify(success=False, message=str(e))
+    return jsonify(success=True, background=True, job=job.to_dict())
+
 
-    return jsonify(success=True, ok_count=len(ok_list), fail_count=len(fail_list), fails=fail_list)
+@order_bp.route("/batch-notify-success", methods=["POST"])
+@login_required
+def batch_notify_success():
+    """批量通知成功"""
+    return _start_bulk_job('notify_success')
+
+
+@order_bp.route("/batch-refund", methods=["POST"])
+@login_required
+def batch_refund():
+    """批量通知退款"""
+    return _start_bulk_job('refund')
+
+
+@order_bp.route("/batch-card91-deliver", methods=["POST"])
+@login_required
+def batch_card91_deliver():
+    """批量91卡券发货"""
+    return _start_bulk_job('card91_deliver')
+
+
+@order_bp.route('/bulk-jobs/<int:job_id>')
+@login_required
+def bulk_job_status(job_id):
+    """批量任务进度"""
+    query = BulkJob.query.filter(BulkJob.id == job_id)
+    if not current_user.is_admin:
+        query = query.filter(BulkJob.user_id == current_user.id)
+    job = query.first()
+    if not job:
+        return jsonify(success=False, message='任务不存在'), 404
+    return jsonify(success=True, job=job.to_dict())
 
 
 @order_bp.route('/<int:order_id>/detail-html', methods=['GET'])
@@ -715,6 +665,10 @@ def order_detail_html(order_id):
         events = OrderEvent.query.filter_by(order_id=order.id).order_by(
             OrderEvent.create_time.desc()
         ).limit(50).all()
+        if not events:
+            # 历史订单的事件可能已归档
+            from app.services.log_archive import archived_order_events
+            events = archived_order_events(order)
     except Exception:
         events = []
 
@@ -2,8 +2,12 @@
 from flask import Blueprint, render_template, request, redirect, url_for, flash, jsonify
 from flask_login import login_required, current_user
 from app.extensions import db
+from app.services.log_writer import enqueue_log
 from app.models.shop import Shop
 from app.models.product import Product
+from app.services.card_pool import available_counts
+from app.services.direct_charge_suppliers import supplier_choices, validate_product_config
+from app.utils.pagination import keyset_paginate
 import logging
 
 logger = logging.getLogger(__name__)
@@ -29,23 +33,31 @@ def _get_accessible_shops():
 
 
 def _log_operation(action, target_type, target_id, detail):
-    try:
-        from app.models.operation_log import OperationLog
-        log = OperationLog(
-            user_id=current_user.id, username=current_user.username,
-            action=action, target_type=target_type, target_id=target_id,
-            detail=detail, ip_address=request.remote_addr,
-        )
-        db.session.add(log)
-        db.session.commit()
-    except Exception as e:
-        logger.warning(f'记录操作日志失败: {e}')
+    from app.models.operation_log import OperationLog
+    enqueue_log(
+        OperationLog,
+        user_id=current_user.id, username=current_user.username,
+        action=action, target_type=target_type, target_id=target_id,
+        detail=detail, ip_address=request.remote_addr,
+    )
+
+
+def _render_form(product, shops, **kwargs):
+    return render_template('product/form.html', product=product, shops=shops,
+                           suppliers=supplier_choices(), **kwargs)
+
+
+def _validate_direct_charge(form):
+    """直充商品选择了供应商时检查供应商配置，返回错误信息。"""
+    api_type = form.get('direct_charge_api_type', '').strip()
+    if form.get('deliver_type') != '2' or not api_type:
+        return None
+    return validate_product_config(api_type, form.get('direct_charge_api_config', '').strip())
 
 
 @product_bp.route('/')
 @login_required
 def product_list():
-    page = request.args.get('page', 1, type=int)
     per_page = 20
     query = Product.query
     if not current_user.is_admin:
@@ -71,9 +83,11 @@ def product_list():
                 Product.jd_product_id.like(f'%{keyword}%'),
             )
         )
-    pagination = query.order_by(Product.id.desc()).paginate(page=page, per_page=per_page, error_out=False)
+    pagination = keyset_paginate(query, Product.id, per_page)
     shops = _get_accessible_shops()
-    return render_template('product/list.html', products=pagination.items, pagination=pagination, shops=shops)
+    pool_stock = available_counts([p.id for p in pagination.items if p.card_pool_enabled])
+    return render_template('product/list.html', products=pagination.items, pagination=pagination, shops=shops,
+                           pool_stock=pool_stock)
 
 
 @product_bp.route('/create', methods=['GET', 'POST'])
@@ -84,11 +98,15 @@ def product_create():
         shop_id = request.form.get('shop_id', type=int)
         if not shop_id:
             flash('请选择店铺', 'danger')
-            return render_template('product/form.html', product=None, shops=shops)
+            return _render_form(None, shops)
         shop = _check_shop_access(shop_id)
         if not shop:
             flash('无权限操作此店铺', 'danger')
-            return render_template('product/form.html', product=None, shops=shops)
+            return _render_form(None, shops)
+        error = _validate_direct_charge(request.form)
+        if error:
+            flash(error, 'danger')
+            return _render_form(None, shops)
         product = Product(shop_id=shop_id)
         _fill_product_fields(product, request.form)
         db.session.add(product)
@@ -102,7 +120,7 @@ def product_create():
             db.session.rollback()
             flash(f'创建失败：{e}', 'danger')
     default_shop_id = request.args.get('shop_id', type=int)
-    return render_template('product/form.html', product=None, shops=shops, default_shop_id=default_shop_id)
+    return _render_form(None, shops, default_shop_id=default_shop_id)
 
 
 @product_bp.route('/edit/<int:product_id>', methods=['GET', 'POST'])
@@ -117,6 +135,10 @@ def product_edit(product_id):
         return redirect(url_for('product.product_list'))
     shops = _get_accessible_shops()
     if request.method == 'POST':
+        error = _validate_direct_charge(request.form)
+        if error:
+            flash(error, 'danger')
+            return _render_form(product, shops)
         _fill_product_fields(product, request.form)
         try:
             db.session.commit()
@@ -126,7 +148,7 @@ def product_edit(product_id):
         except Exception as e:
             db.session.rollback()
             flash(f'更新失败：{e}', 'danger')
-    return render_template('product/form.html', product=product, shops=shops)
+    return _render_form(product, shops)
 
 
 @product_bp.route('/delete/<int:product_id>', methods=['POST'])
@@ -157,7 +179,8 @@ def api_card91_types(shop_id):
     if not shop.card91_api_key:
         return jsonify(success=False, message='该店铺未配置91卡券API密钥，请先在店铺配置中填写')
     from app.services.card91 import card91_get_card_types
-    ok, msg, card_types = card91_get_card_types(shop)
+    # 卡种列表读取内存目录，?refresh=1 时强制重新拉取
+    ok, msg, card_types = card91_get_card_types(shop, refresh=request.args.get('refresh') == '1')
     return jsonify(success=ok, message=msg, data=card_types)
 
 
@@ -215,6 +238,9 @@ def _fill_product_fields(product, form):
     product.card91_card_type_id = form.get('card91_card_type_id', '').strip() or None
     product.card91_card_type_name = form.get('card91_card_type_name', '').strip() or None
     product.card91_plan_id = form.get('card91_plan_id', '').strip() or None
+    product.card_pool_enabled = 1 if form.get('card_pool_enabled') == '1' else 0
+    product.card_pool_max = form.get('card_pool_max', type=int) or None
     product.direct_charge_api_type = form.get('direct_charge_api_type', '').strip() or None
+    product.direct_charge_api_config = form.get('direct_charge_api_config', '').strip() or None
     product.is_enabled = int(form.get('is_enabled', 1))
     product.remark = form.get('remark', '').strip() or None
@@ -2,6 +2,7 @@ from datetime import datetime
 from flask import Blueprint, render_template, request, redirect, url_for, flash, jsonify
 from flask_login import login_required, current_user
 from app.extensions import db
+from app.services.log_writer import enqueue_log
 from app.models.shop import Shop
 from app.services.notification import send_test_notification
 import logging
@@ -22,21 +23,17 @@ def admin_required(f):
 
 
 def _log_operation(action, target_type, target_id, detail):
-    try:
-        from app.models.operation_log import OperationLog
-        log = OperationLog(
-            user_id=current_user.id,
-            username=current_user.username,
-            action=action,
-            target_type=target_type,
-            target_id=target_id,
-            detail=detail,
-            ip_address=request.remote_addr,
-        )
-        db.session.add(log)
-        db.session.commit()
-    except Exception as e:
-        logger.warning(f'记录操作日志失败: {e}')
+    from app.models.operation_log import OperationLog
+    enqueue_log(
+        OperationLog,
+        user_id=current_user.id,
+        username=current_user.username,
+        action=action,
+        target_type=target_type,
+        target_id=target_id,
+        detail=detail,
+        ip_address=request.remote_addr,
+    )
 
 
 @shop_bp.route('/')
@@ -1,11 +1,11 @@
 from datetime import datetime, timedelta
-from flask import Blueprint, render_template, request
+from types import SimpleNamespace
+from flask import Blueprint, render_template, request, redirect, url_for, flash
 from flask_login import login_required, current_user
-from sqlalchemy import func, text
 
-from app.extensions import db
-from app.models.order import Order
 from app.models.shop import Shop
+from app.services.order_stats import query_rollup, daily_series
+from app.services.sql_profiler import get_sql_profiler
 
 statistics_bp = Blueprint('statistics', __name__)
 
@@ -27,51 +27,51 @@ def admin_required(f):
 @login_required
 @admin_required
 def index():
-    # Overall stats
-    total_orders = Order.query.count()
-    total_amount = db.session.query(func.sum(Order.amount)).scalar() or 0
-    completed_orders = Order.query.filter_by(order_status=2).count()
-    pending_orders = Order.query.filter(Order.order_status.in_([0, 1])).count()
+    # 全部数据来自汇总表（order_stats_daily），耗时与订单总量无关
+    by_shop_status = query_rollup(group_by=('shop_id', 'order_status'))
+
+    total_orders = sum(c for c, _ in by_shop_status.values())
+    total_amount = sum(a for _, a in by_shop_status.values())
+    completed_orders = sum(c for (_, status), (c, _) in by_shop_status.items() if status == 2)
+    pending_orders = sum(c for (_, status), (c, _) in by_shop_status.items() if status in (0, 1))
 
     # Per-shop stats（含阿奇索启用状态）
-    shop_stats = db.session.query(
-        Shop.id,
-        Shop.shop_name,
-        Shop.agiso_enabled,
-        func.count(Order.id).label('order_count'),
-        func.coalesce(func.sum(Order.amount), 0).label('total_amount'),
-    ).outerjoin(Order, Shop.id == Order.shop_id).group_by(Shop.id).all()
+    shop_totals = {}
+    status_totals = {}
+    for (shop_id, status), (count, amount) in by_shop_status.items():
+        acc = shop_totals.setdefault(shop_id, [0, 0])
+        acc[0] += count
+        acc[1] += amount
+        status_totals[status] = status_totals.get(status, 0) + count
+    shop_stats = [
+        SimpleNamespace(
+            id=shop.id,
+            shop_name=shop.shop_name,
+            agiso_enabled=shop.agiso_enabled,
+            order_count=shop_totals.get(shop.id, [0, 0])[0],
+            total_amount=shop_totals.get(shop.id, [0, 0])[1],
+        )
+        for shop in Shop.query.order_by(Shop.id).all()
+    ]
 
     # 订单状态分布
-    status_stats = db.session.query(
-        Order.order_status,
-        func.count(Order.id).label('count'),
-    ).group_by(Order.order_status).all()
     status_labels = {0: '待处理', 1: '处理中', 2: '已完成', 3: '已取消', 4: '已退款', 5: '异常'}
     status_distribution = [
-        {'name': status_labels.get(s.order_status, '未知'), 'value': s.count}
-        for s in status_stats
+        {'name': status_labels.get(status, '未知'), 'value': count}
+        for status, count in sorted(status_totals.items())
     ]
 
-    # 近7天统计 - 单条SQL优化
+    # 近7天统计
     today = datetime.now().date()
-    seven_days_ago = datetime.combine(today - timedelta(days=6), datetime.min.time())
-    raw_daily = db.session.query(
-        func.date(Order.create_time).label('day'),
-        func.count(Order.id).label('count'),
-        func.coalesce(func.sum(Order.amount), 0).label('amount'),
-    ).filter(Order.create_time >= seven_days_ago).group_by(func.date(Order.create_time)).all()
-
-    daily_map = {str(r.day): {'count': r.count, 'amount': r.amount} for r in raw_daily}
+    daily_map = daily_series(today - timedelta(days=6), today)
     daily_stats = []
     for i in range(6, -1, -1):
         day = today - timedelta(days=i)
-        key = str(day)
-        rec = daily_map.get(key, {'count': 0, 'amount': 0})
+        count, amount = daily_map.get(day, (0, 0))
         daily_stats.append({
             'date': day.strftime('%m-%d'),
-            'count': rec['count'],
-            'amount': rec['amount'] / 100,
+            'count': count,
+            'amount': amount / 100,
         })
 
     # 店铺订单分布（用于饼图）
@@ -89,3 +89,21 @@ def index():
                            daily_stats=daily_stats,
                            status_distribution=status_distribution,
                            shop_pie=shop_pie)
+
+
+@statistics_bp.route('/sql-profile')
+@login_required
+@admin_required
+def sql_profile():
+    """各接口的 SQL 查询次数与耗时（按平均查询次数倒序）。"""
+    stats = get_sql_profiler().snapshot()
+    return render_template('statistics/sql_profile.html', stats=stats)
+
+
+@statistics_bp.route('/sql-profile/reset', methods=['POST'])
+@login_required
+@admin_required
+def sql_profile_reset():
+    get_sql_profiler().reset()
+    flash('SQL 统计已清空', 'success')
+    return redirect(url_for('statistics.sql_profile'))
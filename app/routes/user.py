@@ -2,7 +2,8 @@ from flask import Blueprint, render_template, request, redirect, url_for, flash,
 from flask_login import login_required, current_user
 
 from app.extensions import db
-from app.models.user import User, UserShopPermission
+from app.services.log_writer import enqueue_log
+from app.models.user import User, UserShopPermission, clear_permission_cache
 from app.models.shop import Shop
 import logging
 
@@ -23,21 +24,17 @@ def admin_required(f):
 
 
 def _log_operation(action, target_type, target_id, detail):
-    try:
-        from app.models.operation_log import OperationLog
-        log = OperationLog(
-            user_id=current_user.id,
-            username=current_user.username,
-            action=action,
-            target_type=target_type,
-            target_id=target_id,
-            detail=detail,
-            ip_address=request.remote_addr,
-        )
-        db.session.add(log)
-        db.session.commit()
-    except Exception as e:
-        logger.warning(f'记录操作日志失败: {e}')
+    from app.models.operation_log import OperationLog
+    enqueue_log(
+        OperationLog,
+        user_id=current_user.id,
+        username=current_user.username,
+        action=action,
+        target_type=target_type,
+        target_id=target_id,
+        detail=detail,
+        ip_address=request.remote_addr,
+    )
 
 
 @user_bp.route('/')
@@ -120,6 +117,7 @@ def user_edit(user_id):
             db.session.add(perm)
 
         db.session.commit()
+        clear_permission_cache(user.id)
         _log_operation('edit_user', 'user', user.id, f'编辑用户: {user.username}')
         flash('用户更新成功', 'success')
         return redirect(url_for('user.user_list'))
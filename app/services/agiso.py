@@ -38,6 +38,8 @@ import logging
 import time
 import requests
 
+from app.services.http_client import http_post
+
 logger = logging.getLogger(__name__)
 
 AGISO_BASE_URL = 'https://gw-api.agiso.com'
@@ -109,7 +111,7 @@ def _post_agiso(shop, path, params):
     params['sign'] = generate_agiso_sign(params, shop.agiso_app_secret)
     url = f'{_build_agiso_base_url(shop)}{path}'
     headers = _build_headers(shop)
-    resp = requests.post(url, json=params, headers=headers, timeout=30)
+    resp = http_post('agiso', url, json=params, headers=headers)
     resp.raise_for_status()
     return resp.json()
 
@@ -0,0 +1,517 @@
+"""订单批量操作（批量通知成功 / 批量退款 / 批量91卡券发货）。
+
+原来的批量通知成功在请求中逐单串行回调、逐单提交，并限制最多 100 单。这里改为批量任务：
+
+- 创建：写入 bulk_jobs，由 worker.py 定时领取（条件 UPDATE，多进程不会重复执行），
+  页面轮询进度；单店铺限并发，少量订单也可能要等多轮接口超时，因此不在请求中执行；
+  单个任务最多 BULK_ACTION_MAX_ORDERS 单
+- 校验：订单、店铺按批一次查出，91卡券商品从路由表匹配，店铺权限按创建人当前权限只查一次
+- 回调：京东回调 / 91卡券提卡在 BULK_ACTION_THREADS 个线程中并发执行，同一店铺最多
+  BULK_ACTION_SHOP_CONCURRENCY 个并发（避免压垮单个店铺的回调接口），线程内只使用
+  店铺 / 订单 / 商品的只读快照，不访问数据库；开启本地库存的商品在主线程领取卡密
+- 落库：回调结果在主线程按 BULK_ACTION_COMMIT_EVERY 单一批回写订单、事件和任务进度，
+  失败的回调与单单操作一样登记到回调发件箱自动重发
+- 回收：执行中的任务至少每 HEARTBEAT_SECONDS 秒随进度刷新 locked_at；超过 LOCK_TIMEOUT 秒
+  没有心跳（worker 重启 / 进程退出）的任务标记为失败（可能已部分执行，不能自动重跑）
+"""
+import json
+import logging
+import os
+import socket
+import time
+import uuid
+from collections import Counter, OrderedDict, deque, namedtuple
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from datetime import datetime, timedelta
+
+from flask import current_app
+
+from app.extensions import db
+from app.models.bulk_job import BulkJob
+from app.models.operation_log import OperationLog
+from app.models.order import Order
+from app.models.order_event import OrderEvent
+from app.models.shop import Shop
+from app.models.user import User
+from app.services.callback_outbox import enqueue_callback, send_callback
+from app.services.card91 import card91_auto_deliver
+from app.services.card_pool import claim_pool_cards
+from app.services.jd_game import callback_game_card_deliver
+from app.services.jd_general import callback_general_card_deliver
+from app.services.log_writer import enqueue_log
+from app.services.product_router import ProductSnapshot, get_product_router
+from app.services.shop_cache import ShopSnapshot
+
+logger = logging.getLogger(__name__)
+
+# 回调状态：1=成功 2=失败（与订单路由一致）
+NOTIFY_STATUS_SUCCESS = 1
+NOTIFY_STATUS_FAILED = 2
+
+# 每次查询的订单 ID 数量（IN 列表长度）
+LOAD_CHUNK = 500
+
+# 任务中保存的失败明细上限
+MAX_FAILURES = 1000
+
+# 执行中任务超过该秒数没有心跳视为执行进程已退出
+LOCK_TIMEOUT = 600
+
+# 执行中任务的心跳间隔（秒），与 BULK_ACTION_COMMIT_EVERY 单先到者为准
+HEARTBEAT_SECONDS = 60
+
+OrderSnapshot = namedtuple('OrderSnapshot', [c.name for c in Order.__table__.columns] + ['card_info_parsed'])
+
+
+def _snapshot(cls, obj, **extra):
+    return cls(**{f: extra[f] if f in extra else getattr(obj, f) for f in cls._fields})
+
+
+# 一个待回调的订单：快照在线程中使用，结果回到主线程按 order_id 回写；
+# pooled 为主线程从本地库存领取的卡密（91卡券发货，未领取时为 None）
+_Item = namedtuple('_Item', 'order_id shop order product pooled', defaults=(None,))
+
+# 线程返回的回调结果；cards / detail 仅91卡券发货使用（提卡失败时 fetched=False）
+Outcome = namedtuple('Outcome', 'ok message cards detail fetched')
+
+
+# ---- 各操作：校验 / 回调 / 回写 ----
+
+def _validate_notify_success(order, shop, product):
+    if order.order_status not in (0, 1):
+        return '状态不符'
+    if order.order_type != 1:
+        return '非直充订单'
+    return None
+
+
+def _validate_refund(order, shop, product):
+    if order.order_status in (3, 4):
+        return '订单已退款或已取消'
+    return None
+
+
+def _validate_card91_deliver(order, shop, product):
+    if order.order_type != 2:
+        return '非卡密订单'
+    if order.order_status not in (0, 1):
+        return '状态不符'
+    if not shop.card91_api_key:
+        return '该店铺未配置91卡券API密钥'
+    if product is None:
+        return '未找到匹配的91卡券商品配置'
+    return None
+
+
+def _call_notify_success(item):
+    ok, msg = send_callback(item.shop, item.order, 'deliver')
+    return Outcome(ok, msg, None, None, True)
+
+
+def _call_refund(item):
+    ok, msg = send_callback(item.shop, item.order, 'refund')
+    return Outcome(ok, msg, None, None, True)
+
+
+def _call_card91_deliver(item):
+    detail = {}
+    if item.pooled is not None:
+        ok, msg, cards = True, f'本地库存发卡{len(item.pooled)}张', item.pooled
+        detail['source'] = 'pool'
+    else:
+        ok, msg, cards = card91_auto_deliver(item.shop, item.order, item.product, detail=detail)
+    if not ok:
+        return Outcome(False, msg, None, detail, False)
+    if item.shop.shop_type == 1:
+        success, callback_msg = callback_game_card_deliver(item.shop, item.order, cards)
+    else:
+        success, callback_msg = callback_general_card_deliver(item.shop, item.order, cards)
+    detail['fetch_msg'] = msg
+    return Outcome(success, callback_msg, cards, detail, True)
+
+
+def _apply_notify_success(job, order, item, outcome):
+    now = datetime.now()
+    if outcome.ok:
+        order.order_status = 2
+        order.notify_status = NOTIFY_STATUS_SUCCESS
+        order.notify_time = now
+        db.session.add(OrderEvent(
+            order_id=order.id, order_no=order.order_no, event_type='notify_success',
+            event_desc=f'批量通知成功：{outcome.message}', operator=job.username, result='success',
+        ))
+        _log_operation(job, 'deliver', order, f'批量通知成功：订单 {order.jd_order_no}')
+        return
+    order.notify_status = NOTIFY_STATUS_FAILED
+    db.session.add(OrderEvent(
+        order_id=order.id, order_no=order.order_no, event_type='error',
+        event_desc=f'批量通知成功失败：{outcome.message}', operator=job.username, result='failed',
+    ))
+    enqueue_callback(order, 'deliver', outcome.message)
+
+
+def _apply_refund(job, order, item, outcome):
+    if outcome.ok:
+        order.order_status = 4
+        order.notify_status = NOTIFY_STATUS_SUCCESS
+        order.notify_time = datetime.now()
+        db.session.add(OrderEvent(
+            order_id=order.id, order_no=order.order_no, event_type='notify_refund',
+            event_desc=f'批量通知退款：{outcome.message}', operator=job.username, result='success',
+        ))
+        _log_operation(job, 'refund', order, f'批量通知退款：订单 {order.jd_order_no}')
+        return
+    order.notify_status = NOTIFY_STATUS_FAILED
+    db.session.add(OrderEvent(
+        order_id=order.id, order_no=order.order_no, event_type='error',
+        event_desc=f'批量通知退款失败：{outcome.message}', operator=job.username, result='failed',
+    ))
+    enqueue_callback(order, 'refund', outcome.message)
+
+
+def _apply_card91_deliver(job, order, item, outcome):
+    detail = dict(outcome.detail or {})
+    fetch_msg = detail.pop('fetch_msg', outcome.message)
+    db.session.add(OrderEvent(
+        order_id=order.id, order_no=order.order_no, event_type='card91_fetch',
+        event_desc=f'91卡券提卡：{fetch_msg}',
+        event_data=json.dumps(dict(detail,
+                                   product_name=item.product.product_name,
+                                   card_type_id=item.product.card91_card_type_id,
+                                   quantity=order.quantity,
+                                   success=outcome.fetched), ensure_ascii=False),
+        operator=job.username, result='success' if outcome.fetched else 'failed',
+    ))
+    if not outcome.fetched:
+        return
+
+    # 卡密已提取，无论回调是否成功都要保存
+    order.set_card_info(outcome.cards)
+    if outcome.ok:
+        now = datetime.now()
+        order.order_status = 2
+        order.deliver_time = now
+        order.notify_status = NOTIFY_STATUS_SUCCESS
+        order.notify_time = now
+        db.session.add(OrderEvent(
+            order_id=order.id, order_no=order.order_no, event_type='card91_deliver',
+            event_desc=f'91卡券发卡成功，共{len(outcome.cards)}张',
+            event_data=json.dumps({'cards_count': len(outcome.cards),
+                                   'callback_msg': outcome.message}, ensure_ascii=False),
+            operator=job.username, result='success',
+        ))
+        _log_operation(job, 'card91_deliver', order,
+                       f'批量91卡券发卡：订单 {order.jd_order_no}，共{len(outcome.cards)}张')
+        return
+    order.notify_status = NOTIFY_STATUS_FAILED
+    db.session.add(OrderEvent(
+        order_id=order.id, order_no=order.order_no, event_type='error',
+        event_desc=f'91卡券回调失败：{outcome.message}', operator=job.username, result='failed',
+    ))
+    enqueue_callback(order, 'deliver', outcome.message)
+
+
+BulkAction = namedtuple('BulkAction', 'permission validate call apply')
+
+ACTIONS = {
+    'notify_success': BulkAction('can_deliver', _validate_notify_success, _call_notify_success, _apply_notify_success),
+    'refund': BulkAction('can_refund', _validate_refund, _call_refund, _apply_refund),
+    'card91_deliver': BulkAction('can_deliver', _validate_card91_deliver, _call_card91_deliver,
+                                 _apply_card91_deliver),
+}
+
+
+def can_run(user, action):
+    """用户是否有该批量操作的权限。"""
+    return user.is_admin or bool(getattr(user, ACTIONS[action].permission))
+
+
+def _log_operation(job, action, order, detail):
+    enqueue_log(
+        OperationLog,
+        user_id=job.user_id,
+        username=job.username,
+        action=action,
+        target_type='order',
+        target_id=order.id,
+        detail=detail,
+        ip_address=job.ip_address,
+    )
+
+
+# ---- 创建 / 领取 ----
+
+def create_bulk_job(user, action, order_ids, ip_address=None, start=False):
+    """创建批量任务（提交）。
+
+    Args:
+        start: True 表示由当前进程立即执行（直接置为执行中，worker 不会领取）
+
+    Raises:
+        ValueError: 操作未知或订单数超过 BULK_ACTION_MAX_ORDERS
+    """
+    if action not in ACTIONS:
+        raise ValueError(f'未知的批量操作: {action}')
+    ids = list(OrderedDict.fromkeys(int(i) for i in order_ids))
+    max_orders = current_app.config.get('BULK_ACTION_MAX_ORDERS', 5000)
+    if len(ids) > max_orders:
+        raise ValueError(f'单次最多选择 {max_orders} 个订单')
+    job = BulkJob(
+        user_id=user.id,
+        username=user.username,
+        ip_address=ip_address,
+        action=action,
+        order_ids=json.dumps(ids),
+        total=len(ids),
+    )
+    if start:
+        job.status = BulkJob.STATUS_RUNNING
+        job.locked_by = _worker_token()
+        job.locked_at = job.start_time = datetime.now()
+    db.session.add(job)
+    db.session.commit()
+    return job
+
+
+def _worker_token():
+    return f'{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}'
+
+
+def _fail_stale_bulk_jobs(now):
+    """执行进程已退出（超时没有心跳）的任务标记为失败，返回数量。
+
+    已回调的订单已经生效，重跑会重复回调，因此不重新排队。
+    """
+    failed = BulkJob.query.filter(
+        BulkJob.status == BulkJob.STATUS_RUNNING,
+        db.or_(BulkJob.locked_at.is_(None), BulkJob.locked_at < now - timedelta(seconds=LOCK_TIMEOUT)),
+    ).update({
+        'status': BulkJob.STATUS_FAILED,
+        'error': '执行进程已退出，任务可能已部分执行，请核对订单状态后重新提交未处理的订单',
+        'locked_by': None,
+        'locked_at': None,
+        'finish_time': now,
+    }, synchronize_session=False)
+    if failed:
+        logger.warning(f'{failed} 个批量任务执行超时（进程可能已退出），已标记为失败')
+    return failed
+
+
+def _claim_bulk_job():
+    now = datetime.now()
+    _fail_stale_bulk_jobs(now)
+    job_id = db.session.query(BulkJob.id).filter(
+        BulkJob.status == BulkJob.STATUS_PENDING,
+    ).order_by(BulkJob.id).limit(1).scalar()
+    if job_id is None:
+        return None
+    claimed = BulkJob.query.filter(
+        BulkJob.id == job_id, BulkJob.status == BulkJob.STATUS_PENDING,
+    ).update({
+        'status': BulkJob.STATUS_RUNNING,
+        'locked_by': _worker_token(),
+        'locked_at': now,
+        'start_time': now,
+    }, synchronize_session=False)
+    db.session.commit()
+    return db.session.get(BulkJob, job_id) if claimed else None
+
+
+# ---- 执行 ----
+
+class _Progress:
+    """主线程中累计的任务进度，随每批订单一起提交。"""
+
+    def __init__(self, job):
+        self.job = job
+        self.succeeded = 0
+        self.failed = 0
+        self.failures = []
+
+    def fail(self, order_id, reason):
+        self.failed += 1
+        if len(self.failures) < MAX_FAILURES:
+            self.failures.append({'id': order_id, 'reason': reason})
+
+    def save(self):
+        job = self.job
+        job.succeeded = self.succeeded
+        job.failed = self.failed
+        job.processed = self.succeeded + self.failed
+        job.failures = json.dumps(self.failures, ensure_ascii=False)
+        job.locked_at = datetime.now()
+
+
+def _match_products(orders):
+    """匹配各订单的91卡券商品，返回 {order_id: 商品快照}（SKU 精确匹配优先，其次商品名称）。"""
+    router = get_product_router()
+    matched = {}
+    for order in orders:
+        product = router.match(order.shop_id, order.sku_id, order.product_info)
+        if product is not None:
+            matched[order.id] = product
+    return matched
+
+
+def _prepare(job, action, progress):
+    """校验订单，返回按店铺分组的待回调订单 {shop_id: deque[_Item]}。"""
+    user = db.session.get(User, job.user_id) if job.user_id else None
+    if user is None:
+        raise ValueError('创建人不存在')
+    if not can_run(user, job.action):
+        raise ValueError('无操作权限')
+    permitted = None if user.is_admin else user.permitted_shop_set()
+
+    ids = job.order_id_list
+    orders = {}
+    for start in range(0, len(ids), LOAD_CHUNK):
+        chunk = ids[start:start + LOAD_CHUNK]
+        orders.update((o.id, o) for o in Order.query.filter(Order.id.in_(chunk)))
+    shop_ids = {o.shop_id for o in orders.values()}
+    shops = {s.id: s for s in Shop.query.filter(Shop.id.in_(shop_ids))} if shop_ids else {}
+    products = _match_products(orders.values()) if job.action == 'card91_deliver' and orders else {}
+
+    shop_snapshots = {}
+    groups = OrderedDict()
+    for order_id in ids:
+        order = orders.get(order_id)
+        if order is None:
+            progress.fail(order_id, '订单不存在')
+            continue
+        if permitted is not None and order.shop_id not in permitted:
+            progress.fail(order_id, '无店铺权限')
+            continue
+        shop = shops.get(order.shop_id)
+        if shop is None:
+            progress.fail(order_id, '店铺不存在')
+            continue
+        product = products.get(order_id)
+        reason = action.validate(order, shop, product)
+        if reason:
+            progress.fail(order_id, reason)
+            continue
+        if shop.id not in shop_snapshots:
+            shop_snapshots[shop.id] = _snapshot(ShopSnapshot, shop)
+        # 本地库存在主线程领取，随任务进度一起提交；线程内只做回调
+        pooled = claim_pool_cards(product, order) if job.action == 'card91_deliver' else None
+        groups.setdefault(shop.id, deque()).append(_Item(
+            order_id,
+            shop_snapshots[shop.id],
+            _snapshot(OrderSnapshot, order, card_info_parsed=order.card_info_parsed),
+            _snapshot(ProductSnapshot, product) if product is not None else None,
+            pooled,
+        ))
+    return groups
+
+
+def _call_in_context(app, action, item):
+    with app.app_context():
+        try:
+            return action.call(item)
+        except Exception as e:
+            logger.exception(f'批量操作回调异常：订单 {item.order.order_no}')
+            return Outcome(False, str(e), None, None, False)
+
+
+def _apply_batch(job, action, results, progress):
+    """回写一批回调结果并提交（连同任务进度）。"""
+    orders = {o.id: o for o in Order.query.filter(Order.id.in_([item.order_id for item, _ in results]))}
+    for item, outcome in results:
+        order = orders.get(item.order_id)
+        if order is None:
+            progress.fail(item.order_id, '订单不存在')
+            continue
+        action.apply(job, order, item, outcome)
+        if outcome.ok:
+            progress.succeeded += 1
+        else:
+            progress.fail(item.order_id, outcome.message)
+    progress.save()
+    db.session.commit()
+
+
+def run_bulk_job(job):
+    """执行已领取的批量任务，返回是否执行完成。"""
+    app = current_app._get_current_object()
+    threads = int(app.config.get('BULK_ACTION_THREADS', 8))
+    shop_limit = int(app.config.get('BULK_ACTION_SHOP_CONCURRENCY', 2))
+    commit_every = int(app.config.get('BULK_ACTION_COMMIT_EVERY', 50))
+    action = ACTIONS[job.action]
+    progress = _Progress(job)
+
+    try:
+        groups = _prepare(job, action, progress)
+        progress.save()
+        db.session.commit()
+
+        inflight = Counter()
+        futures = {}
+        results = []
+        beat = time.monotonic()
+        with ThreadPoolExecutor(max_workers=threads, thread_name_prefix='bulk-action') as executor:
+            while groups or futures:
+                # 轮流从各店铺取订单提交，单店铺并发不超过 shop_limit
+                for shop_id in list(groups):
+                    queue = groups[shop_id]
+                    while queue and inflight[shop_id] < shop_limit and len(futures) < threads:
+                        item = queue.popleft()
+                        futures[executor.submit(_call_in_context, app, action, item)] = item
+                        inflight[shop_id] += 1
+                    if not queue:
+                        del groups[shop_id]
+
+                done, _ = wait(futures, timeout=HEARTBEAT_SECONDS, return_when=FIRST_COMPLETED)
+                for future in done:
+                    item = futures.pop(future)
+                    inflight[item.shop.id] -= 1
+                    results.append((item, future.result()))
+                # 回调较慢时也按心跳间隔提交进度，避免被判定为进程已退出
+                if len(results) >= commit_every or time.monotonic() - beat > HEARTBEAT_SECONDS:
+                    _apply_batch(job, action, results, progress)
+                    results = []
+                    beat = time.monotonic()
+        if results:
+            _apply_batch(job, action, results, progress)
+    except Exception as e:
+        db.session.rollback()
+        logger.exception(f'批量任务 {job.id} 失败')
+        job.status = BulkJob.STATUS_FAILED
+        job.error = str(e)[:500]
+        job.finish_time = datetime.now()
+        db.session.commit()
+        return False
+
+    job.status = BulkJob.STATUS_DONE
+    job.finish_time = datetime.now()
+    db.session.commit()
+    logger.info(f'批量任务 {job.id}（{job.action_label}）完成：成功{job.succeeded}，失败{job.failed}')
+    return True
+
+
+def run_pending_bulk_jobs(limit=1):
+    """领取并执行排队中的批量任务（需在应用上下文中调用），返回执行数量。"""
+    done = 0
+    while done < limit:
+        job = _claim_bulk_job()
+        if job is None:
+            break
+        run_bulk_job(job)
+        done += 1
+    return done
+
+
+def schedule_bulk_jobs(scheduler, app):
+    """在 worker.py 的定时任务中登记批量任务执行。"""
+
+    def _run():
+        with app.app_context():
+            try:
+                run_pending_bulk_jobs()
+            finally:
+                db.session.remove()
+
+    scheduler.add_job(
+        _run, 'interval',
+        seconds=app.config.get('BULK_ACTION_POLL_INTERVAL', 2),
+        id='bulk_actions', max_instances=1, coalesce=True,
+    )
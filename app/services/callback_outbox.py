@@ -0,0 +1,241 @@
+"""京东回调发件箱服务。
+
+回调失败时调用 enqueue_callback() 在当前事务中写入发件箱记录（由调用方提交），
+worker.py 中的 APScheduler 定时调用 drain_outbox()：
+
+- 领取：条件 UPDATE（status=0 -> 1）并打上批次标识，多进程不会重复发送
+- 按店铺批量：同一店铺的记录一起处理，每个店铺一批只提交一次
+- 退避：第 N 次失败后等待 CALLBACK_OUTBOX_BASE_DELAY * 2^(N-1) 秒，最长 CALLBACK_OUTBOX_MAX_DELAY
+- 放弃：超过 max_attempts 置为已放弃并记录错误事件，需人工处理
+- 订单已被人工通知成功时直接标记完成，不再重复回调
+"""
+import logging
+import uuid
+from collections import OrderedDict
+from datetime import datetime, timedelta
+
+from flask import current_app
+
+from app.extensions import db
+from app.models.callback_outbox import CallbackOutbox
+from app.models.order import Order
+from app.models.order_event import OrderEvent
+from app.models.shop import Shop
+from app.services.jd_game import (
+    callback_game_direct_success,
+    callback_game_card_deliver,
+    callback_game_refund,
+)
+from app.services.jd_general import (
+    callback_general_success,
+    callback_general_card_deliver,
+    callback_general_refund,
+)
+
+logger = logging.getLogger(__name__)
+
+# 发送中的记录超过该时间未完成视为进程已退出，重新放回队列（秒）
+LOCK_TIMEOUT = 300
+
+
+def enqueue_callback(order, callback_type, error=None):
+    """登记一次失败的回调，等待定时任务重发（不提交）。
+
+    Args:
+        order: 订单
+        callback_type: deliver / refund
+        error: 本次失败原因
+    """
+    max_attempts = current_app.config.get('CALLBACK_OUTBOX_MAX_ATTEMPTS', 8)
+    base_delay = current_app.config.get('CALLBACK_OUTBOX_BASE_DELAY', 30)
+    entry = CallbackOutbox.query.filter_by(order_id=order.id, callback_type=callback_type).first()
+    if entry is None:
+        entry = CallbackOutbox(order_id=order.id, shop_id=order.shop_id, callback_type=callback_type)
+        db.session.add(entry)
+    entry.status = CallbackOutbox.STATUS_PENDING
+    entry.attempts = 0
+    entry.max_attempts = max_attempts
+    entry.next_retry_time = datetime.now() + timedelta(seconds=base_delay)
+    entry.locked_by = None
+    entry.locked_at = None
+    entry.last_error = str(error)[:500] if error else None
+    return entry
+
+
+def send_callback(shop, order, callback_type):
+    """按店铺类型和订单类型回调京东，返回 (是否成功, 消息)。"""
+    if callback_type == 'refund':
+        if shop.shop_type == 1:
+            return callback_game_refund(shop, order)
+        return callback_general_refund(shop, order)
+
+    if shop.shop_type == 1:
+        if order.order_type == 1:
+            return callback_game_direct_success(shop, order)
+        return callback_game_card_deliver(shop, order, order.card_info_parsed)
+    if order.order_type == 1:
+        return callback_general_success(shop, order)
+    return callback_general_card_deliver(shop, order, order.card_info_parsed)
+
+
+def _already_notified(order, callback_type):
+    if order.notify_status != 1:
+        return False
+    if callback_type == 'refund':
+        return order.order_status == 4
+    return order.order_status == 2
+
+
+def _apply_success(order, callback_type):
+    now = datetime.now()
+    if callback_type == 'refund':
+        order.order_status = 4
+    else:
+        order.order_status = 2
+        if order.order_type == 2 and not order.deliver_time:
+            order.deliver_time = now
+    order.notify_status = 1
+    order.notify_time = now
+
+
+def _backoff(attempts):
+    base = current_app.config.get('CALLBACK_OUTBOX_BASE_DELAY', 30)
+    cap = current_app.config.get('CALLBACK_OUTBOX_MAX_DELAY', 3600)
+    return min(base * (2 ** max(attempts - 1, 0)), cap)
+
+
+def _claim(limit):
+    now = datetime.now()
+    CallbackOutbox.query.filter(
+        CallbackOutbox.status == CallbackOutbox.STATUS_SENDING,
+        CallbackOutbox.locked_at < now - timedelta(seconds=LOCK_TIMEOUT),
+    ).update({'status': CallbackOutbox.STATUS_PENDING}, synchronize_session=False)
+
+    ids = [row[0] for row in db.session.query(CallbackOutbox.id).filter(
+        CallbackOutbox.status == CallbackOutbox.STATUS_PENDING,
+        CallbackOutbox.next_retry_time <= now,
+    ).order_by(CallbackOutbox.shop_id, CallbackOutbox.id).limit(limit).all()]
+    if not ids:
+        db.session.commit()
+        return []
+
+    token = uuid.uuid4().hex
+    CallbackOutbox.query.filter(
+        CallbackOutbox.id.in_(ids),
+        CallbackOutbox.status == CallbackOutbox.STATUS_PENDING,
+    ).update({
+        'status': CallbackOutbox.STATUS_SENDING,
+        'locked_by': token,
+        'locked_at': now,
+    }, synchronize_session=False)
+    db.session.commit()
+    return CallbackOutbox.query.filter_by(
+        locked_by=token, status=CallbackOutbox.STATUS_SENDING,
+    ).order_by(CallbackOutbox.shop_id, CallbackOutbox.id).all()
+
+
+def _process_entry(shop, entry):
+    order = db.session.get(Order, entry.order_id)
+    if order is None:
+        entry.status = CallbackOutbox.STATUS_DEAD
+        entry.last_error = '订单不存在'
+        return False
+
+    if _already_notified(order, entry.callback_type):
+        entry.status = CallbackOutbox.STATUS_DONE
+        return True
+
+    entry.attempts += 1
+    try:
+        if shop is None:
+            ok, msg = False, '店铺不存在'
+        else:
+            ok, msg = send_callback(shop, order, entry.callback_type)
+    except Exception as e:
+        logger.exception(f'订单 {order.order_no} 回调重发异常')
+        ok, msg = False, str(e)
+
+    label = CallbackOutbox.CALLBACK_TYPE_MAP.get(entry.callback_type, entry.callback_type)
+    if ok:
+        _apply_success(order, entry.callback_type)
+        entry.status = CallbackOutbox.STATUS_DONE
+        entry.last_error = None
+        db.session.add(OrderEvent(
+            order_id=order.id, order_no=order.order_no,
+            event_type='callback_retry',
+            event_desc=f'{label}回调自动重发成功（第{entry.attempts}次）：{msg}',
+            operator='system', result='success',
+        ))
+        return True
+
+    entry.last_error = str(msg)[:500]
+    if entry.attempts >= entry.max_attempts:
+        entry.status = CallbackOutbox.STATUS_DEAD
+        db.session.add(OrderEvent(
+            order_id=order.id, order_no=order.order_no,
+            event_type='error',
+            event_desc=f'{label}回调自动重发{entry.attempts}次仍失败，已放弃：{msg}',
+            operator='system', result='failed',
+        ))
+    else:
+        entry.status = CallbackOutbox.STATUS_PENDING
+        entry.next_retry_time = datetime.now() + timedelta(seconds=_backoff(entry.attempts))
+    return False
+
+
+def drain_outbox(limit=None):
+    """发送一批到期的回调（需在应用上下文中调用）。
+
+    Returns:
+        dict: {'sent': 成功数, 'failed': 失败数}
+    """
+    if limit is None:
+        limit = current_app.config.get('CALLBACK_OUTBOX_BATCH_SIZE', 200)
+    entries = _claim(limit)
+    if not entries:
+        return {'sent': 0, 'failed': 0}
+
+    by_shop = OrderedDict()
+    for entry in entries:
+        by_shop.setdefault(entry.shop_id, []).append(entry)
+
+    sent = failed = 0
+    for shop_id, shop_entries in by_shop.items():
+        shop = db.session.get(Shop, shop_id)
+        for entry in shop_entries:
+            if _process_entry(shop, entry):
+                sent += 1
+            else:
+                failed += 1
+            entry.locked_by = None
+            entry.locked_at = None
+        try:
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            logger.error(f'回调发件箱提交失败 shop={shop_id}: {e}')
+
+    logger.info(f'回调发件箱：成功{sent}条，失败{failed}条')
+    return {'sent': sent, 'failed': failed}
+
+
+def start_outbox_scheduler(app):
+    """启动定时重发任务（worker.py 调用）。"""
+    from apscheduler.schedulers.background import BackgroundScheduler
+
+    def _job():
+        with app.app_context():
+            try:
+                drain_outbox()
+            finally:
+                db.session.remove()
+
+    scheduler = BackgroundScheduler(daemon=True)
+    scheduler.add_job(
+        _job, 'interval',
+        seconds=app.config.get('CALLBACK_OUTBOX_INTERVAL', 15),
+        id='callback_outbox', max_instances=1, coalesce=True,
+    )
+    scheduler.start()
+    logger.info('回调发件箱定时任务已启动')
+    return scheduler
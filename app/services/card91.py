@@ -7,13 +7,32 @@ API地址：https://gw-api.agiso.com
 import hashlib
 import json
 import logging
+import os
+import sqlite3
+import threading
 import time
+import uuid
+from collections import namedtuple
+from datetime import datetime
+
 import requests
+from sqlalchemy import select
+
+from app.extensions import db
+from app.models.handpick_record import HandPickRecord
+from app.services.http_client import http_post
+from app.utils.version_stamp import VersionStamp
 
 logger = logging.getLogger(__name__)
 
 AGISO_BASE_URL = 'https://gw-api.agiso.com'
-REQUEST_TIMEOUT = 30
+
+# 卡种列表分页拉取
+CATALOG_PAGE_SIZE = 100
+CATALOG_MAX_PAGES = 50
+
+# 每写入多少条目录扣减记录清理一次过期日志
+PRUNE_EVERY = 1000
 
 
 def _build_sign(params, app_secret):
@@ -31,10 +50,14 @@ def _build_sign(params, app_secret):
     return hashlib.md5(query_str.encode('utf-8')).hexdigest().lower()
 
 
-def _do_request(shop, endpoint, params=None):
-    """发送 Agiso API POST 请求。"""
+def _request(shop, endpoint, params=None):
+    """发送 Agiso API POST 请求，返回 (ok, msg, data, uncertain)。
+
+    uncertain=True 表示请求可能已被91卡券处理但没有拿到明确结果（超时、连接中断、响应异常），
+    HandPick 这类会出卡的请求不能据此认为没有出卡。
+    """
     if not shop or not shop.agiso_access_token:
-        return False, '未配置91卡券AccessToken，请在店铺配置中填写', None
+        return False, '未配置91卡券AccessToken，请在店铺配置中填写', None, False
 
     url = f'{AGISO_BASE_URL}{endpoint}'
 
@@ -54,7 +77,7 @@ def _do_request(shop, endpoint, params=None):
     }
 
     try:
-        resp = requests.post(url, data=req_params, headers=headers, timeout=REQUEST_TIMEOUT)
+        resp = http_post('card91', url, data=req_params, headers=headers)
         resp.raise_for_status()
         result = resp.json()
 
@@ -66,56 +89,84 @@ def _do_request(shop, endpoint, params=None):
         data = result.get('Data', None)
 
         if is_success:
-            return True, error_msg or '成功', data
+            return True, error_msg or '成功', data, False
         else:
             logger.warning(f'91卡券API错误 [{endpoint}]: code={error_code}, msg={error_msg}')
-            return False, error_msg or f'接口错误码：{error_code}', data
+            return False, error_msg or f'接口错误码：{error_code}', data, False
 
     except requests.exceptions.ConnectionError as e:
         logger.error(f'91卡券API连接失败 [{endpoint}]: {e}')
-        return False, '连接91卡券服务器失败，请检查网络', None
+        return False, '连接91卡券服务器失败，请检查网络', None, True
     except requests.exceptions.Timeout:
         logger.error(f'91卡券API超时 [{endpoint}]')
-        return False, '请求91卡券服务器超时', None
+        return False, '请求91卡券服务器超时', None, True
     except Exception as e:
         logger.error(f'91卡券API异常 [{endpoint}]: {e}')
-        return False, f'请求异常：{str(e)}', None
+        return False, f'请求异常：{str(e)}', None, True
 
 
-def card91_get_card_types(shop):
-    """获取卡种列表。"""
-    params = {'pageIndex': '1', 'pageSize': '100'}
-    ok, msg, data = _do_request(shop, '/acpr/CardPwd/GetList', params)
-    if ok and data:
-        card_types = []
+def _do_request(shop, endpoint, params=None):
+    """发送 Agiso API POST 请求，返回 (ok, msg, data)。"""
+    ok, msg, data, _ = _request(shop, endpoint, params)
+    return ok, msg, data
+
+
+def _parse_card_type(item):
+    return {
+        'id': str(item.get('IdNo', '')),
+        'name': item.get('Title', ''),
+        'stock': item.get('RemainingCount', 0),
+        'total': item.get('TotalCount', 0),
+        'used': item.get('UsedCount', 0),
+    }
+
+
+def card91_list_card_types(shop):
+    """分页拉取全部卡种（远程调用，不走缓存）。"""
+    card_types = []
+    for page in range(1, CATALOG_MAX_PAGES + 1):
+        params = {'pageIndex': str(page), 'pageSize': str(CATALOG_PAGE_SIZE)}
+        ok, msg, data = _do_request(shop, '/acpr/CardPwd/GetList', params)
+        if not ok:
+            return False, msg, []
         items = []
+        total = None
         if isinstance(data, dict):
-            items = data.get('List', data.get('list', []))
+            items = data.get('List', data.get('list', [])) or []
+            total = data.get('TotalCount')
         elif isinstance(data, list):
             items = data
-        for item in items:
-            card_types.append({
-                'id': str(item.get('IdNo', '')),
-                'name': item.get('Title', ''),
-                'stock': item.get('RemainingCount', 0),
-                'total': item.get('TotalCount', 0),
-                'used': item.get('UsedCount', 0),
-            })
-        return True, msg, card_types
-    return ok, msg, []
+        card_types.extend(_parse_card_type(item) for item in items)
+        if len(items) < CATALOG_PAGE_SIZE or (total is not None and len(card_types) >= int(total)):
+            break
+    else:
+        logger.warning(f'91卡券卡种超过{CATALOG_MAX_PAGES}页，只加载了前{len(card_types)}个')
+    return True, f'共{len(card_types)}个卡种', card_types
 
 
-def card91_fetch_cards(shop, card_type_id, quantity, order_no):
-    """提卡。"""
+def card91_get_card_types(shop, refresh=False):
+    """获取卡种列表（优先读取卡种目录缓存）。"""
+    catalog = get_card91_catalog()
+    if catalog is None:
+        return card91_list_card_types(shop)
+    return catalog.get_types(shop, refresh=refresh)
+
+
+def card91_hand_pick(shop, card_type_id, quantity, order_no):
+    """提卡，返回 (ok, msg, cards, uncertain)。
+
+    91卡券按 handPickOrderId（order_no）幂等，同一提卡单号重复提卡返回同一批卡密。
+    uncertain=True 时91卡券可能已经出卡，重试必须使用同一个提卡单号。
+    """
     if not card_type_id:
-        return False, '卡种ID未配置', []
+        return False, '卡种ID未配置', [], False
 
     params = {
         'cpkId': str(card_type_id),
         'num': str(int(quantity)),
         'handPickOrderId': str(order_no),
     }
-    ok, msg, data = _do_request(shop, '/acpr/CardPwd/HandPick', params)
+    ok, msg, data, uncertain = _request(shop, '/acpr/CardPwd/HandPick', params)
     if ok and data:
         cards = []
         items = data.get('CardPwdArr', []) if isinstance(data, dict) else []
@@ -126,26 +177,37 @@ def card91_fetch_cards(shop, card_type_id, quantity, order_no):
                 'expiry': str(item.get('d', '')),
             })
         if cards:
-            return True, f'成功提取{len(cards)}张卡密', cards
+            # 本地扣减目录缓存中的库存
+            catalog = get_card91_catalog()
+            if catalog is not None:
+                catalog.decrement(shop.id, card_type_id, len(cards))
+            return True, f'成功提取{len(cards)}张卡密', cards, False
         cpd_url = data.get('CpdUrl', '') if isinstance(data, dict) else ''
         if cpd_url:
-            return True, '提卡成功', [{'cardNo': cpd_url, 'cardPwd': '', 'expiry': ''}]
-        return False, '提卡成功但无卡密数据', []
-    return ok, msg, []
+            return True, '提卡成功', [{'cardNo': cpd_url, 'cardPwd': '', 'expiry': ''}], False
+        # 接口返回成功却没有卡密，无法确认是否已出卡
+        return False, '提卡成功但无卡密数据', [], True
+    return ok, msg, [], uncertain
+
+
+def card91_fetch_cards(shop, card_type_id, quantity, order_no):
+    """提卡，返回 (ok, msg, cards)。"""
+    ok, msg, cards, _ = card91_hand_pick(shop, card_type_id, quantity, order_no)
+    return ok, msg, cards
 
 
 def card91_get_stock(shop, card_type_id):
-    """查询指定卡种库存。"""
-    params = {'pageIndex': '1', 'pageSize': '100'}
-    ok, msg, data = _do_request(shop, '/acpr/CardPwd/GetList', params)
-    if ok and data:
-        items = data.get('List', []) if isinstance(data, dict) else []
-        for item in items:
-            if str(item.get('IdNo', '')) == str(card_type_id):
-                stock = item.get('RemainingCount', 0)
-                return True, f'库存：{stock}张', stock
-        return False, '未找到该卡种', 0
-    return ok, msg, 0
+    """查询指定卡种库存（优先读取卡种目录缓存）。"""
+    catalog = get_card91_catalog()
+    if catalog is not None:
+        return catalog.get_stock(shop, card_type_id)
+    ok, msg, card_types = card91_list_card_types(shop)
+    if not ok:
+        return ok, msg, 0
+    for item in card_types:
+        if item['id'] == str(card_type_id):
+            return True, f'库存：{item["stock"]}张', item['stock']
+    return False, '未找到该卡种', 0
 
 
 def card91_test_connection(shop):
@@ -159,8 +221,12 @@ def card91_test_connection(shop):
     return False, msg
 
 
-def card91_auto_deliver(shop, order, product):
-    """自动提卡发货。"""
+def card91_auto_deliver(shop, order, product, detail=None):
+    """自动提卡发货。
+
+    同一店铺同一卡种的并发提卡会合并为一次 HandPick（见 HandPickCoalescer），
+    传入 detail 字典时写入本单的合并提卡明细，供调用方记录到 OrderEvent。
+    """
     if not product or not product.card91_card_type_id:
         return False, '商品未配置91卡券卡种ID', []
 
@@ -169,9 +235,17 @@ def card91_auto_deliver(shop, order, product):
 
     logger.info(f'91卡券自动提卡：订单={order.order_no}，卡种={product.card91_card_type_id}，数量={order.quantity}')
 
-    ok, msg, cards = card91_fetch_cards(
-        shop, product.card91_card_type_id, order.quantity, order.order_no
-    )
+    coalescer = get_handpick_coalescer()
+    if coalescer is not None:
+        ok, msg, cards, pick_detail = coalescer.fetch(
+            shop, product.card91_card_type_id, order.quantity, order.order_no
+        )
+        if detail is not None:
+            detail.update(pick_detail)
+    else:
+        ok, msg, cards = card91_fetch_cards(
+            shop, product.card91_card_type_id, order.quantity, order.order_no
+        )
 
     if ok and len(cards) >= order.quantity:
         return True, f'成功提取{len(cards)}张卡密', cards[:order.quantity]
@@ -179,3 +253,503 @@ def card91_auto_deliver(shop, order, product):
         return False, f'卡密不足，需{order.quantity}张，只取到{len(cards)}张', []
     else:
         return False, f'提卡失败：{msg}', []
+
+
+# ---- 合并提卡 ----
+
+class _PickRequest:
+    __slots__ = ('order_no', 'quantity', 'event', 'ok', 'msg', 'cards', 'detail')
+
+    def __init__(self, order_no, quantity):
+        self.order_no = str(order_no)
+        self.quantity = int(quantity)
+        self.event = threading.Event()
+        self.ok = False
+        self.msg = ''
+        self.cards = []
+        self.detail = {}
+
+    def resolve(self, ok, msg, cards, **detail):
+        self.ok = ok
+        self.msg = msg
+        self.cards = cards
+        self.detail.update(detail)
+        self.event.set()
+
+
+class _PickBatch:
+    __slots__ = ('requests', 'total', 'full')
+
+    def __init__(self):
+        self.requests = []
+        self.total = 0
+        self.full = threading.Event()
+
+
+_PickRecord = namedtuple('_PickRecord', 'batch_id batch_num pick_offset quantity status')
+
+
+class HandPickJournal:
+    """提卡记录（card91_handpick_records）读写。
+
+    在提卡线程中执行，使用独立的连接与事务，不影响调用方会话中未提交的修改。
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    def lookup(self, shop_id, card_type_id, order_no):
+        """订单此前的提卡记录，没有时返回 None。"""
+        table = HandPickRecord.__table__
+        with self.app.app_context():
+            with db.engine.connect() as conn:
+                row = conn.execute(
+                    select(table.c.batch_id, table.c.batch_num, table.c.pick_offset,
+                           table.c.quantity, table.c.status)
+                    .where(table.c.shop_id == shop_id, table.c.card_type_id == card_type_id,
+                           table.c.order_no == order_no)
+                ).first()
+        return _PickRecord(*row) if row else None
+
+    def record(self, shop_id, card_type_id, batch_id, requests_, status):
+        """登记一个提卡单号覆盖的订单（按到达顺序记录各订单在批次中的位置）。"""
+        now = datetime.now()
+        batch_num = sum(r.quantity for r in requests_)
+        rows, offset = [], 0
+        for r in requests_:
+            rows.append({
+                'shop_id': shop_id, 'card_type_id': card_type_id, 'order_no': r.order_no,
+                'quantity': r.quantity, 'batch_id': batch_id, 'batch_num': batch_num,
+                'pick_offset': offset, 'status': status, 'create_time': now, 'update_time': now,
+            })
+            offset += r.quantity
+        with self.app.app_context():
+            with db.engine.begin() as conn:
+                conn.execute(HandPickRecord.__table__.insert(), rows)
+
+    def mark(self, batch_id, status):
+        table = HandPickRecord.__table__
+        with self.app.app_context():
+            with db.engine.begin() as conn:
+                conn.execute(table.update().where(table.c.batch_id == batch_id)
+                             .values(status=status, update_time=datetime.now()))
+
+
+class HandPickCoalescer:
+    """合并同一店铺同一卡种的并发提卡请求。
+
+    第一个到达的请求作为 leader，等待 CARD91_BATCH_WINDOW_MS 毫秒（或凑满
+    CARD91_BATCH_MAX_NUM 张）后用合计数量发起一次 HandPick，再按到达顺序把
+    CardPwdArr 拆分给各订单：
+
+    - 只有一个订单时直接用订单号作为 handPickOrderId（与单独提卡一致，重试幂等）
+    - 多个订单时 handPickOrderId 为随机批次号；HandPick 之前先把批次号及其覆盖的订单写入
+      提卡记录（HandPickJournal），订单重试时不再参与合并，按记录重放同一个批次号，
+      91卡券返回同一批卡密，本单仍取自己的那一段
+    - 批次被91卡券明确拒绝（如库存不足以满足合计数量）时，各订单改用自己的订单号提卡；
+      超时等结果不确定的失败不改为逐单提卡（91卡券可能已经出卡），各订单返回失败，由重试重放批次号
+    - 批次返回卡密不足时，未分到足额卡密的订单用自己的订单号单独补提差额
+    """
+
+    def __init__(self, window_ms=50, max_num=100, wait_timeout=60, journal=None):
+        self.window = window_ms / 1000.0
+        self.max_num = max_num
+        self.wait_timeout = wait_timeout
+        self.journal = journal
+        self._pending = {}
+        self._lock = threading.Lock()
+
+    def fetch(self, shop, card_type_id, quantity, order_no):
+        """提取卡密，返回 (ok, msg, cards, detail)。"""
+        card_type_id = str(card_type_id)
+        req = _PickRequest(order_no, quantity)
+        if self.journal is not None:
+            try:
+                previous = self.journal.lookup(shop.id, card_type_id, req.order_no)
+            except Exception as e:
+                logger.error(f'读取91卡券提卡记录失败：订单={req.order_no}，{e}')
+                return False, f'读取提卡记录失败：{e}', [], {}
+            if previous is not None:
+                self._replay(shop, card_type_id, req, previous)
+                return req.ok, req.msg, req.cards, req.detail
+
+        key = (shop.id, card_type_id)
+        with self._lock:
+            batch = self._pending.get(key)
+            if batch is not None and batch.total + req.quantity > self.max_num:
+                # 当前批次已满，提前发起
+                batch.full.set()
+                del self._pending[key]
+                batch = None
+            leader = batch is None
+            if leader:
+                batch = self._pending[key] = _PickBatch()
+            batch.requests.append(req)
+            batch.total += req.quantity
+            if batch.total >= self.max_num:
+                batch.full.set()
+
+        if leader:
+            batch.full.wait(self.window)
+            with self._lock:
+                if self._pending.get(key) is batch:
+                    del self._pending[key]
+            try:
+                self._execute(shop, card_type_id, batch)
+            except Exception as e:
+                logger.exception('91卡券合并提卡异常')
+                for r in batch.requests:
+                    if not r.event.is_set():
+                        r.resolve(False, f'请求异常：{e}', [])
+        elif not req.event.wait(self.wait_timeout):
+            return False, '等待合并提卡结果超时', [], {'batch_timeout': True}
+
+        return req.ok, req.msg, req.cards, req.detail
+
+    def _record(self, shop, card_type_id, batch_id, requests_, status):
+        if self.journal is None:
+            return True
+        try:
+            self.journal.record(shop.id, card_type_id, batch_id, requests_, status)
+            return True
+        except Exception as e:
+            logger.error(f'写入91卡券提卡记录失败：batch={batch_id}，{e}')
+            return False
+
+    def _mark(self, batch_id, status):
+        if self.journal is None:
+            return True
+        try:
+            self.journal.mark(batch_id, status)
+            return True
+        except Exception as e:
+            logger.error(f'更新91卡券提卡记录失败：batch={batch_id}，{e}')
+            return False
+
+    def _execute(self, shop, card_type_id, batch):
+        requests_ = batch.requests
+        if len(requests_) == 1:
+            r = requests_[0]
+            # 单独提卡也先登记，重试时不再参与合并（否则会换一个提卡单号重新出卡）
+            if not self._record(shop, card_type_id, r.order_no, requests_, HandPickRecord.STATUS_SINGLE):
+                r.resolve(False, '写入提卡记录失败', [])
+                return
+            ok, msg, cards, uncertain = card91_hand_pick(shop, card_type_id, r.quantity, r.order_no)
+            r.resolve(ok, msg, cards, batch_size=1, handPickOrderId=r.order_no, uncertain=uncertain)
+            return
+
+        batch_id = 'B' + uuid.uuid4().hex[:20].upper()
+        if not self._record(shop, card_type_id, batch_id, requests_, HandPickRecord.STATUS_PENDING):
+            for r in requests_:
+                r.resolve(False, '写入提卡记录失败', [])
+            return
+        ok, msg, cards, uncertain = card91_hand_pick(shop, card_type_id, batch.total, batch_id)
+        common = {
+            'batch_id': batch_id,
+            'batch_size': len(requests_),
+            'batch_num': batch.total,
+            'batch_returned': len(cards),
+            'batch_msg': msg,
+        }
+        if not ok and uncertain:
+            logger.warning(f'91卡券合并提卡结果不确定，等待重试重放批次号：batch={batch_id}, msg={msg}')
+            for r in requests_:
+                r.resolve(False, f'提卡结果不确定：{msg}', [], uncertain=True, **common)
+            return
+        if not ok:
+            # 先改为逐单提卡再按订单号提卡，否则重试会重放批次号，同一订单可能取到两批卡密
+            if not self._mark(batch_id, HandPickRecord.STATUS_SINGLE):
+                for r in requests_:
+                    r.resolve(False, '更新提卡记录失败', [], **common)
+                return
+            logger.warning(f'91卡券合并提卡失败，改为逐单提卡：batch={batch_id}, num={batch.total}, msg={msg}')
+        else:
+            self._mark(batch_id, HandPickRecord.STATUS_DONE)
+        logger.info(f'91卡券合并提卡：batch={batch_id}, 订单数={len(requests_)}, '
+                    f'需要={batch.total}, 取到={len(cards)}')
+
+        offset = 0
+        for r in requests_:
+            self._allocate(shop, card_type_id, r, cards[offset:offset + r.quantity], common)
+            offset += r.quantity
+
+    def _replay(self, shop, card_type_id, req, record):
+        """订单重试：按提卡记录重放同一个提卡单号。"""
+        if record.status == HandPickRecord.STATUS_SINGLE:
+            ok, msg, cards, uncertain = card91_hand_pick(shop, card_type_id, req.quantity, req.order_no)
+            req.resolve(ok, msg, cards, batch_size=1, handPickOrderId=req.order_no, replay=True,
+                        uncertain=uncertain)
+            return
+
+        ok, msg, cards, uncertain = card91_hand_pick(shop, card_type_id, record.batch_num, record.batch_id)
+        common = {
+            'batch_id': record.batch_id,
+            'batch_num': record.batch_num,
+            'batch_returned': len(cards),
+            'batch_msg': msg,
+            'replay': True,
+        }
+        if not ok and (uncertain or record.status == HandPickRecord.STATUS_DONE):
+            req.resolve(False, f'重放提卡单号失败：{msg}', [], uncertain=uncertain, **common)
+            return
+        if not ok:
+            # 上次结果不确定、这次被明确拒绝：该批次号没有出卡，改为逐单提卡
+            if not self._mark(record.batch_id, HandPickRecord.STATUS_SINGLE):
+                req.resolve(False, '更新提卡记录失败', [], **common)
+                return
+        elif record.status == HandPickRecord.STATUS_PENDING:
+            self._mark(record.batch_id, HandPickRecord.STATUS_DONE)
+        logger.info(f'91卡券重放提卡单号：batch={record.batch_id}, 订单={req.order_no}, 取到={len(cards)}')
+        self._allocate(shop, card_type_id, req,
+                       cards[record.pick_offset:record.pick_offset + record.quantity], common)
+
+    def _allocate(self, shop, card_type_id, r, allocated, common):
+        if len(allocated) == r.quantity:
+            r.resolve(True, f'成功提取{len(allocated)}张卡密', allocated,
+                      allocated=len(allocated), topped_up=0, **common)
+            return
+
+        # 批次卡密不足：差额用订单号单独补提（重试时同一订单号返回同一批卡密）
+        need = r.quantity - len(allocated)
+        ok, msg, more, uncertain = card91_hand_pick(shop, card_type_id, need, r.order_no)
+        if ok and len(more) >= need:
+            r.resolve(True, f'成功提取{r.quantity}张卡密', allocated + more[:need],
+                      allocated=len(allocated), topped_up=need, **common)
+            return
+        # 已取出的部分卡密不写入事件（事件数据会展示和归档），重试时按提卡单号重放即可取回
+        topped_up = len(more) if ok else 0
+        fail_msg = f'卡密不足，需{r.quantity}张，只取到{len(allocated) + topped_up}张' if ok else msg
+        r.resolve(False, fail_msg, [], allocated=len(allocated), topped_up=topped_up,
+                  top_up_id=r.order_no, top_up_msg=msg, uncertain=uncertain, **common)
+
+
+# ---- 卡种目录缓存 ----
+
+_Credentials = namedtuple('_Credentials', ['id', 'agiso_access_token', 'agiso_app_secret'])
+
+
+class _ShopCatalog:
+    __slots__ = ('types', 'by_id', 'loaded_at', 'loaded_wall', 'fingerprint')
+
+    def __init__(self, types, fingerprint):
+        self.types = types
+        self.by_id = {t['id']: t for t in types}
+        self.loaded_at = time.monotonic()
+        self.loaded_wall = time.time()
+        self.fingerprint = fingerprint
+
+
+class Card91Catalog:
+    """按店铺缓存的91卡券卡种目录。
+
+    - 首次访问同步分页拉取全部卡种，按 IdNo 建索引
+    - 超过 CARD91_CATALOG_TTL 后先返回旧数据，同时在后台线程刷新（每店铺同时只刷新一次）
+    - 店铺 AccessToken / AppSecret 变化时同步重新加载
+    - HandPick 成功后在本地扣减库存；提卡通常发生在 worker.py，扣减记录写入本机 SQLite 日志
+      （CARD91_CATALOG_DB）并刷新版本戳，其他进程（gunicorn worker）下次访问时读取日志扣减
+      各自的目录，只扣减在其目录加载之后发生的提卡
+    """
+
+    def __init__(self, ttl=300, path=None, stamp_dir=None):
+        self.ttl = ttl
+        self.path = path
+        self.stamp = VersionStamp(stamp_dir, 'card91_catalog')
+        self.origin = uuid.uuid4().hex
+        self._catalogs = {}
+        self._refreshing = set()
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._seen = None
+        self._seq = None
+        self._writes = 0
+
+    # ---- 扣减日志（SQLite） ----
+
+    def _conn(self):
+        if not self.path:
+            return None
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None and self._local.pid == os.getpid():
+            return conn
+        conn = sqlite3.connect(self.path, timeout=1, isolation_level=None, check_same_thread=False)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.execute(
+            'CREATE TABLE IF NOT EXISTS catalog_decrements ('
+            ' seq INTEGER PRIMARY KEY AUTOINCREMENT, origin TEXT NOT NULL, shop_id INTEGER NOT NULL,'
+            ' card_type_id TEXT NOT NULL, count INTEGER NOT NULL, created_at REAL NOT NULL)'
+        )
+        self._local.conn = conn
+        self._local.pid = os.getpid()
+        return conn
+
+    def _write_log(self, shop_id, card_type_id, count):
+        try:
+            conn = self._conn()
+            if conn is None:
+                return
+            now = time.time()
+            conn.execute(
+                'INSERT INTO catalog_decrements (origin, shop_id, card_type_id, count, created_at)'
+                ' VALUES (?, ?, ?, ?, ?)', (self.origin, shop_id, str(card_type_id), count, now),
+            )
+            self._writes += 1
+            if self._writes >= PRUNE_EVERY:
+                self._writes = 0
+                # 超过 TTL 的目录都已重新加载，更早的扣减不再需要
+                conn.execute('DELETE FROM catalog_decrements WHERE created_at < ?', (now - self.ttl * 2,))
+        except sqlite3.Error as e:
+            logger.warning(f'91卡券目录扣减日志写入失败: {e}')
+            return
+        self.stamp.bump()
+
+    def _sync(self):
+        """应用其他进程写入的扣减记录。"""
+        version = self.stamp.current()
+        if version == self._seen:
+            return
+        with self._lock:
+            if version == self._seen:
+                return
+            self._seen = version
+            try:
+                conn = self._conn()
+                if conn is None:
+                    return
+                if self._seq is None:
+                    # 首次同步：此前的扣减已反映在随后加载的目录中
+                    self._seq = conn.execute('SELECT MAX(seq) FROM catalog_decrements').fetchone()[0] or 0
+                    return
+                rows = conn.execute(
+                    'SELECT seq, origin, shop_id, card_type_id, count, created_at FROM catalog_decrements'
+                    ' WHERE seq > ? ORDER BY seq', (self._seq,),
+                ).fetchall()
+            except sqlite3.Error as e:
+                logger.warning(f'91卡券目录扣减日志读取失败: {e}')
+                # 读不到日志时只能整体重新加载
+                self._catalogs.clear()
+                return
+            if rows:
+                self._seq = rows[-1][0]
+            for _, origin, shop_id, card_type_id, count, created_at in rows:
+                catalog = self._catalogs.get(shop_id)
+                if origin == self.origin or catalog is None or created_at < catalog.loaded_wall:
+                    continue
+                self._apply(catalog, card_type_id, count)
+
+    @staticmethod
+    def _apply(catalog, card_type_id, count):
+        item = catalog.by_id.get(str(card_type_id))
+        if item is not None:
+            item['stock'] = max(int(item['stock'] or 0) - count, 0)
+            item['used'] = int(item['used'] or 0) + count
+
+    # ---- 加载 ----
+
+    @staticmethod
+    def _credentials(shop):
+        return _Credentials(shop.id, shop.agiso_access_token, shop.agiso_app_secret)
+
+    def _load(self, creds):
+        ok, msg, types = card91_list_card_types(creds)
+        if ok:
+            with self._lock:
+                self._catalogs[creds.id] = _ShopCatalog(types, creds)
+        return ok, msg
+
+    def _refresh_in_background(self, creds):
+        with self._lock:
+            if creds.id in self._refreshing:
+                return
+            self._refreshing.add(creds.id)
+
+        def _run():
+            try:
+                ok, msg = self._load(creds)
+                if not ok:
+                    logger.warning(f'91卡券卡种目录后台刷新失败 shop={creds.id}: {msg}')
+            finally:
+                with self._lock:
+                    self._refreshing.discard(creds.id)
+
+        threading.Thread(target=_run, name=f'card91-catalog-{creds.id}', daemon=True).start()
+
+    def _catalog(self, shop, refresh=False):
+        """返回 (ok, msg, catalog)。"""
+        self._sync()
+        creds = self._credentials(shop)
+        catalog = self._catalogs.get(shop.id)
+        if refresh or catalog is None or catalog.fingerprint != creds:
+            ok, msg = self._load(creds)
+            if not ok:
+                return False, msg, None
+            return True, msg, self._catalogs[shop.id]
+        if time.monotonic() - catalog.loaded_at > self.ttl:
+            self._refresh_in_background(creds)
+        return True, f'共{len(catalog.types)}个卡种', catalog
+
+    def get_types(self, shop, refresh=False):
+        ok, msg, catalog = self._catalog(shop, refresh=refresh)
+        if not ok:
+            return False, msg, []
+        return True, msg, [dict(t) for t in catalog.types]
+
+    def get_stock(self, shop, card_type_id):
+        ok, msg, catalog = self._catalog(shop)
+        if not ok:
+            return False, msg, 0
+        item = catalog.by_id.get(str(card_type_id))
+        if item is None:
+            return False, '未找到该卡种', 0
+        return True, f'库存：{item["stock"]}张', item['stock']
+
+    def decrement(self, shop_id, card_type_id, count):
+        """提卡后扣减本进程目录中的库存，并通知其他进程扣减。"""
+        catalog = self._catalogs.get(shop_id)
+        if catalog is not None:
+            with self._lock:
+                self._apply(catalog, card_type_id, count)
+        self._write_log(shop_id, card_type_id, count)
+
+    def invalidate(self, shop_id=None):
+        with self._lock:
+            if shop_id is None:
+                self._catalogs.clear()
+            else:
+                self._catalogs.pop(shop_id, None)
+
+
+def init_card91_catalog(app):
+    catalog = Card91Catalog(
+        ttl=int(app.config.get('CARD91_CATALOG_TTL', 300)),
+        path=app.config.get('CARD91_CATALOG_DB'),
+        stamp_dir=app.config.get('CACHE_STAMP_DIR'),
+    )
+    app.extensions['card91_catalog'] = catalog
+    return catalog
+
+
+def get_card91_catalog():
+    from flask import current_app, has_app_context
+    if not has_app_context():
+        return None
+    return current_app.extensions.get('card91_catalog')
+
+
+def init_handpick_coalescer(app):
+    coalescer = None
+    if app.config.get('CARD91_BATCH_ENABLED', True):
+        coalescer = HandPickCoalescer(
+            window_ms=int(app.config.get('CARD91_BATCH_WINDOW_MS', 50)),
+            max_num=int(app.config.get('CARD91_BATCH_MAX_NUM', 100)),
+            journal=HandPickJournal(app),
+        )
+    app.extensions['card91_coalescer'] = coalescer
+    return coalescer
+
+
+def get_handpick_coalescer():
+    from flask import current_app, has_app_context
+    if not has_app_context():
+        return None
+    return current_app.extensions.get('card91_coalescer')
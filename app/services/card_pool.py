@@ -0,0 +1,344 @@
+"""91卡券本地库存（预先提卡，发卡时原子领取）。
+
+远程 HandPick 每单要等一次91卡券接口，高峰期接口变慢时发卡跟着变慢。商品开启本地库存
+（products.card_pool_enabled，发货方式=91卡券）后：
+
+- 补货：worker.py 每 CARD_POOL_REPLENISH_INTERVAL 秒按该 SKU 最近
+  CARD_POOL_RATE_WINDOW_MINUTES 分钟的销量计算水位，可用库存低于低水位时用
+  HandPick 补到高水位，卡密 AES-GCM 加密后写入 card_inventory；每批提卡前先在
+  card_pool_batches 写入提卡单号，超时等结果不确定或入库失败的批次在下一次补货时
+  用同一个提卡单号重放（91卡券按提卡单号幂等），已出的卡密不会丢失
+- 领取：一条条件 UPDATE 把 n 张可用卡密标记为本单已领取（MySQL 用 UPDATE ... ORDER BY id
+  LIMIT n，其他数据库用带 FOR UPDATE SKIP LOCKED 的子查询），多个 worker 并发领取不会
+  拿到同一张卡；领取与保存卡密在同一事务中提交
+- 回退：库存不足时不领取（已领取的部分退回库存），改走远程 HandPick；同一订单重试时
+  直接返回此前领取的卡密，不会重复领取
+"""
+import base64
+import hashlib
+import json
+import logging
+import math
+import uuid
+from datetime import datetime, timedelta
+
+from flask import current_app
+from sqlalchemy import func, select, text
+
+from app.extensions import db
+from app.models.card_inventory import CardInventory
+from app.models.card_pool_batch import CardPoolBatch
+from app.models.order import Order
+from app.models.product import Product
+from app.models.shop import Shop
+from app.services.card91 import card91_auto_deliver, card91_hand_pick
+
+try:
+    from Crypto.Cipher import AES
+    from Crypto.Random import get_random_bytes
+    HAS_CRYPTO = True
+except ImportError:
+    HAS_CRYPTO = False
+
+logger = logging.getLogger(__name__)
+
+_NONCE_SIZE = 12
+_TAG_SIZE = 16
+
+
+# ---- 加密 ----
+
+def _key():
+    # 只用专用密钥：若由 SECRET_KEY 派生，轮换 SECRET_KEY 后整个库存都无法解密
+    secret = current_app.config.get('CARD_POOL_KEY')
+    if not secret:
+        raise ValueError('未配置 CARD_POOL_KEY')
+    return hashlib.sha256(secret.encode('utf-8')).digest()
+
+
+def pool_available():
+    """本地库存是否可用：需要 pycryptodome 和 CARD_POOL_KEY。"""
+    return bool(HAS_CRYPTO and current_app.config.get('CARD_POOL_KEY'))
+
+
+def encrypt_cards(card):
+    """加密一张卡密（dict），返回 base64(nonce | tag | 密文)。"""
+    nonce = get_random_bytes(_NONCE_SIZE)
+    cipher = AES.new(_key(), AES.MODE_GCM, nonce=nonce)
+    ciphertext, tag = cipher.encrypt_and_digest(json.dumps(card, ensure_ascii=False).encode('utf-8'))
+    return base64.b64encode(nonce + tag + ciphertext).decode('ascii')
+
+
+def decrypt_cards(data):
+    """解密 encrypt_cards 的结果，密钥不符或数据被篡改时抛出 ValueError。"""
+    raw = base64.b64decode(data)
+    nonce, tag, ciphertext = raw[:_NONCE_SIZE], raw[_NONCE_SIZE:_NONCE_SIZE + _TAG_SIZE], raw[_NONCE_SIZE + _TAG_SIZE:]
+    cipher = AES.new(_key(), AES.MODE_GCM, nonce=nonce)
+    return json.loads(cipher.decrypt_and_verify(ciphertext, tag).decode('utf-8'))
+
+
+def pool_enabled(product):
+    return bool(product is not None and product.deliver_type == 1
+                and product.card_pool_enabled and product.card91_card_type_id and pool_available())
+
+
+# ---- 领取 ----
+
+def _claimed_rows(order_id):
+    return (CardInventory.query
+            .filter_by(order_id=order_id, status=CardInventory.STATUS_CLAIMED)
+            .order_by(CardInventory.id).all())
+
+
+def claim_pool_cards(product, order, quantity=None):
+    """从本地库存为订单领取卡密（不提交，由调用方与订单一起提交）。
+
+    返回卡密列表；未开启本地库存或库存不足时返回 None（已领取的部分退回库存）。
+    """
+    if not pool_enabled(product):
+        return None
+    quantity = int(quantity or order.quantity or 1)
+
+    # 重试：该订单此前已领取（例如提卡后回调失败）
+    rows = _claimed_rows(order.id)
+    if len(rows) < quantity:
+        need = quantity - len(rows)
+        now = datetime.now()
+        connection = db.session.connection()
+        if connection.dialect.name == 'mysql':
+            result = db.session.execute(text(
+                'UPDATE card_inventory SET status = 1, order_id = :order_id, claim_time = :now'
+                ' WHERE product_id = :product_id AND status = 0 ORDER BY id LIMIT :n'
+            ), {'order_id': order.id, 'now': now, 'product_id': product.id, 'n': need})
+        else:
+            table = CardInventory.__table__
+            ids = (select(table.c.id)
+                   .where(table.c.product_id == product.id, table.c.status == CardInventory.STATUS_AVAILABLE)
+                   .order_by(table.c.id).limit(need)
+                   .with_for_update(skip_locked=True))
+            result = db.session.execute(
+                table.update()
+                .where(table.c.id.in_(ids), table.c.status == CardInventory.STATUS_AVAILABLE)
+                .values(status=CardInventory.STATUS_CLAIMED, order_id=order.id, claim_time=now)
+            )
+        if result.rowcount < need:
+            release_pool_cards(order.id)
+            logger.info(f'本地库存不足：商品={product.id}，订单={order.order_no}，需{quantity}张')
+            return None
+        rows = _claimed_rows(order.id)
+
+    cards, invalid = [], []
+    for row in rows[:quantity]:
+        try:
+            cards.append(decrypt_cards(row.card_data))
+        except ValueError:
+            invalid.append(row.id)
+    if invalid:
+        # 密钥不符或数据损坏：隔离无法解密的卡密，其余退回库存，本单改走远程 HandPick
+        _quarantine_pool_cards(invalid)
+        release_pool_cards(order.id)
+        logger.error(f'本地库存卡密无法解密，已隔离{len(invalid)}张：商品={product.id}，订单={order.order_no}')
+        return None
+    return cards
+
+
+def release_pool_cards(order_id):
+    """把订单已领取但未保存的卡密退回库存（不提交）。"""
+    table = CardInventory.__table__
+    db.session.execute(
+        table.update()
+        .where(table.c.order_id == order_id, table.c.status == CardInventory.STATUS_CLAIMED)
+        .values(status=CardInventory.STATUS_AVAILABLE, order_id=None, claim_time=None)
+    )
+
+
+def _quarantine_pool_cards(ids):
+    """把无法解密的卡密标记为不可用（不提交），不再被领取。"""
+    table = CardInventory.__table__
+    db.session.execute(
+        table.update()
+        .where(table.c.id.in_(ids))
+        .values(status=CardInventory.STATUS_INVALID, order_id=None)
+    )
+
+
+def deliver_cards(shop, order, product, detail=None):
+    """取卡发货：优先本地库存，库存不足时远程 HandPick，返回值同 card91_auto_deliver。"""
+    cards = claim_pool_cards(product, order)
+    if cards is not None:
+        if detail is not None:
+            detail['source'] = 'pool'
+        return True, f'本地库存发卡{len(cards)}张', cards
+    if detail is not None and pool_enabled(product):
+        detail['source'] = 'remote'
+    return card91_auto_deliver(shop, order, product, detail=detail)
+
+
+# ---- 补货 ----
+
+def available_counts(product_ids=None):
+    """各商品的可用库存 {product_id: 张数}。"""
+    query = (db.session.query(CardInventory.product_id, func.count(CardInventory.id))
+             .filter(CardInventory.status == CardInventory.STATUS_AVAILABLE))
+    if product_ids is not None:
+        if not product_ids:
+            return {}
+        query = query.filter(CardInventory.product_id.in_(product_ids))
+    return dict(query.group_by(CardInventory.product_id).all())
+
+
+def _sales_per_minute(products, now):
+    """各商品 SKU 最近窗口内每分钟卖出的卡密张数 {product_id: 张数}。"""
+    window = max(int(current_app.config.get('CARD_POOL_RATE_WINDOW_MINUTES', 60)), 1)
+    since = now - timedelta(minutes=window)
+    skus = {}
+    for product in products:
+        if product.sku_id:
+            skus.setdefault(product.shop_id, set()).add(product.sku_id)
+
+    sold = {}
+    for shop_id, sku_ids in skus.items():
+        rows = (db.session.query(Order.sku_id, func.sum(Order.quantity))
+                .filter(Order.shop_id == shop_id, Order.sku_id.in_(sku_ids),
+                        Order.order_type == 2, Order.create_time >= since)
+                .group_by(Order.sku_id))
+        sold.update(((shop_id, sku_id), int(total or 0)) for sku_id, total in rows)
+    return {p.id: sold.get((p.shop_id, p.sku_id), 0) / window for p in products}
+
+
+def watermarks(product, rate):
+    """按每分钟销量计算 (低水位, 高水位)。"""
+    config = current_app.config
+    cap = product.card_pool_max or int(config.get('CARD_POOL_MAX_STOCK', 500))
+    low = max(int(config.get('CARD_POOL_MIN_STOCK', 5)), math.ceil(rate * config.get('CARD_POOL_LOW_MINUTES', 10)))
+    high = max(low, math.ceil(rate * config.get('CARD_POOL_HIGH_MINUTES', 30)))
+    high = min(high, cap)
+    return min(low, high), high
+
+
+def _pick_batch(shop, batch):
+    """按批次记录提卡入库，返回入库张数；失败或结果不确定时返回 None。
+
+    卡密入库与批次标记已入库在同一事务中提交；提交失败时批次仍为提卡中，下次补货重放。
+    """
+    ok, msg, cards, uncertain = card91_hand_pick(shop, batch.card_type_id, batch.quantity, batch.batch_id)
+    batch.attempts += 1
+    if not ok:
+        batch.last_error = (msg or '')[:500]
+        if not uncertain:
+            batch.status = CardPoolBatch.STATUS_FAILED
+        db.session.commit()
+        logger.warning(f'本地库存补货失败：商品={batch.product_id}，批次={batch.batch_id}，'
+                       f'{"结果不确定，下次补货重放" if uncertain else msg}')
+        return None
+    for card in cards:
+        db.session.add(CardInventory(
+            product_id=batch.product_id, shop_id=batch.shop_id, card_type_id=batch.card_type_id,
+            card_data=encrypt_cards(card), batch_id=batch.batch_id,
+        ))
+    batch.status = CardPoolBatch.STATUS_DONE
+    batch.received = len(cards)
+    db.session.commit()
+    return len(cards)
+
+
+def _replay_batches(product):
+    """重放商品提卡中的批次，返回 (入库张数, 是否仍有未完成批次)。"""
+    added = 0
+    pending = (CardPoolBatch.query
+               .filter_by(product_id=product.id, status=CardPoolBatch.STATUS_PENDING)
+               .order_by(CardPoolBatch.id).all())
+    for batch in pending:
+        shop = db.session.get(Shop, batch.shop_id)
+        if shop is None:
+            return added, True
+        got = _pick_batch(shop, batch)
+        if got is None:
+            if batch.status == CardPoolBatch.STATUS_PENDING:
+                return added, True
+            continue
+        logger.info(f'本地库存补货批次重放成功：商品={product.id}，批次={batch.batch_id}，入库{got}张')
+        added += got
+    return added, False
+
+
+def _refill(shop, product, need):
+    """用 HandPick 提取 need 张卡密存入库存，返回实际入库张数。"""
+    fetch_max = max(int(current_app.config.get('CARD_POOL_FETCH_MAX', 100)), 1)
+    added = 0
+    while added < need:
+        num = min(fetch_max, need - added)
+        # 提卡单号每批唯一，提卡前先落库，结果不确定时下次补货用同一单号重放
+        batch = CardPoolBatch(batch_id=f'POOL{product.id}-{uuid.uuid4().hex[:16]}', product_id=product.id,
+                              shop_id=shop.id, card_type_id=product.card91_card_type_id, quantity=num)
+        db.session.add(batch)
+        db.session.commit()
+        got = _pick_batch(shop, batch)
+        if got is None:
+            break
+        added += got
+        if got < num:
+            logger.warning(f'本地库存补货卡密不足：商品={product.id}，需{num}张，只取到{got}张')
+            break
+    return added
+
+
+def replenish_pools(now=None):
+    """为开启本地库存的商品补货（需在应用上下文中调用），返回 {product_id: 入库张数}。"""
+    if not HAS_CRYPTO:
+        logger.warning('未安装 pycryptodome，本地库存不可用')
+        return {}
+    if not current_app.config.get('CARD_POOL_KEY'):
+        logger.warning('未配置 CARD_POOL_KEY，本地库存不可用')
+        return {}
+    now = now or datetime.now()
+    products = [p for p in Product.query.filter(
+        Product.card_pool_enabled == 1, Product.is_enabled == 1, Product.deliver_type == 1,
+    ).order_by(Product.id) if p.card91_card_type_id]
+    if not products:
+        return {}
+
+    counts = available_counts([p.id for p in products])
+    rates = _sales_per_minute(products, now)
+    shops = {s.id: s for s in Shop.query.filter(Shop.id.in_({p.shop_id for p in products}))}
+
+    added = {}
+    for product in products:
+        low, high = watermarks(product, rates[product.id])
+        available = counts.get(product.id, 0)
+        shop = shops.get(product.shop_id)
+        if shop is None or not shop.agiso_access_token:
+            continue
+        try:
+            # 先重放上次结果不确定的批次；仍未完成时本轮不再提新批次
+            replayed, blocked = _replay_batches(product)
+            available += replayed
+            if blocked or available >= low:
+                if replayed:
+                    added[product.id] = replayed
+                continue
+            added[product.id] = replayed + _refill(shop, product, high - available)
+        except Exception:
+            db.session.rollback()
+            logger.exception(f'本地库存补货异常：商品={product.id}')
+            continue
+        logger.info(f'本地库存补货：商品={product.id}，库存{available}张，'
+                    f'水位{low}-{high}，入库{added[product.id]}张')
+    return added
+
+
+def schedule_card_pool(scheduler, app):
+    """在 worker.py 的定时任务中登记本地库存补货。"""
+
+    def _run():
+        with app.app_context():
+            try:
+                replenish_pools()
+            finally:
+                db.session.remove()
+
+    scheduler.add_job(
+        _run, 'interval',
+        seconds=app.config.get('CARD_POOL_REPLENISH_INTERVAL', 60),
+        id='card_pool_replenish', max_instances=1, coalesce=True,
+    )
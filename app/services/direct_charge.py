@@ -0,0 +1,438 @@
+"""直充引擎（发货方式=2 的商品自动提交上游充值并回调京东）。
+
+过去直充订单只能由操作员在上游充值后逐单点击“通知成功”。商品配置直充供应商后：
+
+- 接单：直充订单匹配到直充商品（路由表，不查库）时，与订单同一事务写入直充任务
+- 提交：worker.py 每 DIRECT_CHARGE_INTERVAL 秒领取一批到期任务（条件 UPDATE，多进程不重复），
+  在 DIRECT_CHARGE_THREADS 个线程中并发提交，每个供应商实例（类型 + 供应商级配置）
+  有独立的连接池，同时进行中的请求不超过其 max_concurrency
+- 查询：充值中的任务按供应商分组，每 query_batch_size 单一次批量查询，直到成功或失败；
+  提交超时（不确定上游是否受理）同样转入查询，上游无此订单时才重新提交，避免重复充值；
+  查询 DIRECT_CHARGE_MAX_POLLS 次仍未出结果（上游一直充值中、查询地址错误等）时任务失败、
+  订单转为异常，由操作员到上游核实
+- 回调：充值成功后并发回调京东（callback_game_direct_success / callback_general_success），
+  单店铺并发不超过 DIRECT_CHARGE_CALLBACK_SHOP_CONCURRENCY，失败的回调登记到回调发件箱自动重发
+- 线程内只使用订单 / 店铺快照，结果在主线程回写并按批提交
+
+供应商适配器见 app/services/direct_charge_suppliers.py。
+"""
+import json
+import logging
+import threading
+import uuid
+from collections import Counter, OrderedDict, deque, namedtuple
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from datetime import datetime, timedelta
+
+from flask import current_app
+
+from app.extensions import db
+from app.models.direct_charge import DirectChargeTask
+from app.models.order import Order
+from app.models.order_event import OrderEvent
+from app.models.product import Product
+from app.models.shop import Shop
+from app.services.bulk_actions import OrderSnapshot
+from app.services.callback_outbox import enqueue_callback, send_callback
+from app.services.direct_charge_suppliers import (
+    FAILED, NOT_FOUND, PROCESSING, SUCCESS, SUPPLIERS, UNKNOWN,
+    ChargeRequest, ChargeResult, get_supplier, parse_config, supplier_key,
+)
+from app.services.product_router import get_product_router
+from app.services.shop_cache import ShopSnapshot
+
+logger = logging.getLogger(__name__)
+
+# 提交中 / 查询中的任务超过该时间未回写视为进程已退出（秒）
+LOCK_TIMEOUT = 300
+
+# 回调状态：1=成功 2=失败（与订单路由一致）
+NOTIFY_STATUS_SUCCESS = 1
+NOTIFY_STATUS_FAILED = 2
+
+# 订单状态：1=处理中 2=已完成 5=异常
+ORDER_PROCESSING = 1
+ORDER_DONE = 2
+ORDER_ERROR = 5
+
+
+# ---- 供应商实例 ----
+
+class DirectChargeEngine:
+    """进程内的供应商适配器缓存：每个供应商实例一个连接池与并发上限。"""
+
+    def __init__(self, app):
+        config = app.config
+        self.defaults = {
+            'max_concurrency': int(config.get('DIRECT_CHARGE_SUPPLIER_CONCURRENCY', 4)),
+            'query_batch_size': int(config.get('DIRECT_CHARGE_QUERY_BATCH_SIZE', 50)),
+            'poll_interval': int(config.get('DIRECT_CHARGE_POLL_INTERVAL', 10)),
+            'timeout': (config.get('HTTP_TIMEOUTS') or {}).get('direct_charge', (3, 15)),
+            'retries': int(config.get('HTTP_RETRIES', 2)),
+        }
+        self._suppliers = {}
+        self._lock = threading.Lock()
+
+    def supplier(self, api_type, config):
+        """返回 (实例标识, 适配器)，同一供应商配置复用同一个适配器。"""
+        key = supplier_key(api_type, config)
+        adapter = self._suppliers.get(key)
+        if adapter is None:
+            with self._lock:
+                adapter = self._suppliers.get(key)
+                if adapter is None:
+                    adapter = SUPPLIERS[api_type](config, self.defaults)
+                    self._suppliers[key] = adapter
+        return key, adapter
+
+    def stats(self):
+        with self._lock:
+            suppliers = list(self._suppliers.values())
+        return [{'type': s.name, 'max_concurrency': s.max_concurrency, 'http': s.http.stats()} for s in suppliers]
+
+    def close(self):
+        with self._lock:
+            suppliers, self._suppliers = list(self._suppliers.values()), {}
+        for supplier in suppliers:
+            supplier.close()
+
+
+def init_direct_charge(app):
+    engine = DirectChargeEngine(app)
+    app.extensions['direct_charge'] = engine
+    return engine
+
+
+def get_direct_charge_engine():
+    return current_app.extensions['direct_charge']
+
+
+# ---- 接单 ----
+
+def find_direct_charge_product(shop_id, sku_id):
+    """按 shop_id + sku_id 匹配已配置供应商的直充商品（路由表快照，不查询数据库）。"""
+    product = get_product_router().direct_charge(shop_id, sku_id)
+    if product is None or get_supplier(product.direct_charge_api_type) is None:
+        return None
+    return product
+
+
+def build_direct_charge_task(order, shop, product, max_attempts=None):
+    """构建直充任务（由调用方与订单一起提交）。"""
+    if max_attempts is None:
+        max_attempts = current_app.config.get('DIRECT_CHARGE_MAX_ATTEMPTS', 3)
+    return DirectChargeTask(
+        order=order,
+        shop_id=shop.id,
+        product_id=product.id,
+        supplier=product.direct_charge_api_type,
+        status=DirectChargeTask.STATUS_PENDING,
+        max_attempts=max_attempts,
+        next_run_time=datetime.now(),
+    )
+
+
+# ---- 领取 ----
+
+def _claim(limit, token, now):
+    """领取到期的待提交（-> 提交中）与充值中（-> 查询中）任务。"""
+    # 提交中超时：不确定上游是否已受理，转为查询确认
+    DirectChargeTask.query.filter(
+        DirectChargeTask.status == DirectChargeTask.STATUS_SUBMITTING,
+        DirectChargeTask.locked_at < now - timedelta(seconds=LOCK_TIMEOUT),
+    ).update({'status': DirectChargeTask.STATUS_CHARGING, 'next_run_time': now, 'locked_by': None},
+             synchronize_session=False)
+
+    for status, values in (
+        (DirectChargeTask.STATUS_PENDING, {
+            'status': DirectChargeTask.STATUS_SUBMITTING,
+            'attempts': DirectChargeTask.attempts + 1,
+        }),
+        # 查询中的任务把下次时间推后，进程退出时超时后自动重新查询
+        (DirectChargeTask.STATUS_CHARGING, {
+            'next_run_time': now + timedelta(seconds=LOCK_TIMEOUT),
+            'polls': DirectChargeTask.polls + 1,
+        }),
+    ):
+        ids = [row[0] for row in db.session.query(DirectChargeTask.id).filter(
+            DirectChargeTask.status == status,
+            DirectChargeTask.next_run_time <= now,
+        ).order_by(DirectChargeTask.next_run_time, DirectChargeTask.id).limit(limit)]
+        if ids:
+            DirectChargeTask.query.filter(
+                DirectChargeTask.id.in_(ids),
+                DirectChargeTask.status == status,
+                DirectChargeTask.next_run_time <= now,
+            ).update(dict(values, locked_by=token, locked_at=now), synchronize_session=False)
+    db.session.commit()
+
+    tasks = DirectChargeTask.query.filter_by(locked_by=token).order_by(DirectChargeTask.id).all()
+    submits = [t for t in tasks if t.status == DirectChargeTask.STATUS_SUBMITTING]
+    polls = [t for t in tasks if t.status == DirectChargeTask.STATUS_CHARGING]
+    return submits, polls
+
+
+# ---- 并发执行 ----
+
+# 一次上游调用：同一 key（供应商实例 / 店铺）同时进行中的调用不超过 limits[key]
+_Work = namedtuple('_Work', 'kind key fn args tasks')
+
+
+def _call_in_context(app, work):
+    with app.app_context():
+        try:
+            return work.fn(*work.args)
+        except Exception as e:
+            logger.exception(f'直充{work.kind}调用异常')
+            return e
+
+
+def _execute(app, works, limits):
+    """并发执行上游调用，返回 [(work, 结果或异常)]。"""
+    threads = int(app.config.get('DIRECT_CHARGE_THREADS', 16))
+    groups = OrderedDict()
+    for work in works:
+        groups.setdefault(work.key, deque()).append(work)
+
+    results = []
+    inflight = Counter()
+    futures = {}
+    with ThreadPoolExecutor(max_workers=threads, thread_name_prefix='direct-charge') as executor:
+        while groups or futures:
+            # 轮流从各 key 取调用提交，单个 key 并发不超过其上限
+            for key in list(groups):
+                queue = groups[key]
+                while queue and inflight[key] < limits.get(key, 1) and len(futures) < threads:
+                    work = queue.popleft()
+                    futures[executor.submit(_call_in_context, app, work)] = work
+                    inflight[key] += 1
+                if not queue:
+                    del groups[key]
+
+            done, _ = wait(futures, return_when=FIRST_COMPLETED)
+            for future in done:
+                work = futures.pop(future)
+                inflight[work.key] -= 1
+                results.append((work, future.result()))
+    return results
+
+
+# ---- 回写 ----
+
+def _add_event(order, event_type, desc, result, data=None):
+    db.session.add(OrderEvent(
+        order_id=order.id, order_no=order.order_no, event_type=event_type, event_desc=desc,
+        event_data=json.dumps(data, ensure_ascii=False) if data else None,
+        operator='system', result=result,
+    ))
+
+
+def _finish(task, order, status, message, now):
+    task.status = status
+    task.last_error = (message or '')[:500]
+    task.finish_time = now
+    task.locked_by = None
+    task.locked_at = None
+    if status == DirectChargeTask.STATUS_FAILED and order is not None:
+        if order.order_status in (0, ORDER_PROCESSING):
+            order.order_status = ORDER_ERROR
+        _add_event(order, 'error', f'直充失败（{task.supplier}）：{message}', 'failed',
+                   {'task_id': task.id, 'attempts': task.attempts})
+
+
+def _apply_result(task, order, result, poll_interval, now, max_polls=None):
+    """回写一次提交 / 查询结果，返回是否充值成功。"""
+    task.locked_by = None
+    task.locked_at = None
+    if result.supplier_order_no:
+        task.supplier_order_no = result.supplier_order_no
+    task.last_error = (result.message or '')[:500]
+
+    if result.state == SUCCESS:
+        _finish(task, order, DirectChargeTask.STATUS_SUCCESS, result.message, now)
+        _add_event(order, 'direct_charge', f'直充成功（{task.supplier}）：{result.message}', 'success',
+                   {'task_id': task.id, 'supplier_order_no': task.supplier_order_no})
+        return True
+    if result.state == FAILED:
+        _finish(task, order, DirectChargeTask.STATUS_FAILED, result.message, now)
+        return False
+    if result.state == NOT_FOUND:
+        if task.attempts >= task.max_attempts:
+            _finish(task, order, DirectChargeTask.STATUS_FAILED,
+                    f'上游无此订单，已提交{task.attempts}次：{result.message}', now)
+        else:
+            task.status = DirectChargeTask.STATUS_PENDING
+            task.next_run_time = now
+        return False
+    # PROCESSING / UNKNOWN：等待下次查询，超过查询次数上限时交给人工处理
+    if max_polls and task.polls >= max_polls:
+        _finish(task, order, DirectChargeTask.STATUS_FAILED,
+                f'已查询{task.polls}次仍未确认充值结果，请到上游核实：{result.message}', now)
+        return False
+    task.status = DirectChargeTask.STATUS_CHARGING
+    task.next_run_time = now + timedelta(seconds=poll_interval)
+    return False
+
+
+def _snapshot(cls, obj, **extra):
+    return cls(**{f: extra[f] if f in extra else getattr(obj, f) for f in cls._fields})
+
+
+def _request(order, config, task):
+    return ChargeRequest(
+        order_no=order.order_no, jd_order_no=order.jd_order_no, account=order.produce_account,
+        quantity=order.quantity or 1, amount=order.amount, sku_id=order.sku_id,
+        product_code=config.get('product_code'), supplier_order_no=task.supplier_order_no,
+    )
+
+
+def _resolve(task, product, engine):
+    """返回 (实例标识, 适配器, 配置) 或错误信息。"""
+    if product is None or product.deliver_type != 2:
+        return '商品配置不存在或已不是直充商品'
+    if get_supplier(product.direct_charge_api_type) is None:
+        return f'未知的直充供应商类型：{product.direct_charge_api_type}'
+    config, error = parse_config(product.direct_charge_api_config)
+    if error:
+        return error
+    key, adapter = engine.supplier(product.direct_charge_api_type, config)
+    return key, adapter, config
+
+
+def run_direct_charge_cycle(limit=None):
+    """提交 / 查询一批到期的直充任务并回调京东（需在应用上下文中调用）。
+
+    Returns:
+        Counter: submitted / polled / succeeded / failed / notified
+    """
+    app = current_app._get_current_object()
+    engine = get_direct_charge_engine()
+    if limit is None:
+        limit = int(app.config.get('DIRECT_CHARGE_BATCH_SIZE', 200))
+    now = datetime.now()
+    stats = Counter()
+    submits, polls = _claim(limit, uuid.uuid4().hex, now)
+    if not submits and not polls:
+        return stats
+
+    tasks = submits + polls
+    orders = {o.id: o for o in Order.query.filter(Order.id.in_({t.order_id for t in tasks}))}
+    products = {p.id: p for p in Product.query.filter(Product.id.in_({t.product_id for t in tasks if t.product_id}))}
+
+    works = []
+    limits = {}
+    adapters = {}
+    query_groups = OrderedDict()
+    for task in tasks:
+        order = orders.get(task.order_id)
+        resolved = _resolve(task, products.get(task.product_id), engine) if order is not None else '订单不存在'
+        if isinstance(resolved, str):
+            _finish(task, order, DirectChargeTask.STATUS_FAILED, resolved, now)
+            stats['failed'] += 1
+            continue
+        if task.status == DirectChargeTask.STATUS_SUBMITTING and order.order_status not in (0, ORDER_PROCESSING):
+            _finish(task, order, DirectChargeTask.STATUS_FAILED,
+                    f'订单状态为{order.order_status_label}，不再提交', now)
+            stats['failed'] += 1
+            continue
+        key, adapter, config = resolved
+        limits[key] = adapter.max_concurrency
+        adapters[key] = adapter
+        request = _request(order, config, task)
+        if task.status == DirectChargeTask.STATUS_SUBMITTING:
+            works.append(_Work('submit', key, adapter.submit, (request,), [task]))
+            if task.submit_time is None:
+                task.submit_time = now
+            if order.order_status == 0:
+                order.order_status = ORDER_PROCESSING
+        else:
+            query_groups.setdefault(key, []).append((task, request))
+    for key, items in query_groups.items():
+        size = adapters[key].query_batch_size
+        for start in range(0, len(items), size):
+            chunk = items[start:start + size]
+            works.append(_Work('query', key, adapters[key].query, ([r for _, r in chunk],), [t for t, _ in chunk]))
+    db.session.commit()
+
+    succeeded = []
+    now = datetime.now()
+    max_polls = int(app.config.get('DIRECT_CHARGE_MAX_POLLS', 360))
+    for work, outcome in _execute(app, works, limits):
+        poll_interval = adapters[work.key].poll_interval
+        if work.kind == 'submit':
+            stats['submitted'] += 1
+            result = outcome if isinstance(outcome, ChargeResult) else ChargeResult(UNKNOWN, None, f'提交异常：{outcome}')
+            pairs = [(work.tasks[0], result)]
+        else:
+            stats['polled'] += len(work.tasks)
+            if isinstance(outcome, Exception):
+                outcome = {}
+            pairs = [(t, outcome.get(orders[t.order_id].order_no) or ChargeResult(PROCESSING, None, '查询无结果'))
+                     for t in work.tasks]
+        for task, result in pairs:
+            order = orders[task.order_id]
+            if _apply_result(task, order, result, poll_interval, now, max_polls):
+                succeeded.append(task)
+            elif task.status == DirectChargeTask.STATUS_FAILED:
+                stats['failed'] += 1
+    stats['succeeded'] += len(succeeded)
+    db.session.commit()
+
+    if succeeded:
+        stats['notified'] = _notify_jd(app, succeeded, orders)
+    logger.info(f'直充：提交{stats["submitted"]}单，查询{stats["polled"]}单，'
+                f'成功{stats["succeeded"]}单，失败{stats["failed"]}单')
+    return stats
+
+
+def _notify_jd(app, tasks, orders):
+    """并发回调京东充值成功，返回回调成功数。"""
+    shop_limit = int(app.config.get('DIRECT_CHARGE_CALLBACK_SHOP_CONCURRENCY', 2))
+    shops = {s.id: s for s in Shop.query.filter(Shop.id.in_({t.shop_id for t in tasks}))}
+    works = []
+    for task in tasks:
+        order = orders[task.order_id]
+        shop = shops.get(order.shop_id)
+        # 操作员已手动通知成功的订单不再回调
+        if shop is None or (order.order_status == ORDER_DONE and order.notify_status == NOTIFY_STATUS_SUCCESS):
+            continue
+        works.append(_Work('callback', shop.id, send_callback,
+                           (_snapshot(ShopSnapshot, shop),
+                            _snapshot(OrderSnapshot, order, card_info_parsed=order.card_info_parsed), 'deliver'),
+                           [task]))
+
+    notified = 0
+    for work, outcome in _execute(app, works, {key: shop_limit for key in shops}):
+        ok, msg = outcome if isinstance(outcome, tuple) else (False, f'回调异常：{outcome}')
+        order = orders[work.tasks[0].order_id]
+        now = datetime.now()
+        if ok:
+            order.order_status = ORDER_DONE
+            order.notify_status = NOTIFY_STATUS_SUCCESS
+            order.notify_time = now
+            order.deliver_time = order.deliver_time or now
+            _add_event(order, 'notify_success', f'直充成功自动通知京东：{msg}', 'success')
+            notified += 1
+        else:
+            order.notify_status = NOTIFY_STATUS_FAILED
+            _add_event(order, 'error', f'直充成功但通知京东失败：{msg}', 'failed')
+            enqueue_callback(order, 'deliver', msg)
+    db.session.commit()
+    return notified
+
+
+def schedule_direct_charge(scheduler, app):
+    """在 worker.py 的定时任务中登记直充任务的提交与查询。"""
+
+    def _run():
+        with app.app_context():
+            try:
+                run_direct_charge_cycle()
+            finally:
+                db.session.remove()
+
+    scheduler.add_job(
+        _run, 'interval',
+        seconds=app.config.get('DIRECT_CHARGE_INTERVAL', 2),
+        id='direct_charge', max_instances=1, coalesce=True,
+    )
@@ -0,0 +1,285 @@
+"""直充上游供应商适配器。
+
+商品的 direct_charge_api_type 选择供应商类型，direct_charge_api_config（JSON）为供应商配置。
+每种供应商实现一个 DirectChargeSupplier 子类并用 @register_supplier 登记：
+
+- submit(request)：提交一笔充值，返回 ChargeResult
+- query(requests)：批量查询充值结果，返回 {订单号: ChargeResult}，上游没有该订单时返回
+  NOT_FOUND（引擎据此重新提交）
+
+结果状态：
+- PROCESSING：上游已受理，等待查询结果
+- SUCCESS / FAILED：充值成功 / 上游明确失败
+- UNKNOWN：提交超时或网络异常，不确定上游是否受理（引擎改为查询，避免重复充值）
+- NOT_FOUND：查询时上游没有该订单
+
+适配器方法在引擎的线程中执行，只能使用请求快照和自身的 HTTP 客户端，不访问数据库。
+模拟供应商（test_only）只在 TESTING 或 DIRECT_CHARGE_MOCK_ENABLED 时可选、可用。
+所有供应商都按我方订单号（order_no）作为商户订单号提交，上游据此去重。
+"""
+import hashlib
+import json
+import logging
+import threading
+import time
+from collections import deque, namedtuple
+
+import requests
+from flask import current_app
+
+from app.services.http_client import HttpClient
+
+logger = logging.getLogger(__name__)
+
+PROCESSING = 'processing'
+SUCCESS = 'success'
+FAILED = 'failed'
+UNKNOWN = 'unknown'
+NOT_FOUND = 'not_found'
+
+# 一笔充值请求（订单快照，在线程中使用）
+ChargeRequest = namedtuple('ChargeRequest',
+                           'order_no jd_order_no account quantity amount sku_id product_code supplier_order_no')
+
+ChargeResult = namedtuple('ChargeResult', 'state supplier_order_no message')
+
+# 商品级配置字段，其余字段为供应商级配置（相同的供应商级配置共用一个连接池和并发上限）
+PRODUCT_FIELDS = ('product_code',)
+
+SUPPLIERS = {}
+
+
+def register_supplier(cls):
+    """登记供应商适配器（类装饰器，按 cls.name 登记）。"""
+    SUPPLIERS[cls.name] = cls
+    return cls
+
+
+def _allowed(cls):
+    if not cls.test_only:
+        return True
+    config = current_app.config
+    return bool(config.get('TESTING') or config.get('DIRECT_CHARGE_MOCK_ENABLED'))
+
+
+def get_supplier(api_type):
+    """按类型返回可用的供应商适配器类，未知类型或当前环境不可用时返回 None。"""
+    cls = SUPPLIERS.get(api_type or '')
+    if cls is None or not _allowed(cls):
+        return None
+    return cls
+
+
+def supplier_choices():
+    """可选的供应商类型 [(类型, 名称)]。"""
+    return [(name, cls.label) for name, cls in SUPPLIERS.items() if _allowed(cls)]
+
+
+class DirectChargeSupplier:
+    """供应商适配器基类。
+
+    供应商级通用配置：
+        max_concurrency: 同时进行中的请求数上限（也是连接池大小）
+        query_batch_size: 每次批量查询的订单数
+        poll_interval: 充值中订单的查询间隔（秒）
+        timeout: [连接超时, 读取超时]（秒）
+    """
+    name = None
+    label = None
+    test_only = False
+
+    def __init__(self, config, defaults=None):
+        defaults = defaults or {}
+        self.config = config
+        self.max_concurrency = max(int(config.get('max_concurrency') or defaults.get('max_concurrency', 4)), 1)
+        self.query_batch_size = max(int(config.get('query_batch_size') or defaults.get('query_batch_size', 50)), 1)
+        self.poll_interval = max(int(config.get('poll_interval') or defaults.get('poll_interval', 10)), 1)
+        timeout = tuple(config.get('timeout') or defaults.get('timeout', (3, 15)))
+        # 每个供应商独立的连接池，大小与并发上限一致
+        self.http = HttpClient(pool_connections=2, pool_maxsize=self.max_concurrency,
+                               retries=int(defaults.get('retries', 1)), timeouts={self.name: timeout})
+
+    @classmethod
+    def validate(cls, config):
+        """检查商品配置，返回错误信息（无错误返回 None）。"""
+        return None
+
+    def submit(self, request):
+        raise NotImplementedError
+
+    def query(self, requests_):
+        raise NotImplementedError
+
+    def close(self):
+        self.http.close()
+
+
+@register_supplier
+class MockSupplier(DirectChargeSupplier):
+    """本地模拟供应商（测试 / 联调使用，不发出网络请求）。
+
+    配置：
+        result: 最终结果 success / failed（默认 success）
+        pending_polls: 提交后需要查询几次才出结果（默认 0，提交即返回结果）
+        fail_accounts: 直接返回失败的充值账号列表
+        delay_ms: 每次调用的模拟耗时（毫秒）
+    """
+    name = 'mock'
+    label = '模拟供应商（测试）'
+    test_only = True
+
+    CALL_LOG_SIZE = 1000
+
+    def __init__(self, config, defaults=None):
+        super().__init__(config, defaults)
+        self._orders = {}  # 订单号 -> 剩余查询次数
+        self._lock = threading.Lock()
+        self.calls = deque(maxlen=self.CALL_LOG_SIZE)  # 最近的调用 [(方法, 订单号列表)]
+
+    def _sleep(self):
+        delay = float(self.config.get('delay_ms') or 0)
+        if delay:
+            time.sleep(delay / 1000)
+
+    def _final(self, request):
+        if request.account in (self.config.get('fail_accounts') or []):
+            return ChargeResult(FAILED, f'MOCK{request.order_no}', '账号不存在')
+        if self.config.get('result', SUCCESS) == FAILED:
+            return ChargeResult(FAILED, f'MOCK{request.order_no}', '充值失败')
+        return ChargeResult(SUCCESS, f'MOCK{request.order_no}', '充值成功')
+
+    def submit(self, request):
+        self._sleep()
+        with self._lock:
+            self.calls.append(('submit', [request.order_no]))
+            pending = int(self.config.get('pending_polls') or 0)
+            self._orders[request.order_no] = pending
+        if pending:
+            return ChargeResult(PROCESSING, f'MOCK{request.order_no}', '充值中')
+        return self._final(request)
+
+    def query(self, requests_):
+        self._sleep()
+        results = {}
+        with self._lock:
+            self.calls.append(('query', [r.order_no for r in requests_]))
+            for request in requests_:
+                if request.order_no not in self._orders:
+                    results[request.order_no] = ChargeResult(NOT_FOUND, None, '订单不存在')
+                    continue
+                remaining = max(self._orders[request.order_no] - 1, 0)
+                self._orders[request.order_no] = remaining
+                if remaining:
+                    results[request.order_no] = ChargeResult(PROCESSING, f'MOCK{request.order_no}', '充值中')
+                else:
+                    results[request.order_no] = self._final(request)
+        return results
+
+
+@register_supplier
+class HttpJsonSupplier(DirectChargeSupplier):
+    """通用 JSON 接口供应商（MD5 签名）。
+
+    配置：
+        submit_url / query_url: 下单 / 批量查单地址
+        app_key / secret: 商户号 / 签名密钥
+        product_code: 上游商品编码（商品级）
+
+    签名：参数按 key 升序拼接 key=value&...，末尾追加 &key=secret，MD5 大写。
+    下单返回 {"code": 0, "status": "success|processing|failed", "supplierOrderNo": "", "message": ""}；
+    查单请求 orderNos 为逗号分隔的订单号，返回 {"code": 0, "orders": [{"orderNo", "status",
+    "supplierOrderNo", "message"}]}，未返回的订单视为不存在。
+    """
+    name = 'http_json'
+    label = '通用JSON接口'
+
+    REQUIRED = ('submit_url', 'query_url', 'app_key', 'secret', 'product_code')
+
+    @classmethod
+    def validate(cls, config):
+        missing = [k for k in cls.REQUIRED if not config.get(k)]
+        if missing:
+            return f'缺少配置项：{", ".join(missing)}'
+        return None
+
+    def _sign(self, params):
+        text = '&'.join(f'{k}={params[k]}' for k in sorted(params) if params[k] not in (None, ''))
+        return hashlib.md5(f'{text}&key={self.config["secret"]}'.encode('utf-8')).hexdigest().upper()
+
+    def _post(self, url, params):
+        params = dict(params, appKey=self.config['app_key'], timestamp=str(int(time.time())))
+        params['sign'] = self._sign(params)
+        resp = self.http.post(self.name, url, json=params)
+        resp.raise_for_status()
+        return resp.json()
+
+    @staticmethod
+    def _state(status):
+        return {'success': SUCCESS, 'processing': PROCESSING, 'failed': FAILED}.get(str(status).lower(), PROCESSING)
+
+    def submit(self, request):
+        params = {
+            'orderNo': request.order_no,
+            'productCode': request.product_code,
+            'account': request.account or '',
+            'quantity': str(request.quantity),
+            'amount': str(request.amount),
+        }
+        try:
+            data = self._post(self.config['submit_url'], params)
+        except (requests.exceptions.RequestException, ValueError) as e:
+            # 超时 / 连接中断时不确定上游是否已受理，交给查询确认
+            return ChargeResult(UNKNOWN, None, f'提交异常：{e}')
+        if str(data.get('code')) != '0':
+            return ChargeResult(FAILED, data.get('supplierOrderNo'), data.get('message') or f'上游拒绝：{data.get("code")}')
+        return ChargeResult(self._state(data.get('status')), data.get('supplierOrderNo'), data.get('message') or '')
+
+    def query(self, requests_):
+        try:
+            data = self._post(self.config['query_url'], {'orderNos': ','.join(r.order_no for r in requests_)})
+        except (requests.exceptions.RequestException, ValueError) as e:
+            return {r.order_no: ChargeResult(PROCESSING, r.supplier_order_no, f'查询异常：{e}') for r in requests_}
+        if str(data.get('code')) != '0':
+            message = data.get('message') or f'查询失败：{data.get("code")}'
+            return {r.order_no: ChargeResult(PROCESSING, r.supplier_order_no, message) for r in requests_}
+        found = {str(item.get('orderNo')): item for item in data.get('orders') or []}
+        results = {}
+        for request in requests_:
+            item = found.get(request.order_no)
+            if item is None:
+                results[request.order_no] = ChargeResult(NOT_FOUND, None, '上游无此订单')
+            else:
+                results[request.order_no] = ChargeResult(self._state(item.get('status')),
+                                                         item.get('supplierOrderNo') or request.supplier_order_no,
+                                                         item.get('message') or '')
+        return results
+
+
+def parse_config(raw):
+    """解析商品的直充配置 JSON，返回 (配置, 错误信息)。"""
+    if not raw:
+        return {}, None
+    try:
+        config = json.loads(raw)
+    except ValueError as e:
+        return None, f'直充配置不是有效的JSON：{e}'
+    if not isinstance(config, dict):
+        return None, '直充配置必须是JSON对象'
+    return config, None
+
+
+def validate_product_config(api_type, raw):
+    """检查商品的直充供应商类型与配置，返回错误信息（无错误返回 None）。"""
+    cls = get_supplier(api_type)
+    if cls is None:
+        return f'未知的直充供应商类型：{api_type or "未选择"}'
+    config, error = parse_config(raw)
+    if error:
+        return error
+    return cls.validate(config)
+
+
+def supplier_key(api_type, config):
+    """供应商实例标识：类型 + 供应商级配置（不含商品级字段）。"""
+    shared = {k: v for k, v in config.items() if k not in PRODUCT_FIELDS}
+    return f'{api_type}:{json.dumps(shared, sort_keys=True, ensure_ascii=False)}'
@@ -0,0 +1,290 @@
+"""发货任务队列服务。
+
+推单接口不再同步调用 91卡券提卡（30秒超时）和京东发卡回调（10秒超时），
+而是把 FulfillmentJob 与订单写在同一事务中立即应答京东；
+独立的发货 worker 进程（python worker.py）轮询领取任务并执行。
+
+- 领取：条件 UPDATE（status=0 -> 1），多个 worker 进程并发领取互不重复
+- 限流：单个 worker 进程内每个店铺最多 FULFILLMENT_SHOP_CONCURRENCY 个任务同时执行
+- 幂等：提卡使用订单号作为 handPickOrderId，重试时 91卡券返回同一批卡密；
+  卡密已保存的订单重试时只补发回调，不再提卡
+- 重试：按 RETRY_DELAYS 退避，超过最大次数置为失败并记录错误事件
+- 事件：沿用 card91_fetch / card91_deliver / error 订单事件
+- 卡密已提取但回调多次失败的任务转入回调发件箱（callback_outbox）继续重发
+"""
+import json
+import logging
+import os
+import signal
+import socket
+import threading
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+from app.extensions import db
+from app.models.fulfillment_job import FulfillmentJob
+from app.models.order_event import OrderEvent
+from app.models.product import Product
+from app.models.shop import Shop
+from app.services.callback_outbox import enqueue_callback
+from app.services.card91 import card91_auto_deliver
+from app.services.card_pool import claim_pool_cards
+from app.services.jd_game import callback_game_card_deliver
+from app.services.jd_general import callback_general_card_deliver
+from app.services.product_router import get_product_router
+
+logger = logging.getLogger(__name__)
+
+# 第N次失败后的等待秒数
+RETRY_DELAYS = [10, 30, 60, 300, 900]
+
+# 执行中的任务超过该时间未完成视为 worker 已崩溃，重新放回队列（秒）
+LOCK_TIMEOUT = 300
+
+
+def find_card91_product(shop_id, sku_id):
+    """按 shop_id + sku_id 匹配启用的91卡券商品配置（路由表快照，不查询数据库）。"""
+    return get_product_router().by_sku(shop_id, sku_id)
+
+
+def build_card91_job(order, shop, product, max_attempts=None):
+    """构建91卡券发货任务（由调用方与订单一起提交）。"""
+    from flask import current_app
+    if max_attempts is None:
+        max_attempts = current_app.config.get('FULFILLMENT_MAX_ATTEMPTS', 5)
+    return FulfillmentJob(
+        order=order,
+        shop_id=shop.id,
+        product_id=product.id if product else None,
+        job_type='card91_deliver',
+        status=FulfillmentJob.STATUS_PENDING,
+        max_attempts=max_attempts,
+        next_run_time=datetime.now(),
+    )
+
+
+def _add_event(order, event_type, desc, result, data=None):
+    db.session.add(OrderEvent(
+        order_id=order.id,
+        order_no=order.order_no,
+        event_type=event_type,
+        event_desc=desc,
+        event_data=json.dumps(data, ensure_ascii=False) if data else None,
+        result=result,
+    ))
+
+
+# ---- 领取 ----
+
+def claim_jobs(worker_id, limit, inflight=None, shop_limit=2):
+    """领取最多 limit 个到期任务。
+
+    Args:
+        worker_id: worker 标识
+        limit: 本次最多领取数量
+        inflight: 本进程各店铺正在执行的任务数 {shop_id: n}
+        shop_limit: 单店铺并发上限
+
+    Returns:
+        list[(job_id, shop_id)]
+    """
+    if limit <= 0:
+        return []
+    now = datetime.now()
+    per_shop = Counter(inflight or {})
+
+    # 回收超时任务
+    FulfillmentJob.query.filter(
+        FulfillmentJob.status == FulfillmentJob.STATUS_RUNNING,
+        FulfillmentJob.locked_at < now - timedelta(seconds=LOCK_TIMEOUT),
+    ).update({'status': FulfillmentJob.STATUS_PENDING}, synchronize_session=False)
+
+    candidates = db.session.query(FulfillmentJob.id, FulfillmentJob.shop_id).filter(
+        FulfillmentJob.status == FulfillmentJob.STATUS_PENDING,
+        FulfillmentJob.next_run_time <= now,
+    ).order_by(FulfillmentJob.id).limit(limit * 4).all()
+
+    claimed = []
+    for job_id, shop_id in candidates:
+        if len(claimed) >= limit:
+            break
+        if per_shop[shop_id] >= shop_limit:
+            continue
+        updated = FulfillmentJob.query.filter_by(
+            id=job_id, status=FulfillmentJob.STATUS_PENDING,
+        ).update({
+            'status': FulfillmentJob.STATUS_RUNNING,
+            'locked_by': worker_id,
+            'locked_at': now,
+            'attempts': FulfillmentJob.attempts + 1,
+        }, synchronize_session=False)
+        if updated:
+            claimed.append((job_id, shop_id))
+            per_shop[shop_id] += 1
+    db.session.commit()
+    return claimed
+
+
+# ---- 执行 ----
+
+def _deliver_card91(job):
+    """执行91卡券发货，返回 (是否成功, 消息)。"""
+    order = job.order
+    shop = db.session.get(Shop, job.shop_id)
+    if not order or not shop:
+        return False, '订单或店铺不存在'
+
+    if order.order_status == 2 and order.notify_status == 1:
+        return True, '订单已发货'
+
+    cards = order.card_info_parsed
+    if not cards:
+        product = db.session.get(Product, job.product_id) if job.product_id else None
+        detail = {}
+        # 优先从本地库存领取（与保存卡密同一事务提交），库存不足时远程提卡
+        cards = claim_pool_cards(product, order)
+        if cards is not None:
+            ok, msg = True, f'本地库存发卡{len(cards)}张'
+            detail['source'] = 'pool'
+        else:
+            ok, msg, cards = card91_auto_deliver(shop, order, product, detail=detail)
+        _add_event(order, 'card91_fetch', f'91卡券自动提卡：{msg}', 'success' if ok else 'failed',
+                   dict(detail, attempt=job.attempts, quantity=order.quantity))
+        if not ok:
+            db.session.commit()
+            return False, msg
+        # 先保存卡密，回调失败重试时不再重复提卡
+        order.set_card_info(cards)
+        db.session.commit()
+
+    if shop.shop_type == 1:
+        success, callback_msg = callback_game_card_deliver(shop, order, cards)
+    else:
+        success, callback_msg = callback_general_card_deliver(shop, order, cards)
+
+    if success:
+        order.order_status = 2
+        order.deliver_time = datetime.now()
+        order.notify_status = 1
+        order.notify_time = datetime.now()
+        _add_event(order, 'card91_deliver', f'91卡券自动发卡成功，共{len(cards)}张', 'success')
+        db.session.commit()
+        logger.info(f"订单 {order.order_no} 91卡券自动发货完成")
+        return True, callback_msg
+
+    order.notify_status = 2
+    _add_event(order, 'error', f'91卡券发卡回调失败：{callback_msg}', 'failed')
+    db.session.commit()
+    return False, callback_msg
+
+
+JOB_HANDLERS = {
+    'card91_deliver': _deliver_card91,
+}
+
+
+def run_job(job_id):
+    """执行一个已领取的任务并更新任务状态（需在应用上下文中调用）。"""
+    job = db.session.get(FulfillmentJob, job_id)
+    if not job:
+        return False
+    handler = JOB_HANDLERS.get(job.job_type)
+    try:
+        if handler is None:
+            ok, msg = False, f'未知任务类型：{job.job_type}'
+        else:
+            ok, msg = handler(job)
+    except Exception as e:
+        db.session.rollback()
+        logger.exception(f'发货任务 {job_id} 执行异常')
+        job = db.session.get(FulfillmentJob, job_id)
+        ok, msg = False, f'执行异常：{e}'
+
+    job.locked_by = None
+    job.locked_at = None
+    if ok:
+        job.status = FulfillmentJob.STATUS_DONE
+        job.last_error = None
+    elif job.attempts >= job.max_attempts:
+        job.status = FulfillmentJob.STATUS_FAILED
+        job.last_error = str(msg)[:500]
+        if job.order:
+            _add_event(job.order, 'error', f'自动发货失败（已重试{job.attempts}次）：{msg}', 'failed')
+            # 卡密已提取、仅回调失败的订单交给回调发件箱继续重发
+            if job.order.card_info_parsed:
+                enqueue_callback(job.order, 'deliver', msg)
+    else:
+        delay = RETRY_DELAYS[min(job.attempts, len(RETRY_DELAYS)) - 1]
+        job.status = FulfillmentJob.STATUS_PENDING
+        job.next_run_time = datetime.now() + timedelta(seconds=delay)
+        job.last_error = str(msg)[:500]
+    db.session.commit()
+    return ok
+
+
+def run_pending_jobs(app, limit=100, worker_id='inline'):
+    """在当前线程中同步执行所有到期任务（运维脚本/测试使用）。"""
+    with app.app_context():
+        claimed = claim_jobs(worker_id, limit, shop_limit=limit)
+        for job_id, _ in claimed:
+            run_job(job_id)
+        return len(claimed)
+
+
+def _run_job_in_context(app, job_id):
+    with app.app_context():
+        try:
+            run_job(job_id)
+        finally:
+            db.session.remove()
+
+
+def run_worker(app):
+    """发货 worker 主循环（python worker.py 启动）。"""
+    threads = int(app.config.get('FULFILLMENT_WORKER_THREADS', 8))
+    shop_limit = int(app.config.get('FULFILLMENT_SHOP_CONCURRENCY', 2))
+    poll_interval = float(app.config.get('FULFILLMENT_POLL_INTERVAL', 1.0))
+    worker_id = f'{socket.gethostname()}:{os.getpid()}'
+
+    stop = threading.Event()
+    inflight = Counter()
+    inflight_lock = threading.Lock()
+
+    def _stop(signum, frame):
+        logger.info(f'发货worker收到信号 {signum}，等待执行中的任务完成后退出')
+        stop.set()
+
+    signal.signal(signal.SIGTERM, _stop)
+    signal.signal(signal.SIGINT, _stop)
+
+    logger.info(f'发货worker启动：{worker_id}，线程数={threads}，单店并发={shop_limit}')
+    with ThreadPoolExecutor(max_workers=threads, thread_name_prefix='fulfillment') as executor:
+        while not stop.is_set():
+            with inflight_lock:
+                snapshot = dict(inflight)
+            free = threads - sum(snapshot.values())
+            claimed = []
+            if free > 0:
+                try:
+                    with app.app_context():
+                        claimed = claim_jobs(worker_id, free, snapshot, shop_limit)
+                        db.session.remove()
+                except Exception as e:
+                    logger.error(f'领取发货任务失败: {e}')
+
+            for job_id, shop_id in claimed:
+                with inflight_lock:
+                    inflight[shop_id] += 1
+
+                def _release(_future, shop_id=shop_id):
+                    with inflight_lock:
+                        inflight[shop_id] -= 1
+                        if inflight[shop_id] <= 0:
+                            del inflight[shop_id]
+
+                executor.submit(_run_job_in_context, app, job_id).add_done_callback(_release)
+
+            if not claimed:
+                stop.wait(poll_interval)
+    logger.info('发货worker已退出')
@@ -0,0 +1,186 @@
+"""出站 HTTP 客户端。
+
+京东回调、91卡券提卡、阿奇索接口、钉钉/企业微信通知过去都直接调用
+requests.post，每次请求都要重新建立 TCP+TLS 连接。这里提供一个进程内共享的
+requests.Session：
+
+- 按主机复用 keep-alive 连接池（HTTP_POOL_CONNECTIONS 个主机池，每池 HTTP_POOL_MAXSIZE 个连接）
+- 按集成配置连接/读取超时（HTTP_TIMEOUTS，如 jd_game=(3, 10)）
+- 连接被重置/断开（复用到服务端已关闭的空闲连接）时自动重试 HTTP_RETRIES 次；
+  读取超时不重试，避免重复回调
+- 按主机统计请求数、错误数、重试数和耗时（stats()）
+
+各服务通过 http_post(integration, url, ...) 发送请求。
+"""
+import logging
+import os
+import threading
+import time
+from collections import deque
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+logger = logging.getLogger(__name__)
+
+# (连接超时, 读取超时) 秒
+DEFAULT_TIMEOUTS = {
+    'jd_game': (3, 10),
+    'jd_general': (3, 10),
+    'card91': (5, 30),
+    'agiso': (5, 30),
+    'notification': (3, 10),
+}
+DEFAULT_TIMEOUT = (5, 30)
+
+# 每个主机保留最近多少次耗时用于计算 p95
+LATENCY_SAMPLES = 200
+
+
+class _HostStats:
+    __slots__ = ('requests', 'errors', 'retries', 'total_ms', 'max_ms', 'samples')
+
+    def __init__(self):
+        self.requests = 0
+        self.errors = 0
+        self.retries = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+        self.samples = deque(maxlen=LATENCY_SAMPLES)
+
+    def to_dict(self):
+        samples = sorted(self.samples)
+        p95 = samples[min(len(samples) - 1, int(len(samples) * 0.95))] if samples else 0
+        return {
+            'requests': self.requests,
+            'errors': self.errors,
+            'retries': self.retries,
+            'avg_ms': round(self.total_ms / self.requests, 2) if self.requests else 0,
+            'p95_ms': round(p95, 2),
+            'max_ms': round(self.max_ms, 2),
+        }
+
+
+class HttpClient:
+    """共享连接池的出站 HTTP 客户端。"""
+
+    def __init__(self, pool_connections=20, pool_maxsize=20, retries=2, timeouts=None):
+        self.pool_connections = pool_connections
+        self.pool_maxsize = pool_maxsize
+        self.retries = retries
+        self.timeouts = dict(DEFAULT_TIMEOUTS)
+        self.timeouts.update(timeouts or {})
+        self._session = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self._stats = {}
+
+    @classmethod
+    def from_config(cls, config):
+        return cls(
+            pool_connections=int(config.get('HTTP_POOL_CONNECTIONS', 20)),
+            pool_maxsize=int(config.get('HTTP_POOL_MAXSIZE', 20)),
+            retries=int(config.get('HTTP_RETRIES', 2)),
+            timeouts=config.get('HTTP_TIMEOUTS'),
+        )
+
+    @property
+    def session(self):
+        # gunicorn fork 后不能复用父进程的连接
+        if self._session is None or self._pid != os.getpid():
+            with self._lock:
+                if self._session is None or self._pid != os.getpid():
+                    session = requests.Session()
+                    adapter = HTTPAdapter(pool_connections=self.pool_connections,
+                                          pool_maxsize=self.pool_maxsize)
+                    session.mount('http://', adapter)
+                    session.mount('https://', adapter)
+                    self._session = session
+                    self._pid = os.getpid()
+                    self._stats = {}
+        return self._session
+
+    def timeout_for(self, integration):
+        return self.timeouts.get(integration, DEFAULT_TIMEOUT)
+
+    def _host_stats(self, url):
+        host = urlsplit(url).netloc or url
+        stats = self._stats.get(host)
+        if stats is None:
+            with self._lock:
+                stats = self._stats.setdefault(host, _HostStats())
+        return stats
+
+    def request(self, integration, method, url, **kwargs):
+        """发送请求，连接被重置时重试。异常与 requests 保持一致。"""
+        kwargs.setdefault('timeout', self.timeout_for(integration))
+        session = self.session
+        stats = self._host_stats(url)
+        attempt = 0
+        start = time.perf_counter()
+        while True:
+            try:
+                resp = session.request(method, url, **kwargs)
+                break
+            except requests.exceptions.ConnectionError as e:
+                # 连接超时不重试（ConnectTimeout 同时也是 Timeout），避免请求耗时翻倍
+                if isinstance(e, requests.exceptions.Timeout) or attempt >= self.retries:
+                    self._record(stats, start, error=True, retries=attempt)
+                    raise
+                attempt += 1
+                logger.warning(f'[{integration}] 连接异常，第{attempt}次重试: {url} {e}')
+            except Exception:
+                self._record(stats, start, error=True, retries=attempt)
+                raise
+        self._record(stats, start, error=False, retries=attempt)
+        return resp
+
+    def post(self, integration, url, **kwargs):
+        return self.request(integration, 'POST', url, **kwargs)
+
+    def get(self, integration, url, **kwargs):
+        return self.request(integration, 'GET', url, **kwargs)
+
+    def _record(self, stats, start, error, retries):
+        elapsed = (time.perf_counter() - start) * 1000
+        with self._lock:
+            stats.requests += 1
+            stats.retries += retries
+            if error:
+                stats.errors += 1
+            stats.total_ms += elapsed
+            stats.max_ms = max(stats.max_ms, elapsed)
+            stats.samples.append(elapsed)
+
+    def stats(self):
+        """各主机的请求统计。"""
+        with self._lock:
+            return {host: s.to_dict() for host, s in self._stats.items()}
+
+    def close(self):
+        if self._session is not None:
+            self._session.close()
+            self._session = None
+
+
+# 无应用上下文时（脚本、单独线程）使用的默认客户端
+_default_client = HttpClient()
+
+
+def init_http_client(app):
+    client = HttpClient.from_config(app.config)
+    app.extensions['http_client'] = client
+    return client
+
+
+def get_http_client():
+    from flask import current_app, has_app_context
+    if has_app_context() and 'http_client' in current_app.extensions:
+        return current_app.extensions['http_client']
+    return _default_client
+
+
+def http_post(integration, url, **kwargs):
+    """通过共享连接池发送 POST 请求。"""
+    return get_http_client().post(integration, url, **kwargs)
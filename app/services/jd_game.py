@@ -10,9 +10,10 @@ import base64
 import hashlib
 import json
 import logging
-import requests
 from datetime import datetime
 
+from app.services.http_client import http_post
+
 logger = logging.getLogger(__name__)
 
 
@@ -130,7 +131,7 @@ def callback_game_direct_success(shop, order):
     params = _build_game_callback_params(shop, data_obj)
 
     try:
-        resp = requests.post(callback_url, data=params, timeout=10)
+        resp = http_post('jd_game', callback_url, data=params)
         result = resp.json()
         ret_code = str(result.get('retCode', ''))
         if ret_code == '100':
@@ -175,7 +176,7 @@ def callback_game_card_deliver(shop, order, cards):
     params = _build_game_callback_params(shop, data_obj)
 
     try:
-        resp = requests.post(callback_url, data=params, timeout=10)
+        resp = http_post('jd_game', callback_url, data=params)
         result = resp.json()
         ret_code = str(result.get('retCode', ''))
         if ret_code == '100':
@@ -217,7 +218,7 @@ def callback_game_refund(shop, order):
     params = _build_game_callback_params(shop, data_obj)
 
     try:
-        resp = requests.post(callback_url, data=params, timeout=10)
+        resp = http_post('jd_game', callback_url, data=params)
         result = resp.json()
         ret_code = str(result.get('retCode', ''))
         if ret_code == '100':
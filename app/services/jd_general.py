@@ -10,9 +10,10 @@ import base64
 import hashlib
 import json
 import logging
-import requests
 from datetime import datetime
 
+from app.services.http_client import http_post
+
 logger = logging.getLogger(__name__)
 
 try:
@@ -155,7 +156,7 @@ def callback_general_success(shop, order):
     params = _build_general_callback_params(shop, order, produce_status=1)
 
     try:
-        resp = requests.post(callback_url, data=params, timeout=10)
+        resp = http_post('jd_general', callback_url, data=params)
         result = resp.json()
         code = str(result.get('code', ''))
         if code == '0':
@@ -194,7 +195,7 @@ def callback_general_card_deliver(shop, order, cards):
     params = _build_general_callback_params(shop, order, produce_status=1, product_json=product_json)
 
     try:
-        resp = requests.post(callback_url, data=params, timeout=10)
+        resp = http_post('jd_general', callback_url, data=params)
         result = resp.json()
         code = str(result.get('code', ''))
         if code == '0':
@@ -226,7 +227,7 @@ def callback_general_refund(shop, order):
     params = _build_general_callback_params(shop, order, produce_status=2)
 
     try:
-        resp = requests.post(callback_url, data=params, timeout=10)
+        resp = http_post('jd_general', callback_url, data=params)
         result = resp.json()
         code = str(result.get('code', ''))
         if code == '0':
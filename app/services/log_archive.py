@@ -0,0 +1,289 @@
+"""日志表保留与冷归档。
+
+api_logs / order_events / notification_logs / operation_logs 只增不删。这里按月滚动归档：
+
+- 保留期由 LOG_RETENTION_DAYS 按表配置（0 表示不归档），早于
+  “(当前时间 - 保留天数) 所在月份第一天”的记录整月归档
+- 归档：按主键分批读取，按天追加写入 gzip 压缩的 JSONL 文件
+  {LOG_ARCHIVE_DIR}/{表名}/{YYYY-MM}/{表名}-{YYYY-MM-DD}.jsonl.gz，
+  文件 fsync 后再删除这一批并提交；中途中断重跑时可能重复追加，读取时按主键去重
+- 查询：后台日志页面 source=archive 时按日期范围流式读取归档文件（archive_paginate），
+  订单详情页在数据库中没有事件时读取归档的订单事件（archived_order_events）
+- worker.py 每天 LOG_ARCHIVE_HOUR 点执行一次，也可手动运行 python migrations/archive_logs.py
+
+这些表都有外键，MySQL 分区表不支持外键，因此没有使用 RANGE 分区，
+而是按主键分批读取、删除早于截止时间的记录（create_time 在入队时记录，主键在批量写入时分配，
+两者只是大致同序，读取归档时按主键归并各天的文件）。
+"""
+import gzip
+import heapq
+import json
+import logging
+import os
+from collections import deque
+from datetime import date, datetime, timedelta
+
+from flask import current_app
+from sqlalchemy import DateTime, Date
+from sqlalchemy.orm.attributes import set_committed_value
+
+from app.extensions import db
+from app.models.api_log import ApiLog
+from app.models.notification_log import NotificationLog
+from app.models.operation_log import OperationLog
+from app.models.order_event import OrderEvent
+from app.models.shop import Shop
+from app.utils.pagination import keyset_paginate_rows
+
+logger = logging.getLogger(__name__)
+
+ARCHIVE_MODELS = {
+    'api_logs': ApiLog,
+    'order_events': OrderEvent,
+    'notification_logs': NotificationLog,
+    'operation_logs': OperationLog,
+}
+
+# 归档页面未指定日期时显示最近一个归档日之前的天数
+DEFAULT_ARCHIVE_DAYS = 7
+
+# 订单详情最多向后查找多少天的归档事件
+ORDER_EVENT_SCAN_DAYS = 31
+
+
+def _archive_dir():
+    return current_app.config.get('LOG_ARCHIVE_DIR')
+
+
+def _month_start(dt):
+    return datetime(dt.year, dt.month, 1)
+
+
+def archive_cutoff(table, now=None):
+    """返回该表的归档截止时间（早于该时间的记录会被归档），未启用时返回 None。"""
+    days = (current_app.config.get('LOG_RETENTION_DAYS') or {}).get(table)
+    if not days:
+        return None
+    now = now or datetime.now()
+    return _month_start(now - timedelta(days=days))
+
+
+def archive_path(table, day):
+    return os.path.join(_archive_dir(), table, day.strftime('%Y-%m'), f'{table}-{day:%Y-%m-%d}.jsonl.gz')
+
+
+# ---- 序列化 ----
+
+def _encode(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    return value
+
+
+def _row_dict(table, row):
+    return {c.name: _encode(row._mapping[c]) for c in table.columns}
+
+
+def to_model(model, data):
+    """归档记录 -> 不关联 session 的模型实例（只读展示用）。"""
+    values = {}
+    for column in model.__table__.columns:
+        value = data.get(column.name)
+        if value is not None and isinstance(column.type, DateTime):
+            value = datetime.fromisoformat(value)
+        elif value is not None and isinstance(column.type, Date):
+            value = date.fromisoformat(value)
+        values[column.key] = value
+    return model(**values)
+
+
+def _write_batch(table, rows):
+    by_day = {}
+    for data in rows:
+        day = datetime.fromisoformat(data['create_time']).date() if data.get('create_time') else date(1970, 1, 1)
+        by_day.setdefault(day, []).append(data)
+    for day, items in by_day.items():
+        path = archive_path(table, day)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'ab') as raw:
+            with gzip.GzipFile(fileobj=raw, mode='ab') as gz:
+                for data in items:
+                    gz.write(json.dumps(data, ensure_ascii=False).encode('utf-8') + b'\n')
+            raw.flush()
+            os.fsync(raw.fileno())
+
+
+# ---- 归档 ----
+
+def archive_table(table, now=None, batch_size=None):
+    """归档一张表的过期记录，返回归档条数。"""
+    cutoff = archive_cutoff(table, now)
+    if cutoff is None or not _archive_dir():
+        return 0
+    batch_size = batch_size or current_app.config.get('LOG_ARCHIVE_BATCH_SIZE', 2000)
+    sa_table = ARCHIVE_MODELS[table].__table__
+
+    total = 0
+    last_id = 0
+    while True:
+        rows = db.session.execute(
+            sa_table.select()
+            .where(sa_table.c.id > last_id, sa_table.c.create_time < cutoff)
+            .order_by(sa_table.c.id)
+            .limit(batch_size)
+        ).all()
+        if not rows:
+            break
+        data = [_row_dict(sa_table, r) for r in rows]
+        ids = [r.id for r in rows]
+        _write_batch(table, data)
+        db.session.execute(sa_table.delete().where(sa_table.c.id.in_(ids)))
+        db.session.commit()
+        total += len(rows)
+        last_id = ids[-1]
+
+    if total:
+        logger.info(f'{table} 归档 {total} 条（早于 {cutoff:%Y-%m-%d}）')
+    return total
+
+
+def archive_expired(now=None):
+    """归档所有启用保留期的日志表，返回 {表名: 条数}。"""
+    result = {}
+    for table in ARCHIVE_MODELS:
+        try:
+            result[table] = archive_table(table, now)
+        except Exception as e:
+            db.session.rollback()
+            logger.exception(f'{table} 归档失败: {e}')
+            result[table] = 0
+    return result
+
+
+def schedule_log_archive(scheduler, app):
+    """在 worker.py 的定时任务中登记每日归档。"""
+
+    def _job():
+        with app.app_context():
+            try:
+                archive_expired()
+            finally:
+                db.session.remove()
+
+    scheduler.add_job(
+        _job, 'cron',
+        hour=app.config.get('LOG_ARCHIVE_HOUR', 3),
+        id='log_archive', max_instances=1, coalesce=True,
+    )
+
+
+# ---- 读取 ----
+
+def _iter_archive_file(path):
+    """读取一个归档文件，按主键去重。
+
+    每次归档按主键顺序追加，中断重跑只会重复追加上次未删除的那一批，因此文件内
+    跳过不大于已读最大主键的记录即可得到递增且不重复的序列。
+    """
+    last_id = 0
+    with gzip.open(path, 'rt', encoding='utf-8') as f:
+        for line in f:
+            if not line.strip():
+                continue
+            data = json.loads(line)
+            if data['id'] <= last_id:
+                continue
+            last_id = data['id']
+            yield data
+
+
+def iter_archive(table, start_day, end_day):
+    """按主键递增读取 [start_day, end_day] 的归档记录（dict），已去重。
+
+    create_time 在日志入队时记录、主键在批量写入时分配，且每个进程各有写入器，
+    跨天的记录主键不一定递增（例如 23:59:59 的记录主键大于次日 00:00:00 的记录），
+    因此各天的文件分别去重后按主键归并。
+    """
+    if not _archive_dir():
+        return
+    files = []
+    day = start_day
+    while day <= end_day:
+        path = archive_path(table, day)
+        if os.path.exists(path):
+            files.append(_iter_archive_file(path))
+        day += timedelta(days=1)
+    yield from heapq.merge(*files, key=lambda data: data['id'])
+
+
+def latest_archive_day(table):
+    """最近一个有归档文件的日期，没有归档时返回 None。"""
+    base = os.path.join(_archive_dir() or '', table)
+    if not _archive_dir() or not os.path.isdir(base):
+        return None
+    days = []
+    for month in os.listdir(base):
+        for name in os.listdir(os.path.join(base, month)):
+            if name.startswith(f'{table}-') and name.endswith('.jsonl.gz'):
+                try:
+                    days.append(date.fromisoformat(name[len(table) + 1:-len('.jsonl.gz')]))
+                except ValueError:
+                    continue
+    return max(days) if days else None
+
+
+def archive_date_range(table, start_date, end_date):
+    """解析页面传入的日期（YYYY-MM-DD），未指定时取最近一个归档日及之前几天。"""
+    def _parse(value):
+        try:
+            return datetime.strptime(value, '%Y-%m-%d').date() if value else None
+        except ValueError:
+            return None
+
+    start, end = _parse(start_date), _parse(end_date)
+    if end is None:
+        end = latest_archive_day(table) or date.today()
+    if start is None or start > end:
+        start = end - timedelta(days=DEFAULT_ARCHIVE_DAYS - 1)
+    return start, end
+
+
+def archive_paginate(table, start_date, end_date, match, per_page):
+    """归档数据的游标分页（与 keyset_paginate 相同的 URL 参数）。
+
+    Args:
+        table: 表名
+        start_date / end_date: 页面日期参数
+        match: 过滤函数，参数为归档记录 dict
+        per_page: 每页条数
+
+    Returns:
+        (KeysetPagination, (开始日期, 结束日期))
+    """
+    start, end = archive_date_range(table, start_date, end_date)
+    rows = (r for r in iter_archive(table, start, end) if match(r))
+    pagination = keyset_paginate_rows(rows, 'id', per_page)
+    model = ARCHIVE_MODELS[table]
+    pagination.items = [to_model(model, r) for r in pagination.items]
+    if model is NotificationLog:
+        shops = {s.id: s for s in Shop.query.all()}
+        for item in pagination.items:
+            set_committed_value(item, 'shop', shops.get(item.shop_id))
+    return pagination, (start, end)
+
+
+def archived_order_events(order, limit=50):
+    """订单在归档中的事件（按时间倒序），订单不在归档期内时返回空列表。"""
+    if not order.create_time or not _archive_dir():
+        return []
+    cutoff = archive_cutoff('order_events')
+    if cutoff is None or order.create_time >= cutoff:
+        return []
+    start = order.create_time.date()
+    last = (order.update_time or order.create_time).date()
+    end = min(max(last, start), start + timedelta(days=ORDER_EVENT_SCAN_DAYS))
+    events = deque(
+        (r for r in iter_archive('order_events', start, end) if r.get('order_id') == order.id),
+        maxlen=limit,
+    )
+    return [to_model(OrderEvent, r) for r in reversed(events)]
@@ -0,0 +1,241 @@
+"""日志异步批量写入服务（write-behind）。
+
+ApiLog / OperationLog / NotificationLog 不再在请求线程内 INSERT + COMMIT，
+而是放入进程内有界队列，由后台线程按批次（满 N 条或每 M 毫秒）
+使用多行 INSERT 一次写入，请求路径不再产生任何日志 I/O。
+
+配置项（见 config.py）：
+- LOG_WRITER_ASYNC：是否启用后台线程（关闭时同步写入，测试环境使用）
+- LOG_WRITER_QUEUE_SIZE：队列容量上限
+- LOG_WRITER_BATCH_SIZE：单批最大行数
+- LOG_WRITER_FLUSH_INTERVAL_MS：最长攒批时间（毫秒）
+- LOG_WRITER_OVERFLOW_POLICY：队列满时的策略
+  drop_new=丢弃新日志 drop_oldest=丢弃最旧日志 block=短暂阻塞等待
+
+进程退出时（atexit / gunicorn worker_exit）会把队列中剩余日志全部落库。
+"""
+import atexit
+import logging
+import os
+import queue
+import threading
+import time
+import weakref
+from datetime import datetime
+
+from app.extensions import db
+
+logger = logging.getLogger(__name__)
+
+OVERFLOW_DROP_NEW = 'drop_new'
+OVERFLOW_DROP_OLDEST = 'drop_oldest'
+OVERFLOW_BLOCK = 'block'
+
+# 阻塞策略下最长等待时间（秒），超时后仍丢弃，避免拖垮请求线程
+BLOCK_TIMEOUT = 0.05
+
+_writers = weakref.WeakSet()
+
+
+class LogWriter:
+    """进程内日志写入队列 + 后台批量落库线程。"""
+
+    def __init__(self, app):
+        self.app = app
+        self.async_mode = app.config.get('LOG_WRITER_ASYNC', True)
+        self.batch_size = max(1, int(app.config.get('LOG_WRITER_BATCH_SIZE', 200)))
+        self.flush_interval = int(app.config.get('LOG_WRITER_FLUSH_INTERVAL_MS', 500)) / 1000.0
+        self.overflow_policy = app.config.get('LOG_WRITER_OVERFLOW_POLICY', OVERFLOW_DROP_NEW)
+        self.queue = queue.Queue(maxsize=int(app.config.get('LOG_WRITER_QUEUE_SIZE', 10000)))
+
+        self.dropped = 0
+        self.written = 0
+        self.failed = 0
+
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._pid = None
+
+    # ---- 入队 ----
+
+    def enqueue(self, model, **fields):
+        """放入一条日志，不做任何数据库操作。
+
+        Args:
+            model: 日志模型类（ApiLog / OperationLog / NotificationLog）
+            **fields: 列名 -> 值
+
+        Returns:
+            bool: 是否成功入队（队列满被丢弃时返回 False）
+        """
+        fields.setdefault('create_time', datetime.now())
+        item = (model.__table__, fields)
+
+        if not self.async_mode:
+            self._write_batch([item])
+            return True
+
+        self._ensure_thread()
+        try:
+            self.queue.put_nowait(item)
+            return True
+        except queue.Full:
+            pass
+
+        if self.overflow_policy == OVERFLOW_DROP_OLDEST:
+            try:
+                self.queue.get_nowait()
+                self._count_drop()
+            except queue.Empty:
+                pass
+            try:
+                self.queue.put_nowait(item)
+                return True
+            except queue.Full:
+                pass
+        elif self.overflow_policy == OVERFLOW_BLOCK:
+            try:
+                self.queue.put(item, timeout=BLOCK_TIMEOUT)
+                return True
+            except queue.Full:
+                pass
+
+        self._count_drop()
+        return False
+
+    def _count_drop(self):
+        with self._lock:
+            self.dropped += 1
+            dropped = self.dropped
+        # 避免刷屏：每丢弃1000条提示一次
+        if dropped == 1 or dropped % 1000 == 0:
+            logger.warning(f'日志队列已满，累计丢弃 {dropped} 条日志（策略={self.overflow_policy}）')
+
+    # ---- 后台线程 ----
+
+    def _ensure_thread(self):
+        # gunicorn fork 后子进程需要重新启动线程
+        if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+                return
+            self._stop.clear()
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name='log-writer', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while not self._stop.is_set():
+            batch = self._collect_batch()
+            if batch:
+                self._write_batch(batch)
+
+    def _collect_batch(self):
+        """阻塞收集一批日志：满 batch_size 条或超过 flush_interval 即返回。"""
+        batch = []
+        try:
+            batch.append(self.queue.get(timeout=self.flush_interval))
+        except queue.Empty:
+            return batch
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self.queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _drain(self):
+        batch = []
+        while True:
+            try:
+                batch.append(self.queue.get_nowait())
+            except queue.Empty:
+                return batch
+
+    # ---- 落库 ----
+
+    def _write_batch(self, batch):
+        """按表分组，每组一条多行 INSERT，整批一个事务。"""
+        groups = {}
+        for table, fields in batch:
+            key = (table.name, tuple(sorted(fields)))
+            groups.setdefault(key, (table, []))[1].append(fields)
+
+        with self._flush_lock:
+            try:
+                with self.app.app_context():
+                    with db.engine.begin() as conn:
+                        for table, rows in groups.values():
+                            conn.execute(table.insert().values(rows))
+                with self._lock:
+                    self.written += len(batch)
+            except Exception as e:
+                with self._lock:
+                    self.failed += len(batch)
+                logger.error(f'批量写入日志失败（{len(batch)}条）: {e}')
+
+    def flush(self):
+        """立即把队列中所有日志写入数据库。"""
+        batch = self._drain()
+        while batch:
+            self._write_batch(batch[:self.batch_size])
+            batch = batch[self.batch_size:]
+
+    def shutdown(self):
+        """停止后台线程并落库剩余日志（进程退出时调用）。"""
+        self._stop.set()
+        thread = self._thread
+        if thread is not None and thread.is_alive() and self._pid == os.getpid():
+            thread.join(timeout=self.flush_interval * 2 + 1)
+        self.flush()
+
+    def stats(self):
+        """队列监控数据。"""
+        return {
+            'queue_size': self.queue.qsize(),
+            'queue_capacity': self.queue.maxsize,
+            'written': self.written,
+            'dropped': self.dropped,
+            'failed': self.failed,
+        }
+
+
+def init_log_writer(app):
+    """创建并挂载应用级日志写入器。"""
+    writer = LogWriter(app)
+    app.extensions['log_writer'] = writer
+    _writers.add(writer)
+    return writer
+
+
+def get_log_writer():
+    from flask import current_app
+    return current_app.extensions['log_writer']
+
+
+def enqueue_log(model, **fields):
+    """在请求上下文中写日志的便捷入口，失败不影响业务。"""
+    try:
+        return get_log_writer().enqueue(model, **fields)
+    except Exception as e:
+        logger.warning(f'日志入队失败: {e}')
+        return False
+
+
+def flush_all():
+    """落库本进程内所有写入器的剩余日志。"""
+    for writer in list(_writers):
+        try:
+            writer.shutdown()
+        except Exception as e:
+            logger.error(f'日志写入器关闭失败: {e}')
+
+
+atexit.register(flush_all)
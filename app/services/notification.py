@@ -1,19 +1,36 @@
 import hmac
 import hashlib
+import heapq
 import base64
+import itertools
 import json
+import os
+import queue
+import sqlite3
 import time
 import logging
+import weakref
+from collections import Counter, namedtuple
+from datetime import datetime
 from urllib.parse import quote_plus
 
 import threading
-import requests
 
 from app.extensions import db
 from app.models.notification_log import NotificationLog
+from app.services.log_writer import (
+    BLOCK_TIMEOUT,
+    OVERFLOW_BLOCK,
+    OVERFLOW_DROP_OLDEST,
+    enqueue_log,
+)
+from app.services.http_client import http_post
+from app.services.rate_limit import TokenBucketLimiter
+from app.services.shop_cache import ShopSnapshot
 
 logger = logging.getLogger(__name__)
 
+# 每次发送失败后等待的秒数，共发送 len(RETRY_INTERVALS) 次（最后一个值不使用）
 RETRY_INTERVALS = [1, 3, 5]
 
 
@@ -32,6 +49,36 @@ def build_order_message(order, shop):
     )
 
 
+# 汇总通知中的订单摘要
+OrderSummary = namedtuple('OrderSummary', 'id jd_order_no product amount quantity message')
+
+
+def summarize_order(order, shop):
+    return OrderSummary(order.id, order.jd_order_no, order.product_info or order.sku_id or '-',
+                        order.amount or 0, order.quantity or 1, build_order_message(order, shop))
+
+
+def build_digest_message(orders, shop, list_limit=10, top_limit=5):
+    """多个订单的汇总通知：订单数、总金额、热门商品、前 list_limit 个订单号。"""
+    total = sum(o.amount for o in orders) / 100
+    top = Counter()
+    for o in orders:
+        top[o.product] += o.quantity
+    lines = [
+        f"### 📦 新订单汇总（{len(orders)}单）\n\n",
+        f"**店铺：** {shop.shop_name}\n\n",
+        f"**订单数：** {len(orders)}\n\n",
+        f"**总金额：** ¥{total:.2f}\n\n",
+        "**热门商品：**\n\n",
+    ]
+    lines += [f"- {name} × {n}\n" for name, n in top.most_common(top_limit)]
+    order_nos = '、'.join(o.jd_order_no for o in orders[:list_limit])
+    more = f"（共{len(orders)}单，仅列出前{list_limit}单）" if len(orders) > list_limit else ''
+    lines.append(f"\n**订单号：** {order_nos}{more}\n\n")
+    lines.append("> 请及时处理订单")
+    return ''.join(lines)
+
+
 def _generate_dingtalk_sign(timestamp, secret):
     """Generate DingTalk webhook signature."""
     string_to_sign = f"{timestamp}\n{secret}"
@@ -64,7 +111,7 @@ def send_dingtalk(webhook, secret, message):
             }
         }
 
-        resp = requests.post(url, json=data, timeout=10)
+        resp = http_post('notification', url, json=data)
         resp_text = resp.text
         result = resp.json()
         if result.get('errcode', -1) == 0:
@@ -88,7 +135,7 @@ def send_wecom(webhook, message):
             }
         }
 
-        resp = requests.post(webhook, json=data, timeout=10)
+        resp = http_post('notification', webhook, json=data)
         resp_text = resp.text
         result = resp.json()
         if result.get('errcode', -1) == 0:
@@ -108,73 +155,536 @@ def _do_send(notify_type, shop, message):
     return False, '', '未配置通知渠道'
 
 
-def _send_notification_sync(app, order_id, shop_id, message, channels):
-    """在后台线程中同步发送通知（带重试）"""
-    with app.app_context():
-        from app.models.order import Order as _Order
-        from app.models.shop import Shop as _Shop
-        from datetime import datetime
+def _webhook(notify_type, shop):
+    if notify_type == 'dingtalk':
+        return shop.dingtalk_webhook
+    if notify_type == 'wecom':
+        return shop.wecom_webhook
+    return None
 
-        order = db.session.get(_Order, order_id)
-        shop = db.session.get(_Shop, shop_id)
-        if not order or not shop:
-            return
 
-        for channel in channels:
-            success = False
-            resp_text = ''
-            error_msg = None
-
-            for attempt, wait in enumerate(RETRY_INTERVALS):
-                ok, resp_text, err = _do_send(channel, shop, message)
-                if ok:
-                    success = True
-                    error_msg = None
-                    break
-                error_msg = err
-                if attempt < len(RETRY_INTERVALS) - 1:
-                    time.sleep(wait)
-
-            log = NotificationLog(
-                order_id=order.id,
-                shop_id=shop.id,
-                notify_type=channel,
-                notify_status=1 if success else 0,
-                request_data=json.dumps({"message": message[:500]}, ensure_ascii=False),
-                response_data=resp_text[:2000] if resp_text else None,
-                error_message=error_msg,
-            )
-            db.session.add(log)
-
-        order.notified = 1
-        order.notify_send_time = datetime.now()
-        db.session.commit()
+class _Task:
+    """一个店铺一个渠道的一次通知（汇总通知覆盖多个订单）。"""
+    __slots__ = ('order_ids', 'shop', 'channel', 'message', 'attempt')
 
+    def __init__(self, order_ids, shop, channel, message):
+        self.order_ids = order_ids
+        self.shop = shop
+        self.channel = channel
+        self.message = message
+        self.attempt = 0
 
-def send_order_notification(order, shop):
-    """Send order notification via configured channels (async)."""
-    if shop.notify_enabled != 1:
-        return
 
-    message = build_order_message(order, shop)
+class _Window:
+    """店铺的汇总窗口：窗口内到达的订单攒到窗口结束时合并发送。"""
+    __slots__ = ('until', 'orders')
+
+    def __init__(self, until):
+        self.until = until
+        self.orders = []
 
+
+class DigestWindows:
+    """按店铺的汇总窗口。
+
+    每个 gunicorn worker 各有一份窗口时，突发订单在每个 worker 都会立即发一条、窗口结束时
+    再各发一条汇总，消息数随 worker 数成倍增加。配置 SQLite 文件（NOTIFY_RATE_DB，与
+    webhook 令牌桶共用）时窗口和窗口内攒下的订单摘要在同一台机器的 worker 间共享
+    （BEGIN IMMEDIATE 串行），到期的窗口只被一个 worker 取走发送；为空或读写失败时仅进程内汇总。
+    时间使用 time.time()，各进程一致。
+    """
+
+    def __init__(self, window, path=None):
+        self.window = window
+        self.path = path
+        self._windows = {}  # 店铺ID -> _Window（进程内）
+        self._lock = threading.Lock()
+
+    def add(self, shop_id, summary, now):
+        """登记一个订单，返回 True 表示店铺空闲、应立即单独通知（并开启窗口）。"""
+        if self.path:
+            try:
+                return self._add_shared(shop_id, summary, now)
+            except sqlite3.Error as e:
+                logger.warning(f'汇总窗口读写失败，改为进程内汇总: {e}')
+        with self._lock:
+            window = self._windows.get(shop_id)
+            if window is None or (now >= window.until and not window.orders):
+                self._windows[shop_id] = _Window(now + self.window)
+                return True
+            window.orders.append(summary)
+            return False
+
+    def due(self, now):
+        """取走已到期窗口中攒下的订单，返回 [(店铺ID, [OrderSummary])]。"""
+        ready = []
+        if self.path:
+            try:
+                ready = self._due_shared(now)
+            except sqlite3.Error as e:
+                logger.warning(f'汇总窗口读写失败: {e}')
+        with self._lock:
+            for shop_id, window in list(self._windows.items()):
+                if window.until > now:
+                    continue
+                if window.orders:
+                    ready.append((shop_id, window.orders))
+                    # 订单仍在持续到达，开启下一个窗口
+                    self._windows[shop_id] = _Window(now + self.window)
+                else:
+                    del self._windows[shop_id]
+        return ready
+
+    def pending(self, shared=True):
+        """窗口中等待汇总的订单数（shared=False 时只统计进程内）。"""
+        with self._lock:
+            count = sum(len(w.orders) for w in self._windows.values())
+        if shared and self.path:
+            try:
+                conn = self._conn()
+                try:
+                    count += conn.execute('SELECT COUNT(*) FROM digest_orders').fetchone()[0]
+                finally:
+                    conn.close()
+            except sqlite3.Error:
+                pass
+        return count
+
+    def _conn(self):
+        conn = sqlite3.connect(self.path, timeout=1, isolation_level=None)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('CREATE TABLE IF NOT EXISTS digest_windows (shop_id INTEGER PRIMARY KEY, until REAL NOT NULL)')
+        conn.execute(
+            'CREATE TABLE IF NOT EXISTS digest_orders ('
+            ' id INTEGER PRIMARY KEY AUTOINCREMENT, shop_id INTEGER NOT NULL, data TEXT NOT NULL)'
+        )
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_digest_orders_shop ON digest_orders (shop_id, id)')
+        return conn
+
+    def _add_shared(self, shop_id, summary, now):
+        conn = self._conn()
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            row = conn.execute('SELECT until FROM digest_windows WHERE shop_id = ?', (shop_id,)).fetchone()
+            held = conn.execute('SELECT 1 FROM digest_orders WHERE shop_id = ? LIMIT 1', (shop_id,)).fetchone()
+            immediate = row is None or (now >= row[0] and held is None)
+            if immediate:
+                conn.execute('INSERT OR REPLACE INTO digest_windows (shop_id, until) VALUES (?, ?)',
+                             (shop_id, now + self.window))
+            else:
+                conn.execute('INSERT INTO digest_orders (shop_id, data) VALUES (?, ?)',
+                             (shop_id, json.dumps(list(summary), ensure_ascii=False)))
+            conn.execute('COMMIT')
+            return immediate
+        finally:
+            conn.close()
+
+    def _due_shared(self, now):
+        conn = self._conn()
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            ready = []
+            shop_ids = [r[0] for r in conn.execute('SELECT shop_id FROM digest_windows WHERE until <= ?', (now,))]
+            for shop_id in shop_ids:
+                rows = conn.execute('SELECT id, data FROM digest_orders WHERE shop_id = ? ORDER BY id',
+                                    (shop_id,)).fetchall()
+                if rows:
+                    ready.append((shop_id, [OrderSummary(*json.loads(data)) for _, data in rows]))
+                    conn.execute('DELETE FROM digest_orders WHERE shop_id = ? AND id <= ?', (shop_id, rows[-1][0]))
+                    conn.execute('UPDATE digest_windows SET until = ? WHERE shop_id = ?',
+                                 (now + self.window, shop_id))
+                else:
+                    conn.execute('DELETE FROM digest_windows WHERE shop_id = ?', (shop_id,))
+            conn.execute('COMMIT')
+            return ready
+        finally:
+            conn.close()
+
+
+def _notify_channels(shop):
+    """店铺开启通知且配置了 webhook 的渠道。"""
+    if shop.notify_enabled != 1:
+        return []
     channels = []
     if shop.dingtalk_webhook:
         channels.append('dingtalk')
     if shop.wecom_webhook:
         channels.append('wecom')
+    return channels
+
+
+def _shop_snapshot(shop):
+    """线程中只使用店铺的只读快照，不访问数据库。"""
+    if isinstance(shop, ShopSnapshot):
+        return shop
+    return ShopSnapshot(**{f: getattr(shop, f) for f in ShopSnapshot._fields})
+
+
+class NotificationDispatcher:
+    """新订单通知分发：固定线程池 + 有界队列 + 延时重试。
+
+    原来每个订单启动一个线程，线程内重新查询订单和店铺，重试之间 time.sleep，
+    突发大量订单时线程数和占用的数据库连接随订单数增长。这里：
+
+    - 请求线程只把（订单ID、店铺快照、渠道、消息）放入有界队列，不做任何 I/O
+    - NOTIFY_WORKER_THREADS 个常驻线程发送，失败后按 RETRY_INTERVALS 放入延时堆，
+      由定时线程到期后重新入队，发送线程不 sleep（同步模式 NOTIFY_ASYNC=False 下没有定时线程，
+      在调用线程中立即重试，限流时记为失败）
+    - 队列满时按 NOTIFY_OVERFLOW_POLICY 处理（drop_new / drop_oldest / block，同日志写入器），
+      被丢弃的通知记一条失败的通知日志
+    - NotificationLog 经日志写入器批量落库；订单的 notified 标记攒批后一条 UPDATE 写入
+    - stats() 提供队列深度、延时重试数、发送 / 重试 / 丢弃计数，通知日志页面展示
+
+    突发订单（秒杀）时按店铺汇总、按 webhook 限流：
+
+    - 店铺空闲时的第一个订单立即单独通知，并开启 NOTIFY_DIGEST_WINDOW 秒的汇总窗口，
+      窗口内到达的订单在窗口结束时合并为一条汇总消息（只有一单时仍发单独通知），
+      订单持续到达时窗口滚动；窗口为 0 或同步模式时不汇总
+    - 窗口经 NOTIFY_RATE_DB 在同一台机器的 worker 间共享（DigestWindows），每个店铺每个窗口
+      最多一条汇总消息；未配置时每个 worker 各自汇总，消息数随 worker 数成倍增加
+    - 每个 webhook 一个令牌桶（NOTIFY_RATE_PER_MINUTE / NOTIFY_RATE_BURST），取不到令牌的
+      消息按需等待的时间放回延时堆，不计入失败重试次数；延时堆同样受队列容量和溢出策略限制
+    - 汇总通知的 NotificationLog.order_ids 记录覆盖的订单
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self.async_mode = app.config.get('NOTIFY_ASYNC', True)
+        self.threads = max(1, int(app.config.get('NOTIFY_WORKER_THREADS', 4)))
+        self.overflow_policy = app.config.get('NOTIFY_OVERFLOW_POLICY', OVERFLOW_DROP_OLDEST)
+        self.flush_interval = int(app.config.get('NOTIFY_FLUSH_INTERVAL_MS', 500)) / 1000.0
+        self.mark_batch_size = max(1, int(app.config.get('NOTIFY_MARK_BATCH_SIZE', 200)))
+        self.queue = queue.Queue(maxsize=int(app.config.get('NOTIFY_QUEUE_SIZE', 2000)))
+        # 汇总窗口由定时线程到期发送，同步模式没有定时线程，窗口内的订单会一直留着，因此不汇总
+        self.digest_window = float(app.config.get('NOTIFY_DIGEST_WINDOW', 10)) if self.async_mode else 0
+        self.digest_list_limit = int(app.config.get('NOTIFY_DIGEST_LIST_ORDERS', 10))
+        self.limiter = TokenBucketLimiter(
+            int(app.config.get('NOTIFY_RATE_PER_MINUTE', 20)),
+            int(app.config.get('NOTIFY_RATE_BURST', 5)),
+            app.config.get('NOTIFY_RATE_DB'),
+        )
+
+        self.sent = 0
+        self.failed = 0
+        self.retried = 0
+        self.dropped = 0
+        self.throttled = 0
+        self.digests = 0
+
+        self._delayed = []  # [(到期时间, 序号, 任务)]
+        self._seq = itertools.count()
+        self._remaining = {}  # 订单ID -> 未完成的渠道数
+        self._digest_windows = DigestWindows(self.digest_window, app.config.get('NOTIFY_RATE_DB'))
+        self._shops = {}  # 店铺ID -> (店铺快照, 渠道)，汇总发送时使用
+        self._finished = []  # 已完成、待标记 notified 的订单ID
+        self._lock = threading.Lock()
+        self._cond = threading.Condition(self._lock)
+        self._stop = threading.Event()
+        self._workers = []
+        self._pid = None
+
+    # ---- 提交 ----
+
+    def submit(self, order_id, shop, message, channels):
+        """登记一个订单的各渠道通知，不做任何 I/O。"""
+        self._submit([order_id], _shop_snapshot(shop), message, channels)
+
+    def _submit(self, order_ids, shop, message, channels):
+        with self._lock:
+            for order_id in order_ids:
+                self._remaining[order_id] = self._remaining.get(order_id, 0) + len(channels)
+        for channel in channels:
+            self._put(_Task(order_ids, shop, channel, message))
+
+    def notify_order(self, order, shop, channels):
+        """新订单通知：店铺空闲时立即发送，汇总窗口内的订单留到窗口结束时合并发送。"""
+        summary = summarize_order(order, shop)
+        shop = _shop_snapshot(shop)
+        if self.digest_window <= 0:
+            self._submit([summary.id], shop, summary.message, channels)
+            return
+        with self._lock:
+            self._shops[shop.id] = (shop, channels)
+        if self._digest_windows.add(shop.id, summary, time.time()):
+            self._submit([summary.id], shop, summary.message, channels)
+
+    def _load_shop(self, shop_id):
+        """读取店铺快照（窗口中的订单由其他 worker 登记、本进程没有该店铺快照时）。"""
+        from app.models.shop import Shop
+        with self.app.app_context():
+            with db.engine.connect() as conn:
+                row = conn.execute(Shop.__table__.select().where(Shop.__table__.c.id == shop_id)).first()
+        if row is None:
+            return None, []
+        shop = ShopSnapshot(**row._mapping)
+        return shop, _notify_channels(shop)
+
+    def flush_digests(self, now=None):
+        """发送已到期汇总窗口中攒下的订单，返回发送的窗口数。"""
+        now = time.time() if now is None else now
+        ready = self._digest_windows.due(now)
+        for shop_id, orders in ready:
+            with self._lock:
+                cached = self._shops.get(shop_id)
+            shop, channels = cached or self._load_shop(shop_id)
+            if not channels:
+                logger.info(f'店铺 {shop_id} 已关闭通知，放弃汇总的 {len(orders)} 个订单')
+                continue
+            if len(orders) == 1:
+                message = orders[0].message
+            else:
+                message = build_digest_message(orders, shop, self.digest_list_limit)
+                with self._lock:
+                    self.digests += 1
+            self._submit([o.id for o in orders], shop, message, channels)
+        return len(ready)
+
+    def _put(self, task):
+        if not self.async_mode:
+            self._execute(task)
+            return
+
+        self._ensure_threads()
+        try:
+            self.queue.put_nowait(task)
+            return
+        except queue.Full:
+            pass
+
+        if self.overflow_policy == OVERFLOW_DROP_OLDEST:
+            try:
+                self._drop(self.queue.get_nowait())
+            except queue.Empty:
+                pass
+            try:
+                self.queue.put_nowait(task)
+                return
+            except queue.Full:
+                pass
+        elif self.overflow_policy == OVERFLOW_BLOCK:
+            try:
+                self.queue.put(task, timeout=BLOCK_TIMEOUT)
+                return
+            except queue.Full:
+                pass
+        self._drop(task)
+
+    def _drop(self, task):
+        with self._lock:
+            self.dropped += 1
+            dropped = self.dropped
+        if dropped == 1 or dropped % 1000 == 0:
+            logger.warning(f'通知队列已满，累计丢弃 {dropped} 条通知（策略={self.overflow_policy}）')
+        self._finish(task, False, '', '通知队列已满，已丢弃')
+
+    # ---- 发送 ----
+
+    def _delay(self, task, seconds):
+        # 延时堆与队列共用 NOTIFY_QUEUE_SIZE 上限：drop_oldest 丢弃最早放入的任务，
+        # 其余策略丢弃新任务（调用方是发送 / 定时线程，阻塞等待会拖住发送）
+        dropped = None
+        with self._cond:
+            if self.queue.maxsize > 0 and len(self._delayed) >= self.queue.maxsize:
+                if self.overflow_policy == OVERFLOW_DROP_OLDEST:
+                    i = min(range(len(self._delayed)), key=lambda k: self._delayed[k][1])
+                    dropped = self._delayed[i][2]
+                    self._delayed[i] = self._delayed[-1]
+                    self._delayed.pop()
+                    heapq.heapify(self._delayed)
+                else:
+                    dropped, task = task, None
+            if task is not None:
+                heapq.heappush(self._delayed, (time.monotonic() + seconds, next(self._seq), task))
+                self._cond.notify()
+        if dropped is not None:
+            self._drop(dropped)
+
+    def _execute(self, task):
+        # 同步模式没有定时线程处理延时堆：限流时直接记失败，发送失败时立即重试
+        while True:
+            wait = self.limiter.acquire(_webhook(task.channel, task.shop))
+            if wait > 0:
+                with self._lock:
+                    self.throttled += 1
+                if not self.async_mode:
+                    self._finish(task, False, '', 'webhook 发送频率超限')
+                    return
+                self._delay(task, wait)
+                return
+            try:
+                ok, resp_text, err = _do_send(task.channel, task.shop, task.message)
+            except Exception as e:
+                ok, resp_text, err = False, '', str(e)
+            task.attempt += 1
+            if not ok and task.attempt < len(RETRY_INTERVALS):
+                with self._lock:
+                    self.retried += 1
+                if not self.async_mode:
+                    continue
+                self._delay(task, RETRY_INTERVALS[task.attempt - 1])
+                return
+            self._finish(task, ok, resp_text, err)
+            return
+
+    def _finish(self, task, ok, resp_text, err):
+        enqueue_log(
+            NotificationLog,
+            order_id=task.order_ids[0],
+            order_ids=json.dumps(task.order_ids) if len(task.order_ids) > 1 else None,
+            shop_id=task.shop.id,
+            notify_type=task.channel,
+            notify_status=1 if ok else 0,
+            request_data=json.dumps({"message": task.message[:500]}, ensure_ascii=False),
+            response_data=resp_text[:2000] if resp_text else None,
+            error_message=None if ok else err,
+        )
+        with self._lock:
+            if ok:
+                self.sent += 1
+            else:
+                self.failed += 1
+            for order_id in task.order_ids:
+                left = self._remaining.get(order_id, 1) - 1
+                if left > 0:
+                    self._remaining[order_id] = left
+                else:
+                    self._remaining.pop(order_id, None)
+                    self._finished.append(order_id)
+            due = len(self._finished) >= self.mark_batch_size
+        if due or not self.async_mode:
+            self.flush_marks()
+
+    def release_due(self, now=None):
+        """把到期的重试重新放入队列，返回数量。"""
+        now = time.monotonic() if now is None else now
+        due = []
+        with self._lock:
+            while self._delayed and self._delayed[0][0] <= now:
+                due.append(heapq.heappop(self._delayed)[2])
+        for task in due:
+            self._put(task)
+        return len(due)
+
+    def flush_marks(self):
+        """把已完成通知的订单批量标记为已通知。"""
+        with self._lock:
+            order_ids, self._finished = self._finished, []
+        if not order_ids:
+            return
+        from app.models.order import Order
+        try:
+            with self.app.app_context():
+                with db.engine.begin() as conn:
+                    conn.execute(Order.__table__.update().where(Order.__table__.c.id.in_(order_ids))
+                                 .values(notified=1, notify_send_time=datetime.now()))
+        except Exception as e:
+            logger.error(f'订单通知标记写入失败（{len(order_ids)}单）: {e}')
+
+    # ---- 线程 ----
+
+    def _ensure_threads(self):
+        # gunicorn fork 后子进程需要重新启动线程
+        if self._workers and self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._workers and self._pid == os.getpid():
+                return
+            self._stop.clear()
+            self._pid = os.getpid()
+            workers = [threading.Thread(target=self._work, name=f'notify-{i}', daemon=True)
+                       for i in range(self.threads)]
+            workers.append(threading.Thread(target=self._tick, name='notify-timer', daemon=True))
+            for t in workers:
+                t.start()
+            self._workers = workers
+
+    def _work(self):
+        with self.app.app_context():
+            while not self._stop.is_set():
+                try:
+                    task = self.queue.get(timeout=self.flush_interval)
+                except queue.Empty:
+                    continue
+                try:
+                    self._execute(task)
+                except Exception:
+                    logger.exception('通知发送异常')
+
+    def _tick(self):
+        with self.app.app_context():
+            while not self._stop.is_set():
+                with self._cond:
+                    timeout = self.flush_interval
+                    if self._delayed:
+                        timeout = min(timeout, max(self._delayed[0][0] - time.monotonic(), 0))
+                    self._cond.wait(timeout)
+                self.release_due()
+                self.flush_digests()
+                self.flush_marks()
+
+    def shutdown(self):
+        """停止线程并写入已完成订单的标记（进程退出时调用），未发送的通知放弃。"""
+        self._stop.set()
+        with self._cond:
+            self._cond.notify_all()
+        if self._pid == os.getpid():
+            for t in self._workers:
+                t.join(timeout=self.flush_interval * 2 + 1)
+        self._workers = []
+        # 共享汇总窗口中的订单由其他 worker 发送，这里只统计本进程的
+        pending = self.queue.qsize() + len(self._delayed) + self._digest_windows.pending(shared=False)
+        if pending:
+            logger.warning(f'进程退出，放弃 {pending} 条未发送的通知')
+        self.flush_marks()
+
+    def stats(self):
+        """队列监控数据。"""
+        return {
+            'queue_size': self.queue.qsize(),
+            'queue_capacity': self.queue.maxsize,
+            'delayed': len(self._delayed),
+            'digest_pending': self._digest_windows.pending(),
+            'workers': self.threads,
+            'sent': self.sent,
+            'failed': self.failed,
+            'retried': self.retried,
+            'throttled': self.throttled,
+            'digests': self.digests,
+            'dropped': self.dropped,
+        }
+
 
+_dispatchers = weakref.WeakSet()
+
+
+def init_notification_dispatcher(app):
+    dispatcher = NotificationDispatcher(app)
+    app.extensions['notification_dispatcher'] = dispatcher
+    _dispatchers.add(dispatcher)
+    return dispatcher
+
+
+def get_notification_dispatcher():
+    from flask import current_app
+    return current_app.extensions['notification_dispatcher']
+
+
+def shutdown_dispatchers():
+    """停止本进程内所有通知分发器（gunicorn worker_exit 调用）。"""
+    for dispatcher in list(_dispatchers):
+        try:
+            dispatcher.shutdown()
+        except Exception as e:
+            logger.error(f'通知分发器关闭失败: {e}')
+
+
+def send_order_notification(order, shop):
+    """Send order notification via configured channels (async)."""
+    channels = _notify_channels(shop)
     if not channels:
         return
 
-    from flask import current_app
-    app = current_app._get_current_object()
-    t = threading.Thread(
-        target=_send_notification_sync,
-        args=(app, order.id, shop.id, message, channels),
-        daemon=True
-    )
-    t.start()
+    get_notification_dispatcher().notify_order(order, shop, channels)
 
 
 def resend_notification(log_id):
@@ -191,11 +701,20 @@ def resend_notification(log_id):
     if not order or not shop:
         return False, '订单或店铺不存在'
 
-    message = build_order_message(order, shop)
+    if log_entry.order_ids:
+        # 汇总通知：按原来覆盖的订单重新生成汇总消息
+        order_ids = json.loads(log_entry.order_ids)
+        orders = {o.id: o for o in Order.query.filter(Order.id.in_(order_ids))}
+        summaries = [summarize_order(orders[i], shop) for i in order_ids if i in orders]
+        message = build_digest_message(summaries, shop)
+    else:
+        message = build_order_message(order, shop)
     ok, resp_text, err = _do_send(log_entry.notify_type, shop, message)
 
-    new_log = NotificationLog(
+    enqueue_log(
+        NotificationLog,
         order_id=order.id,
+        order_ids=log_entry.order_ids,
         shop_id=shop.id,
         notify_type=log_entry.notify_type,
         notify_status=1 if ok else 0,
@@ -203,8 +722,6 @@ def resend_notification(log_id):
         response_data=resp_text[:2000] if resp_text else None,
         error_message=err,
     )
-    db.session.add(new_log)
-    db.session.commit()
 
     return ok, err if not ok else '发送成功'
 
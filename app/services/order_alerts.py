@@ -0,0 +1,248 @@
+"""新订单提醒推送（Server-Sent Events）。
+
+后台页面原来每 15 秒轮询 /api/new-order-count，每个标签页每次轮询都要写 session 并执行两次
+COUNT。这里改为推送：
+
+- 发布：Order 的 ORM 事件记录新订单（以及未处理订单数的变化）所在店铺，事务提交后发布，
+  回滚则丢弃，京东游戏 / 通用 / 阿奇索等所有接单入口都会经过这里
+- 跨 worker：配置 ORDER_ALERT_DB 时事件写入本机 SQLite 文件，每个 worker 的监听线程每
+  ORDER_ALERT_POLL_INTERVAL 秒读取一次新事件并分发给本进程的订阅者；为空则仅进程内分发
+- 订阅：/api/order-events 按当前用户有权限的店铺过滤事件，推送 orders（新订单数）和
+  pending（未处理订单数，来自 order_pending_counts，每个 worker 在变化后只查询一次）
+- 每个连接最长 SSE_STREAM_SECONDS 秒，浏览器 EventSource 自动重连；每个 worker 最多
+  SSE_MAX_CONNECTIONS 个连接，超出返回 503，页面退回 15 秒轮询
+"""
+import logging
+import queue
+import sqlite3
+import threading
+import time
+
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import object_session
+
+from app.extensions import db
+from app.models.order import Order
+from app.services.order_stats import PENDING_STATUSES, pending_counts
+
+logger = logging.getLogger(__name__)
+
+_SESSION_ALERT_KEY = 'order_alerts'
+
+# 事件类型：新订单 / 未处理订单数变化
+EVENT_NEW = 'new'
+EVENT_PENDING = 'pending'
+
+# SQLite 中保留的事件时长（秒）
+EVENT_RETENTION_SECONDS = 600
+
+# 每个订阅者最多积压的事件数，超出后丢弃（只影响提醒次数，角标会在下一个事件时校正）
+SUBSCRIBER_QUEUE_SIZE = 1000
+
+
+# ---- 发布 ----
+
+def _record(target, kind):
+    session = object_session(target)
+    if session is None or target.shop_id is None:
+        return
+    session.info.setdefault(_SESSION_ALERT_KEY, []).append((kind, target.shop_id, target.id))
+
+
+@event.listens_for(Order, 'after_insert')
+def _order_created(mapper, connection, target):
+    _record(target, EVENT_NEW)
+
+
+@event.listens_for(Order, 'after_update')
+def _order_status_changed(mapper, connection, target):
+    hist = inspect(target).attrs.order_status.history
+    if not hist.has_changes():
+        return
+    old = hist.deleted[0] if hist.deleted else None
+    if old in PENDING_STATUSES or target.order_status in PENDING_STATUSES:
+        _record(target, EVENT_PENDING)
+
+
+@event.listens_for(Order, 'after_delete')
+def _order_deleted(mapper, connection, target):
+    if target.order_status in PENDING_STATUSES:
+        _record(target, EVENT_PENDING)
+
+
+@event.listens_for(db.session, 'after_commit')
+def _publish_alerts(session):
+    events = session.info.pop(_SESSION_ALERT_KEY, None)
+    if not events:
+        return
+    from flask import current_app, has_app_context
+    if not has_app_context() or 'order_alerts' not in current_app.extensions:
+        return
+    try:
+        current_app.extensions['order_alerts'].publish(events)
+    except Exception as e:
+        logger.warning(f'新订单提醒发布失败: {e}')
+
+
+@event.listens_for(db.session, 'after_rollback')
+def _discard_alerts(session):
+    session.info.pop(_SESSION_ALERT_KEY, None)
+
+
+# ---- 订阅 ----
+
+class Subscriber:
+    def __init__(self):
+        self.queue = queue.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+
+    def put(self, events):
+        for item in events:
+            try:
+                self.queue.put_nowait(item)
+            except queue.Full:
+                return
+
+    def get(self, timeout):
+        """等待事件，返回本次取到的全部事件（超时返回空列表）。"""
+        try:
+            events = [self.queue.get(timeout=timeout)]
+        except queue.Empty:
+            return []
+        while True:
+            try:
+                events.append(self.queue.get_nowait())
+            except queue.Empty:
+                return events
+
+
+class OrderAlertHub:
+    """进程内的订单事件分发，配置 SQLite 文件时经文件在 worker 间共享。"""
+
+    def __init__(self, app):
+        self.app = app
+        self.path = app.config.get('ORDER_ALERT_DB')
+        self.poll_interval = app.config.get('ORDER_ALERT_POLL_INTERVAL', 1.0)
+        self.max_connections = app.config.get('SSE_MAX_CONNECTIONS', 8)
+        self._subscribers = set()
+        self._lock = threading.Lock()
+        self._listener = None
+        self._last_seq = None
+        self._version = 0  # 每次分发事件后递增，未处理订单数缓存随之失效
+        self._pending = None  # (version, {shop_id: 数量})
+        self._pending_lock = threading.Lock()
+        if self.path:
+            conn = self._conn()
+            conn.close()
+
+    def _conn(self):
+        conn = sqlite3.connect(self.path, timeout=1, isolation_level=None)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute(
+            'CREATE TABLE IF NOT EXISTS order_alerts ('
+            ' seq INTEGER PRIMARY KEY AUTOINCREMENT, kind TEXT NOT NULL,'
+            ' shop_id INTEGER NOT NULL, order_id INTEGER, created REAL NOT NULL)'
+        )
+        return conn
+
+    # ---- 发布 / 分发 ----
+
+    def publish(self, events):
+        """发布 [(类型, 店铺ID, 订单ID)]。"""
+        if not self.path:
+            self._dispatch(events)
+            return
+        now = time.time()
+        conn = self._conn()
+        try:
+            conn.executemany('INSERT INTO order_alerts (kind, shop_id, order_id, created) VALUES (?, ?, ?, ?)',
+                             [(kind, shop_id, order_id, now) for kind, shop_id, order_id in events])
+            conn.execute('DELETE FROM order_alerts WHERE created < ?', (now - EVENT_RETENTION_SECONDS,))
+        finally:
+            conn.close()
+
+    def _dispatch(self, events):
+        self._version += 1
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for sub in subscribers:
+            sub.put(events)
+
+    def _poll(self):
+        conn = self._conn()
+        try:
+            if self._last_seq is None:
+                self._last_seq = conn.execute('SELECT COALESCE(MAX(seq), 0) FROM order_alerts').fetchone()[0]
+                return
+            rows = conn.execute('SELECT seq, kind, shop_id, order_id FROM order_alerts WHERE seq > ? ORDER BY seq',
+                                (self._last_seq,)).fetchall()
+        finally:
+            conn.close()
+        if rows:
+            self._last_seq = rows[-1][0]
+            self._dispatch([(kind, shop_id, order_id) for _, kind, shop_id, order_id in rows])
+
+    def _listen(self):
+        while True:
+            try:
+                self._poll()
+            except sqlite3.Error as e:
+                logger.warning(f'新订单提醒读取失败: {e}')
+            time.sleep(self.poll_interval)
+
+    def _ensure_listener(self):
+        if not self.path or self._listener is not None:
+            return
+        self._poll()
+        self._listener = threading.Thread(target=self._listen, name='order-alert-listener', daemon=True)
+        self._listener.start()
+
+    # ---- 订阅 ----
+
+    def subscribe(self):
+        """登记订阅者，连接数已满时返回 None。"""
+        with self._lock:
+            if len(self._subscribers) >= self.max_connections:
+                return None
+            sub = Subscriber()
+            self._subscribers.add(sub)
+            self._ensure_listener()
+        return sub
+
+    def unsubscribe(self, sub):
+        with self._lock:
+            self._subscribers.discard(sub)
+
+    @property
+    def connection_count(self):
+        return len(self._subscribers)
+
+    # ---- 未处理订单数 ----
+
+    def pending_for(self, shop_ids=None):
+        """shop_ids 范围内的未处理订单数（None 表示全部店铺）。"""
+        cached = self._pending
+        if cached is None or cached[0] != self._version:
+            with self._pending_lock:
+                cached = self._pending
+                if cached is None or cached[0] != self._version:
+                    version = self._version
+                    with self.app.app_context():
+                        try:
+                            cached = self._pending = (version, pending_counts())
+                        finally:
+                            db.session.remove()
+        counts = cached[1]
+        if shop_ids is None:
+            return sum(counts.values())
+        return sum(n for shop_id, n in counts.items() if shop_id in shop_ids)
+
+
+def init_order_alerts(app):
+    hub = OrderAlertHub(app)
+    app.extensions['order_alerts'] = hub
+    return hub
+
+
+def get_order_alerts():
+    from flask import current_app
+    return current_app.extensions['order_alerts']
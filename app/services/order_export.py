@@ -0,0 +1,427 @@
+"""订单导出。
+
+- 查询：只投影导出需要的列，并 LEFT JOIN 店铺名（不加载 ORM 对象，没有逐行懒加载），
+  使用独立连接 + stream_results（MySQL 服务端游标）按 EXPORT_YIELD_PER 行分批读取，内存占用固定
+- 格式：csv（UTF-8 BOM，兼容 Excel）、csv.gz（流式 gzip 压缩）、xlsx（流式写入 zip，不依赖第三方库）
+- 小批量 CSV 在请求中直接流式下载；行数超过 EXPORT_SYNC_MAX_ROWS 或 XLSX 格式时创建导出任务，
+  由 worker.py 定时领取执行，进度写回 export_jobs，完成后在导出任务页面下载
+- 执行中的任务定期刷新 locked_at（心跳）；超过 LOCK_TIMEOUT 秒没有心跳（worker 重启 / 进程退出）
+  的任务重新排队
+- 导出文件保留 EXPORT_RETENTION_HOURS 小时后删除
+"""
+import csv
+import io
+import json
+import logging
+import os
+import re
+import socket
+import time
+import uuid
+import zipfile
+import zlib
+from datetime import datetime, timedelta
+from decimal import Decimal
+from xml.sax.saxutils import escape
+
+from flask import current_app
+
+from app.extensions import db
+from app.models.export_job import ExportJob
+from app.models.order import Order
+from app.models.shop import Shop
+from app.models.user import User
+from app.services.order_search import apply_order_filters
+
+logger = logging.getLogger(__name__)
+
+EXPORT_HEADERS = ['京东订单号', '系统订单号', '店铺名称', '店铺类型', '订单类型', '订单状态',
+                  '商品信息', '金额(元)', '数量', '充值账号', '创建时间']
+
+EXPORT_COLUMNS = (
+    Order.jd_order_no, Order.order_no, Shop.shop_name, Order.shop_type, Order.order_type,
+    Order.order_status, Order.product_info, Order.amount, Order.quantity, Order.produce_account,
+    Order.create_time,
+)
+
+# 格式 -> (MIME 类型, 文件扩展名)
+EXPORT_FORMATS = {
+    'csv': ('text/csv; charset=utf-8-sig', '.csv'),
+    'csv.gz': ('application/gzip', '.csv.gz'),
+    'xlsx': ('application/vnd.openxmlformats-officedocument.spreadsheetml.sheet', '.xlsx'),
+}
+
+# 不参与筛选的请求参数
+NON_FILTER_ARGS = ('format', 'background', 'after', 'before', 'page')
+
+# 每个 CSV 块包含的行数
+CSV_CHUNK_ROWS = 500
+
+# 单个工作表最多行数（含表头，Excel 上限 1048576）
+XLSX_MAX_ROWS = 1000000
+
+_TWO_PLACES = Decimal('0.01')
+
+# 导出中任务超过该秒数没有心跳视为执行进程已退出，重新排队
+LOCK_TIMEOUT = 600
+
+# 导出中任务的心跳间隔（秒），与 EXPORT_PROGRESS_EVERY 行先到者为准
+HEARTBEAT_SECONDS = 60
+
+
+# ---- 查询 ----
+
+def export_statement(query):
+    """订单查询 -> 导出用的投影 SELECT（按订单ID倒序）。"""
+    return query.with_entities(*EXPORT_COLUMNS).outerjoin(
+        Shop, Shop.id == Order.shop_id
+    ).order_by(Order.id.desc()).statement
+
+
+def _format_row(row):
+    (jd_order_no, order_no, shop_name, shop_type, order_type, order_status,
+     product_info, amount, quantity, produce_account, create_time) = row
+    return [
+        jd_order_no,
+        order_no,
+        shop_name or '',
+        Order.SHOP_TYPE_MAP.get(shop_type, '未知'),
+        Order.TYPE_MAP.get(order_type, '未知'),
+        Order.STATUS_MAP.get(order_status, '未知'),
+        product_info or '',
+        (Decimal(amount or 0) / 100).quantize(_TWO_PLACES),
+        quantity,
+        produce_account or '',
+        create_time.strftime('%Y-%m-%d %H:%M:%S') if create_time else '',
+    ]
+
+
+def iter_export_rows(statement):
+    """使用独立连接和服务端游标流式读取，逐行返回格式化后的值列表。"""
+    yield_per = current_app.config.get('EXPORT_YIELD_PER', 2000)
+    with db.engine.connect() as conn:
+        result = conn.execution_options(stream_results=True, yield_per=yield_per).execute(statement)
+        for row in result:
+            yield _format_row(row)
+
+
+# ---- 写出 ----
+
+def iter_csv_chunks(rows):
+    """CSV 文本分块（首块含 BOM 和表头）。"""
+    buf = io.StringIO()
+    buf.write('\ufeff')  # UTF-8 BOM
+    writer = csv.writer(buf)
+    writer.writerow(EXPORT_HEADERS)
+    count = 0
+    for row in rows:
+        writer.writerow(row)
+        count += 1
+        if count % CSV_CHUNK_ROWS == 0:
+            yield buf.getvalue()
+            buf.seek(0)
+            buf.truncate()
+    if buf.tell():
+        yield buf.getvalue()
+
+
+def iter_gzip(chunks):
+    """把文本块流式压缩为 gzip 字节块。"""
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        data = compressor.compress(chunk.encode('utf-8'))
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+_XML_ILLEGAL = re.compile('[\x00-\x08\x0b\x0c\x0e-\x1f]')
+
+_XLSX_STATIC = {
+    '_rels/.rels': (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" Target="xl/workbook.xml"/>'
+        '</Relationships>'
+    ),
+    'xl/styles.xml': (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<styleSheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main">'
+        '<fonts count="1"><font><sz val="11"/><name val="Calibri"/></font></fonts>'
+        '<fills count="1"><fill><patternFill patternType="none"/></fill></fills>'
+        '<borders count="1"><border><left/><right/><top/><bottom/><diagonal/></border></borders>'
+        '<cellStyleXfs count="1"><xf numFmtId="0" fontId="0" fillId="0" borderId="0"/></cellStyleXfs>'
+        '<cellXfs count="1"><xf numFmtId="0" fontId="0" fillId="0" borderId="0" xfId="0"/></cellXfs>'
+        '</styleSheet>'
+    ),
+}
+
+
+def _xlsx_cell(value):
+    if isinstance(value, (int, Decimal)) and not isinstance(value, bool):
+        return f'<c><v>{value}</v></c>'
+    if value is None or value == '':
+        return '<c/>'
+    text = escape(_XML_ILLEGAL.sub('', str(value)))
+    return f'<c t="inlineStr"><is><t xml:space="preserve">{text}</t></is></c>'
+
+
+def _xlsx_row(values):
+    return '<row>' + ''.join(_xlsx_cell(v) for v in values) + '</row>'
+
+
+def _write_xlsx_index(zf, sheet_count):
+    sheets = ''.join(
+        f'<sheet name="订单{i}" sheetId="{i}" r:id="rId{i}"/>' for i in range(1, sheet_count + 1)
+    )
+    zf.writestr('xl/workbook.xml', (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+        'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">'
+        f'<sheets>{sheets}</sheets></workbook>'
+    ))
+    rels = ''.join(
+        f'<Relationship Id="rId{i}" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet" '
+        f'Target="worksheets/sheet{i}.xml"/>' for i in range(1, sheet_count + 1)
+    )
+    rels += (f'<Relationship Id="rId{sheet_count + 1}" '
+             'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/styles" Target="styles.xml"/>')
+    zf.writestr('xl/_rels/workbook.xml.rels', (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        f'<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">{rels}</Relationships>'
+    ))
+    overrides = ''.join(
+        f'<Override PartName="/xl/worksheets/sheet{i}.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+        for i in range(1, sheet_count + 1)
+    )
+    zf.writestr('[Content_Types].xml', (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+        '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+        '<Default Extension="xml" ContentType="application/xml"/>'
+        '<Override PartName="/xl/workbook.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+        '<Override PartName="/xl/styles.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.styles+xml"/>'
+        f'{overrides}</Types>'
+    ))
+    for name, content in _XLSX_STATIC.items():
+        zf.writestr(name, content)
+
+
+def write_xlsx(rows, fileobj):
+    """把行流式写为 XLSX（行内字符串，超过 XLSX_MAX_ROWS 自动分表）。"""
+    sheet_count = 0
+    with zipfile.ZipFile(fileobj, 'w', zipfile.ZIP_DEFLATED, allowZip64=True) as zf:
+        rows = iter(rows)
+        exhausted = False
+        while not exhausted:
+            sheet_count += 1
+            with zf.open(f'xl/worksheets/sheet{sheet_count}.xml', 'w', force_zip64=True) as sheet:
+                sheet.write((
+                    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+                    '<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main"><sheetData>'
+                    + _xlsx_row(EXPORT_HEADERS)
+                ).encode('utf-8'))
+                written = 1
+                buf = []
+                for row in rows:
+                    buf.append(_xlsx_row(row))
+                    written += 1
+                    if len(buf) >= CSV_CHUNK_ROWS:
+                        sheet.write(''.join(buf).encode('utf-8'))
+                        buf = []
+                    if written >= XLSX_MAX_ROWS:
+                        break
+                else:
+                    exhausted = True
+                if buf:
+                    sheet.write(''.join(buf).encode('utf-8'))
+                sheet.write(b'</sheetData></worksheet>')
+        _write_xlsx_index(zf, sheet_count)
+
+
+def export_filename(export_format, now=None):
+    now = now or datetime.now()
+    return f'订单导出_{now.strftime("%Y%m%d_%H%M%S")}{EXPORT_FORMATS[export_format][1]}'
+
+
+def filter_args(args):
+    """请求参数 -> 保存到导出任务的筛选条件。"""
+    return {k: v for k, v in args.items() if k not in NON_FILTER_ARGS and v not in (None, '')}
+
+
+# ---- 导出任务 ----
+
+def create_export_job(user, args, export_format, total_rows=None):
+    """创建导出任务（提交），由 worker.py 执行。"""
+    job = ExportJob(
+        user_id=user.id,
+        username=user.username,
+        export_format=export_format,
+        filters=json.dumps(filter_args(args), ensure_ascii=False),
+        total_rows=total_rows,
+        file_name=export_filename(export_format),
+    )
+    db.session.add(job)
+    db.session.commit()
+    return job
+
+
+def _requeue_stale_exports(now):
+    """执行进程已退出（超时没有心跳）的导出任务重新排队，返回数量。"""
+    requeued = ExportJob.query.filter(
+        ExportJob.status == ExportJob.STATUS_RUNNING,
+        db.or_(ExportJob.locked_at.is_(None), ExportJob.locked_at < now - timedelta(seconds=LOCK_TIMEOUT)),
+    ).update({
+        'status': ExportJob.STATUS_PENDING,
+        'locked_by': None,
+        'locked_at': None,
+        'processed_rows': 0,
+    }, synchronize_session=False)
+    if requeued:
+        logger.warning(f'{requeued} 个导出任务执行超时（进程可能已退出），已重新排队')
+    return requeued
+
+
+def _claim_export_job():
+    now = datetime.now()
+    _requeue_stale_exports(now)
+    job_id = db.session.query(ExportJob.id).filter(
+        ExportJob.status == ExportJob.STATUS_PENDING,
+    ).order_by(ExportJob.id).limit(1).scalar()
+    if job_id is None:
+        return None
+    token = f'{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}'
+    claimed = ExportJob.query.filter(
+        ExportJob.id == job_id, ExportJob.status == ExportJob.STATUS_PENDING,
+    ).update({
+        'status': ExportJob.STATUS_RUNNING,
+        'locked_by': token,
+        'locked_at': now,
+        'start_time': now,
+    }, synchronize_session=False)
+    db.session.commit()
+    return db.session.get(ExportJob, job_id) if claimed else None
+
+
+def _job_rows(job):
+    """按任务保存的筛选条件和创建人当前权限生成导出行，并定期写回进度。"""
+    user = db.session.get(User, job.user_id) if job.user_id else None
+    if user is None:
+        raise ValueError('创建人不存在')
+    permitted_ids = None if user.is_admin else user.get_permitted_shop_ids()
+    query = apply_order_filters(Order.query, json.loads(job.filters or '{}'), permitted_ids)
+    if job.total_rows is None:
+        job.total_rows = query.order_by(None).count()
+        job.locked_at = datetime.now()
+        db.session.commit()
+
+    every = current_app.config.get('EXPORT_PROGRESS_EVERY', 5000)
+    count = 0
+    beat = time.monotonic()
+    for row in iter_export_rows(export_statement(query)):
+        yield row
+        count += 1
+        if count % every == 0 or time.monotonic() - beat > HEARTBEAT_SECONDS:
+            job.processed_rows = count
+            job.locked_at = datetime.now()
+            db.session.commit()
+            beat = time.monotonic()
+    job.processed_rows = count
+
+
+def run_export_job(job):
+    """执行已领取的导出任务，写入 EXPORT_DIR 下的文件。"""
+    export_dir = current_app.config.get('EXPORT_DIR')
+    os.makedirs(export_dir, exist_ok=True)
+    path = os.path.join(export_dir, f'export_{job.id}{EXPORT_FORMATS[job.export_format][1]}')
+    # 超时重新排队的任务可能与原进程同时执行，各自写临时文件，完成后原子替换
+    tmp_path = f'{path}.{uuid.uuid4().hex[:8]}.part'
+    try:
+        rows = _job_rows(job)
+        if job.export_format == 'xlsx':
+            with open(tmp_path, 'wb') as f:
+                write_xlsx(rows, f)
+        elif job.export_format == 'csv.gz':
+            with open(tmp_path, 'wb') as f:
+                for data in iter_gzip(iter_csv_chunks(rows)):
+                    f.write(data)
+        else:
+            with open(tmp_path, 'w', encoding='utf-8', newline='') as f:
+                for chunk in iter_csv_chunks(rows):
+                    f.write(chunk)
+        os.replace(tmp_path, path)
+    except Exception as e:
+        db.session.rollback()
+        logger.exception(f'导出任务 {job.id} 失败')
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        job.status = ExportJob.STATUS_FAILED
+        job.error = str(e)[:500]
+        job.finish_time = datetime.now()
+        db.session.commit()
+        return False
+
+    job.status = ExportJob.STATUS_DONE
+    job.file_path = path
+    job.file_size = os.path.getsize(path)
+    job.finish_time = datetime.now()
+    db.session.commit()
+    logger.info(f'导出任务 {job.id} 完成：{job.processed_rows} 行，{job.file_size} 字节')
+    return True
+
+
+def run_pending_exports(limit=1):
+    """领取并执行排队中的导出任务（需在应用上下文中调用），返回执行数量。"""
+    done = 0
+    while done < limit:
+        job = _claim_export_job()
+        if job is None:
+            break
+        run_export_job(job)
+        done += 1
+    return done
+
+
+def cleanup_exports(now=None):
+    """删除超过保留期的导出文件，返回清理数量。"""
+    now = now or datetime.now()
+    hours = current_app.config.get('EXPORT_RETENTION_HOURS', 72)
+    jobs = ExportJob.query.filter(
+        ExportJob.status == ExportJob.STATUS_DONE,
+        ExportJob.finish_time < now - timedelta(hours=hours),
+    ).all()
+    for job in jobs:
+        if job.file_path and os.path.exists(job.file_path):
+            os.remove(job.file_path)
+        job.status = ExportJob.STATUS_EXPIRED
+    db.session.commit()
+    return len(jobs)
+
+
+def schedule_export_jobs(scheduler, app):
+    """在 worker.py 的定时任务中登记导出任务执行与过期文件清理。"""
+
+    def _run():
+        with app.app_context():
+            try:
+                run_pending_exports()
+            finally:
+                db.session.remove()
+
+    def _cleanup():
+        with app.app_context():
+            try:
+                cleanup_exports()
+            finally:
+                db.session.remove()
+
+    scheduler.add_job(
+        _run, 'interval',
+        seconds=app.config.get('EXPORT_POLL_INTERVAL', 3),
+        id='order_export', max_instances=1, coalesce=True,
+    )
+    scheduler.add_job(_cleanup, 'interval', hours=1, id='order_export_cleanup',
+                      max_instances=1, coalesce=True)
@@ -0,0 +1,116 @@
+"""订单接单（ingest）工作单元。
+
+京东推单接口过去的流程是：SELECT 防重 -> INSERT 订单并提交 -> INSERT 创建事件并提交，
+每单至少两次提交，且 SELECT 与 INSERT 之间存在并发窗口。
+
+这里把订单、它的 order_created 事件以及附带的发货任务放在同一个事务里一次提交，
+防重完全依赖 orders 表的唯一索引 idx_jd_order_shop(jd_order_no, shop_id)：
+插入冲突（IntegrityError）即视为重复推单，回滚后返回已存在的订单。
+该索引缺失时（如迁移 0002 因存在重复订单而失败）拒绝接单（抛出 DedupeIndexMissing，
+接口返回 500，京东稍后重推），避免重复订单与重复发货任务入库。
+请求日志由 log_writer 异步批量写入，不占用该事务。
+
+每个阶段的耗时（毫秒）记录在返回结果的 timings 中并写入日志。
+"""
+import logging
+import time
+import uuid
+from collections import namedtuple
+from datetime import datetime
+
+from flask import current_app
+from sqlalchemy import inspect
+from sqlalchemy.exc import IntegrityError
+
+from app.extensions import db
+from app.models.order import Order
+from app.models.order_event import OrderEvent
+
+logger = logging.getLogger(__name__)
+
+IngestResult = namedtuple('IngestResult', ['order', 'created', 'timings'])
+
+DEDUPE_INDEX = 'idx_jd_order_shop'
+
+
+class DedupeIndexMissing(RuntimeError):
+    """orders 表缺少接单防重唯一索引。"""
+
+
+def _check_dedupe_index():
+    """确认防重唯一索引存在。
+
+    每个进程确认成功一次后不再检查；缺失时每次接单都重新检查，执行迁移后无需重启即可恢复。
+    """
+    if current_app.extensions.get('order_dedupe_index'):
+        return
+    inspector = inspect(db.session.connection())
+    names = {i['name'] for i in inspector.get_indexes('orders') if i.get('unique')}
+    names.update(u['name'] for u in inspector.get_unique_constraints('orders'))
+    if DEDUPE_INDEX not in names:
+        logger.error(f'orders 表缺少唯一索引 {DEDUPE_INDEX}，拒绝接单，'
+                     f'请清理重复订单后执行 python migrations/migrate.py')
+        raise DedupeIndexMissing(f'orders 表缺少唯一索引 {DEDUPE_INDEX}')
+    current_app.extensions['order_dedupe_index'] = True
+
+
+def generate_order_no():
+    """生成我方订单号：ORD + 时间戳 + 8位随机串。"""
+    return f"ORD{datetime.now().strftime('%Y%m%d%H%M%S')}{uuid.uuid4().hex[:8].upper()}"
+
+
+def _ms(start, end):
+    return round((end - start) * 1000, 2)
+
+
+def ingest_order(order, event_desc, related=()):
+    """在一个事务中持久化订单及其创建事件。
+
+    Args:
+        order: 尚未加入会话的 Order 对象
+        event_desc: order_created 事件描述
+        related: 随订单一起提交的其他对象（如 FulfillmentJob），重复推单时一并回滚
+
+    Returns:
+        IngestResult: (order, created, timings)
+            created=False 表示唯一索引冲突（重复推单），order 为已存在的订单
+
+    Raises:
+        DedupeIndexMissing: 防重唯一索引不存在
+    """
+    _check_dedupe_index()
+    timings = {}
+    t_start = time.perf_counter()
+
+    db.session.add(order)
+    db.session.add(OrderEvent(
+        order=order,
+        order_no=order.order_no,
+        event_type='order_created',
+        event_desc=event_desc,
+        result='info',
+    ))
+    for obj in related:
+        db.session.add(obj)
+    t_build = time.perf_counter()
+    timings['build'] = _ms(t_start, t_build)
+
+    try:
+        db.session.flush()
+        t_flush = time.perf_counter()
+        timings['flush'] = _ms(t_build, t_flush)
+        db.session.commit()
+        t_commit = time.perf_counter()
+        timings['commit'] = _ms(t_flush, t_commit)
+    except IntegrityError:
+        db.session.rollback()
+        existing = Order.query.filter_by(jd_order_no=order.jd_order_no, shop_id=order.shop_id).first()
+        if existing is None:
+            raise
+        timings['total'] = _ms(t_start, time.perf_counter())
+        logger.info(f"重复推单已忽略: jd={order.jd_order_no}, local={existing.order_no}, timings={timings}")
+        return IngestResult(existing, False, timings)
+
+    timings['total'] = _ms(t_start, t_commit)
+    logger.info(f"订单入库: jd={order.jd_order_no}, local={order.order_no}, timings={timings}")
+    return IngestResult(order, True, timings)
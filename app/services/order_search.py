@@ -0,0 +1,245 @@
+"""订单筛选与关键字搜索。
+
+订单列表和导出共用 apply_order_filters(query, args)（店铺/类型/状态/日期/关键字），
+其中关键字由 apply_keyword_filter(query, keyword) 处理：
+
+1. 精确匹配快速路径：形如系统订单号（ORD + 14位时间 + 8位十六进制）→ order_no 唯一索引
+2. n-gram 分词检索：关键字切成与建索引相同的分词，在 order_search_tokens 中
+   找出包含全部分词的订单，再用原 LIKE 条件在候选集上精确过滤（结果与 LIKE 完全一致，
+   号码既能精确匹配也能片段匹配）。系统订单号中的年份 / 年月数字（如 "202"、"026"）
+   几乎出现在每个订单中，这类分词不参与候选集筛选（见 LOW_SELECTIVITY_GRAMS）
+3. 关键字过短无法切出分词、或只有低区分度分词时，退回原来的 LIKE 扫描
+
+分词表由 Order 的 ORM 事件在同一事务中维护；历史数据用
+python migrations/backfill_search.py 回填。
+"""
+import re
+from datetime import datetime
+
+from sqlalchemy import event, func, inspect
+
+from app.extensions import db
+from app.models.order import Order
+from app.models.order_search import OrderSearchToken
+
+SEARCH_FIELDS = ('order_no', 'jd_order_no', 'product_info', 'produce_account')
+
+# 非中文字符的 n-gram 长度；中文按 2 字切分（与 MySQL ngram 默认一致）
+ASCII_GRAM = 3
+CJK_GRAM = 2
+
+ORDER_NO_PATTERN = re.compile(r'^ORD\d{14}[0-9A-F]{8}$', re.IGNORECASE)
+
+
+def _date_grams(first_year=2020, last_year=2039):
+    """系统订单号时间部分（YYYYMM...）中年份与年月开头的分词。"""
+    grams = set()
+    for year in range(first_year, last_year + 1):
+        y = str(year)
+        grams.update({y[0:3], y[1:4], y[2:4] + '0', y[2:4] + '1'})
+    return frozenset(grams)
+
+
+# 区分度过低、不用于候选集筛选的分词（仍然建索引，可随时调整）
+LOW_SELECTIVITY_GRAMS = _date_grams()
+
+_CJK_RUN = re.compile(r'[\u3400-\u9fff\uf900-\ufaff]+')
+_WORD_RUN = re.compile(r'[0-9a-z\u3400-\u9fff\uf900-\ufaff]+')
+
+_token_table = OrderSearchToken.__table__
+
+
+def _grams(run, n):
+    if len(run) <= n:
+        return [run]
+    return [run[i:i + n] for i in range(len(run) - n + 1)]
+
+
+def tokenize(text):
+    """切分文本，返回分词集合（小写）。"""
+    tokens = set()
+    if not text:
+        return tokens
+    for word in _WORD_RUN.findall(str(text).lower()):
+        pos = 0
+        for m in _CJK_RUN.finditer(word):
+            if m.start() > pos:
+                tokens.update(_grams(word[pos:m.start()], ASCII_GRAM))
+            tokens.update(_grams(m.group(), CJK_GRAM))
+            pos = m.end()
+        if pos < len(word):
+            tokens.update(_grams(word[pos:], ASCII_GRAM))
+    return tokens
+
+
+def query_tokens(keyword):
+    """切分搜索关键字；存在无法用索引匹配的短片段时返回 None。
+
+    文本中的片段比关键字片段长时，关键字片段可能只是文本分词的一部分，
+    因此关键字的每个片段都必须达到 n-gram 长度。
+    """
+    keyword = (keyword or '').lower()
+    words = _WORD_RUN.findall(keyword)
+    if not words:
+        return None
+    tokens = set()
+    for word in words:
+        pos = 0
+        parts = []
+        for m in _CJK_RUN.finditer(word):
+            if m.start() > pos:
+                parts.append((word[pos:m.start()], ASCII_GRAM))
+            parts.append((m.group(), CJK_GRAM))
+            pos = m.end()
+        if pos < len(word):
+            parts.append((word[pos:], ASCII_GRAM))
+        for part, n in parts:
+            if len(part) < n:
+                return None
+            tokens.update(_grams(part, n))
+    return tokens
+
+
+def search_tokens(keyword):
+    """用于候选集筛选的关键字分词（去掉低区分度分词），无可用分词时返回 None。"""
+    tokens = query_tokens(keyword)
+    if not tokens:
+        return None
+    return (tokens - LOW_SELECTIVITY_GRAMS) or None
+
+
+def order_tokens(order):
+    """订单全部搜索字段的分词（全文，不截断）。"""
+    tokens = set()
+    for field in SEARCH_FIELDS:
+        value = getattr(order, field, None)
+        if value:
+            tokens |= tokenize(str(value))
+    return tokens
+
+
+def _like_filter(keyword):
+    return db.or_(
+        Order.order_no.like(f'%{keyword}%'),
+        Order.jd_order_no.like(f'%{keyword}%'),
+        Order.product_info.like(f'%{keyword}%'),
+        Order.produce_account.like(f'%{keyword}%'),
+    )
+
+
+def apply_keyword_filter(query, keyword):
+    """为订单查询加上关键字条件（系统订单号/京东订单号/商品信息/充值账号）。"""
+    keyword = (keyword or '').strip()
+    if not keyword:
+        return query
+
+    if ORDER_NO_PATTERN.match(keyword):
+        return query.filter(Order.order_no == keyword.upper())
+
+    tokens = search_tokens(keyword)
+    if not tokens:
+        return query.filter(_like_filter(keyword))
+
+    candidates = db.session.query(OrderSearchToken.order_id).filter(
+        OrderSearchToken.token.in_(tokens)
+    ).group_by(OrderSearchToken.order_id).having(
+        func.count(OrderSearchToken.token) == len(tokens)
+    )
+    return query.filter(Order.id.in_(candidates)).filter(_like_filter(keyword))
+
+
+def _int_arg(args, name):
+    try:
+        return int(args.get(name))
+    except (TypeError, ValueError):
+        return None
+
+
+def apply_order_filters(query, args, permitted_shop_ids=None):
+    """按列表页筛选参数过滤订单。
+
+    Args:
+        query: 订单查询
+        args: 筛选参数（request.args 或导出任务保存的 dict）
+        permitted_shop_ids: 非管理员可访问的店铺ID列表，None 表示不限
+    """
+    if permitted_shop_ids is not None:
+        query = query.filter(Order.shop_id.in_(permitted_shop_ids)) if permitted_shop_ids else query.filter(db.false())
+
+    shop_id = _int_arg(args, 'shop_id')
+    shop_type = _int_arg(args, 'shop_type')
+    order_type = _int_arg(args, 'order_type')
+    order_status = _int_arg(args, 'order_status')
+    keyword = (args.get('keyword') or '').strip()
+    jd_order_no = (args.get('jd_order_no') or '').strip()
+    start_date = (args.get('start_date') or '').strip()
+    end_date = (args.get('end_date') or '').strip()
+
+    if shop_id:
+        query = query.filter(Order.shop_id == shop_id)
+    if shop_type:
+        query = query.filter(Order.shop_type == shop_type)
+    if order_type:
+        query = query.filter(Order.order_type == order_type)
+    if order_status is not None and order_status != -1:
+        query = query.filter(Order.order_status == order_status)
+
+    # 关键字搜索：支持系统订单号、京东订单号、商品名称、充值账号（分词索引 + 精确匹配）
+    if keyword:
+        query = apply_keyword_filter(query, keyword)
+    elif jd_order_no:
+        query = query.filter(Order.jd_order_no.like(f'%{jd_order_no}%'))
+    if start_date:
+        try:
+            query = query.filter(Order.create_time >= datetime.strptime(start_date, '%Y-%m-%d'))
+        except ValueError:
+            pass
+    if end_date:
+        try:
+            query = query.filter(Order.create_time <= datetime.strptime(end_date + ' 23:59:59', '%Y-%m-%d %H:%M:%S'))
+        except ValueError:
+            pass
+    return query
+
+
+# ---- 分词维护 ----
+
+def _token_rows(order_id, tokens):
+    return [{'token': t, 'order_id': order_id} for t in tokens]
+
+
+def reindex_orders(connection, orders):
+    """重建一批订单的分词（backfill 使用）。"""
+    ids = [o.id for o in orders]
+    if not ids:
+        return 0
+    connection.execute(_token_table.delete().where(_token_table.c.order_id.in_(ids)))
+    rows = []
+    for o in orders:
+        rows.extend(_token_rows(o.id, order_tokens(o)))
+    if rows:
+        connection.execute(_token_table.insert(), rows)
+    return len(rows)
+
+
+@event.listens_for(Order, 'after_insert')
+def _index_new_order(mapper, connection, target):
+    rows = _token_rows(target.id, order_tokens(target))
+    if rows:
+        connection.execute(_token_table.insert(), rows)
+
+
+@event.listens_for(Order, 'after_update')
+def _reindex_order(mapper, connection, target):
+    state = inspect(target)
+    if not any(state.attrs[f].history.has_changes() for f in SEARCH_FIELDS):
+        return
+    connection.execute(_token_table.delete().where(_token_table.c.order_id == target.id))
+    rows = _token_rows(target.id, order_tokens(target))
+    if rows:
+        connection.execute(_token_table.insert(), rows)
+
+
+@event.listens_for(Order, 'after_delete')
+def _unindex_order(mapper, connection, target):
+    connection.execute(_token_table.delete().where(_token_table.c.order_id == target.id))
@@ -0,0 +1,374 @@
+"""订单统计汇总（order_stats_hourly / order_stats_daily）。
+
+- 维护：Order 的 ORM 事件把新增/状态变更/删除换算成各汇总桶的增量，暂存在 session.info，
+  after_flush 时按桶排序后批量 upsert（同一次 flush 内同一桶只写一次，固定加锁顺序避免死锁）。
+  汇总与订单在同一事务中提交或回滚。
+- 查询：query_rollup(start, end, group_by) 统计 [start, end) 内下单的订单，
+  整天部分读天表，首尾不足一天的部分读小时表，结果行数与订单量无关。
+- 未处理订单数：同一批增量中状态为待处理 / 处理中的部分按店铺累加到 order_pending_counts，
+  pending_counts() 读取（新订单提醒角标，不再对汇总表做全量 SUM）。
+- 重建：rebuild_rollups(since) 按 orders 重新计算（python migrations/rebuild_stats.py）。
+"""
+import logging
+from collections import defaultdict
+from datetime import datetime, timedelta
+
+from sqlalchemy import event, func, inspect
+from sqlalchemy.orm import object_session
+
+from app.extensions import db
+from app.models.order import Order
+from app.models.order_stats import OrderStatHourly, OrderStatDaily, OrderPendingCount
+from app.models.shop import Shop
+
+logger = logging.getLogger(__name__)
+
+_SESSION_DELTA_KEY = 'order_stat_deltas'
+
+# 汇总维度（时间维度之外）
+DIMENSIONS = ('shop_id', 'shop_type', 'order_type', 'order_status')
+
+# 影响汇总的订单字段
+TRACKED_FIELDS = ('create_time', 'amount') + DIMENSIONS
+
+# 计入未处理订单数的订单状态（待处理 / 处理中）
+PENDING_STATUSES = (0, 1)
+
+_hourly = OrderStatHourly.__table__
+_daily = OrderStatDaily.__table__
+_pending = OrderPendingCount.__table__
+
+
+def _floor_hour(dt):
+    return dt.replace(minute=0, second=0, microsecond=0)
+
+
+def _ceil_hour(dt):
+    floor = _floor_hour(dt)
+    return floor if floor == dt else floor + timedelta(hours=1)
+
+
+def _day_start(d):
+    return datetime.combine(d, datetime.min.time())
+
+
+# ---- 增量维护 ----
+
+def _bucket(values):
+    """订单字段 -> (小时, 店铺ID, 店铺类型, 订单类型, 订单状态)，缺少店铺时不计入。"""
+    if values['shop_id'] is None:
+        return None
+    create_time = values['create_time'] or datetime.now()
+    return (_floor_hour(create_time), values['shop_id'], values['shop_type'] or 0,
+            values['order_type'] or 0, values['order_status'] or 0)
+
+
+def _current_values(target):
+    return {f: getattr(target, f) for f in TRACKED_FIELDS}
+
+
+def _previous_values(target):
+    state = inspect(target)
+    values = {}
+    for f in TRACKED_FIELDS:
+        hist = state.attrs[f].history
+        if hist.has_changes():
+            values[f] = hist.deleted[0] if hist.deleted else None
+        else:
+            values[f] = getattr(target, f)
+    return values
+
+
+def _add_delta(target, values, sign):
+    bucket = _bucket(values)
+    session = object_session(target)
+    if bucket is None or session is None:
+        return
+    deltas = session.info.setdefault(_SESSION_DELTA_KEY, defaultdict(lambda: [0, 0]))
+    delta = deltas[bucket]
+    delta[0] += sign
+    delta[1] += sign * (values['amount'] or 0)
+
+
+def _upsert(connection, table, key, count, amount):
+    values = dict(key, order_count=count, total_amount=amount, update_time=datetime.now())
+    dialect = connection.dialect.name
+    if dialect == 'mysql':
+        from sqlalchemy.dialects.mysql import insert
+        stmt = insert(table).values(**values)
+        stmt = stmt.on_duplicate_key_update(
+            order_count=table.c.order_count + stmt.inserted.order_count,
+            total_amount=table.c.total_amount + stmt.inserted.total_amount,
+            update_time=stmt.inserted.update_time,
+        )
+    elif dialect == 'sqlite':
+        from sqlalchemy.dialects.sqlite import insert
+        stmt = insert(table).values(**values)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=list(key),
+            set_={
+                'order_count': table.c.order_count + stmt.excluded.order_count,
+                'total_amount': table.c.total_amount + stmt.excluded.total_amount,
+                'update_time': stmt.excluded.update_time,
+            },
+        )
+    else:
+        cond = [table.c[k] == v for k, v in key.items()]
+        result = connection.execute(table.update().where(*cond).values(
+            order_count=table.c.order_count + count,
+            total_amount=table.c.total_amount + amount,
+            update_time=values['update_time'],
+        ))
+        if result.rowcount:
+            return
+        stmt = table.insert().values(**values)
+    connection.execute(stmt)
+
+
+def _upsert_pending(connection, shop_id, count):
+    values = dict(shop_id=shop_id, pending_count=count, update_time=datetime.now())
+    dialect = connection.dialect.name
+    if dialect == 'mysql':
+        from sqlalchemy.dialects.mysql import insert
+        stmt = insert(_pending).values(**values)
+        stmt = stmt.on_duplicate_key_update(
+            pending_count=_pending.c.pending_count + stmt.inserted.pending_count,
+            update_time=stmt.inserted.update_time,
+        )
+    elif dialect == 'sqlite':
+        from sqlalchemy.dialects.sqlite import insert
+        stmt = insert(_pending).values(**values)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=['shop_id'],
+            set_={
+                'pending_count': _pending.c.pending_count + stmt.excluded.pending_count,
+                'update_time': stmt.excluded.update_time,
+            },
+        )
+    else:
+        result = connection.execute(_pending.update().where(_pending.c.shop_id == shop_id).values(
+            pending_count=_pending.c.pending_count + count,
+            update_time=values['update_time'],
+        ))
+        if result.rowcount:
+            return
+        stmt = _pending.insert().values(**values)
+    connection.execute(stmt)
+
+
+def _apply_deltas(connection, deltas):
+    daily = defaultdict(lambda: [0, 0])
+    pending = defaultdict(int)
+    for bucket in sorted(deltas):
+        count, amount = deltas[bucket]
+        if not count and not amount:
+            continue
+        hour, shop_id, shop_type, order_type, order_status = bucket
+        dims = dict(shop_id=shop_id, shop_type=shop_type, order_type=order_type, order_status=order_status)
+        _upsert(connection, _hourly, dict(stat_hour=hour, **dims), count, amount)
+        day = daily[(hour.date(), shop_id, shop_type, order_type, order_status)]
+        day[0] += count
+        day[1] += amount
+        if order_status in PENDING_STATUSES:
+            pending[shop_id] += count
+    for key in sorted(daily):
+        count, amount = daily[key]
+        if not count and not amount:
+            continue
+        stat_date, shop_id, shop_type, order_type, order_status = key
+        _upsert(connection, _daily, dict(stat_date=stat_date, shop_id=shop_id, shop_type=shop_type,
+                                         order_type=order_type, order_status=order_status), count, amount)
+    for shop_id in sorted(pending):
+        if pending[shop_id]:
+            _upsert_pending(connection, shop_id, pending[shop_id])
+
+
+def _keep_old_value(target, value, oldvalue, initiator):
+    return value
+
+
+# 提交后属性已过期时直接赋值也要先加载旧值，否则无法从原桶中扣减
+for _field in TRACKED_FIELDS:
+    event.listen(getattr(Order, _field), 'set', _keep_old_value, active_history=True, retval=True)
+
+
+@event.listens_for(Order, 'after_insert')
+def _count_new_order(mapper, connection, target):
+    _add_delta(target, _current_values(target), 1)
+
+
+@event.listens_for(Order, 'after_update')
+def _move_order(mapper, connection, target):
+    state = inspect(target)
+    if not any(state.attrs[f].history.has_changes() for f in TRACKED_FIELDS):
+        return
+    _add_delta(target, _previous_values(target), -1)
+    _add_delta(target, _current_values(target), 1)
+
+
+@event.listens_for(Order, 'after_delete')
+def _uncount_order(mapper, connection, target):
+    _add_delta(target, _previous_values(target), -1)
+
+
+@event.listens_for(db.session, 'after_flush')
+def _flush_deltas(session, flush_context):
+    deltas = session.info.pop(_SESSION_DELTA_KEY, None)
+    if deltas:
+        _apply_deltas(session.connection(), deltas)
+
+
+@event.listens_for(db.session, 'after_rollback')
+def _discard_deltas(session):
+    session.info.pop(_SESSION_DELTA_KEY, None)
+
+
+@event.listens_for(Shop, 'after_delete')
+def _drop_shop_stats(mapper, connection, target):
+    connection.execute(_hourly.delete().where(_hourly.c.shop_id == target.id))
+    connection.execute(_daily.delete().where(_daily.c.shop_id == target.id))
+    connection.execute(_pending.delete().where(_pending.c.shop_id == target.id))
+
+
+# ---- 查询 ----
+
+def _select(model, time_col, lo, hi, group_by, shop_ids):
+    cols = [getattr(model, g) for g in group_by]
+    query = db.session.query(*cols, func.sum(model.order_count), func.sum(model.total_amount))
+    if lo is not None:
+        query = query.filter(time_col >= lo)
+    if hi is not None:
+        query = query.filter(time_col < hi)
+    if shop_ids is not None:
+        query = query.filter(model.shop_id.in_(shop_ids)) if shop_ids else query.filter(db.false())
+    if cols:
+        query = query.group_by(*cols)
+    return query.all()
+
+
+def query_rollup(start=None, end=None, group_by=(), shop_ids=None):
+    """统计 [start, end) 内下单的订单（按小时取整）。
+
+    Args:
+        start / end: datetime，None 表示不限
+        group_by: DIMENSIONS 中的字段
+        shop_ids: 限定店铺ID列表，None 表示全部
+
+    Returns:
+        dict: {分组值元组: (订单数, 金额分)}，不分组时键为 ()
+    """
+    group_by = tuple(group_by)
+    for g in group_by:
+        if g not in DIMENSIONS:
+            raise ValueError(f'不支持的统计维度: {g}')
+
+    lo = _floor_hour(start) if start else None
+    hi = _ceil_hour(end) if end else None
+    if lo is not None:
+        day_lo = lo.date() if lo == _day_start(lo.date()) else lo.date() + timedelta(days=1)
+    else:
+        day_lo = None
+    day_hi = hi.date() if hi is not None else None
+
+    segments = []
+    if day_lo is None or day_hi is None or day_lo < day_hi:
+        segments.append((OrderStatDaily, OrderStatDaily.stat_date, day_lo, day_hi))
+        if lo is not None and lo < _day_start(day_lo):
+            segments.append((OrderStatHourly, OrderStatHourly.stat_hour, lo, _day_start(day_lo)))
+        if hi is not None and _day_start(day_hi) < hi:
+            segments.append((OrderStatHourly, OrderStatHourly.stat_hour, _day_start(day_hi), hi))
+    elif lo < hi:
+        segments.append((OrderStatHourly, OrderStatHourly.stat_hour, lo, hi))
+
+    result = defaultdict(lambda: [0, 0])
+    for model, time_col, seg_lo, seg_hi in segments:
+        for row in _select(model, time_col, seg_lo, seg_hi, group_by, shop_ids):
+            count, amount = row[-2], row[-1]
+            if count is None:
+                continue
+            acc = result[tuple(row[:-2])]
+            acc[0] += int(count)
+            acc[1] += int(amount or 0)
+    return {k: (v[0], v[1]) for k, v in result.items() if v[0]}
+
+
+def daily_series(start_date, end_date, shop_ids=None):
+    """[start_date, end_date] 每天的下单数与金额，返回 {date: (订单数, 金额分)}。"""
+    query = db.session.query(
+        OrderStatDaily.stat_date,
+        func.sum(OrderStatDaily.order_count),
+        func.sum(OrderStatDaily.total_amount),
+    ).filter(OrderStatDaily.stat_date >= start_date, OrderStatDaily.stat_date <= end_date)
+    if shop_ids is not None:
+        query = query.filter(OrderStatDaily.shop_id.in_(shop_ids)) if shop_ids else query.filter(db.false())
+    rows = query.group_by(OrderStatDaily.stat_date).all()
+    return {r[0]: (int(r[1] or 0), int(r[2] or 0)) for r in rows}
+
+
+def pending_counts(shop_ids=None):
+    """各店铺未处理订单数 {shop_id: 数量}，shop_ids 为 None 表示全部店铺。"""
+    query = db.session.query(OrderPendingCount.shop_id, OrderPendingCount.pending_count)
+    if shop_ids is not None:
+        if not shop_ids:
+            return {}
+        query = query.filter(OrderPendingCount.shop_id.in_(shop_ids))
+    return {shop_id: count for shop_id, count in query if count}
+
+
+# ---- 重建 ----
+
+def rebuild_rollups(since=None, batch_size=5000):
+    """按 orders 重新计算汇总（需在应用上下文中调用）。
+
+    Args:
+        since: 只重建该日期（含）之后下单的订单，None 表示全量
+        batch_size: 每批读取的订单数
+
+    Returns:
+        int: 参与计算的订单数
+    """
+    since = _day_start(since.date() if isinstance(since, datetime) else since) if since else None
+
+    hourly_del = _hourly.delete()
+    daily_del = _daily.delete()
+    if since is not None:
+        hourly_del = hourly_del.where(_hourly.c.stat_hour >= since)
+        daily_del = daily_del.where(_daily.c.stat_date >= since.date())
+    db.session.execute(hourly_del)
+    db.session.execute(daily_del)
+
+    # 未处理订单数不分时间，整体重算：since 之前的部分直接分组统计，之后的部分随增量累加
+    db.session.execute(_pending.delete())
+    if since is not None:
+        earlier = db.session.query(Order.shop_id, func.count(Order.id)).filter(
+            Order.create_time < since, Order.order_status.in_(PENDING_STATUSES),
+            Order.shop_id.isnot(None),
+        ).group_by(Order.shop_id).all()
+        for shop_id, count in earlier:
+            _upsert_pending(db.session.connection(), shop_id, count)
+
+    deltas = defaultdict(lambda: [0, 0])
+    last_id = 0
+    total = 0
+    while True:
+        query = db.session.query(
+            Order.id, Order.create_time, Order.amount, *[getattr(Order, d) for d in DIMENSIONS]
+        ).filter(Order.id > last_id)
+        if since is not None:
+            query = query.filter(Order.create_time >= since)
+        rows = query.order_by(Order.id).limit(batch_size).all()
+        if not rows:
+            break
+        for row in rows:
+            bucket = _bucket(row._asdict())
+            if bucket is None:
+                continue
+            deltas[bucket][0] += 1
+            deltas[bucket][1] += row.amount or 0
+        total += len(rows)
+        last_id = rows[-1].id
+
+    _apply_deltas(db.session.connection(), deltas)
+    db.session.commit()
+    logger.info(f'订单统计汇总重建完成：{total} 个订单，{len(deltas)} 个小时桶')
+    return total
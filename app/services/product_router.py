@@ -0,0 +1,187 @@
+"""商品发货路由表（91卡券 / 直充）。
+
+每个卡密 / 直充订单接单时都要按 (shop_id, sku_id) 查一次商品配置，手动91卡券发货在 SKU 未匹配时
+还要按商品名称做 LIKE '%关键字%' 查询（无法使用索引）。商品配置很少修改，这里在进程内
+维护一份只读路由表：
+
+- 只包含已启用、发货方式为91卡券或直充的商品，保存不可变快照（ProductSnapshot）
+- (shop_id, sku_id) 字典精确匹配（两种发货方式各一份）；91卡券商品名称按字符二元组建立倒排索引，模糊匹配时取关键字
+  所有二元组的候选集交集，再逐个确认包含关系（与 LIKE 一样不区分大小写）
+- 同一 SKU / 名称匹配多个商品时取 ID 最小的一个
+- Product 表任何增删改（以及删除店铺）提交后自动失效（ORM 事件），并通过版本戳通知其他 worker；
+  另外每 PRODUCT_ROUTER_TTL 秒重建一次兜底
+
+接单接口与发货匹配商品不产生数据库往返。
+"""
+import logging
+import threading
+import time
+from collections import namedtuple
+
+from sqlalchemy import event
+from sqlalchemy.orm import object_session
+
+from app.extensions import db
+from app.models.product import Product
+from app.models.shop import Shop
+from app.utils.version_stamp import VersionStamp
+
+logger = logging.getLogger(__name__)
+
+ProductSnapshot = namedtuple('ProductSnapshot', [c.name for c in Product.__table__.columns])
+
+_SESSION_DIRTY_KEY = 'product_router_dirty'
+
+# 按商品名称模糊匹配时使用的关键字长度（与原 product_info[:20] 一致）
+NAME_KEYWORD_LENGTH = 20
+
+
+def _snapshot(product):
+    return ProductSnapshot(**{f: getattr(product, f) for f in ProductSnapshot._fields})
+
+
+def _bigrams(text):
+    return {text[i:i + 2] for i in range(len(text) - 1)}
+
+
+class _RouteTable:
+    """一次构建出的完整路由表（构建后只读）。"""
+
+    def __init__(self, products, version, ttl):
+        self.version = version
+        self.expires_at = time.monotonic() + ttl
+        self.by_sku = {}
+        self.direct_by_sku = {}
+        self.by_shop = {}  # shop_id -> [(小写名称, 快照)]，按 ID 升序
+        self.name_index = {}  # shop_id -> {二元组: {在 by_shop 列表中的下标}}
+
+        for product in sorted(products, key=lambda p: p.id):
+            if product.deliver_type == 2:
+                if product.sku_id:
+                    self.direct_by_sku.setdefault((product.shop_id, product.sku_id), product)
+                continue
+            if product.sku_id:
+                self.by_sku.setdefault((product.shop_id, product.sku_id), product)
+            name = (product.product_name or '').casefold()
+            entries = self.by_shop.setdefault(product.shop_id, [])
+            index = self.name_index.setdefault(product.shop_id, {})
+            for gram in _bigrams(name):
+                index.setdefault(gram, set()).add(len(entries))
+            entries.append((name, product))
+
+    def by_name(self, shop_id, keyword):
+        keyword = (keyword or '').casefold()
+        entries = self.by_shop.get(shop_id)
+        if not keyword or not entries:
+            return None
+        grams = _bigrams(keyword)
+        if grams:
+            index = self.name_index[shop_id]
+            candidates = None
+            for gram in grams:
+                positions = index.get(gram)
+                if not positions:
+                    return None
+                candidates = positions if candidates is None else candidates & positions
+                if not candidates:
+                    return None
+            positions = sorted(candidates)
+        else:
+            positions = range(len(entries))
+        for position in positions:
+            name, product = entries[position]
+            if keyword in name:
+                return product
+        return None
+
+
+class ProductRouter:
+    """应用级商品发货路由表。"""
+
+    def __init__(self, app):
+        self.app = app
+        self.ttl = int(app.config.get('PRODUCT_ROUTER_TTL', 300))
+        self.stamp = VersionStamp(app.config.get('CACHE_STAMP_DIR'), 'product')
+        self._table = None
+        self._lock = threading.Lock()
+
+    def _current_table(self):
+        table = self._table
+        version = self.stamp.current()
+        if table is not None and table.version == version and time.monotonic() < table.expires_at:
+            return table
+        with self._lock:
+            table = self._table
+            if table is not None and table.version == version and time.monotonic() < table.expires_at:
+                return table
+            products = [_snapshot(p) for p in Product.query.filter(
+                Product.is_enabled == 1, Product.deliver_type.in_((1, 2)),
+            )]
+            table = _RouteTable(products, version, self.ttl)
+            self._table = table
+            logger.debug(f'商品路由表已重建：{len(products)}个自动发货商品')
+            return table
+
+    def by_sku(self, shop_id, sku_id):
+        """按 shop_id + sku_id 精确匹配启用的91卡券商品。"""
+        if not sku_id:
+            return None
+        return self._current_table().by_sku.get((shop_id, sku_id))
+
+    def direct_charge(self, shop_id, sku_id):
+        """按 shop_id + sku_id 精确匹配启用的直充商品。"""
+        if not sku_id:
+            return None
+        return self._current_table().direct_by_sku.get((shop_id, sku_id))
+
+    def by_name(self, shop_id, keyword):
+        """按商品名称包含关键字匹配启用的91卡券商品。"""
+        return self._current_table().by_name(shop_id, keyword)
+
+    def match(self, shop_id, sku_id=None, product_info=None):
+        """订单匹配91卡券商品：SKU 精确匹配优先，其次按订单商品信息前20个字符匹配商品名称。"""
+        product = self.by_sku(shop_id, sku_id)
+        if product is None and product_info:
+            product = self.by_name(shop_id, product_info[:NAME_KEYWORD_LENGTH])
+        return product
+
+    def invalidate(self):
+        """失效本进程路由表并通知其他 worker。"""
+        self._table = None
+        self.stamp.bump()
+
+
+def init_product_router(app):
+    router = ProductRouter(app)
+    app.extensions['product_router'] = router
+    return router
+
+
+def get_product_router():
+    from flask import current_app
+    return current_app.extensions['product_router']
+
+
+# ---- 自动失效：Product 有增删改（或删除店铺级联删除商品）并提交后失效路由表 ----
+
+@event.listens_for(Product, 'after_insert')
+@event.listens_for(Product, 'after_update')
+@event.listens_for(Product, 'after_delete')
+@event.listens_for(Shop, 'after_delete')
+def _mark_product_dirty(mapper, connection, target):
+    session = object_session(target) or db.session
+    session.info[_SESSION_DIRTY_KEY] = True
+
+
+@event.listens_for(db.session, 'after_commit')
+def _invalidate_on_commit(session):
+    if session.info.pop(_SESSION_DIRTY_KEY, False):
+        try:
+            get_product_router().invalidate()
+        except Exception as e:
+            logger.warning(f'商品路由表失效失败: {e}')
+
+
+@event.listens_for(db.session, 'after_rollback')
+def _clear_on_rollback(session):
+    session.info.pop(_SESSION_DIRTY_KEY, None)
@@ -0,0 +1,77 @@
+"""按 key 的令牌桶限流（通知 webhook 使用）。
+
+钉钉机器人每个 webhook 每分钟最多约 20 条消息（企业微信类似），超出后返回错误，
+重试只会让限流更严重。这里每个 webhook 一个令牌桶：
+
+- 容量 burst，每分钟补充 rate_per_minute 个令牌
+- acquire() 取到令牌返回 0，否则返回需要等待的秒数（不阻塞，调用方延时重排）
+- 配置 SQLite 文件时令牌状态在同一台机器的 worker 间共享（BEGIN IMMEDIATE 串行），
+  为空则仅进程内限流
+"""
+import logging
+import sqlite3
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class TokenBucketLimiter:
+    def __init__(self, rate_per_minute, burst, path=None):
+        self.rate = rate_per_minute / 60.0
+        self.burst = max(1, burst)
+        self.path = path
+        self._buckets = {}  # key -> (令牌数, 更新时间)
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        return self.rate > 0
+
+    def _take(self, tokens, updated, now):
+        """返回 (新令牌数, 需等待秒数)。"""
+        if updated is None:
+            tokens = float(self.burst)
+        else:
+            tokens = min(float(self.burst), tokens + max(now - updated, 0) * self.rate)
+        if tokens >= 1:
+            return tokens - 1, 0.0
+        return tokens, (1 - tokens) / self.rate
+
+    def acquire(self, key, now=None):
+        """为 key 取一个令牌，返回需要等待的秒数（0 表示已取到）。"""
+        if not self.enabled or not key:
+            return 0.0
+        now = time.time() if now is None else now
+        if self.path:
+            try:
+                return self._acquire_shared(key, now)
+            except sqlite3.Error as e:
+                logger.warning(f'限流状态读写失败，改为进程内限流: {e}')
+        with self._lock:
+            tokens, updated = self._buckets.get(key, (None, None))
+            tokens, wait = self._take(tokens, updated, now)
+            self._buckets[key] = (tokens, now)
+        return wait
+
+    def _conn(self):
+        conn = sqlite3.connect(self.path, timeout=1, isolation_level=None)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute(
+            'CREATE TABLE IF NOT EXISTS token_buckets ('
+            ' key TEXT PRIMARY KEY, tokens REAL NOT NULL, updated REAL NOT NULL)'
+        )
+        return conn
+
+    def _acquire_shared(self, key, now):
+        conn = self._conn()
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            row = conn.execute('SELECT tokens, updated FROM token_buckets WHERE key = ?', (key,)).fetchone()
+            tokens, wait = self._take(row[0] if row else None, row[1] if row else None, now)
+            conn.execute('INSERT OR REPLACE INTO token_buckets (key, tokens, updated) VALUES (?, ?, ?)',
+                         (key, tokens, now))
+            conn.execute('COMMIT')
+            return wait
+        finally:
+            conn.close()
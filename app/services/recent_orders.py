@@ -0,0 +1,176 @@
+"""近期订单防重索引。
+
+京东超时重推时，同一个 jd_order_no 会在短时间内反复推送。这里维护一份
+(jd_order_no, shop_id) -> order_no 的近期订单索引，重复推单直接从索引应答，
+不再访问 MySQL。
+
+两级存储：
+- 进程内 LRU（RECENT_ORDER_LRU_SIZE 条）
+- 本机 SQLite 文件（RECENT_ORDER_DB，WAL 模式），所有 gunicorn worker 共享
+
+只保留 RECENT_ORDER_WINDOW_HOURS 小时内的订单；每个进程首次使用时
+从 MySQL 预热最近 RECENT_ORDER_WINDOW_HOURS 小时的订单。
+索引只是加速层：未命中时仍由 orders 唯一索引兜底防重。
+"""
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+
+logger = logging.getLogger(__name__)
+
+# 每写入多少条清理一次过期数据
+PRUNE_EVERY = 1000
+
+
+class RecentOrderIndex:
+    """近期订单索引（进程内 LRU + 跨进程 SQLite）。"""
+
+    def __init__(self, app):
+        self.app = app
+        self.path = app.config.get('RECENT_ORDER_DB')
+        self.window = int(app.config.get('RECENT_ORDER_WINDOW_HOURS', 24)) * 3600
+        self.capacity = int(app.config.get('RECENT_ORDER_LRU_SIZE', 10000))
+        self._lru = OrderedDict()
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._warmed_pid = None
+        self._puts = 0
+
+    # ---- SQLite ----
+
+    def _conn(self):
+        if not self.path:
+            return None
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None and self._local.pid == os.getpid():
+            return conn
+        conn = sqlite3.connect(self.path, timeout=1, isolation_level=None, check_same_thread=False)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.execute(
+            'CREATE TABLE IF NOT EXISTS recent_orders ('
+            ' jd_order_no TEXT NOT NULL, shop_id INTEGER NOT NULL, order_no TEXT NOT NULL,'
+            ' created_at REAL NOT NULL, PRIMARY KEY (jd_order_no, shop_id))'
+        )
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_created_at ON recent_orders (created_at)')
+        self._local.conn = conn
+        self._local.pid = os.getpid()
+        return conn
+
+    # ---- LRU ----
+
+    def _lru_get(self, key):
+        with self._lock:
+            entry = self._lru.get(key)
+            if entry is None:
+                return None
+            order_no, created_at = entry
+            if created_at < time.time() - self.window:
+                del self._lru[key]
+                return None
+            self._lru.move_to_end(key)
+            return order_no
+
+    def _lru_put(self, key, order_no, created_at):
+        with self._lock:
+            self._lru[key] = (order_no, created_at)
+            self._lru.move_to_end(key)
+            while len(self._lru) > self.capacity:
+                self._lru.popitem(last=False)
+
+    # ---- 对外接口 ----
+
+    def get(self, jd_order_no, shop_id):
+        """查询近期订单，命中返回我方订单号，否则返回 None。"""
+        if not jd_order_no or not shop_id:
+            return None
+        self._ensure_warm()
+        key = (str(jd_order_no), int(shop_id))
+        order_no = self._lru_get(key)
+        if order_no is not None:
+            return order_no
+        try:
+            conn = self._conn()
+            if conn is None:
+                return None
+            row = conn.execute(
+                'SELECT order_no, created_at FROM recent_orders WHERE jd_order_no = ? AND shop_id = ?',
+                key,
+            ).fetchone()
+        except sqlite3.Error as e:
+            logger.warning(f'近期订单索引查询失败: {e}')
+            return None
+        if not row or row[1] < time.time() - self.window:
+            return None
+        self._lru_put(key, row[0], row[1])
+        return row[0]
+
+    def put(self, jd_order_no, shop_id, order_no, created_at=None):
+        """记录一条接单成功的订单。"""
+        if not jd_order_no or not shop_id or not order_no:
+            return
+        self.put_many([(jd_order_no, shop_id, order_no, created_at)])
+
+    def put_many(self, rows):
+        now = time.time()
+        records = []
+        for jd_order_no, shop_id, order_no, created_at in rows:
+            ts = created_at.timestamp() if isinstance(created_at, datetime) else (created_at or now)
+            key = (str(jd_order_no), int(shop_id))
+            self._lru_put(key, order_no, ts)
+            records.append((key[0], key[1], order_no, ts))
+        if not records:
+            return
+        try:
+            conn = self._conn()
+            if conn is None:
+                return
+            conn.executemany(
+                'INSERT OR REPLACE INTO recent_orders (jd_order_no, shop_id, order_no, created_at) '
+                'VALUES (?, ?, ?, ?)',
+                records,
+            )
+            self._puts += len(records)
+            if self._puts >= PRUNE_EVERY:
+                self._puts = 0
+                conn.execute('DELETE FROM recent_orders WHERE created_at < ?', (now - self.window,))
+        except sqlite3.Error as e:
+            logger.warning(f'近期订单索引写入失败: {e}')
+
+    def _ensure_warm(self):
+        pid = os.getpid()
+        if self._warmed_pid == pid:
+            return
+        self._warmed_pid = pid
+        self.warm()
+
+    def warm(self):
+        """从 MySQL 预热最近窗口内的订单。"""
+        from app.models.order import Order
+        since = datetime.now() - timedelta(seconds=self.window)
+        try:
+            with self.app.app_context():
+                rows = Order.query.with_entities(
+                    Order.jd_order_no, Order.shop_id, Order.order_no, Order.create_time,
+                ).filter(Order.create_time >= since).all()
+        except Exception as e:
+            logger.warning(f'近期订单索引预热失败: {e}')
+            return 0
+        self.put_many([tuple(r) for r in rows if r[0]])
+        logger.info(f'近期订单索引预热完成：{len(rows)}条')
+        return len(rows)
+
+
+def init_recent_orders(app):
+    index = RecentOrderIndex(app)
+    app.extensions['recent_orders'] = index
+    return index
+
+
+def get_recent_orders():
+    from flask import current_app
+    return current_app.extensions['recent_orders']
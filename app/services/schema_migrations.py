@@ -0,0 +1,245 @@
+"""版本化的数据库结构迁移与热点查询索引审计。
+
+- MIGRATIONS 按版本号顺序声明结构变更（加字段 / 加索引 / 删索引），已执行的版本记录在
+  schema_migrations 表，python migrations/migrate.py（init_db.py 也会调用）只执行未记录的版本
+- 每个操作执行前先检查是否已存在，新装库（init.sql / db.create_all 已包含最新结构）执行时
+  只登记版本
+- MySQL 下索引变更使用 ALGORITHM=INPLACE, LOCK=NONE 在线执行，不阻塞读写
+- hot_queries() 列出热点查询及其应使用的索引，explain_indexes() 用 EXPLAIN 取实际使用的索引，
+  测试与 python migrations/migrate.py --explain 据此检查索引是否生效
+"""
+import logging
+import re
+from collections import namedtuple
+from datetime import datetime
+
+from sqlalchemy import func, inspect, select, text
+
+from app.extensions import db
+from app.models.api_log import ApiLog
+from app.models.card_inventory import CardInventory
+from app.models.order import Order
+from app.models.product import Product
+from app.models.schema_migration import SchemaMigration
+
+logger = logging.getLogger(__name__)
+
+
+class AddColumn:
+    """添加字段，definition 为 MySQL 字段定义（其他数据库去掉 COMMENT）。"""
+
+    def __init__(self, table, name, definition):
+        self.table = table
+        self.name = name
+        self.definition = definition
+
+    def is_applied(self, inspector):
+        return self.name in {c['name'] for c in inspector.get_columns(self.table)}
+
+    def sql(self, dialect):
+        definition = self.definition
+        if dialect != 'mysql':
+            definition = re.sub(r'\s+COMMENT\s+.*$', '', definition)
+        return f'ALTER TABLE {self.table} ADD COLUMN {self.name} {definition}'
+
+    def __str__(self):
+        return f'添加字段 {self.table}.{self.name}'
+
+
+def _index_names(inspector, table):
+    names = {i['name'] for i in inspector.get_indexes(table)}
+    names.update(u['name'] for u in inspector.get_unique_constraints(table))
+    return names
+
+
+class AddIndex:
+    def __init__(self, table, name, columns, unique=False):
+        self.table = table
+        self.name = name
+        self.columns = tuple(columns)
+        self.unique = unique
+
+    def is_applied(self, inspector):
+        return self.name in _index_names(inspector, self.table)
+
+    def sql(self, dialect):
+        kind = 'UNIQUE INDEX' if self.unique else 'INDEX'
+        columns = ', '.join(self.columns)
+        if dialect == 'mysql':
+            return f'ALTER TABLE {self.table} ADD {kind} {self.name} ({columns}), ALGORITHM=INPLACE, LOCK=NONE'
+        return f'CREATE {kind} {self.name} ON {self.table} ({columns})'
+
+    def __str__(self):
+        return f'添加{"唯一" if self.unique else ""}索引 {self.table}.{self.name} ({", ".join(self.columns)})'
+
+
+class DropIndex:
+    def __init__(self, table, name):
+        self.table = table
+        self.name = name
+
+    def is_applied(self, inspector):
+        return self.name not in _index_names(inspector, self.table)
+
+    def sql(self, dialect):
+        if dialect == 'mysql':
+            return f'ALTER TABLE {self.table} DROP INDEX {self.name}, ALGORITHM=INPLACE, LOCK=NONE'
+        return f'DROP INDEX {self.name}'
+
+    def __str__(self):
+        return f'删除索引 {self.table}.{self.name}'
+
+
+Migration = namedtuple('Migration', 'version description operations')
+
+MIGRATIONS = [
+    Migration('0001', 'shops 表添加91卡券字段', [
+        AddColumn('shops', 'card91_api_url', 'VARCHAR(500) COMMENT "91卡券API地址"'),
+        AddColumn('shops', 'card91_api_key', 'VARCHAR(200) COMMENT "91卡券API密钥"'),
+        AddColumn('shops', 'card91_api_secret', 'VARCHAR(500) COMMENT "91卡券API签名密钥"'),
+    ]),
+    # 旧版 init.sql 建的是非唯一索引 (jd_order_no, shop_type)，接单防重复依赖该唯一索引；
+    # 存在重复订单时会失败，需先清理
+    Migration('0002', 'orders (jd_order_no, shop_id) 唯一索引', [
+        AddIndex('orders', 'idx_jd_order_shop', ('jd_order_no', 'shop_id'), unique=True),
+    ]),
+    Migration('0003', 'orders 充值账号索引（关键字搜索精确匹配）', [
+        AddIndex('orders', 'idx_produce_account', ('produce_account',)),
+    ]),
+    Migration('0004', '热点查询索引', [
+        AddIndex('orders', 'idx_order_shop_id', ('shop_id', 'id')),
+        AddIndex('orders', 'idx_order_status_id', ('order_status', 'id')),
+        AddIndex('api_logs', 'idx_api_type_id', ('api_type', 'id')),
+        AddIndex('products', 'idx_product_match', ('shop_id', 'sku_id', 'is_enabled', 'deliver_type')),
+        # 被 idx_product_match 的前缀覆盖
+        DropIndex('products', 'idx_shop_sku'),
+    ]),
+    Migration('0005', 'notification_logs 汇总通知覆盖的订单', [
+        AddColumn('notification_logs', 'order_ids', 'TEXT COMMENT "汇总通知覆盖的订单ID列表JSON"'),
+    ]),
+    Migration('0006', '91卡券本地库存（商品配置与SKU销量索引）', [
+        AddColumn('products', 'card_pool_enabled', 'SMALLINT NOT NULL DEFAULT 0 COMMENT "是否启用本地库存"'),
+        AddColumn('products', 'card_pool_max', 'INT COMMENT "本地库存上限（为空使用全局配置）"'),
+        AddIndex('orders', 'idx_order_sku_time', ('shop_id', 'sku_id', 'create_time')),
+    ]),
+    Migration('0007', 'export_jobs 执行心跳（回收进程退出后卡住的导出任务）', [
+        AddColumn('export_jobs', 'locked_at', 'DATETIME COMMENT "最近一次心跳时间"'),
+    ]),
+    Migration('0008', 'bulk_jobs 执行心跳（回收进程退出后卡住的批量任务）', [
+        AddColumn('bulk_jobs', 'locked_at', 'DATETIME COMMENT "最近一次心跳时间"'),
+    ]),
+    # 旧版 init.sql 的索引：idx_jd_order 已被 idx_jd_order_shop 取代，idx_shop 的 shop_id 前缀
+    # 被 idx_order_shop_id 覆盖、按状态统计改读汇总表；只增加写入开销
+    Migration('0009', 'orders 删除旧版冗余索引', [
+        DropIndex('orders', 'idx_jd_order'),
+        DropIndex('orders', 'idx_shop'),
+    ]),
+]
+
+
+# ---- 执行 ----
+
+def applied_versions():
+    SchemaMigration.__table__.create(db.session.connection(), checkfirst=True)
+    return {v for (v,) in db.session.query(SchemaMigration.version)}
+
+
+def pending_migrations():
+    applied = applied_versions()
+    return [m for m in MIGRATIONS if m.version not in applied]
+
+
+def apply_migrations(log=logger.info):
+    """按顺序执行未执行的迁移，返回本次执行的版本号列表。
+
+    某个版本失败时抛出异常，之后的版本不再执行（已完成的版本已记录）。
+    """
+    done = []
+    for migration in pending_migrations():
+        for op in migration.operations:
+            connection = db.session.connection()
+            if op.is_applied(inspect(connection)):
+                continue
+            try:
+                db.session.execute(text(op.sql(connection.dialect.name)))
+                db.session.commit()
+            except Exception:
+                db.session.rollback()
+                log(f'迁移 {migration.version} 失败：{op}')
+                raise
+            log(f'迁移 {migration.version}：{op}')
+        db.session.add(SchemaMigration(version=migration.version, description=migration.description))
+        db.session.commit()
+        done.append(migration.version)
+    return done
+
+
+# ---- 热点查询审计 ----
+
+HotQuery = namedtuple('HotQuery', 'name description statement index')
+
+
+def hot_queries():
+    """热点查询及应使用的索引（参数为示例值，只用于 EXPLAIN）。"""
+    return [
+        HotQuery('jd_order_lookup', '京东查单 / 阿奇索按京东订单号查订单',
+                 select(Order).where(Order.jd_order_no == 'JD0000000001'), 'idx_jd_order_shop'),
+        HotQuery('order_ingest_dedup', '接单防重复',
+                 select(Order).where(Order.jd_order_no == 'JD0000000001', Order.shop_id == 1),
+                 'idx_jd_order_shop'),
+        HotQuery('order_list_permitted', '操作员订单列表（按店铺权限过滤）',
+                 select(Order).where(Order.shop_id.in_([1, 2, 3])).order_by(Order.id.desc()).limit(20),
+                 'idx_order_shop_id'),
+        HotQuery('order_list_status', '订单列表按状态筛选（待处理 / 处理中）',
+                 select(Order).where(Order.order_status.in_([0, 1])).order_by(Order.id.desc()).limit(20),
+                 'idx_order_status_id'),
+        HotQuery('api_log_by_type', 'API 日志按接口类型筛选',
+                 select(ApiLog).where(ApiLog.api_type == '游戏直充接单').order_by(ApiLog.id.desc()).limit(20),
+                 'idx_api_type_id'),
+        HotQuery('card91_product_match', '接单时匹配91卡券商品',
+                 select(Product).where(Product.shop_id == 1, Product.sku_id == 'SKU1',
+                                       Product.is_enabled == 1, Product.deliver_type == 1),
+                 'idx_product_match'),
+        HotQuery('card_pool_claim', '91卡券本地库存领取卡密',
+                 select(CardInventory.id).where(CardInventory.product_id == 1, CardInventory.status == 0)
+                 .order_by(CardInventory.id).limit(1),
+                 'idx_inventory_claim'),
+        HotQuery('card_pool_sales_rate', '本地库存补货统计SKU近期销量',
+                 select(Order.sku_id, func.sum(Order.quantity))
+                 .where(Order.shop_id == 1, Order.sku_id.in_(['SKU1', 'SKU2']), Order.order_type == 2,
+                        Order.create_time >= datetime(2024, 1, 1))
+                 .group_by(Order.sku_id),
+                 'idx_order_sku_time'),
+    ]
+
+
+_SQLITE_INDEX = re.compile(r'USING (?:COVERING )?INDEX (\w+)')
+
+
+def explain_indexes(statement):
+    """EXPLAIN 语句，返回执行计划中使用的索引名集合（支持 MySQL / SQLite）。"""
+    connection = db.session.connection()
+    dialect = connection.dialect
+    sql = str(statement.compile(dialect=dialect, compile_kwargs={'literal_binds': True}))
+    if dialect.name == 'sqlite':
+        rows = connection.exec_driver_sql(f'EXPLAIN QUERY PLAN {sql}').all()
+        return {m.group(1) for row in rows for m in [_SQLITE_INDEX.search(row[-1])] if m}
+    if dialect.name == 'mysql':
+        rows = connection.exec_driver_sql(f'EXPLAIN {sql}').mappings().all()
+        return {row['key'] for row in rows if row['key']}
+    raise ValueError(f'不支持的数据库: {dialect.name}')
+
+
+def audit_hot_queries():
+    """检查每个热点查询是否使用了预期索引，返回 [{name, description, index, used, ok}]。"""
+    result = []
+    for query in hot_queries():
+        used = explain_indexes(query.statement)
+        result.append({
+            'name': query.name,
+            'description': query.description,
+            'index': query.index,
+            'used': sorted(used),
+            'ok': query.index in used,
+        })
+    return result
@@ -0,0 +1,152 @@
+"""店铺解析缓存。
+
+京东推单/查单接口每次都要按 customerId / vendorId / shop_code 定位店铺，
+而店铺配置一天只改几次。这里在进程内维护一份只读索引：
+
+- 按 game_customer_id / general_vendor_id / shop_code 建立字典索引
+- 索引中保存不可变的店铺配置快照（ShopSnapshot），只包含已启用店铺
+- Shop 表任何增删改提交后自动失效（ORM 事件），并通过版本戳通知其他 worker
+- 到达 SHOP_CACHE_TTL 或任一店铺的到期时间边界时重建
+
+热路径上解析店铺不产生数据库往返。
+"""
+import logging
+import threading
+import time
+from collections import namedtuple
+from datetime import datetime
+
+from sqlalchemy import event
+from sqlalchemy.orm import object_session
+
+from app.extensions import db
+from app.models.shop import Shop
+from app.utils.version_stamp import VersionStamp
+
+logger = logging.getLogger(__name__)
+
+ShopSnapshot = namedtuple('ShopSnapshot', [c.name for c in Shop.__table__.columns])
+
+_SESSION_DIRTY_KEY = 'shop_cache_dirty'
+
+
+def _snapshot(shop):
+    return ShopSnapshot(**{f: getattr(shop, f) for f in ShopSnapshot._fields})
+
+
+class _ShopIndex:
+    """一次构建出的完整索引（构建后只读）。"""
+
+    def __init__(self, shops, version, ttl):
+        self.version = version
+        self.by_customer_id = {}
+        self.by_vendor_id = {}
+        self.by_code = {}
+        self.first_game_shop = None
+
+        for shop in sorted(shops, key=lambda s: s.id):
+            if shop.game_customer_id:
+                self.by_customer_id.setdefault(str(shop.game_customer_id), shop)
+            if shop.general_vendor_id:
+                self.by_vendor_id.setdefault(str(shop.general_vendor_id), shop)
+            if shop.shop_code:
+                self.by_code.setdefault(str(shop.shop_code), shop)
+            if shop.shop_type == 1 and self.first_game_shop is None:
+                self.first_game_shop = shop
+
+        # 过期时间：TTL 或最近一个尚未到达的店铺到期时间，取较早者
+        now = datetime.now()
+        expires_at = time.monotonic() + ttl
+        upcoming = [s.expire_time for s in shops if s.expire_time and s.expire_time > now]
+        if upcoming:
+            seconds = (min(upcoming) - now).total_seconds()
+            expires_at = min(expires_at, time.monotonic() + seconds)
+        self.expires_at = expires_at
+
+
+class ShopCache:
+    """应用级店铺解析缓存。"""
+
+    def __init__(self, app):
+        self.app = app
+        self.ttl = int(app.config.get('SHOP_CACHE_TTL', 300))
+        self.stamp = VersionStamp(app.config.get('CACHE_STAMP_DIR'), 'shop')
+        self._index = None
+        self._lock = threading.Lock()
+
+    def _current_index(self):
+        index = self._index
+        version = self.stamp.current()
+        if index is not None and index.version == version and time.monotonic() < index.expires_at:
+            return index
+        with self._lock:
+            index = self._index
+            if index is not None and index.version == version and time.monotonic() < index.expires_at:
+                return index
+            shops = [_snapshot(s) for s in Shop.query.filter_by(is_enabled=1).all()]
+            index = _ShopIndex(shops, version, self.ttl)
+            self._index = index
+            logger.debug(f'店铺缓存已重建：{len(shops)}个启用店铺')
+            return index
+
+    def by_game_customer_id(self, customer_id):
+        """按游戏点卡客户ID查找启用店铺。"""
+        if not customer_id:
+            return None
+        return self._current_index().by_customer_id.get(str(customer_id))
+
+    def by_vendor_id(self, vendor_id):
+        """按通用交易商家ID查找启用店铺。"""
+        if not vendor_id:
+            return None
+        return self._current_index().by_vendor_id.get(str(vendor_id))
+
+    def by_code(self, shop_code):
+        """按店铺代码查找启用店铺。"""
+        if not shop_code:
+            return None
+        return self._current_index().by_code.get(str(shop_code))
+
+    def first_game_shop(self):
+        """第一个启用的游戏点卡店铺（推单未匹配到店铺时的兜底）。"""
+        return self._current_index().first_game_shop
+
+    def invalidate(self):
+        """失效本进程缓存并通知其他 worker。"""
+        self._index = None
+        self.stamp.bump()
+
+
+def init_shop_cache(app):
+    cache = ShopCache(app)
+    app.extensions['shop_cache'] = cache
+    return cache
+
+
+def get_shop_cache():
+    from flask import current_app
+    return current_app.extensions['shop_cache']
+
+
+# ---- 自动失效：Shop 有增删改并提交后失效缓存 ----
+
+@event.listens_for(Shop, 'after_insert')
+@event.listens_for(Shop, 'after_update')
+@event.listens_for(Shop, 'after_delete')
+def _mark_shop_dirty(mapper, connection, target):
+    session = object_session(target) or db.session
+    session.info[_SESSION_DIRTY_KEY] = True
+
+
+@event.listens_for(db.session, 'after_commit')
+def _invalidate_on_commit(session):
+    if session.info.pop(_SESSION_DIRTY_KEY, False):
+        try:
+            get_shop_cache().invalidate()
+        except Exception as e:
+            logger.warning(f'店铺缓存失效失败: {e}')
+
+
+@event.listens_for(db.session, 'after_rollback')
+def _clear_on_rollback(session):
+    session.info.pop(_SESSION_DIRTY_KEY, None)
@@ -0,0 +1,293 @@
+"""请求级 SQL 统计。
+
+通过 SQLAlchemy 引擎事件（before/after_cursor_execute）记录每个请求的查询次数、
+数据库总耗时和最慢的几条语句：
+
+- SQL_PROFILER_HEADERS 开启时（默认跟随 debug）在响应头输出 X-DB-Query-Count / X-DB-Time-Ms
+- 查询次数或耗时超过 SQL_PROFILER_LOG_QUERIES / SQL_PROFILER_LOG_MS 时记录告警日志
+- 按 endpoint 汇总（请求数、平均/最大查询次数、数据库耗时、最慢语句），定期合并到本机
+  SQLite 文件（SQL_PROFILER_DB，worker 间共享），统计报表中的“SQL 统计”页面读取
+- capture_queries() 可在任意代码块中统计查询（测试中的 query_budget 基于它）
+"""
+import heapq
+import json
+import logging
+import re
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+from flask import g, request
+from sqlalchemy import event
+
+from app.extensions import db
+
+logger = logging.getLogger(__name__)
+
+# 每个请求 / 每个 endpoint 保留的最慢语句条数
+REQUEST_SLOWEST = 3
+ENDPOINT_SLOWEST = 5
+
+# 语句截断长度
+STATEMENT_MAX_LENGTH = 500
+
+_WHITESPACE = re.compile(r'\s+')
+_local = threading.local()
+
+
+def _active():
+    stack = getattr(_local, 'collectors', None)
+    if stack is None:
+        stack = _local.collectors = []
+    return stack
+
+
+class QueryCollector:
+    """一段代码内执行的 SQL 统计。"""
+
+    def __init__(self, record=False):
+        self.count = 0
+        self.total_ms = 0.0
+        self._slowest = []
+        self.statements = [] if record else None
+
+    def add(self, statement, ms):
+        self.count += 1
+        self.total_ms += ms
+        item = (ms, self.count, statement)
+        if len(self._slowest) < REQUEST_SLOWEST:
+            heapq.heappush(self._slowest, item)
+        elif ms > self._slowest[0][0]:
+            heapq.heapreplace(self._slowest, item)
+        if self.statements is not None:
+            self.statements.append(statement)
+
+    @property
+    def slowest(self):
+        """最慢的语句 [(耗时ms, 语句)]，按耗时倒序。"""
+        return [(round(ms, 2), stmt) for ms, _, stmt in sorted(self._slowest, reverse=True)]
+
+
+def _normalize(statement):
+    return _WHITESPACE.sub(' ', statement).strip()[:STATEMENT_MAX_LENGTH]
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    # 起始时间记在本条语句的执行上下文上：语句报错时 after_cursor_execute 不会触发，
+    # 上下文随语句一起丢弃，不会在连接上留下残留
+    if context is not None and _active():
+        context._sql_profiler_start = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    start = getattr(context, '_sql_profiler_start', None)
+    collectors = _active()
+    if start is None or not collectors:
+        return
+    ms = (time.perf_counter() - start) * 1000
+    statement = _normalize(statement)
+    for collector in collectors:
+        collector.add(statement, ms)
+
+
+@contextmanager
+def capture_queries(record=True):
+    """统计代码块内执行的 SQL（当前线程），返回 QueryCollector。"""
+    collector = QueryCollector(record=record)
+    _active().append(collector)
+    try:
+        yield collector
+    finally:
+        _active().remove(collector)
+
+
+class SqlProfiler:
+    """按 endpoint 汇总的 SQL 统计。"""
+
+    def __init__(self, app):
+        self.path = app.config.get('SQL_PROFILER_DB')
+        self.flush_interval = app.config.get('SQL_PROFILER_FLUSH_INTERVAL', 10)
+        self.log_queries = app.config.get('SQL_PROFILER_LOG_QUERIES', 50)
+        self.log_ms = app.config.get('SQL_PROFILER_LOG_MS', 500)
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._last_flush = time.monotonic()
+
+    # ---- 记录 ----
+
+    def record(self, endpoint, collector, request_ms):
+        with self._lock:
+            stat = self._pending.get(endpoint)
+            if stat is None:
+                stat = self._pending[endpoint] = _empty_stat()
+            _merge(stat, {
+                'requests': 1,
+                'queries': collector.count,
+                'db_ms': collector.total_ms,
+                'request_ms': request_ms,
+                'max_queries': collector.count,
+                'max_db_ms': collector.total_ms,
+                'slowest': collector.slowest,
+            })
+            due = self.path and time.monotonic() - self._last_flush >= self.flush_interval
+        if due:
+            self.flush()
+
+        if collector.count >= self.log_queries or collector.total_ms >= self.log_ms:
+            logger.warning(
+                f'SQL 开销过高 endpoint={endpoint} queries={collector.count} '
+                f'db_ms={collector.total_ms:.1f} slowest={collector.slowest[:1]}'
+            )
+
+    # ---- 本机 SQLite 汇总 ----
+
+    def _conn(self):
+        conn = sqlite3.connect(self.path, timeout=1, isolation_level=None)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute(
+            'CREATE TABLE IF NOT EXISTS endpoint_sql_stats ('
+            ' endpoint TEXT PRIMARY KEY, stats TEXT NOT NULL, updated_at REAL NOT NULL)'
+        )
+        return conn
+
+    def flush(self):
+        """把本进程的增量合并到 SQLite 文件（未配置文件时保留在进程内）。"""
+        if not self.path:
+            return
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            self._last_flush = time.monotonic()
+        if not pending:
+            return
+        try:
+            conn = self._conn()
+            try:
+                conn.execute('BEGIN IMMEDIATE')
+                for endpoint, delta in pending.items():
+                    row = conn.execute('SELECT stats FROM endpoint_sql_stats WHERE endpoint = ?',
+                                       (endpoint,)).fetchone()
+                    stat = json.loads(row[0]) if row else _empty_stat()
+                    _merge(stat, delta)
+                    conn.execute(
+                        'INSERT OR REPLACE INTO endpoint_sql_stats (endpoint, stats, updated_at) VALUES (?, ?, ?)',
+                        (endpoint, json.dumps(stat, ensure_ascii=False), time.time()),
+                    )
+                conn.execute('COMMIT')
+            finally:
+                conn.close()
+        except sqlite3.Error as e:
+            logger.warning(f'SQL 统计写入失败: {e}')
+
+    def snapshot(self):
+        """各 endpoint 的汇总，按平均查询次数倒序。"""
+        self.flush()
+        stats = {}
+        if self.path:
+            try:
+                conn = self._conn()
+                try:
+                    for endpoint, data in conn.execute('SELECT endpoint, stats FROM endpoint_sql_stats'):
+                        stats[endpoint] = json.loads(data)
+                finally:
+                    conn.close()
+            except sqlite3.Error as e:
+                logger.warning(f'SQL 统计读取失败: {e}')
+        else:
+            with self._lock:
+                stats = {k: json.loads(json.dumps(v)) for k, v in self._pending.items()}
+
+        result = []
+        for endpoint, stat in stats.items():
+            n = stat['requests'] or 1
+            result.append(dict(
+                stat,
+                endpoint=endpoint,
+                avg_queries=round(stat['queries'] / n, 1),
+                avg_db_ms=round(stat['db_ms'] / n, 2),
+                avg_request_ms=round(stat['request_ms'] / n, 2),
+            ))
+        result.sort(key=lambda s: s['avg_queries'], reverse=True)
+        return result
+
+    def reset(self):
+        with self._lock:
+            self._pending = {}
+        if self.path:
+            try:
+                conn = self._conn()
+                try:
+                    conn.execute('DELETE FROM endpoint_sql_stats')
+                finally:
+                    conn.close()
+            except sqlite3.Error as e:
+                logger.warning(f'SQL 统计清空失败: {e}')
+
+
+def _empty_stat():
+    return {'requests': 0, 'queries': 0, 'db_ms': 0.0, 'request_ms': 0.0,
+            'max_queries': 0, 'max_db_ms': 0.0, 'slowest': []}
+
+
+def _merge(stat, delta):
+    for key in ('requests', 'queries', 'db_ms', 'request_ms'):
+        stat[key] += delta[key]
+    stat['max_queries'] = max(stat['max_queries'], delta['max_queries'])
+    stat['max_db_ms'] = max(stat['max_db_ms'], delta['max_db_ms'])
+    slowest = {}
+    for ms, stmt in list(stat['slowest']) + list(delta['slowest']):
+        if ms > slowest.get(stmt, -1):
+            slowest[stmt] = ms
+    stat['slowest'] = sorted(([ms, stmt] for stmt, ms in slowest.items()), reverse=True)[:ENDPOINT_SLOWEST]
+
+
+def init_sql_profiler(app):
+    profiler = SqlProfiler(app)
+    app.extensions['sql_profiler'] = profiler
+    if not app.config.get('SQL_PROFILER_ENABLED', True):
+        return profiler
+
+    with app.app_context():
+        engine = db.engine
+    if not event.contains(engine, 'before_cursor_execute', _before_cursor_execute):
+        event.listen(engine, 'before_cursor_execute', _before_cursor_execute)
+        event.listen(engine, 'after_cursor_execute', _after_cursor_execute)
+
+    @app.before_request
+    def _start_sql_profile():
+        collector = QueryCollector()
+        _active().append(collector)
+        g.sql_profile = (collector, time.perf_counter())
+
+    @app.after_request
+    def _sql_profile_headers(response):
+        profile = g.get('sql_profile')
+        headers = app.config.get('SQL_PROFILER_HEADERS')
+        if profile and (app.debug if headers is None else headers):
+            collector = profile[0]
+            response.headers['X-DB-Query-Count'] = str(collector.count)
+            response.headers['X-DB-Time-Ms'] = f'{collector.total_ms:.2f}'
+            if app.debug:
+                logger.info(f'{request.method} {request.path} queries={collector.count} '
+                            f'db_ms={collector.total_ms:.1f}')
+        return response
+
+    @app.teardown_request
+    def _finish_sql_profile(exc):
+        profile = g.pop('sql_profile', None)
+        if profile is None:
+            return
+        collector, started = profile
+        if collector in _active():
+            _active().remove(collector)
+        try:
+            profiler.record(request.endpoint or 'unknown', collector, (time.perf_counter() - started) * 1000)
+        except Exception as e:
+            logger.warning(f'SQL 统计记录失败: {e}')
+
+    return profiler
+
+
+def get_sql_profiler():
+    from flask import current_app
+    return current_app.extensions['sql_profiler']
@@ -0,0 +1,260 @@
+"""京东查单响应缓存。
+
+京东对每个处理中的订单反复轮询 /api/game/query、/api/game/card-query、
+/api/general/query。每次轮询都要查订单、解析卡密 JSON、AES 加密、签名。
+这里按 (接口, jd_order_no) 缓存已编码/加密好的响应体：
+
+- 订单 order_status / card_info 变更并提交后失效对应订单（ORM 事件）
+- 失效记录写入本机 SQLite 日志（STATUS_CACHE_DB）并刷新版本戳，
+  其他 worker（含 worker.py）在下次访问时读取日志失效对应订单
+- 店铺配置变更（店铺缓存版本戳变化）时清空全部缓存
+- 同一订单的并发轮询只计算一次（single-flight），其余请求等待结果
+- STATUS_CACHE_TTL 兜底过期，"订单不存在" 不缓存
+
+通用交易响应中的 timestamp / sign 每次按当前时间重新生成（MD5 签名开销很小），
+缓存的是除此之外的完整响应（含 AES 加密后的卡密）。
+"""
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from sqlalchemy import event
+from sqlalchemy.orm import object_session
+from sqlalchemy.orm.base import NO_VALUE
+
+from app.extensions import db
+from app.models.order import Order
+from app.utils.version_stamp import VersionStamp
+
+logger = logging.getLogger(__name__)
+
+_SESSION_DIRTY_KEY = 'status_cache_dirty'
+
+# 每写入多少条失效记录清理一次过期日志
+PRUNE_EVERY = 1000
+
+# 跟随者等待计算结果的最长时间（秒）
+FLIGHT_TIMEOUT = 5
+
+
+class _Flight:
+    __slots__ = ('event', 'value', 'ok')
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.value = None
+        self.ok = False
+
+
+class StatusResponseCache:
+    """进程内查单响应缓存。"""
+
+    def __init__(self, app, shop_stamp=None):
+        self.app = app
+        self.ttl = int(app.config.get('STATUS_CACHE_TTL', 60))
+        self.capacity = int(app.config.get('STATUS_CACHE_SIZE', 50000))
+        self.path = app.config.get('STATUS_CACHE_DB')
+        self.stamp = VersionStamp(app.config.get('CACHE_STAMP_DIR'), 'order_status')
+        self.shop_stamp = shop_stamp
+        self._entries = OrderedDict()
+        self._kinds = set()
+        self._inflight = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._generation = 0
+        self._seen = None
+        self._seq = None
+        self._writes = 0
+        self.hits = 0
+        self.misses = 0
+
+    # ---- 失效日志（SQLite） ----
+
+    def _conn(self):
+        if not self.path:
+            return None
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None and self._local.pid == os.getpid():
+            return conn
+        conn = sqlite3.connect(self.path, timeout=1, isolation_level=None, check_same_thread=False)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.execute(
+            'CREATE TABLE IF NOT EXISTS status_invalidations ('
+            ' seq INTEGER PRIMARY KEY AUTOINCREMENT, jd_order_no TEXT NOT NULL, created_at REAL NOT NULL)'
+        )
+        self._local.conn = conn
+        self._local.pid = os.getpid()
+        return conn
+
+    def _read_log(self):
+        """读取上次之后的失效记录，返回需要失效的订单号。"""
+        try:
+            conn = self._conn()
+            if conn is None:
+                return []
+            if self._seq is None:
+                row = conn.execute('SELECT MAX(seq) FROM status_invalidations').fetchone()
+                self._seq = row[0] or 0
+                return []
+            rows = conn.execute(
+                'SELECT seq, jd_order_no FROM status_invalidations WHERE seq > ? ORDER BY seq',
+                (self._seq,),
+            ).fetchall()
+        except sqlite3.Error as e:
+            logger.warning(f'查单缓存失效日志读取失败: {e}')
+            # 读不到日志时只能整体清空
+            self._entries.clear()
+            return []
+        if rows:
+            self._seq = rows[-1][0]
+        return [r[1] for r in rows]
+
+    def _write_log(self, jd_order_nos):
+        try:
+            conn = self._conn()
+            if conn is None:
+                return
+            now = time.time()
+            cur = conn.executemany(
+                'INSERT INTO status_invalidations (jd_order_no, created_at) VALUES (?, ?)',
+                [(no, now) for no in jd_order_nos],
+            )
+            self._writes += cur.rowcount
+            if self._writes >= PRUNE_EVERY:
+                self._writes = 0
+                conn.execute('DELETE FROM status_invalidations WHERE created_at < ?', (now - self.ttl * 10,))
+        except sqlite3.Error as e:
+            logger.warning(f'查单缓存失效日志写入失败: {e}')
+
+    # ---- 同步 ----
+
+    def _versions(self):
+        shop_version = self.shop_stamp.current() if self.shop_stamp else None
+        return self.stamp.current(), shop_version
+
+    def _sync(self):
+        """检查其他进程的变更，返回当前缓存代数。"""
+        versions = self._versions()
+        if versions == self._seen:
+            return self._generation
+        with self._lock:
+            if versions != self._seen:
+                if self._seen is None or versions[1] != self._seen[1]:
+                    self._entries.clear()
+                    self._read_log()
+                else:
+                    self._evict(self._read_log())
+                self._seen = versions
+                self._generation += 1
+            return self._generation
+
+    def _evict(self, jd_order_nos):
+        for no in jd_order_nos:
+            for kind in self._kinds:
+                self._entries.pop((kind, no), None)
+
+    # ---- 对外接口 ----
+
+    def get_or_compute(self, kind, jd_order_no, compute):
+        """返回缓存的响应体，未命中时调用 compute() 计算（返回 None 表示不缓存）。"""
+        key = (kind, str(jd_order_no))
+        generation = self._sync()
+        entry = self._entries.get(key)
+        if entry is not None and entry[1] > time.monotonic():
+            self.hits += 1
+            return entry[0]
+
+        with self._lock:
+            flight = self._inflight.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._inflight[key] = _Flight()
+
+        if not leader:
+            if flight.event.wait(FLIGHT_TIMEOUT) and flight.ok:
+                self.hits += 1
+                return flight.value
+            return compute()
+
+        self.misses += 1
+        try:
+            value = compute()
+            flight.value = value
+            flight.ok = True
+            if value is not None:
+                with self._lock:
+                    # 计算期间发生过失效则不写入，避免缓存旧状态
+                    if self._generation == generation:
+                        self._kinds.add(kind)
+                        self._entries[key] = (value, time.monotonic() + self.ttl)
+                        self._entries.move_to_end(key)
+                        while len(self._entries) > self.capacity:
+                            self._entries.popitem(last=False)
+            return value
+        finally:
+            flight.event.set()
+            with self._lock:
+                self._inflight.pop(key, None)
+
+    def invalidate(self, jd_order_nos):
+        """失效指定订单并通知其他进程。"""
+        jd_order_nos = [str(no) for no in jd_order_nos if no]
+        if not jd_order_nos:
+            return
+        with self._lock:
+            self._evict(jd_order_nos)
+            self._generation += 1
+        self._write_log(jd_order_nos)
+        self.stamp.bump()
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._generation += 1
+
+    def stats(self):
+        return {'size': len(self._entries), 'hits': self.hits, 'misses': self.misses}
+
+
+def init_status_cache(app):
+    shop_cache = app.extensions.get('shop_cache')
+    cache = StatusResponseCache(app, shop_stamp=shop_cache.stamp if shop_cache else None)
+    app.extensions['status_cache'] = cache
+    return cache
+
+
+def get_status_cache():
+    from flask import current_app
+    return current_app.extensions['status_cache']
+
+
+# ---- 自动失效：order_status / card_info 变更并提交后失效 ----
+
+@event.listens_for(Order.order_status, 'set')
+@event.listens_for(Order.card_info, 'set')
+def _mark_order_dirty(target, value, oldvalue, initiator):
+    if value == oldvalue and oldvalue is not NO_VALUE:
+        return
+    session = object_session(target)
+    if session is None or not target.jd_order_no:
+        return
+    session.info.setdefault(_SESSION_DIRTY_KEY, set()).add(target.jd_order_no)
+
+
+@event.listens_for(db.session, 'after_commit')
+def _invalidate_on_commit(session):
+    dirty = session.info.pop(_SESSION_DIRTY_KEY, None)
+    if dirty:
+        try:
+            get_status_cache().invalidate(dirty)
+        except Exception as e:
+            logger.warning(f'查单缓存失效失败: {e}')
+
+
+@event.listens_for(db.session, 'after_rollback')
+def _clear_on_rollback(session):
+    session.info.pop(_SESSION_DIRTY_KEY, None)
@@ -0,0 +1,217 @@
+"""列表页游标（keyset）分页。
+
+Flask-SQLAlchemy 的 paginate() 每翻一页都要 OFFSET 扫描并执行一次完整 COUNT(*)，
+api_logs 这类大表翻到深页会非常慢。这里按主键倒序做游标分页：
+
+- 下一页：WHERE id < 当前页最后一条 ORDER BY id DESC LIMIT n+1
+- 上一页：WHERE id > 当前页第一条 ORDER BY id ASC LIMIT n+1（结果再反转）
+- 第 N 页与第 1 页代价相同，都只走主键索引范围扫描
+
+总数通过 CountCache 按查询条件缓存（LIST_COUNT_CACHE_TTL 秒）；MySQL 下无筛选条件的
+大表直接使用 information_schema 的估算行数，模板中显示为“约”。
+
+URL 参数：after=<id> 下一页，before=<id> 上一页，page 仅用于显示页码。
+"""
+import math
+import threading
+import time
+from collections import OrderedDict, deque
+
+from flask import current_app, request, url_for
+from sqlalchemy import func, text
+
+from app.extensions import db
+
+CURSOR_ARGS = ('after', 'before', 'page')
+
+
+class CountCache:
+    """按查询语句缓存列表总数（进程内，TTL 过期）。"""
+
+    def __init__(self, ttl=60, capacity=1000, estimate_min=100000):
+        self.ttl = ttl
+        self.capacity = capacity
+        self.estimate_min = estimate_min
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(query):
+        compiled = query.statement.compile(dialect=db.engine.dialect)
+        return str(compiled), repr(sorted(compiled.params.items()))
+
+    def _estimate(self, query, column):
+        """MySQL 下无筛选条件时读取表的估算行数，不足阈值返回 None。"""
+        if query.whereclause is not None or db.engine.dialect.name != 'mysql':
+            return None
+        row = db.session.execute(text(
+            'SELECT TABLE_ROWS FROM information_schema.TABLES '
+            'WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = :name'
+        ), {'name': column.table.name}).first()
+        if row is None or row[0] is None or row[0] < self.estimate_min:
+            return None
+        return int(row[0])
+
+    def count(self, query, column):
+        """返回 (总数, 是否为估算值)。"""
+        count_query = query.order_by(None).with_entities(func.count(column))
+        key = self._key(count_query)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[2] > now:
+                return entry[0], entry[1]
+
+        estimate = self._estimate(query, column)
+        if estimate is not None:
+            total, approximate = estimate, True
+        else:
+            total, approximate = count_query.scalar() or 0, False
+
+        with self._lock:
+            self._entries[key] = (total, approximate, now + self.ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.capacity:
+                self._entries.popitem(last=False)
+        return total, approximate
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+def init_count_cache(app):
+    cache = CountCache(
+        ttl=app.config.get('LIST_COUNT_CACHE_TTL', 60),
+        estimate_min=app.config.get('LIST_COUNT_ESTIMATE_MIN', 100000),
+    )
+    app.extensions['count_cache'] = cache
+    return cache
+
+
+def get_count_cache():
+    return current_app.extensions['count_cache']
+
+
+class KeysetPagination:
+    """游标分页结果，属性与 paginate() 的返回值保持相近（items/total/pages/page/has_prev/has_next）。"""
+
+    def __init__(self, items, per_page, page, has_prev, has_next, total, approximate, cursor_of):
+        self.items = items
+        self.per_page = per_page
+        self.page = page
+        self.has_prev = has_prev
+        self.has_next = has_next
+        self.total = total
+        self.approximate = approximate
+        self.prev_cursor = cursor_of(items[0]) if items else None
+        self.next_cursor = cursor_of(items[-1]) if items else None
+
+    @property
+    def pages(self):
+        return max(math.ceil(self.total / self.per_page), 1) if self.per_page else 1
+
+    def _url(self, **cursor):
+        args = {k: v for k, v in request.args.items() if k not in CURSOR_ARGS and v != ''}
+        args.update(request.view_args or {})
+        args.update(cursor)
+        return url_for(request.endpoint, **args)
+
+    @property
+    def first_url(self):
+        return self._url()
+
+    @property
+    def prev_url(self):
+        if not self.has_prev:
+            return None
+        if self.page <= 2:
+            return self._url()
+        return self._url(before=self.prev_cursor, page=self.page - 1)
+
+    @property
+    def next_url(self):
+        if not self.has_next:
+            return None
+        return self._url(after=self.next_cursor, page=self.page + 1)
+
+
+def keyset_paginate(query, column, per_page):
+    """按 column（自增主键）倒序做游标分页，游标从 request.args 读取。
+
+    Args:
+        query: 已加好筛选条件、未排序的查询
+        column: 排序/游标列，如 Order.id
+        per_page: 每页条数
+    """
+    after = request.args.get('after', type=int)
+    before = request.args.get('before', type=int)
+    page = max(request.args.get('page', 1, type=int) or 1, 1)
+    key = column.key
+
+    if before is not None:
+        rows = query.filter(column > before).order_by(column.asc()).limit(per_page + 1).all()
+        has_prev = len(rows) > per_page
+        items = list(reversed(rows[:per_page]))
+        has_next = True
+        if not has_prev:
+            page = 1
+        if not items:
+            # 游标之后的记录已被删除，回到第一页
+            before = None
+    if before is None:
+        if after is not None:
+            rows = query.filter(column < after).order_by(column.desc()).limit(per_page + 1).all()
+            has_prev = True
+        else:
+            rows = query.order_by(column.desc()).limit(per_page + 1).all()
+            has_prev = False
+            page = 1
+        has_next = len(rows) > per_page
+        items = rows[:per_page]
+
+    total, approximate = get_count_cache().count(query, column)
+    return KeysetPagination(
+        items, per_page, page, has_prev, has_next, total, approximate,
+        cursor_of=lambda obj: getattr(obj, key),
+    )
+
+
+def keyset_paginate_rows(rows, key, per_page):
+    """对按 key 递增的可迭代对象（dict）做与 keyset_paginate 相同的倒序游标分页。
+
+    用于归档文件等无法用 SQL 查询的数据源：流式扫描一遍，只保留当前页所需的行，
+    总数为精确值。
+    """
+    after = request.args.get('after', type=int)
+    before = request.args.get('before', type=int)
+    page = max(request.args.get('page', 1, type=int) or 1, 1)
+
+    total = 0
+    if before is not None:
+        window = []
+        for row in rows:
+            total += 1
+            if row[key] > before and len(window) <= per_page:
+                window.append(row)
+        has_prev = len(window) > per_page
+        items = list(reversed(window[:per_page]))
+        has_next = True
+        if not has_prev:
+            page = 1
+    else:
+        window = deque(maxlen=per_page + 1)
+        for row in rows:
+            total += 1
+            if after is None or row[key] < after:
+                window.append(row)
+        has_next = len(window) > per_page
+        items = list(reversed(window))[:per_page]
+        has_prev = after is not None
+        if after is None:
+            page = 1
+
+    return KeysetPagination(
+        items, per_page, page, has_prev, has_next, total, False,
+        cursor_of=lambda row: row[key],
+    )
@@ -0,0 +1,54 @@
+"""跨进程缓存版本戳。
+
+gunicorn 多 worker 各自持有进程内缓存，某个 worker 修改数据后需要通知其他
+worker 失效。这里用一个本地文件的 mtime 作为版本号：修改方 bump() 刷新文件，
+读取方每次只需一次 os.stat()，不产生任何数据库往返。
+
+目录由 CACHE_STAMP_DIR 配置；为空时退化为进程内计数器（单进程/测试环境）。
+"""
+import itertools
+import os
+import threading
+import time
+
+_local_counter = itertools.count(1)
+
+
+class VersionStamp:
+    """以文件 mtime 表示的版本号。"""
+
+    def __init__(self, stamp_dir, name):
+        self.path = os.path.join(stamp_dir, f'{name}.version') if stamp_dir else None
+        self._local = 0
+        self._lock = threading.Lock()
+        if self.path:
+            os.makedirs(stamp_dir, exist_ok=True)
+
+    def current(self):
+        """返回当前版本号（不存在时为0）。"""
+        if not self.path:
+            return self._local
+        try:
+            return os.stat(self.path).st_mtime_ns
+        except OSError:
+            return 0
+
+    def bump(self):
+        """刷新版本号，使所有进程的缓存在下一次访问时失效。"""
+        if not self.path:
+            with self._lock:
+                self._local = next(_local_counter)
+            return
+        now_ns = time.time_ns()
+        # mtime 精度可能只有秒级，保证单调递增
+        try:
+            prev = os.stat(self.path).st_mtime_ns
+        except OSError:
+            prev = 0
+        new_ns = max(now_ns, prev + 1)
+        try:
+            with open(self.path, 'a'):
+                pass
+            os.utime(self.path, ns=(new_ns, new_ns))
+        except OSError:
+            pass
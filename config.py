@@ -1,4 +1,14 @@
 import os
+import tempfile
+
+
+def _timeout(name, default):
+    """读取 "连接超时,读取超时" 形式的环境变量。"""
+    value = os.environ.get(name)
+    if not value:
+        return default
+    connect, _, read = value.partition(',')
+    return float(connect), float(read or connect)
 
 
 class Config:
@@ -16,6 +26,169 @@ class Config:
         'pool_timeout': 30,
     }
 
+    # 日志异步批量写入（ApiLog / OperationLog / NotificationLog）
+    LOG_WRITER_ASYNC = True
+    LOG_WRITER_QUEUE_SIZE = int(os.environ.get('LOG_WRITER_QUEUE_SIZE', 10000))
+    LOG_WRITER_BATCH_SIZE = int(os.environ.get('LOG_WRITER_BATCH_SIZE', 200))
+    LOG_WRITER_FLUSH_INTERVAL_MS = int(os.environ.get('LOG_WRITER_FLUSH_INTERVAL_MS', 500))
+    # 队列满时：drop_new=丢弃新日志 drop_oldest=丢弃最旧日志 block=短暂阻塞
+    LOG_WRITER_OVERFLOW_POLICY = os.environ.get('LOG_WRITER_OVERFLOW_POLICY', 'drop_new')
+
+    # 新订单通知分发：NOTIFY_WORKER_THREADS 个常驻线程发送，失败后延时重试；
+    # 队列满时的策略同日志写入器（默认丢弃最旧的通知，它们已经过时）
+    NOTIFY_ASYNC = True
+    NOTIFY_WORKER_THREADS = int(os.environ.get('NOTIFY_WORKER_THREADS', 4))
+    NOTIFY_QUEUE_SIZE = int(os.environ.get('NOTIFY_QUEUE_SIZE', 2000))
+    NOTIFY_OVERFLOW_POLICY = os.environ.get('NOTIFY_OVERFLOW_POLICY', 'drop_oldest')
+    NOTIFY_FLUSH_INTERVAL_MS = int(os.environ.get('NOTIFY_FLUSH_INTERVAL_MS', 500))
+    NOTIFY_MARK_BATCH_SIZE = int(os.environ.get('NOTIFY_MARK_BATCH_SIZE', 200))
+    # 突发订单汇总：店铺空闲时第一单立即通知，之后 NOTIFY_DIGEST_WINDOW 秒内的订单合并为一条汇总（0 或 NOTIFY_ASYNC=False 时不汇总）
+    NOTIFY_DIGEST_WINDOW = float(os.environ.get('NOTIFY_DIGEST_WINDOW', 10))
+    NOTIFY_DIGEST_LIST_ORDERS = int(os.environ.get('NOTIFY_DIGEST_LIST_ORDERS', 10))
+    # 每个 webhook 的令牌桶（钉钉机器人约 20 条/分钟）；令牌状态和汇总窗口经本机SQLite文件在 worker 间共享，
+    # 持续突发时每个店铺每个窗口一条汇总（默认 10 秒窗口约 6 条/分钟）
+    NOTIFY_RATE_PER_MINUTE = int(os.environ.get('NOTIFY_RATE_PER_MINUTE', 20))
+    NOTIFY_RATE_BURST = int(os.environ.get('NOTIFY_RATE_BURST', 5))
+    NOTIFY_RATE_DB = os.environ.get('NOTIFY_RATE_DB', os.path.join(tempfile.gettempdir(), 'ds_notify_rate.db'))
+
+    # 跨 worker 缓存版本戳目录（为空则只在进程内失效）
+    CACHE_STAMP_DIR = os.environ.get('CACHE_STAMP_DIR', os.path.join(tempfile.gettempdir(), 'ds_cache'))
+    # 店铺解析缓存最长有效期（秒）
+    SHOP_CACHE_TTL = int(os.environ.get('SHOP_CACHE_TTL', 300))
+
+    # 91卡券商品路由表最长有效期（秒），商品增删改后立即失效
+    PRODUCT_ROUTER_TTL = int(os.environ.get('PRODUCT_ROUTER_TTL', 300))
+
+    # 近期订单防重索引（本机SQLite文件，worker间共享；为空则仅进程内LRU）
+    RECENT_ORDER_DB = os.environ.get('RECENT_ORDER_DB', os.path.join(tempfile.gettempdir(), 'ds_recent_orders.db'))
+    RECENT_ORDER_WINDOW_HOURS = int(os.environ.get('RECENT_ORDER_WINDOW_HOURS', 24))
+    RECENT_ORDER_LRU_SIZE = int(os.environ.get('RECENT_ORDER_LRU_SIZE', 10000))
+
+    # 京东查单响应缓存（失效日志为本机SQLite文件，worker间共享；为空则仅进程内失效）
+    STATUS_CACHE_DB = os.environ.get('STATUS_CACHE_DB', os.path.join(tempfile.gettempdir(), 'ds_status_cache.db'))
+    STATUS_CACHE_TTL = int(os.environ.get('STATUS_CACHE_TTL', 60))
+    STATUS_CACHE_SIZE = int(os.environ.get('STATUS_CACHE_SIZE', 50000))
+
+    # 列表页游标分页：总数缓存时间（秒）；MySQL 无筛选条件且估算行数超过阈值时直接用估算值
+    LIST_COUNT_CACHE_TTL = int(os.environ.get('LIST_COUNT_CACHE_TTL', 60))
+    LIST_COUNT_ESTIMATE_MIN = int(os.environ.get('LIST_COUNT_ESTIMATE_MIN', 100000))
+
+    # 日志保留与归档（worker.py 每天 LOG_ARCHIVE_HOUR 点执行）：超过保留天数的记录按月归档为
+    # {LOG_ARCHIVE_DIR}/{表名}/{YYYY-MM}/{表名}-{YYYY-MM-DD}.jsonl.gz 后从数据库删除；0 表示不归档
+    LOG_ARCHIVE_DIR = os.environ.get('LOG_ARCHIVE_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'archive'))
+    LOG_RETENTION_DAYS = {
+        'api_logs': int(os.environ.get('API_LOG_RETENTION_DAYS', 30)),
+        'order_events': int(os.environ.get('ORDER_EVENT_RETENTION_DAYS', 180)),
+        'notification_logs': int(os.environ.get('NOTIFICATION_LOG_RETENTION_DAYS', 90)),
+        'operation_logs': int(os.environ.get('OPERATION_LOG_RETENTION_DAYS', 180)),
+    }
+    LOG_ARCHIVE_BATCH_SIZE = int(os.environ.get('LOG_ARCHIVE_BATCH_SIZE', 2000))
+    LOG_ARCHIVE_HOUR = int(os.environ.get('LOG_ARCHIVE_HOUR', 3))
+
+    # 订单导出：超过 EXPORT_SYNC_MAX_ROWS 行或 xlsx 格式时转为后台任务（worker.py 执行），
+    # 文件写入 EXPORT_DIR，保留 EXPORT_RETENTION_HOURS 小时
+    EXPORT_DIR = os.environ.get('EXPORT_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'exports'))
+    EXPORT_SYNC_MAX_ROWS = int(os.environ.get('EXPORT_SYNC_MAX_ROWS', 20000))
+    EXPORT_YIELD_PER = int(os.environ.get('EXPORT_YIELD_PER', 2000))
+    EXPORT_PROGRESS_EVERY = int(os.environ.get('EXPORT_PROGRESS_EVERY', 5000))
+    EXPORT_POLL_INTERVAL = int(os.environ.get('EXPORT_POLL_INTERVAL', 3))
+    EXPORT_RETENTION_HOURS = int(os.environ.get('EXPORT_RETENTION_HOURS', 72))
+
+    # 订单批量操作：由 worker.py 后台执行（页面轮询进度）；
+    # 回调在 BULK_ACTION_THREADS 个线程中并发（单店铺最多 BULK_ACTION_SHOP_CONCURRENCY 个），
+    # 每 BULK_ACTION_COMMIT_EVERY 单提交一次并更新进度
+    BULK_ACTION_MAX_ORDERS = int(os.environ.get('BULK_ACTION_MAX_ORDERS', 5000))
+    BULK_ACTION_THREADS = int(os.environ.get('BULK_ACTION_THREADS', 8))
+    BULK_ACTION_SHOP_CONCURRENCY = int(os.environ.get('BULK_ACTION_SHOP_CONCURRENCY', 2))
+    BULK_ACTION_COMMIT_EVERY = int(os.environ.get('BULK_ACTION_COMMIT_EVERY', 50))
+    BULK_ACTION_POLL_INTERVAL = int(os.environ.get('BULK_ACTION_POLL_INTERVAL', 2))
+
+    # 请求级 SQL 统计：SQL_PROFILER_HEADERS 为空时跟随 debug 输出 X-DB-Query-Count / X-DB-Time-Ms；
+    # 单个请求超过 SQL_PROFILER_LOG_QUERIES 条或 SQL_PROFILER_LOG_MS 毫秒时记录告警；
+    # 按 endpoint 的汇总每 SQL_PROFILER_FLUSH_INTERVAL 秒合并到本机SQLite文件（为空则仅进程内）
+    SQL_PROFILER_ENABLED = os.environ.get('SQL_PROFILER_ENABLED', '1') == '1'
+    SQL_PROFILER_HEADERS = {'1': True, '0': False}.get(os.environ.get('SQL_PROFILER_HEADERS', ''))
+    SQL_PROFILER_LOG_QUERIES = int(os.environ.get('SQL_PROFILER_LOG_QUERIES', 50))
+    SQL_PROFILER_LOG_MS = int(os.environ.get('SQL_PROFILER_LOG_MS', 500))
+    SQL_PROFILER_DB = os.environ.get('SQL_PROFILER_DB', os.path.join(tempfile.gettempdir(), 'ds_sql_profile.db'))
+    SQL_PROFILER_FLUSH_INTERVAL = int(os.environ.get('SQL_PROFILER_FLUSH_INTERVAL', 10))
+
+    # 新订单提醒推送（SSE）：事件经本机SQLite文件在 worker 间共享（为空则仅进程内）；
+    # 每个连接最长 SSE_STREAM_SECONDS 秒后由浏览器重连，每个 worker 最多 SSE_MAX_CONNECTIONS 个连接，
+    # 超出时页面退回轮询（gunicorn_conf.py 的 threads 需大于该值）
+    ORDER_ALERT_DB = os.environ.get('ORDER_ALERT_DB', os.path.join(tempfile.gettempdir(), 'ds_order_alerts.db'))
+    ORDER_ALERT_POLL_INTERVAL = float(os.environ.get('ORDER_ALERT_POLL_INTERVAL', 1.0))
+    SSE_STREAM_SECONDS = int(os.environ.get('SSE_STREAM_SECONDS', 55))
+    SSE_HEARTBEAT_SECONDS = int(os.environ.get('SSE_HEARTBEAT_SECONDS', 15))
+    SSE_RETRY_MS = int(os.environ.get('SSE_RETRY_MS', 3000))
+    SSE_MAX_CONNECTIONS = int(os.environ.get('SSE_MAX_CONNECTIONS', 8))
+
+    # 发货任务队列（worker.py）
+    FULFILLMENT_WORKER_THREADS = int(os.environ.get('FULFILLMENT_WORKER_THREADS', 8))
+    FULFILLMENT_SHOP_CONCURRENCY = int(os.environ.get('FULFILLMENT_SHOP_CONCURRENCY', 2))
+    FULFILLMENT_POLL_INTERVAL = float(os.environ.get('FULFILLMENT_POLL_INTERVAL', 1.0))
+    FULFILLMENT_MAX_ATTEMPTS = int(os.environ.get('FULFILLMENT_MAX_ATTEMPTS', 5))
+
+    # 91卡券合并提卡：同店铺同卡种的并发提卡在窗口内合并为一次 HandPick
+    CARD91_BATCH_ENABLED = os.environ.get('CARD91_BATCH_ENABLED', '1') == '1'
+    CARD91_BATCH_WINDOW_MS = int(os.environ.get('CARD91_BATCH_WINDOW_MS', 50))
+    CARD91_BATCH_MAX_NUM = int(os.environ.get('CARD91_BATCH_MAX_NUM', 100))
+
+    # 91卡券本地库存（商品开启后生效）：worker.py 每 CARD_POOL_REPLENISH_INTERVAL 秒按最近
+    # CARD_POOL_RATE_WINDOW_MINUTES 分钟的销量补货，库存低于 CARD_POOL_LOW_MINUTES 分钟销量
+    # （至少 CARD_POOL_MIN_STOCK 张）时补到 CARD_POOL_HIGH_MINUTES 分钟销量（不超过商品上限或
+    # CARD_POOL_MAX_STOCK），每次 HandPick 最多 CARD_POOL_FETCH_MAX 张；
+    # 卡密用专用密钥 CARD_POOL_KEY AES-GCM 加密保存，未配置时本地库存不启用（不要随 SECRET_KEY 轮换）
+    CARD_POOL_KEY = os.environ.get('CARD_POOL_KEY', '')
+    CARD_POOL_REPLENISH_INTERVAL = int(os.environ.get('CARD_POOL_REPLENISH_INTERVAL', 60))
+    CARD_POOL_RATE_WINDOW_MINUTES = int(os.environ.get('CARD_POOL_RATE_WINDOW_MINUTES', 60))
+    CARD_POOL_LOW_MINUTES = int(os.environ.get('CARD_POOL_LOW_MINUTES', 10))
+    CARD_POOL_HIGH_MINUTES = int(os.environ.get('CARD_POOL_HIGH_MINUTES', 30))
+    CARD_POOL_MIN_STOCK = int(os.environ.get('CARD_POOL_MIN_STOCK', 5))
+    CARD_POOL_MAX_STOCK = int(os.environ.get('CARD_POOL_MAX_STOCK', 500))
+    CARD_POOL_FETCH_MAX = int(os.environ.get('CARD_POOL_FETCH_MAX', 100))
+
+    # 91卡券卡种目录缓存（秒），过期后后台刷新；提卡扣减的库存通过本机 SQLite 日志同步给其他进程
+    CARD91_CATALOG_TTL = int(os.environ.get('CARD91_CATALOG_TTL', 300))
+    CARD91_CATALOG_DB = os.environ.get('CARD91_CATALOG_DB', os.path.join(tempfile.gettempdir(), 'ds_card91_catalog.db'))
+
+    # 直充引擎（worker.py）：每 DIRECT_CHARGE_INTERVAL 秒领取最多 DIRECT_CHARGE_BATCH_SIZE 个任务，
+    # 在 DIRECT_CHARGE_THREADS 个线程中提交 / 批量查询上游；以下为供应商配置未指定时的默认值：
+    # 每个供应商最多 DIRECT_CHARGE_SUPPLIER_CONCURRENCY 个并发请求，充值中订单每
+    # DIRECT_CHARGE_POLL_INTERVAL 秒查询一次，每次批量查询 DIRECT_CHARGE_QUERY_BATCH_SIZE 单
+    DIRECT_CHARGE_INTERVAL = int(os.environ.get('DIRECT_CHARGE_INTERVAL', 2))
+    DIRECT_CHARGE_BATCH_SIZE = int(os.environ.get('DIRECT_CHARGE_BATCH_SIZE', 200))
+    DIRECT_CHARGE_THREADS = int(os.environ.get('DIRECT_CHARGE_THREADS', 16))
+    DIRECT_CHARGE_SUPPLIER_CONCURRENCY = int(os.environ.get('DIRECT_CHARGE_SUPPLIER_CONCURRENCY', 4))
+    DIRECT_CHARGE_POLL_INTERVAL = int(os.environ.get('DIRECT_CHARGE_POLL_INTERVAL', 10))
+    DIRECT_CHARGE_QUERY_BATCH_SIZE = int(os.environ.get('DIRECT_CHARGE_QUERY_BATCH_SIZE', 50))
+    DIRECT_CHARGE_MAX_ATTEMPTS = int(os.environ.get('DIRECT_CHARGE_MAX_ATTEMPTS', 3))
+    # 充值中订单最多查询次数（默认按 10 秒间隔约 1 小时），仍未出结果时任务失败、订单转异常由人工核实
+    DIRECT_CHARGE_MAX_POLLS = int(os.environ.get('DIRECT_CHARGE_MAX_POLLS', 360))
+    DIRECT_CHARGE_CALLBACK_SHOP_CONCURRENCY = int(os.environ.get('DIRECT_CHARGE_CALLBACK_SHOP_CONCURRENCY', 2))
+    # 模拟供应商（不发请求、默认充值成功）只在测试或显式开启时可选，联调环境设为 1
+    DIRECT_CHARGE_MOCK_ENABLED = os.environ.get('DIRECT_CHARGE_MOCK_ENABLED', '0') == '1'
+
+    # 京东回调发件箱（worker.py 中定时重发）
+    CALLBACK_OUTBOX_INTERVAL = int(os.environ.get('CALLBACK_OUTBOX_INTERVAL', 15))
+    CALLBACK_OUTBOX_BATCH_SIZE = int(os.environ.get('CALLBACK_OUTBOX_BATCH_SIZE', 200))
+    CALLBACK_OUTBOX_BASE_DELAY = int(os.environ.get('CALLBACK_OUTBOX_BASE_DELAY', 30))
+    CALLBACK_OUTBOX_MAX_DELAY = int(os.environ.get('CALLBACK_OUTBOX_MAX_DELAY', 3600))
+    CALLBACK_OUTBOX_MAX_ATTEMPTS = int(os.environ.get('CALLBACK_OUTBOX_MAX_ATTEMPTS', 8))
+
+    # 出站 HTTP 连接池（京东回调 / 91卡券 / 阿奇索 / 通知）
+    HTTP_POOL_CONNECTIONS = int(os.environ.get('HTTP_POOL_CONNECTIONS', 20))
+    HTTP_POOL_MAXSIZE = int(os.environ.get('HTTP_POOL_MAXSIZE', 20))
+    HTTP_RETRIES = int(os.environ.get('HTTP_RETRIES', 2))
+    HTTP_TIMEOUTS = {
+        'jd_game': _timeout('HTTP_TIMEOUT_JD_GAME', (3, 10)),
+        'jd_general': _timeout('HTTP_TIMEOUT_JD_GENERAL', (3, 10)),
+        'card91': _timeout('HTTP_TIMEOUT_CARD91', (5, 30)),
+        'agiso': _timeout('HTTP_TIMEOUT_AGISO', (5, 30)),
+        'notification': _timeout('HTTP_TIMEOUT_NOTIFICATION', (3, 10)),
+        'direct_charge': _timeout('HTTP_TIMEOUT_DIRECT_CHARGE', (3, 15)),
+    }
+
 
 class TestConfig(Config):
     TESTING = True
@@ -23,3 +196,15 @@ class TestConfig(Config):
     SQLALCHEMY_ENGINE_OPTIONS = {}
     WTF_CSRF_ENABLED = False
     SERVER_NAME = 'localhost'
+    LOG_WRITER_ASYNC = False
+    NOTIFY_ASYNC = False
+    NOTIFY_RATE_PER_MINUTE = 0
+    NOTIFY_RATE_DB = None
+    CACHE_STAMP_DIR = None
+    RECENT_ORDER_DB = None
+    STATUS_CACHE_DB = None
+    CARD91_CATALOG_DB = None
+    CARD_POOL_KEY = 'test-card-pool-key'
+    LOG_ARCHIVE_DIR = None
+    SQL_PROFILER_DB = None
+    ORDER_ALERT_DB = None
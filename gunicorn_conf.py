@@ -1,6 +1,8 @@
 chdir = '/www/wwwroot/ds'
 workers = 4
-threads = 2
+# 新订单提醒推送（/api/order-events）是长连接，每个 worker 最多占用 SSE_MAX_CONNECTIONS（默认8）个线程，
+# 其余线程处理普通请求；threads > 1 时 gunicorn 使用 gthread worker
+threads = 16
 user = 'www'
 worker_class = 'sync'
 bind = '0.0.0.0:5000'
@@ -8,3 +10,11 @@ pidfile = '/www/wwwroot/ds/gunicorn.pid'
 accesslog = '/www/wwwlogs/python/ds/gunicorn_access.log'
 errorlog = '/www/wwwlogs/python/ds/gunicorn_error.log'
 loglevel = 'info'
+
+
+def worker_exit(server, worker):
+    """worker 退出前停止通知分发，并把日志队列中剩余的日志写入数据库。"""
+    from app.services.notification import shutdown_dispatchers
+    from app.services.log_writer import flush_all
+    shutdown_dispatchers()
+    flush_all()
@@ -0,0 +1,30 @@
+"""手动归档过期日志（worker.py 每天会自动执行一次）。
+
+    python migrations/archive_logs.py                  # 归档所有启用保留期的日志表
+    python migrations/archive_logs.py --table api_logs # 只归档指定表
+"""
+import argparse
+
+from dotenv import load_dotenv
+load_dotenv()
+
+from app import create_app
+from app.services.log_archive import ARCHIVE_MODELS, archive_expired, archive_table
+
+
+def main(table=None):
+    app = create_app()
+    with app.app_context():
+        if table:
+            result = {table: archive_table(table)}
+        else:
+            result = archive_expired()
+        for name, count in result.items():
+            print(f'{name}: 归档 {count} 条')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='归档过期日志')
+    parser.add_argument('--table', choices=sorted(ARCHIVE_MODELS), help='只归档指定表')
+    args = parser.parse_args()
+    main(args.table)
@@ -83,8 +83,11 @@ CREATE TABLE IF NOT EXISTS orders (
     create_time DATETIME DEFAULT CURRENT_TIMESTAMP,
     update_time DATETIME DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
 
-    INDEX idx_jd_order (jd_order_no, shop_type),
-    INDEX idx_shop (shop_id, order_status),
+    UNIQUE KEY idx_jd_order_shop (jd_order_no, shop_id),
+    INDEX idx_produce_account (produce_account),
+    INDEX idx_order_shop_id (shop_id, id),
+    INDEX idx_order_status_id (order_status, id),
+    INDEX idx_order_sku_time (shop_id, sku_id, create_time),
     INDEX idx_create_time (create_time),
     INDEX idx_notified (notified, create_time),
 
@@ -131,6 +134,7 @@ CREATE TABLE IF NOT EXISTS notification_logs (
     id BIGINT PRIMARY KEY AUTO_INCREMENT,
     order_id BIGINT NOT NULL COMMENT '订单ID',
     shop_id BIGINT NOT NULL COMMENT '店铺ID',
+    order_ids TEXT COMMENT '汇总通知覆盖的订单ID列表JSON',
 
     notify_type VARCHAR(20) NOT NULL COMMENT '通知类型：dingtalk/wecom',
     notify_status TINYINT DEFAULT 0 COMMENT '通知状态：0=失败 1=成功',
@@ -163,6 +167,7 @@ CREATE TABLE IF NOT EXISTS api_logs (
     ip_address VARCHAR(50) COMMENT '请求IP',
     create_time DATETIME DEFAULT CURRENT_TIMESTAMP,
 
+    INDEX idx_api_type_id (api_type, id),
     INDEX idx_shop (shop_id),
     INDEX idx_create_time (create_time)
 ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COMMENT='API日志表';
@@ -193,14 +198,17 @@ CREATE TABLE IF NOT EXISTS products (
     sku_id VARCHAR(100) COMMENT '京东SKU ID',
     sku_name VARCHAR(200) COMMENT 'SKU名称/套餐名称',
 
-    deliver_type TINYINT DEFAULT 0 COMMENT '发货方式：0=手动 1=91卡券卡密 2=直充API预留',
+    deliver_type TINYINT DEFAULT 0 COMMENT '发货方式：0=手动 1=91卡券卡密 2=直充API',
 
     card91_card_type_id VARCHAR(100) COMMENT '91卡券卡种ID',
     card91_card_type_name VARCHAR(200) COMMENT '91卡券卡种名称',
     card91_plan_id VARCHAR(100) COMMENT '91卡券方案ID',
 
-    direct_charge_api_type VARCHAR(50) COMMENT '直充API类型（预留）',
-    direct_charge_api_config TEXT COMMENT '直充API配置JSON（预留）',
+    direct_charge_api_type VARCHAR(50) COMMENT '直充供应商类型',
+    direct_charge_api_config TEXT COMMENT '直充供应商配置JSON',
+
+    card_pool_enabled TINYINT NOT NULL DEFAULT 0 COMMENT '是否启用本地库存：0=否 1=是',
+    card_pool_max INT COMMENT '本地库存上限（为空使用全局配置）',
 
     is_enabled TINYINT DEFAULT 1 COMMENT '是否启用：0=禁用 1=启用',
     remark VARCHAR(500) COMMENT '备注',
@@ -208,7 +216,7 @@ CREATE TABLE IF NOT EXISTS products (
     create_time DATETIME DEFAULT CURRENT_TIMESTAMP,
     update_time DATETIME DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
 
-    INDEX idx_shop_sku (shop_id, sku_id),
+    INDEX idx_product_match (shop_id, sku_id, is_enabled, deliver_type),
     FOREIGN KEY (shop_id) REFERENCES shops(id) ON DELETE CASCADE
 ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COMMENT='商品配置表';
 
@@ -231,6 +239,238 @@ CREATE TABLE IF NOT EXISTS order_events (
     FOREIGN KEY (order_id) REFERENCES orders(id) ON DELETE CASCADE
 ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COMMENT='订单事件日志表';
 
+-- 10. fulfillment_jobs table
+CREATE TABLE IF NOT EXISTS fulfillment_jobs (
+    id BIGINT PRIMARY KEY AUTO_INCREMENT,
+    order_id BIGINT NOT NULL COMMENT '订单ID',
+    shop_id BIGINT NOT NULL COMMENT '店铺ID（用于按店铺限流）',
+    product_id BIGINT COMMENT '匹配到的商品配置ID',
+
+    job_type VARCHAR(50) NOT NULL DEFAULT 'card91_deliver' COMMENT '任务类型',
+    status TINYINT NOT NULL DEFAULT 0 COMMENT '任务状态：0=待执行 1=执行中 2=已完成 3=已失败',
+    attempts INT NOT NULL DEFAULT 0 COMMENT '已执行次数',
+    max_attempts INT NOT NULL DEFAULT 5 COMMENT '最大执行次数',
+    next_run_time DATETIME DEFAULT CURRENT_TIMESTAMP COMMENT '下次可执行时间',
+
+    locked_by VARCHAR(100) COMMENT '执行该任务的worker标识',
+    locked_at DATETIME COMMENT '领取时间',
+    last_error VARCHAR(500) COMMENT '最近一次错误',
+
+    create_time DATETIME DEFAULT CURRENT_TIMESTAMP,
+    update_time DATETIME DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+
+    UNIQUE KEY uk_order_job (order_id, job_type),
+    INDEX idx_job_status_run (status, next_run_time),
+    FOREIGN KEY (order_id) REFERENCES orders(id) ON DELETE CASCADE
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COMMENT='发货任务队列表';
+
+-- 11. callback_outbox table
+CREATE TABLE IF NOT EXISTS callback_outbox (
+    id BIGINT PRIMARY KEY AUTO_INCREMENT,
+    order_id BIGINT NOT NULL COMMENT '订单ID',
+    shop_id BIGINT NOT NULL COMMENT '店铺ID（按店铺批量发送）',
+    callback_type VARCHAR(20) NOT NULL COMMENT '回调类型：deliver=发货成功 refund=退款',
+
+    status TINYINT NOT NULL DEFAULT 0 COMMENT '状态：0=待发送 1=发送中 2=已成功 3=已放弃',
+    attempts INT NOT NULL DEFAULT 0 COMMENT '已重发次数',
+    max_attempts INT NOT NULL DEFAULT 8 COMMENT '最大重发次数',
+    next_retry_time DATETIME DEFAULT CURRENT_TIMESTAMP COMMENT '下次重发时间',
+
+    locked_by VARCHAR(100) COMMENT '领取该记录的批次标识',
+    locked_at DATETIME COMMENT '领取时间',
+    last_error VARCHAR(500) COMMENT '最近一次失败原因',
+
+    create_time DATETIME DEFAULT CURRENT_TIMESTAMP,
+    update_time DATETIME DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+
+    UNIQUE KEY uk_order_callback (order_id, callback_type),
+    INDEX idx_outbox_status_retry (status, next_retry_time),
+    FOREIGN KEY (order_id) REFERENCES orders(id) ON DELETE CASCADE
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COMMENT='京东回调发件箱表';
+
+-- 12. order_search_tokens table（订单关键字搜索 n-gram 分词，python migrations/backfill_search.py 回填）
+CREATE TABLE IF NOT EXISTS order_search_tokens (
+    token VARCHAR(32) NOT NULL COMMENT 'n-gram 分词',
+    order_id BIGINT NOT NULL COMMENT '订单ID',
+    PRIMARY KEY (token, order_id),
+    INDEX idx_search_order (order_id),
+    FOREIGN KEY (order_id) REFERENCES orders(id) ON DELETE CASCADE
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_bin COMMENT='订单搜索分词表';
+
+-- 13. order_stats_hourly table（订单小时汇总，python migrations/rebuild_stats.py 重建）
+CREATE TABLE IF NOT EXISTS order_stats_hourly (
+    id BIGINT PRIMARY KEY AUTO_INCREMENT,
+    stat_hour DATETIME NOT NULL COMMENT '统计小时（整点）',
+    shop_id BIGINT NOT NULL COMMENT '店铺ID',
+    shop_type TINYINT NOT NULL COMMENT '店铺类型',
+    order_type TINYINT NOT NULL COMMENT '订单类型',
+    order_status TINYINT NOT NULL COMMENT '订单状态',
+    order_count INT NOT NULL DEFAULT 0 COMMENT '订单数',
+    total_amount BIGINT NOT NULL DEFAULT 0 COMMENT '订单金额（分）',
+    update_time DATETIME DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+    UNIQUE KEY uk_stat_hour (stat_hour, shop_id, shop_type, order_type, order_status),
+    INDEX idx_stat_hour_shop (shop_id, stat_hour),
+    FOREIGN KEY (shop_id) REFERENCES shops(id) ON DELETE CASCADE
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COMMENT='订单小时汇总表';
+
+-- 14. order_stats_daily table（订单天汇总）
+CREATE TABLE IF NOT EXISTS order_stats_daily (
+    id BIGINT PRIMARY KEY AUTO_INCREMENT,
+    stat_date DATE NOT NULL COMMENT '统计日期',
+    shop_id BIGINT NOT NULL COMMENT '店铺ID',
+    shop_type TINYINT NOT NULL COMMENT '店铺类型',
+    order_type TINYINT NOT NULL COMMENT '订单类型',
+    order_status TINYINT NOT NULL COMMENT '订单状态',
+    order_count INT NOT NULL DEFAULT 0 COMMENT '订单数',
+    total_amount BIGINT NOT NULL DEFAULT 0 COMMENT '订单金额（分）',
+    update_time DATETIME DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+    UNIQUE KEY uk_stat_date (stat_date, shop_id, shop_type, order_type, order_status),
+    INDEX idx_stat_date_shop (shop_id, stat_date),
+    FOREIGN KEY (shop_id) REFERENCES shops(id) ON DELETE CASCADE
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COMMENT='订单天汇总表';
+
+-- 15. export_jobs table（订单后台导出任务，worker.py 执行）
+CREATE TABLE IF NOT EXISTS export_jobs (
+    id BIGINT PRIMARY KEY AUTO_INCREMENT,
+    user_id BIGINT COMMENT '创建人ID',
+    username VARCHAR(50) COMMENT '创建人用户名',
+    export_format VARCHAR(10) NOT NULL DEFAULT 'csv' COMMENT '文件格式：csv/csv.gz/xlsx',
+    filters TEXT COMMENT '筛选条件JSON（与订单列表参数一致）',
+    status TINYINT NOT NULL DEFAULT 0 COMMENT '状态：0=排队中 1=导出中 2=已完成 3=失败 4=文件已过期',
+    total_rows INT COMMENT '预计行数',
+    processed_rows INT NOT NULL DEFAULT 0 COMMENT '已导出行数',
+    file_name VARCHAR(200) COMMENT '下载文件名',
+    file_path VARCHAR(500) COMMENT '本地文件路径',
+    file_size BIGINT COMMENT '文件大小（字节）',
+    error VARCHAR(500) COMMENT '失败原因',
+    locked_by VARCHAR(100) COMMENT '执行该任务的进程标识',
+    locked_at DATETIME COMMENT '最近一次心跳时间（超时未刷新则重新排队）',
+    create_time DATETIME DEFAULT CURRENT_TIMESTAMP,
+    start_time DATETIME COMMENT '开始时间',
+    finish_time DATETIME COMMENT '完成时间',
+    INDEX idx_export_status (status, id),
+    INDEX idx_export_user (user_id, id),
+    FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE SET NULL
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COMMENT='订单导出任务表';
+
+-- 16. order_pending_counts table（店铺未处理订单数，随订单统计汇总维护）
+CREATE TABLE IF NOT EXISTS order_pending_counts (
+    shop_id BIGINT PRIMARY KEY COMMENT '店铺ID',
+    pending_count INT NOT NULL DEFAULT 0 COMMENT '未处理订单数',
+    update_time DATETIME DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+    FOREIGN KEY (shop_id) REFERENCES shops(id) ON DELETE CASCADE
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COMMENT='店铺未处理订单数表';
+
+-- 17. schema_migrations table（已执行的结构迁移版本，python migrations/migrate.py）
+CREATE TABLE IF NOT EXISTS schema_migrations (
+    version VARCHAR(20) PRIMARY KEY COMMENT '迁移版本号',
+    description VARCHAR(200) COMMENT '迁移说明',
+    applied_time DATETIME DEFAULT CURRENT_TIMESTAMP COMMENT '执行时间'
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COMMENT='结构迁移版本表';
+
+-- 18. bulk_jobs table（订单批量操作任务，少量订单请求内执行，其余由 worker.py 执行）
+CREATE TABLE IF NOT EXISTS bulk_jobs (
+    id BIGINT PRIMARY KEY AUTO_INCREMENT,
+    user_id BIGINT COMMENT '创建人ID',
+    username VARCHAR(50) COMMENT '创建人用户名',
+    ip_address VARCHAR(50) COMMENT '创建人IP（写入操作日志）',
+    action VARCHAR(30) NOT NULL COMMENT '操作：notify_success/refund/card91_deliver',
+    order_ids MEDIUMTEXT NOT NULL COMMENT '订单ID列表JSON',
+    status TINYINT NOT NULL DEFAULT 0 COMMENT '状态：0=排队中 1=执行中 2=已完成 3=失败',
+    total INT NOT NULL DEFAULT 0 COMMENT '订单数',
+    processed INT NOT NULL DEFAULT 0 COMMENT '已处理订单数',
+    succeeded INT NOT NULL DEFAULT 0 COMMENT '成功数',
+    failed INT NOT NULL DEFAULT 0 COMMENT '失败数',
+    failures MEDIUMTEXT COMMENT '失败明细JSON [{id, reason}]',
+    error VARCHAR(500) COMMENT '任务失败原因',
+    locked_by VARCHAR(100) COMMENT '执行该任务的进程标识',
+    locked_at DATETIME COMMENT '最近一次心跳时间（超时未刷新则标记失败）',
+    create_time DATETIME DEFAULT CURRENT_TIMESTAMP,
+    start_time DATETIME COMMENT '开始时间',
+    finish_time DATETIME COMMENT '完成时间',
+    INDEX idx_bulk_status (status, id),
+    INDEX idx_bulk_user (user_id, id),
+    FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE SET NULL
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COMMENT='订单批量操作任务表';
+
+-- 19. card_inventory table（91卡券本地库存，worker.py 预先提卡，发卡时原子领取）
+CREATE TABLE IF NOT EXISTS card_inventory (
+    id BIGINT PRIMARY KEY AUTO_INCREMENT,
+    product_id BIGINT NOT NULL COMMENT '商品ID',
+    shop_id BIGINT NOT NULL COMMENT '提卡店铺ID',
+    card_type_id VARCHAR(100) NOT NULL COMMENT '91卡券卡种ID',
+    card_data TEXT NOT NULL COMMENT '卡密JSON（AES-GCM加密）',
+    batch_id VARCHAR(64) COMMENT '补货批次（HandPick 提卡单号）',
+    status TINYINT NOT NULL DEFAULT 0 COMMENT '状态：0=可用 1=已领取 2=无法解密',
+    order_id BIGINT COMMENT '领取订单ID',
+    create_time DATETIME DEFAULT CURRENT_TIMESTAMP,
+    claim_time DATETIME COMMENT '领取时间',
+    INDEX idx_inventory_claim (product_id, status, id),
+    INDEX idx_inventory_order (order_id),
+    FOREIGN KEY (product_id) REFERENCES products(id) ON DELETE CASCADE,
+    FOREIGN KEY (order_id) REFERENCES orders(id) ON DELETE SET NULL
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COMMENT='91卡券本地库存表';
+
+-- 20. direct_charge_tasks table（直充任务，worker.py 提交上游供应商并批量查询结果）
+CREATE TABLE IF NOT EXISTS direct_charge_tasks (
+    id BIGINT PRIMARY KEY AUTO_INCREMENT,
+    order_id BIGINT NOT NULL COMMENT '订单ID',
+    shop_id BIGINT NOT NULL COMMENT '店铺ID',
+    product_id BIGINT COMMENT '匹配到的商品配置ID',
+    supplier VARCHAR(50) NOT NULL COMMENT '供应商类型（商品的直充API类型）',
+    supplier_order_no VARCHAR(100) COMMENT '供应商订单号',
+    status TINYINT NOT NULL DEFAULT 0 COMMENT '状态：0=待提交 1=提交中 2=充值中 3=充值成功 4=充值失败',
+    attempts INT NOT NULL DEFAULT 0 COMMENT '已提交次数',
+    max_attempts INT NOT NULL DEFAULT 3 COMMENT '最大提交次数',
+    polls INT NOT NULL DEFAULT 0 COMMENT '已查询次数',
+    next_run_time DATETIME DEFAULT CURRENT_TIMESTAMP COMMENT '下次提交/查询时间',
+    locked_by VARCHAR(64) COMMENT '领取批次标识',
+    locked_at DATETIME COMMENT '领取时间',
+    last_error VARCHAR(500) COMMENT '最近一次上游返回信息',
+    create_time DATETIME DEFAULT CURRENT_TIMESTAMP,
+    submit_time DATETIME COMMENT '首次提交时间',
+    finish_time DATETIME COMMENT '完成时间',
+    UNIQUE KEY uk_direct_charge_order (order_id),
+    INDEX idx_direct_charge_status_run (status, next_run_time),
+    FOREIGN KEY (order_id) REFERENCES orders(id) ON DELETE CASCADE
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COMMENT='直充任务表';
+
+-- 21. card91_handpick_records table（91卡券提卡记录，HandPick 前写入，重试时重放同一提卡单号）
+CREATE TABLE IF NOT EXISTS card91_handpick_records (
+    id BIGINT PRIMARY KEY AUTO_INCREMENT,
+    shop_id BIGINT NOT NULL COMMENT '店铺ID',
+    card_type_id VARCHAR(100) NOT NULL COMMENT '91卡券卡种ID',
+    order_no VARCHAR(64) NOT NULL COMMENT '订单号',
+    quantity INT NOT NULL COMMENT '本单数量',
+    batch_id VARCHAR(64) NOT NULL COMMENT '提卡单号（handPickOrderId）',
+    batch_num INT NOT NULL COMMENT '该提卡单号的提卡数量',
+    pick_offset INT NOT NULL DEFAULT 0 COMMENT '本单在批次卡密中的起始位置',
+    status TINYINT NOT NULL DEFAULT 0 COMMENT '状态：0=提卡中 1=已提卡 2=逐单提卡',
+    create_time DATETIME DEFAULT CURRENT_TIMESTAMP,
+    update_time DATETIME DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+    UNIQUE KEY uk_handpick_order (shop_id, card_type_id, order_no),
+    INDEX idx_handpick_batch (batch_id)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COMMENT='91卡券提卡记录表';
+
+-- 22. card_pool_batches table（91卡券本地库存补货批次，HandPick 前写入，结果不确定时重放同一提卡单号）
+CREATE TABLE IF NOT EXISTS card_pool_batches (
+    id BIGINT PRIMARY KEY AUTO_INCREMENT,
+    batch_id VARCHAR(64) NOT NULL COMMENT '提卡单号（handPickOrderId）',
+    product_id BIGINT NOT NULL COMMENT '商品ID',
+    shop_id BIGINT NOT NULL COMMENT '提卡店铺ID',
+    card_type_id VARCHAR(100) NOT NULL COMMENT '91卡券卡种ID',
+    quantity INT NOT NULL COMMENT '提卡数量',
+    status TINYINT NOT NULL DEFAULT 0 COMMENT '状态：0=提卡中 1=已入库 2=失败',
+    received INT NOT NULL DEFAULT 0 COMMENT '入库张数',
+    attempts INT NOT NULL DEFAULT 0 COMMENT '提卡次数',
+    last_error VARCHAR(500) COMMENT '最近一次失败信息',
+    create_time DATETIME DEFAULT CURRENT_TIMESTAMP,
+    update_time DATETIME DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+    UNIQUE KEY uk_pool_batch_id (batch_id),
+    INDEX idx_pool_batch_status (status, product_id),
+    FOREIGN KEY (product_id) REFERENCES products(id) ON DELETE CASCADE
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COMMENT='91卡券本地库存补货批次表';
+
 -- Add card91 columns to shops table if not exists
 ALTER TABLE shops
     ADD COLUMN IF NOT EXISTS card91_api_url VARCHAR(500) COMMENT '91卡券API地址',
@@ -0,0 +1,55 @@
+"""数据库结构迁移与热点查询索引检查。
+
+    python migrations/migrate.py            # 执行未执行的迁移（MySQL 下索引在线添加，不锁表）
+    python migrations/migrate.py --status   # 查看各版本是否已执行
+    python migrations/migrate.py --explain  # EXPLAIN 热点查询，检查是否使用了预期索引
+
+迁移定义见 app/services/schema_migrations.py。
+"""
+import argparse
+import sys
+
+from dotenv import load_dotenv
+load_dotenv()
+
+from app import create_app
+from app.services.schema_migrations import (
+    MIGRATIONS, applied_versions, apply_migrations, audit_hot_queries,
+)
+
+
+def status():
+    applied = applied_versions()
+    for m in MIGRATIONS:
+        print(f'{m.version}  {"已执行" if m.version in applied else "未执行"}  {m.description}')
+
+
+def explain():
+    ok = True
+    for item in audit_hot_queries():
+        mark = 'OK ' if item['ok'] else 'MISS'
+        print(f'[{mark}] {item["name"]}（{item["description"]}）期望 {item["index"]}，'
+              f'实际 {", ".join(item["used"]) or "全表扫描"}')
+        ok = ok and item['ok']
+    return ok
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='数据库结构迁移')
+    parser.add_argument('--status', action='store_true', help='查看迁移版本状态')
+    parser.add_argument('--explain', action='store_true', help='检查热点查询的索引使用情况')
+    args = parser.parse_args()
+
+    app = create_app()
+    with app.app_context():
+        if args.status:
+            status()
+        elif args.explain:
+            sys.exit(0 if explain() else 1)
+        else:
+            try:
+                done = apply_migrations(log=print)
+            except Exception as e:
+                print(f'结构迁移失败：{e}')
+                sys.exit(1)
+            print(f'迁移完成：{", ".join(done)}' if done else '没有需要执行的迁移')
@@ -3,4 +3,5 @@ cd /www/wwwroot/ds
 source venv/bin/activate
 export PYTHONPATH=/www/wwwroot/ds:$PYTHONPATH
 /www/wwwroot/ds/venv/bin/gunicorn -c gunicorn_conf.py run:app -D
+nohup /www/wwwroot/ds/venv/bin/python worker.py >> worker.log 2>&1 &
 echo "✅ 应用已启动"
@@ -1,5 +1,6 @@
 import json
 import pytest
+from contextlib import contextmanager
 from app import create_app
 from app.extensions import db as _db
 from app.models.user import User, UserShopPermission
@@ -94,6 +95,17 @@ def login(client, username, password):
                        follow_redirects=True)
 
 
+@contextmanager
+def query_budget(max_queries):
+    """代码块内执行的 SQL 不超过 max_queries 条，超出时列出全部语句。"""
+    from app.services.sql_profiler import capture_queries
+    with capture_queries() as collector:
+        yield collector
+    assert collector.count <= max_queries, (
+        f'执行了 {collector.count} 条 SQL，预算 {max_queries} 条：\n' + '\n'.join(collector.statements)
+    )
+
+
 # ---- Model Tests ----
 
 class TestUserModel:
@@ -775,3 +787,2552 @@ class TestOrderEvent:
         assert '阿奇索'.encode() not in resp.data
         # 应有91卡券配置
         assert '91卡券'.encode() in resp.data
+
+
+# ---- 日志异步批量写入测试 ----
+
+class TestLogWriter:
+    def _writer(self, app, monkeypatch, **overrides):
+        from app.services.log_writer import LogWriter
+        app.config.update(LOG_WRITER_ASYNC=True, **overrides)
+        writer = LogWriter(app)
+        # 不启动后台线程，由测试手动 flush
+        monkeypatch.setattr(writer, '_ensure_thread', lambda: None)
+        return writer
+
+    def test_api_request_logged(self, client, shop):
+        """同步模式下 /api/ 请求仍会写入 ApiLog"""
+        from app.models.api_log import ApiLog
+        client.post('/api/order/create', content_type='application/json',
+                    data=json.dumps({'shop_code': 'TEST001', 'jd_order_no': 'JD_LOG_001', 'amount': 100}))
+        assert ApiLog.query.filter_by(api_type='create_order').count() == 1
+
+    def test_batch_flush(self, app, db, monkeypatch):
+        """入队不落库，flush 时多行写入"""
+        from app.models.operation_log import OperationLog
+        writer = self._writer(app, monkeypatch, LOG_WRITER_BATCH_SIZE=2)
+        for i in range(5):
+            assert writer.enqueue(OperationLog, username='admin', action='test', detail=str(i))
+        assert OperationLog.query.count() == 0
+        writer.flush()
+        assert OperationLog.query.count() == 5
+        assert writer.stats()['written'] == 5
+
+    def test_overflow_drop_new(self, app, db, monkeypatch):
+        from app.models.operation_log import OperationLog
+        writer = self._writer(app, monkeypatch, LOG_WRITER_QUEUE_SIZE=2,
+                              LOG_WRITER_OVERFLOW_POLICY='drop_new')
+        results = [writer.enqueue(OperationLog, username='admin', action='test', detail=str(i))
+                   for i in range(3)]
+        assert results == [True, True, False]
+        assert writer.stats()['dropped'] == 1
+        writer.flush()
+        assert sorted(l.detail for l in OperationLog.query.all()) == ['0', '1']
+
+    def test_overflow_drop_oldest(self, app, db, monkeypatch):
+        from app.models.operation_log import OperationLog
+        writer = self._writer(app, monkeypatch, LOG_WRITER_QUEUE_SIZE=2,
+                              LOG_WRITER_OVERFLOW_POLICY='drop_oldest')
+        for i in range(3):
+            writer.enqueue(OperationLog, username='admin', action='test', detail=str(i))
+        writer.flush()
+        assert sorted(l.detail for l in OperationLog.query.all()) == ['1', '2']
+
+    def test_shutdown_flushes(self, app, db, monkeypatch):
+        from app.models.operation_log import OperationLog
+        writer = self._writer(app, monkeypatch)
+        writer.enqueue(OperationLog, username='admin', action='test')
+        writer.shutdown()
+        assert OperationLog.query.count() == 1
+
+
+# ---- 店铺解析缓存测试 ----
+
+class TestShopCache:
+    def test_lookup_keys(self, app, db):
+        from app.services.shop_cache import get_shop_cache
+        s = Shop(shop_name='缓存店铺', shop_code='CACHE001', shop_type=2, is_enabled=1,
+                 game_customer_id='C100', general_vendor_id='V100')
+        db.session.add(s)
+        db.session.commit()
+        cache = get_shop_cache()
+        assert cache.by_game_customer_id('C100').id == s.id
+        assert cache.by_vendor_id('V100').id == s.id
+        assert cache.by_code('CACHE001').id == s.id
+        assert cache.by_code('NONE') is None
+
+    def test_snapshot_immutable(self, app, shop):
+        from app.services.shop_cache import get_shop_cache
+        snap = get_shop_cache().by_code('TEST001')
+        with pytest.raises(AttributeError):
+            snap.shop_name = 'x'
+
+    def test_no_query_on_hit(self, app, db, shop):
+        from sqlalchemy import event
+        from app.services.shop_cache import get_shop_cache
+        cache = get_shop_cache()
+        cache.by_code('TEST001')
+        statements = []
+        listener = lambda *args: statements.append(args[2])
+        event.listen(db.engine, 'before_cursor_execute', listener)
+        try:
+            for _ in range(10):
+                assert cache.by_code('TEST001') is not None
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', listener)
+        assert statements == []
+
+    def test_invalidated_on_commit(self, app, db, shop):
+        from app.services.shop_cache import get_shop_cache
+        cache = get_shop_cache()
+        assert cache.by_code('TEST001').shop_name == '测试店铺'
+        shop.shop_name = '改名店铺'
+        db.session.commit()
+        assert cache.by_code('TEST001').shop_name == '改名店铺'
+        shop.is_enabled = 0
+        db.session.commit()
+        assert cache.by_code('TEST001') is None
+
+    def test_disabled_shop_rejected_by_api(self, client, db, shop):
+        shop.is_enabled = 0
+        db.session.commit()
+        resp = client.post('/api/order/create', content_type='application/json',
+                           data=json.dumps({'shop_code': 'TEST001', 'jd_order_no': 'JD_X', 'amount': 1}))
+        assert json.loads(resp.data)['success'] is False
+
+
+# ---- 接单工作单元测试 ----
+
+def jd_game_push(order_id, **biz):
+    """构造京东游戏点卡推单表单"""
+    import base64
+    biz.setdefault('orderId', order_id)
+    biz.setdefault('totalPrice', '1.00')
+    biz.setdefault('buyNum', '1')
+    data = base64.b64encode(json.dumps(biz).encode('utf-8')).decode('ascii')
+    return {'customerId': 'C001', 'data': data, 'timestamp': '20240101000000', 'sign': 'x'}
+
+
+class TestOrderIngest:
+    def test_ingest_single_commit(self, app, db, shop):
+        from sqlalchemy import event
+        from app.models.order_event import OrderEvent
+        from app.services.order_ingest import ingest_order, generate_order_no
+        commits = []
+        listener = lambda conn: commits.append(1)
+        event.listen(db.engine, 'commit', listener)
+        try:
+            order = Order(order_no=generate_order_no(), jd_order_no='JD_UOW_1', shop_id=shop.id,
+                          shop_type=1, order_type=1, amount=100)
+            result = ingest_order(order, '创建')
+        finally:
+            event.remove(db.engine, 'commit', listener)
+        assert result.created is True
+        assert len(commits) == 1
+        assert OrderEvent.query.filter_by(order_id=order.id, event_type='order_created').count() == 1
+        assert {'build', 'flush', 'commit', 'total'} <= set(result.timings)
+
+    def test_ingest_duplicate(self, app, db, order):
+        from app.services.order_ingest import ingest_order, generate_order_no
+        dup = Order(order_no=generate_order_no(), jd_order_no=order.jd_order_no, shop_id=order.shop_id,
+                    shop_type=1, order_type=1, amount=100)
+        result = ingest_order(dup, '重复')
+        assert result.created is False
+        assert result.order.id == order.id
+        assert Order.query.count() == 1
+
+    def test_game_direct_duplicate_push(self, client, db, shop):
+        shop.game_customer_id = 'C001'
+        db.session.commit()
+        resp = client.post('/api/game/direct', data=jd_game_push('JD_PUSH_1'))
+        assert json.loads(resp.data)['retMessage'] == '接收成功'
+        resp = client.post('/api/game/direct', data=jd_game_push('JD_PUSH_1'))
+        assert json.loads(resp.data)['retMessage'] == '订单已存在'
+        assert Order.query.filter_by(jd_order_no='JD_PUSH_1').count() == 1
+
+    def test_general_distill_duplicate_push(self, client, db):
+        s = Shop(shop_name='通用店', shop_code='GEN001', shop_type=2, is_enabled=1, general_vendor_id='V1')
+        db.session.add(s)
+        db.session.commit()
+        form = {'vendorId': 'V1', 'jdOrderNo': 'JD_GEN_1', 'bizType': '1', 'totalPrice': '100'}
+        first = json.loads(client.post('/api/general/distill', data=form).data)
+        second = json.loads(client.post('/api/general/distill', data=form).data)
+        assert first['agentOrderNo'] == second['agentOrderNo']
+        assert Order.query.filter_by(jd_order_no='JD_GEN_1').count() == 1
+
+        # 缺少订单号时拒绝，不当作重复推单应答
+        for account in ('acc1', 'acc2'):
+            resp = client.post('/api/general/distill', data=dict(form, jdOrderNo='', produceAccount=account))
+            assert resp.status_code == 400 and resp.get_json()['message'] == '缺少订单号'
+        assert Order.query.filter_by(jd_order_no='').count() == 0
+
+    def test_refuse_without_dedupe_index(self, app, db, shop):
+        from sqlalchemy import text
+        from app.services.order_ingest import DedupeIndexMissing, ingest_order, generate_order_no
+        db.session.execute(text('DROP INDEX idx_jd_order_shop'))
+        db.session.commit()
+
+        def push():
+            return ingest_order(Order(order_no=generate_order_no(), jd_order_no='JD_NOIDX', shop_id=shop.id,
+                                      shop_type=1, order_type=1, amount=100), '创建')
+
+        with pytest.raises(DedupeIndexMissing):
+            push()
+        assert Order.query.count() == 0
+        # 迁移补上索引后无需重启即可恢复接单
+        db.session.execute(text('CREATE UNIQUE INDEX idx_jd_order_shop ON orders (jd_order_no, shop_id)'))
+        db.session.commit()
+        assert push().created is True
+        assert push().created is False
+
+
+# ---- 近期订单防重索引测试 ----
+
+class TestRecentOrders:
+    def test_duplicate_push_no_order_query(self, client, db, shop):
+        """重复推单命中近期订单索引，不再查询 orders 表"""
+        from sqlalchemy import event
+        shop.game_customer_id = 'C001'
+        db.session.commit()
+        client.post('/api/game/card', data=jd_game_push('JD_RETRY_1'))
+        statements = []
+        listener = lambda *args: statements.append(args[2])
+        event.listen(db.engine, 'before_cursor_execute', listener)
+        try:
+            resp = client.post('/api/game/card', data=jd_game_push('JD_RETRY_1'))
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', listener)
+        assert json.loads(resp.data)['retMessage'] == '订单已存在'
+        assert not [s for s in statements if 'FROM orders' in s]
+
+    def test_warm_from_database(self, app, order):
+        from app.services.recent_orders import RecentOrderIndex
+        index = RecentOrderIndex(app)
+        assert index.get(order.jd_order_no, order.shop_id) == order.order_no
+        assert index.get('UNKNOWN', order.shop_id) is None
+
+    def test_shared_between_processes(self, app, tmp_path):
+        """两个索引实例共享同一个 SQLite 文件（模拟两个 worker）"""
+        from app.services.recent_orders import RecentOrderIndex
+        app.config['RECENT_ORDER_DB'] = str(tmp_path / 'recent.db')
+        worker_a = RecentOrderIndex(app)
+        worker_b = RecentOrderIndex(app)
+        worker_a.put('JD_SHARED', 1, 'ORD_SHARED')
+        assert worker_b.get('JD_SHARED', 1) == 'ORD_SHARED'
+
+    def test_window_expiry(self, app):
+        import time
+        from app.services.recent_orders import RecentOrderIndex
+        index = RecentOrderIndex(app)
+        index.put('JD_OLD', 1, 'ORD_OLD', created_at=time.time() - index.window - 1)
+        assert index.get('JD_OLD', 1) is None
+
+
+# ---- 发货任务队列测试 ----
+
+class TestFulfillment:
+    @pytest.fixture
+    def card_shop(self, db, shop):
+        from app.models.product import Product
+        shop.game_customer_id = 'C001'
+        shop.card91_api_key = 'KEY'
+        db.session.add(Product(shop_id=shop.id, product_name='爱奇艺月卡', sku_id='SKU_CARD',
+                               deliver_type=1, card91_card_type_id='TYPE001', is_enabled=1))
+        db.session.commit()
+        return shop
+
+    def _patch(self, monkeypatch, fetch_ok=True, callback_ok=True):
+        import app.services.fulfillment as fulfillment
+        calls = {'fetch': [], 'callback': 0}
+
+        def fake_deliver(shop, order, product, detail=None):
+            calls['fetch'].append(order.order_no)
+            if not fetch_ok:
+                return False, '库存不足', []
+            return True, '提卡成功', [{'cardNo': 'NO1', 'cardPass': 'PW1'}]
+
+        def fake_callback(shop, order, cards):
+            calls['callback'] += 1
+            return callback_ok, 'ok' if callback_ok else '回调超时'
+
+        monkeypatch.setattr(fulfillment, 'card91_auto_deliver', fake_deliver)
+        monkeypatch.setattr(fulfillment, 'callback_game_card_deliver', fake_callback)
+        return calls
+
+    def test_push_enqueues_job(self, client, db, card_shop, monkeypatch):
+        """推单只写入发货任务，不在请求内提卡"""
+        from app.models.fulfillment_job import FulfillmentJob
+        calls = self._patch(monkeypatch)
+        resp = client.post('/api/game/card', data=jd_game_push('JD_JOB_1', skuId='SKU_CARD'))
+        assert json.loads(resp.data)['retMessage'] == '接收成功'
+        order = Order.query.filter_by(jd_order_no='JD_JOB_1').first()
+        job = FulfillmentJob.query.filter_by(order_id=order.id).one()
+        assert job.status == FulfillmentJob.STATUS_PENDING
+        assert order.order_status == 0
+        assert calls['fetch'] == []
+
+    def test_worker_delivers(self, app, client, db, card_shop, monkeypatch):
+        from app.models.fulfillment_job import FulfillmentJob
+        from app.models.order_event import OrderEvent
+        from app.services.fulfillment import run_pending_jobs
+        calls = self._patch(monkeypatch)
+        client.post('/api/game/card', data=jd_game_push('JD_JOB_2', skuId='SKU_CARD'))
+        assert run_pending_jobs(app) == 1
+        order = Order.query.filter_by(jd_order_no='JD_JOB_2').first()
+        assert order.order_status == 2 and order.notify_status == 1
+        assert order.card_info_parsed[0]['cardNo'] == 'NO1'
+        assert calls['fetch'] == [order.order_no]
+        assert FulfillmentJob.query.filter_by(order_id=order.id).one().status == FulfillmentJob.STATUS_DONE
+        types = {e.event_type for e in OrderEvent.query.filter_by(order_id=order.id)}
+        assert {'card91_fetch', 'card91_deliver'} <= types
+
+    def test_retry_reuses_cards(self, app, client, db, card_shop, monkeypatch):
+        """回调失败后按退避重试，卡密已保存时不再重复提卡"""
+        from datetime import datetime
+        from app.models.fulfillment_job import FulfillmentJob
+        from app.services.fulfillment import run_pending_jobs
+        calls = self._patch(monkeypatch, callback_ok=False)
+        client.post('/api/game/card', data=jd_game_push('JD_JOB_3', skuId='SKU_CARD'))
+        run_pending_jobs(app)
+        job = FulfillmentJob.query.one()
+        assert job.status == FulfillmentJob.STATUS_PENDING and job.attempts == 1
+        assert job.next_run_time > datetime.now()
+        assert run_pending_jobs(app) == 0
+
+        self._patch(monkeypatch, callback_ok=True)
+        job.next_run_time = datetime.now()
+        db.session.commit()
+        run_pending_jobs(app)
+        db.session.refresh(job)
+        assert job.status == FulfillmentJob.STATUS_DONE
+        assert len(calls['fetch']) == 1
+
+    def test_max_attempts_marks_failed(self, app, client, db, card_shop, monkeypatch):
+        from app.models.fulfillment_job import FulfillmentJob
+        from app.services.fulfillment import run_pending_jobs
+        self._patch(monkeypatch, fetch_ok=False)
+        client.post('/api/game/card', data=jd_game_push('JD_JOB_4', skuId='SKU_CARD'))
+        job = FulfillmentJob.query.one()
+        job.max_attempts = 1
+        db.session.commit()
+        run_pending_jobs(app)
+        db.session.refresh(job)
+        assert job.status == FulfillmentJob.STATUS_FAILED
+        assert job.last_error == '库存不足'
+
+    def test_claim_respects_shop_limit(self, app, db, shop):
+        from app.models.fulfillment_job import FulfillmentJob
+        from app.services.fulfillment import claim_jobs
+        for i in range(3):
+            o = Order(order_no=f'ORD_LIM{i}', jd_order_no=f'JD_LIM{i}', shop_id=shop.id,
+                      shop_type=1, order_type=2, amount=100)
+            db.session.add(FulfillmentJob(order=o, shop_id=shop.id))
+        db.session.commit()
+        claimed = claim_jobs('w1', 10, inflight={shop.id: 1}, shop_limit=2)
+        assert len(claimed) == 1
+        assert claim_jobs('w2', 10, inflight={shop.id: 2}, shop_limit=2) == []
+
+
+# ---- 出站HTTP客户端测试 ----
+
+class TestHttpClient:
+    class _FakeResponse:
+        status_code = 200
+
+    def test_timeouts_per_integration(self, app):
+        from app.services.http_client import get_http_client
+        client = get_http_client()
+        assert client.timeout_for('jd_game') == app.config['HTTP_TIMEOUTS']['jd_game']
+        assert client.timeout_for('card91') == (5, 30)
+
+    def test_shared_session(self, app):
+        from app.services.http_client import get_http_client
+        client = get_http_client()
+        assert client.session is client.session
+        adapter = client.session.get_adapter('https://api.m.jd.com')
+        assert adapter._pool_maxsize == app.config['HTTP_POOL_MAXSIZE']
+
+    def test_retry_on_connection_reset(self, monkeypatch):
+        import requests
+        from app.services.http_client import HttpClient
+        client = HttpClient(retries=2)
+        calls = []
+
+        def fake_request(method, url, **kwargs):
+            calls.append(kwargs['timeout'])
+            if len(calls) < 2:
+                raise requests.exceptions.ConnectionError('Connection reset by peer')
+            return self._FakeResponse()
+
+        monkeypatch.setattr(client.session, 'request', fake_request)
+        resp = client.post('jd_game', 'https://api.m.jd.com/callback', data={})
+        assert resp.status_code == 200
+        assert calls == [(3, 10), (3, 10)]
+        stats = client.stats()['api.m.jd.com']
+        assert stats['requests'] == 1 and stats['retries'] == 1 and stats['errors'] == 0
+
+    def test_no_retry_on_read_timeout(self, monkeypatch):
+        import requests
+        from app.services.http_client import HttpClient
+        client = HttpClient(retries=2)
+        calls = []
+
+        def fake_request(method, url, **kwargs):
+            calls.append(1)
+            raise requests.exceptions.ReadTimeout('timeout')
+
+        monkeypatch.setattr(client.session, 'request', fake_request)
+        with pytest.raises(requests.exceptions.ReadTimeout):
+            client.post('card91', 'https://gw-api.agiso.com/x')
+        assert len(calls) == 1
+        assert client.stats()['gw-api.agiso.com']['errors'] == 1
+
+
+# ---- 回调发件箱测试 ----
+
+class TestCallbackOutbox:
+    def _due(self, db, entry):
+        from datetime import datetime
+        entry.next_retry_time = datetime.now()
+        db.session.commit()
+
+    def test_failed_notify_enqueues(self, client, db, admin_user, order):
+        """回调失败时与 notify_status 一起写入发件箱"""
+        from app.models.callback_outbox import CallbackOutbox
+        login(client, 'admin', 'admin123')
+        resp = client.post(f'/order/{order.id}/notify-success')
+        assert json.loads(resp.data)['success'] is False
+        entry = CallbackOutbox.query.filter_by(order_id=order.id).one()
+        assert entry.callback_type == 'deliver'
+        assert entry.status == CallbackOutbox.STATUS_PENDING
+        assert db.session.get(Order, order.id).notify_status == 2
+
+    def test_drain_success(self, app, db, order, monkeypatch):
+        import app.services.callback_outbox as outbox
+        from app.models.order_event import OrderEvent
+        entry = outbox.enqueue_callback(order, 'deliver', '超时')
+        db.session.commit()
+        self._due(db, entry)
+        monkeypatch.setattr(outbox, 'send_callback', lambda shop, o, t: (True, '回调成功'))
+        assert outbox.drain_outbox() == {'sent': 1, 'failed': 0}
+        assert entry.status == entry.STATUS_DONE
+        assert order.order_status == 2 and order.notify_status == 1
+        assert OrderEvent.query.filter_by(order_id=order.id, event_type='callback_retry').count() == 1
+
+    def test_drain_backoff_and_dead(self, app, db, order, monkeypatch):
+        from datetime import datetime
+        import app.services.callback_outbox as outbox
+        app.config['CALLBACK_OUTBOX_MAX_ATTEMPTS'] = 2
+        entry = outbox.enqueue_callback(order, 'refund', '超时')
+        db.session.commit()
+        self._due(db, entry)
+        monkeypatch.setattr(outbox, 'send_callback', lambda shop, o, t: (False, '京东繁忙'))
+        assert outbox.drain_outbox() == {'sent': 0, 'failed': 1}
+        assert entry.status == entry.STATUS_PENDING and entry.attempts == 1
+        assert entry.next_retry_time > datetime.now()
+        assert outbox.drain_outbox() == {'sent': 0, 'failed': 0}
+        self._due(db, entry)
+        outbox.drain_outbox()
+        assert entry.status == entry.STATUS_DEAD
+        assert entry.last_error == '京东繁忙'
+
+    def test_skip_already_notified(self, app, db, order, monkeypatch):
+        import app.services.callback_outbox as outbox
+        entry = outbox.enqueue_callback(order, 'deliver')
+        order.order_status = 2
+        order.notify_status = 1
+        db.session.commit()
+        self._due(db, entry)
+        calls = []
+        monkeypatch.setattr(outbox, 'send_callback', lambda *a: calls.append(a) or (True, ''))
+        outbox.drain_outbox()
+        assert calls == []
+        assert entry.status == entry.STATUS_DONE
+
+    def test_backoff_is_exponential_and_capped(self, app):
+        from app.services.callback_outbox import _backoff
+        app.config.update(CALLBACK_OUTBOX_BASE_DELAY=30, CALLBACK_OUTBOX_MAX_DELAY=100)
+        assert [_backoff(n) for n in (1, 2, 3, 4)] == [30, 60, 100, 100]
+
+
+# ---- 京东查单响应缓存测试 ----
+
+def jd_query_form(order_id):
+    import base64
+    data = base64.b64encode(json.dumps({'orderId': order_id}).encode('utf-8')).decode('ascii')
+    return {'customerId': 'C001', 'data': data}
+
+
+class TestStatusCache:
+    def _count_order_selects(self, db, func):
+        from sqlalchemy import event
+        statements = []
+        listener = lambda *args: statements.append(args[2])
+        event.listen(db.engine, 'before_cursor_execute', listener)
+        try:
+            result = func()
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', listener)
+        return result, len([s for s in statements if 'FROM orders' in s])
+
+    def test_repeat_poll_hits_cache(self, client, db, order):
+        client.post('/api/game/query', data=jd_query_form(order.jd_order_no))
+        resp, selects = self._count_order_selects(
+            db, lambda: client.post('/api/game/query', data=jd_query_form(order.jd_order_no)))
+        assert json.loads(resp.data)['retCode'] == '100'
+        assert selects == 0
+
+    def test_status_change_invalidates(self, client, db, card_order):
+        import base64
+        form = jd_query_form(card_order.jd_order_no)
+        first = json.loads(client.post('/api/game/card-query', data=form).data)
+        assert json.loads(base64.b64decode(first['data']))['orderStatus'] == 1
+        card_order.set_card_info([{'cardNo': 'N1', 'cardPwd': 'P1'}, {'cardNo': 'N2', 'cardPwd': 'P2'}])
+        card_order.order_status = 2
+        db.session.commit()
+        second = json.loads(client.post('/api/game/card-query', data=form).data)
+        data = json.loads(base64.b64decode(second['data']))
+        assert data['orderStatus'] == 0
+        assert data['cardinfos'][0] == {'cardno': 'N1', 'cardpass': 'P1'}
+
+    def test_general_query_signed_fresh(self, client, db, monkeypatch):
+        from app.services.jd_general import generate_general_sign
+        s = Shop(shop_name='通用店', shop_code='GEN001', shop_type=2, is_enabled=1, general_md5_secret='K')
+        db.session.add(s)
+        db.session.commit()
+        db.session.add(Order(order_no='ORD_GQ', jd_order_no='JD_GQ', shop_id=s.id, shop_type=2,
+                             order_type=1, order_status=2, amount=100))
+        db.session.commit()
+        client.post('/api/general/query', data={'jdOrderNo': 'JD_GQ'})
+        resp = json.loads(client.post('/api/general/query', data={'jdOrderNo': 'JD_GQ'}).data)
+        assert resp['produceStatus'] == 1
+        sign_p = {k: v for k, v in resp.items() if k not in ('sign', 'signType')}
+        assert resp['sign'] == generate_general_sign(sign_p, 'K')
+
+    def test_single_flight(self, app):
+        import threading
+        from app.services.status_cache import StatusResponseCache
+        cache = StatusResponseCache(app)
+        calls = []
+        gate = threading.Event()
+
+        def compute():
+            calls.append(1)
+            gate.wait(2)
+            return {'v': 1}
+
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(cache.get_or_compute('k', 'JD1', compute)))
+                   for _ in range(5)]
+        for t in threads:
+            t.start()
+        gate.set()
+        for t in threads:
+            t.join()
+        assert len(calls) == 1
+        assert results == [{'v': 1}] * 5
+
+    def test_cross_process_invalidation(self, app, tmp_path):
+        from app.services.status_cache import StatusResponseCache
+        app.config.update(STATUS_CACHE_DB=str(tmp_path / 'status.db'), CACHE_STAMP_DIR=str(tmp_path))
+        worker_a = StatusResponseCache(app)
+        worker_b = StatusResponseCache(app)
+        worker_b.get_or_compute('k', 'JD1', lambda: 'old')
+        worker_a.invalidate(['JD1'])
+        assert worker_b.get_or_compute('k', 'JD1', lambda: 'new') == 'new'
+
+
+# ---- 91卡券合并提卡测试 ----
+
+class TestHandPickCoalescer:
+    class _Shop:
+        id = 1
+
+    def _fake_fetch(self, monkeypatch, stock=None, fail_batch=False, timeout_batch=0):
+        """模拟91卡券 HandPick：同一提卡单号重复提卡返回同一批卡密。"""
+        import app.services.card91 as card91
+        calls = []
+        issued = {}
+        counter = {'n': 0, 'timeouts': timeout_batch}
+
+        def fake_pick(shop, card_type_id, quantity, order_no):
+            calls.append((order_no, quantity))
+            if fail_batch and order_no.startswith('B'):
+                return False, '库存不足', [], False
+            if order_no not in issued:
+                n = quantity if stock is None else min(quantity, stock - counter['n'])
+                issued[order_no] = []
+                for _ in range(max(n, 0)):
+                    counter['n'] += 1
+                    issued[order_no].append({'cardNo': f'C{counter["n"]}', 'cardPwd': 'P', 'expiry': ''})
+            if order_no.startswith('B') and counter['timeouts'] > 0:
+                # 91卡券已出卡，但响应超时
+                counter['timeouts'] -= 1
+                return False, '请求91卡券服务器超时', [], True
+            return True, 'ok', list(issued[order_no]), False
+
+        monkeypatch.setattr(card91, 'card91_hand_pick', fake_pick)
+        return calls
+
+    def _run_concurrent(self, coalescer, requests_):
+        import threading
+        results = {}
+
+        def worker(order_no, qty):
+            results[order_no] = coalescer.fetch(self._Shop(), 'T1', qty, order_no)
+
+        threads = [threading.Thread(target=worker, args=r) for r in requests_]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        return results
+
+    def test_coalesce_and_split(self, monkeypatch):
+        from app.services.card91 import HandPickCoalescer
+        calls = self._fake_fetch(monkeypatch)
+        coalescer = HandPickCoalescer(window_ms=200)
+        results = self._run_concurrent(coalescer, [('ORD_A', 1), ('ORD_B', 2), ('ORD_C', 1)])
+        assert len(calls) == 1 and calls[0][1] == 4 and calls[0][0].startswith('B')
+        all_cards = [c['cardNo'] for r in results.values() for c in r[2]]
+        assert sorted(all_cards) == ['C1', 'C2', 'C3', 'C4']
+        assert len(results['ORD_B'][2]) == 2
+        assert results['ORD_A'][3]['batch_size'] == 3
+
+    def test_single_order_uses_order_no(self, monkeypatch):
+        from app.services.card91 import HandPickCoalescer
+        calls = self._fake_fetch(monkeypatch)
+        ok, msg, cards, detail = HandPickCoalescer(window_ms=1).fetch(self._Shop(), 'T1', 2, 'ORD_ONE')
+        assert ok and len(cards) == 2
+        assert calls == [('ORD_ONE', 2)]
+        assert detail['handPickOrderId'] == 'ORD_ONE'
+
+    def test_partial_shortage_tops_up(self, monkeypatch):
+        """批次返回不足时按到达顺序分配，差额单独补提"""
+        from app.services.card91 import HandPickCoalescer
+        calls = self._fake_fetch(monkeypatch, stock=3)
+        coalescer = HandPickCoalescer(window_ms=200)
+        results = self._run_concurrent(coalescer, [('ORD_A', 2), ('ORD_B', 2)])
+        oks = sorted(r[0] for r in results.values())
+        assert oks == [False, True]
+        failed = next(r for r in results.values() if not r[0])
+        assert failed[3]['allocated'] == 1
+        # 部分卡密不以明文写入事件明细
+        assert 'partial_cards' not in failed[3] and 'P' not in json.dumps(failed[3])
+        assert len(calls) == 2
+
+    def test_batch_failure_falls_back(self, monkeypatch):
+        from app.services.card91 import HandPickCoalescer
+        calls = self._fake_fetch(monkeypatch, fail_batch=True)
+        coalescer = HandPickCoalescer(window_ms=200)
+        results = self._run_concurrent(coalescer, [('ORD_A', 1), ('ORD_B', 1)])
+        assert all(r[0] for r in results.values())
+        assert {c[0] for c in calls[1:]} == {'ORD_A', 'ORD_B'}
+
+    def test_max_num_splits_batches(self, monkeypatch):
+        from app.services.card91 import HandPickCoalescer
+        calls = self._fake_fetch(monkeypatch)
+        coalescer = HandPickCoalescer(window_ms=200, max_num=2)
+        results = self._run_concurrent(coalescer, [('ORD_A', 2), ('ORD_B', 2)])
+        assert all(r[0] for r in results.values())
+        assert sorted(c[1] for c in calls) == [2, 2]
+
+    def test_uncertain_batch_replays_batch_id(self, app, monkeypatch):
+        """批次超时不改为逐单提卡，重试时重放同一批次号并取回本单那一段卡密"""
+        from app.models.handpick_record import HandPickRecord
+        from app.services.card91 import HandPickCoalescer, HandPickJournal
+        calls = self._fake_fetch(monkeypatch, timeout_batch=1)
+        coalescer = HandPickCoalescer(window_ms=200, journal=HandPickJournal(app))
+        results = self._run_concurrent(coalescer, [('ORD_A', 1), ('ORD_B', 2)])
+        assert not any(r[0] for r in results.values())
+        assert all(r[3]['uncertain'] for r in results.values())
+        assert len(calls) == 1
+        batch_id = calls[0][0]
+        assert {r.status for r in HandPickRecord.query} == {HandPickRecord.STATUS_PENDING}
+
+        # 重试时即使同时到达也不再合并，各自重放批次号
+        retry = self._run_concurrent(coalescer, [('ORD_B', 2), ('ORD_A', 1)])
+        assert [c[0] for c in calls[1:]] == [batch_id, batch_id]
+        cards = {no: [c['cardNo'] for c in r[2]] for no, r in retry.items()}
+        assert len(cards['ORD_A']) == 1 and len(cards['ORD_B']) == 2
+        assert sorted(cards['ORD_A'] + cards['ORD_B']) == ['C1', 'C2', 'C3']
+        assert {r.status for r in HandPickRecord.query} == {HandPickRecord.STATUS_DONE}
+
+    def test_rejected_batch_retry_uses_order_no(self, app, monkeypatch):
+        """批次被明确拒绝后逐单提卡，重试也只用订单号，不会再进入新批次"""
+        from app.models.handpick_record import HandPickRecord
+        from app.services.card91 import HandPickCoalescer, HandPickJournal
+        calls = self._fake_fetch(monkeypatch, fail_batch=True)
+        coalescer = HandPickCoalescer(window_ms=200, journal=HandPickJournal(app))
+        self._run_concurrent(coalescer, [('ORD_A', 1), ('ORD_B', 1)])
+        assert {r.status for r in HandPickRecord.query} == {HandPickRecord.STATUS_SINGLE}
+        del calls[:]
+        retry = self._run_concurrent(coalescer, [('ORD_A', 1), ('ORD_B', 1)])
+        assert sorted(calls) == [('ORD_A', 1), ('ORD_B', 1)]
+        assert retry['ORD_A'][2][0]['cardNo'] != retry['ORD_B'][2][0]['cardNo']
+
+
+# ---- 91卡券卡种目录缓存测试 ----
+
+class TestCard91Catalog:
+    def _fake_remote(self, monkeypatch, total=250):
+        import app.services.card91 as card91
+        calls = []
+
+        def fake_request(shop, endpoint, params=None):
+            calls.append((endpoint, dict(params or {})))
+            if endpoint.endswith('HandPick'):
+                num = int(params['num'])
+                return True, 'ok', {'CardPwdArr': [{'c': f'N{i}', 'p': 'P'} for i in range(num)]}, False
+            page, size = int(params['pageIndex']), int(params['pageSize'])
+            ids = range((page - 1) * size, min(page * size, total))
+            return True, 'ok', {'TotalCount': total, 'List': [
+                {'IdNo': f'T{i}', 'Title': f'卡种{i}', 'RemainingCount': 10} for i in ids]}, False
+
+        monkeypatch.setattr(card91, '_request', fake_request)
+        return calls
+
+    def _shop(self, db, shop):
+        shop.agiso_access_token = 'TOKEN'
+        shop.card91_api_key = 'KEY'
+        db.session.commit()
+        return shop
+
+    def test_paginates_full_list(self, app, db, shop, monkeypatch):
+        from app.services.card91 import card91_get_card_types
+        calls = self._fake_remote(monkeypatch)
+        ok, msg, types = card91_get_card_types(self._shop(db, shop))
+        assert ok and len(types) == 250
+        assert [c[1]['pageIndex'] for c in calls] == ['1', '2', '3']
+
+    def test_stock_served_from_memory(self, app, db, shop, monkeypatch):
+        from app.services.card91 import card91_get_card_types, card91_get_stock
+        calls = self._fake_remote(monkeypatch)
+        shop = self._shop(db, shop)
+        card91_get_card_types(shop)
+        calls.clear()
+        assert card91_get_stock(shop, 'T199') == (True, '库存：10张', 10)
+        assert card91_get_stock(shop, 'NOPE')[0] is False
+        assert calls == []
+
+    def test_handpick_decrements_stock(self, app, db, shop, monkeypatch):
+        from app.services.card91 import card91_get_card_types, card91_get_stock, card91_fetch_cards
+        self._fake_remote(monkeypatch)
+        shop = self._shop(db, shop)
+        card91_get_card_types(shop)
+        ok, msg, cards = card91_fetch_cards(shop, 'T5', 3, 'ORD001')
+        assert ok and len(cards) == 3
+        assert card91_get_stock(shop, 'T5')[2] == 7
+
+    def test_stale_refreshes_in_background(self, app, db, shop, monkeypatch):
+        from app.services.card91 import get_card91_catalog, card91_get_card_types
+        calls = self._fake_remote(monkeypatch, total=5)
+        shop = self._shop(db, shop)
+        catalog = get_card91_catalog()
+        card91_get_card_types(shop)
+        refreshed = []
+        monkeypatch.setattr(catalog, '_refresh_in_background', lambda creds: refreshed.append(creds.id))
+        catalog.ttl = 0
+        calls.clear()
+        ok, msg, types = card91_get_card_types(shop)
+        assert ok and len(types) == 5
+        assert calls == [] and refreshed == [shop.id]
+
+    def test_types_api_uses_cache(self, client, db, admin_user, shop, monkeypatch):
+        calls = self._fake_remote(monkeypatch, total=3)
+        self._shop(db, shop)
+        login(client, 'admin', 'admin123')
+        client.get(f'/product/api/card91-types/{shop.id}')
+        resp = json.loads(client.get(f'/product/api/card91-stock/{shop.id}/T1').data)
+        assert resp['stock'] == 10
+        assert len(calls) == 1
+
+    def test_decrement_published_to_other_processes(self, app, db, shop, monkeypatch, tmp_path):
+        """worker 提卡扣减的库存同步到 web 进程的目录"""
+        from app.services.card91 import Card91Catalog
+        self._fake_remote(monkeypatch, total=3)
+        shop = self._shop(db, shop)
+        config = {'path': str(tmp_path / 'catalog.db'), 'stamp_dir': str(tmp_path / 'stamps')}
+        web, worker = Card91Catalog(**config), Card91Catalog(**config)
+        assert web.get_stock(shop, 'T1')[2] == 10
+        worker.get_stock(shop, 'T1')
+
+        worker.decrement(shop.id, 'T1', 3)
+        assert worker.get_stock(shop, 'T1')[2] == 7
+        assert web.get_stock(shop, 'T1')[2] == 7
+        # 已反映在重新加载的目录中的扣减不再重复扣减
+        late = Card91Catalog(**config)
+        assert late.get_stock(shop, 'T1')[2] == 10
+        worker.decrement(shop.id, 'T2', 1)
+        assert late.get_stock(shop, 'T1')[2] == 10 and late.get_stock(shop, 'T2')[2] == 9
+        assert web.get_stock(shop, 'T1')[2] == 7
+
+
+# ---- 订单关键字搜索测试 ----
+
+class TestOrderSearch:
+    def _search(self, keyword):
+        from app.services.order_search import apply_keyword_filter
+        return sorted(o.order_no for o in apply_keyword_filter(Order.query, keyword).all())
+
+    def _orders(self, db, shop):
+        rows = [
+            ('ORD20240101120000AAAAAAAA', 'JD7001', '爱奇艺黄金会员月卡', '13800138000'),
+            ('ORD20240101120001BBBBBBBB', 'JD7002', '腾讯视频会员季卡', 'user@example.com'),
+            ('ORD20240101120002CCCCCCCC', 'JD7003', '爱奇艺年卡', '13900139000'),
+        ]
+        for order_no, jd_no, info, account in rows:
+            db.session.add(Order(order_no=order_no, jd_order_no=jd_no, shop_id=shop.id, shop_type=1,
+                                 order_type=1, amount=100, product_info=info, produce_account=account))
+        db.session.commit()
+
+    def test_tokenize(self):
+        from app.services.order_search import tokenize, query_tokens
+        assert tokenize('爱奇艺VIP') == {'爱奇', '奇艺', 'vip'}
+        assert query_tokens('奇艺') == {'奇艺'}
+        assert query_tokens('v') is None
+
+    def test_ngram_search(self, db, shop):
+        self._orders(db, shop)
+        assert self._search('爱奇艺') == ['ORD20240101120000AAAAAAAA', 'ORD20240101120002CCCCCCCC']
+        assert self._search('会员') == ['ORD20240101120000AAAAAAAA', 'ORD20240101120001BBBBBBBB']
+        assert self._search('example') == ['ORD20240101120001BBBBBBBB']
+        assert self._search('38000') == ['ORD20240101120000AAAAAAAA']
+
+    def test_exact_fast_paths(self, db, shop):
+        self._orders(db, shop)
+        assert self._search('ord20240101120001bbbbbbbb') == ['ORD20240101120001BBBBBBBB']
+        assert self._search('13900139000') == ['ORD20240101120002CCCCCCCC']
+
+    def test_substring_semantics(self, db, shop):
+        """号码既精确匹配也片段匹配；长商品信息全文可搜；年份分词不参与候选集"""
+        from app.services.order_search import search_tokens
+        self._orders(db, shop)
+        db.session.add(Order(order_no='ORD20240101120003DDDDDDDD', jd_order_no='JD7004', shop_id=shop.id,
+                             shop_type=1, order_type=1, amount=100, produce_account='813900139000',
+                             product_info='说明' * 200 + '星辰兑换码'))
+        db.session.commit()
+        assert self._search('13900139000') == ['ORD20240101120002CCCCCCCC', 'ORD20240101120003DDDDDDDD']
+        assert self._search('星辰兑换') == ['ORD20240101120003DDDDDDDD']
+        assert search_tokens('2024') is None
+        assert search_tokens('20240101') == {'401', '010', '101'}
+        assert len(self._search('2024')) == 4
+
+    def test_tokens_follow_updates(self, db, shop):
+        from app.models.order_search import OrderSearchToken
+        self._orders(db, shop)
+        o = Order.query.filter_by(jd_order_no='JD7002').first()
+        o.product_info = '优酷会员'
+        db.session.commit()
+        assert self._search('腾讯') == []
+        assert self._search('优酷') == [o.order_no]
+        db.session.delete(o)
+        db.session.commit()
+        assert OrderSearchToken.query.filter_by(order_id=o.id).count() == 0
+
+    def test_backfill_and_list_keyword(self, client, db, admin_user, shop):
+        from app.models.order_search import OrderSearchToken
+        from app.services.order_search import reindex_orders
+        self._orders(db, shop)
+        OrderSearchToken.query.delete()
+        db.session.commit()
+        assert self._search('爱奇艺') == []
+        with db.engine.begin() as conn:
+            assert reindex_orders(conn, Order.query.all()) > 0
+        login(client, 'admin', 'admin123')
+        resp = client.get('/order/?keyword=腾讯视频')
+        assert 'JD7002' in resp.data.decode('utf-8')
+        assert 'JD7001' not in resp.data.decode('utf-8')
+
+
+# ---- 列表游标分页测试 ----
+
+class TestKeysetPagination:
+    def _logs(self, db, n):
+        from app.models.operation_log import OperationLog
+        for i in range(n):
+            db.session.add(OperationLog(user_id=1, username=f'user{i}', action='login', detail=str(i)))
+        db.session.commit()
+        return [log.id for log in OperationLog.query.order_by(OperationLog.id.desc()).all()]
+
+    def _page(self, app, url):
+        from app.models.operation_log import OperationLog
+        from app.utils.pagination import keyset_paginate
+        with app.test_request_context(url):
+            p = keyset_paginate(OperationLog.query, OperationLog.id, 10)
+            return p, [log.id for log in p.items], p.prev_url, p.next_url
+
+    def test_next_and_prev_cursors(self, app, db):
+        ids = self._logs(db, 25)
+        p, items, prev_url, next_url = self._page(app, '/operation-log/')
+        assert items == ids[:10] and not p.has_prev and p.has_next
+        assert prev_url is None and f'after={ids[9]}' in next_url and 'page=2' in next_url
+
+        p, items, prev_url, next_url = self._page(app, f'/operation-log/?after={ids[19]}&page=3')
+        assert items == ids[20:] and p.has_prev and not p.has_next and next_url is None
+        assert f'before={ids[20]}' in prev_url and 'page=2' in prev_url
+
+        p, items, _, _ = self._page(app, f'/operation-log/?before={ids[20]}&page=2')
+        assert items == ids[10:20] and p.has_prev and p.has_next and p.page == 2
+
+    def test_prev_to_first_page(self, app, db):
+        ids = self._logs(db, 15)
+        p, items, prev_url, _ = self._page(app, f'/operation-log/?before={ids[10]}&page=5')
+        assert items == ids[:10] and not p.has_prev and p.page == 1 and prev_url is None
+        p, _, prev_url, _ = self._page(app, f'/operation-log/?after={ids[9]}&page=2')
+        assert prev_url == '/operation-log/'
+
+    def test_urls_keep_filters(self, app, db):
+        ids = self._logs(db, 12)
+        _, _, _, next_url = self._page(app, f'/operation-log/?action=login&page=1&after=&username=')
+        assert 'action=login' in next_url and 'username' not in next_url
+        assert next_url.count('page=') == 1
+
+    def test_count_cached_across_pages(self, app, db):
+        from sqlalchemy import event
+        ids = self._logs(db, 25)
+        p, _, _, _ = self._page(app, '/operation-log/')
+        assert p.total == 25 and p.pages == 3 and not p.approximate
+        statements = []
+        listener = lambda *args: statements.append(args[2].lower())
+        event.listen(db.engine, 'before_cursor_execute', listener)
+        try:
+            p, _, _, _ = self._page(app, f'/operation-log/?after={ids[9]}&page=2')
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', listener)
+        assert p.total == 25
+        assert not [s for s in statements if 'count(' in s]
+        assert any('operation_logs.id < ?' in s for s in statements)
+
+    def test_list_pages_render(self, client, db, admin_user, shop):
+        for i in range(25):
+            db.session.add(Order(order_no=f'ORD2024010112{i:04d}00ABCDEF01', jd_order_no=f'JDP{i:03d}',
+                                 shop_id=shop.id, shop_type=1, order_type=1, amount=100))
+        db.session.commit()
+        login(client, 'admin', 'admin123')
+        html = client.get('/order/?shop_id=%d' % shop.id).data.decode('utf-8')
+        assert 'JDP024' in html and 'JDP004' not in html and '下一页' in html
+        first_last = Order.query.filter_by(jd_order_no='JDP005').first().id
+        html = client.get(f'/order/?shop_id={shop.id}&after={first_last}&page=2').data.decode('utf-8')
+        assert 'JDP004' in html and 'JDP005' not in html and '上一页' in html
+        for path in ('/api-log/', '/operation-log/', '/notification/', '/product/'):
+            assert client.get(path + '?after=999999&page=2').status_code == 200
+
+
+# ---- 订单统计汇总测试 ----
+
+class TestOrderStats:
+    def _order(self, db, shop, jd_no, status=0, amount=100, create_time=None, order_type=1):
+        from datetime import datetime
+        o = Order(order_no=f'ORD{jd_no}', jd_order_no=jd_no, shop_id=shop.id, shop_type=1,
+                  order_type=order_type, amount=amount, order_status=status,
+                  create_time=create_time or datetime.now())
+        db.session.add(o)
+        return o
+
+    def test_insert_and_transition(self, app, db, shop):
+        from app.services.order_stats import query_rollup
+        o1 = self._order(db, shop, 'S1', amount=100)
+        self._order(db, shop, 'S2', amount=250, status=2)
+        db.session.commit()
+        assert query_rollup(group_by=('order_status',)) == {(0,): (1, 100), (2,): (1, 250)}
+        o1.order_status = 2
+        db.session.commit()
+        assert query_rollup(group_by=('order_status',)) == {(2,): (2, 350)}
+        db.session.delete(o1)
+        db.session.commit()
+        assert query_rollup() == {(): (1, 250)}
+
+    def test_rollback_discards_deltas(self, app, db, shop):
+        from app.services.order_stats import query_rollup
+        o = self._order(db, shop, 'S1')
+        db.session.commit()
+        o.order_status = 4
+        db.session.flush()
+        db.session.rollback()
+        assert query_rollup(group_by=('order_status',)) == {(0,): (1, 100)}
+
+    def test_range_uses_daily_and_hourly(self, app, db, shop):
+        from datetime import datetime
+        from app.services.order_stats import query_rollup
+        times = [datetime(2024, 5, 1, 22, 30), datetime(2024, 5, 2, 3), datetime(2024, 5, 3, 12),
+                 datetime(2024, 5, 4, 1, 15), datetime(2024, 5, 4, 9)]
+        for i, t in enumerate(times):
+            self._order(db, shop, f'R{i}', amount=10 * (i + 1), create_time=t)
+        db.session.commit()
+        assert query_rollup(datetime(2024, 5, 1, 22), datetime(2024, 5, 4, 2)) == {(): (4, 100)}
+        assert query_rollup(datetime(2024, 5, 2), datetime(2024, 5, 4)) == {(): (2, 50)}
+        assert query_rollup(datetime(2024, 5, 4, 1, 40), datetime(2024, 5, 4, 9, 1)) == {(): (2, 90)}
+        assert query_rollup(datetime(2024, 5, 4, 2), datetime(2024, 5, 4, 8)) == {}
+        assert query_rollup(shop_ids=[]) == {}
+
+    def test_rebuild_matches_incremental(self, app, db, shop):
+        from datetime import datetime, timedelta
+        from app.models.order_stats import OrderStatDaily, OrderStatHourly
+        from app.services.order_stats import query_rollup, rebuild_rollups
+        for i in range(6):
+            self._order(db, shop, f'B{i}', status=i % 3, amount=100 + i, order_type=1 + i % 2,
+                        create_time=datetime.now() - timedelta(days=i))
+        db.session.commit()
+        dims = ('shop_id', 'shop_type', 'order_type', 'order_status')
+        expected = query_rollup(group_by=dims)
+        OrderStatHourly.query.delete()
+        OrderStatDaily.query.delete()
+        db.session.commit()
+        assert query_rollup() == {}
+        assert rebuild_rollups(batch_size=4) == 6
+        assert query_rollup(group_by=dims) == expected
+        assert rebuild_rollups(since=datetime.now() - timedelta(days=2)) == 3
+        assert query_rollup(group_by=dims) == expected
+
+    def test_statistics_page_reads_rollups(self, client, db, admin_user, shop):
+        from sqlalchemy import event
+        self._order(db, shop, 'P1', status=2, amount=1000)
+        self._order(db, shop, 'P2', status=1, amount=500)
+        db.session.commit()
+        login(client, 'admin', 'admin123')
+        statements = []
+        listener = lambda *args: statements.append(args[2])
+        event.listen(db.engine, 'before_cursor_execute', listener)
+        try:
+            resp = client.get('/statistics/')
+            pending = json.loads(client.get('/api/new-order-count').data)['pending']
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', listener)
+        html = resp.data.decode('utf-8')
+        assert '¥15.00' in html and '¥10.00' not in html.split('店铺统计')[0]
+        assert pending == 1
+        assert not [s for s in statements if 'FROM orders' in s and 'count(' in s.lower()
+                    and 'create_time >' not in s]
+
+
+# ---- 日志归档测试 ----
+
+class TestLogArchive:
+    @pytest.fixture
+    def archive_dir(self, app, tmp_path):
+        app.config['LOG_ARCHIVE_DIR'] = str(tmp_path)
+        app.config['LOG_RETENTION_DAYS'] = {'api_logs': 30, 'order_events': 30,
+                                            'notification_logs': 30, 'operation_logs': 30}
+        return tmp_path
+
+    def _api_logs(self, db, times, shop_id=None, api_type='游戏直充接单'):
+        from app.models.api_log import ApiLog
+        for t in times:
+            db.session.add(ApiLog(shop_id=shop_id, api_type=api_type, request_method='POST',
+                                  request_body='x' * 100, create_time=t))
+        db.session.commit()
+
+    def test_archive_whole_months(self, app, db, archive_dir):
+        import os
+        from datetime import datetime
+        from app.models.api_log import ApiLog
+        from app.services.log_archive import archive_table, archive_cutoff, iter_archive
+        now = datetime(2024, 5, 20, 12)
+        assert archive_cutoff('api_logs', now) == datetime(2024, 4, 1)
+        self._api_logs(db, [datetime(2024, 3, 1, 8), datetime(2024, 3, 31, 23, 59),
+                            datetime(2024, 4, 1, 0, 1), datetime(2024, 5, 19)])
+        assert archive_table('api_logs', now=now, batch_size=1) == 2
+        assert [l.create_time for l in ApiLog.query.order_by(ApiLog.id).all()] == [
+            datetime(2024, 4, 1, 0, 1), datetime(2024, 5, 19)]
+        assert os.path.exists(archive_dir / 'api_logs' / '2024-03' / 'api_logs-2024-03-31.jsonl.gz')
+        from datetime import date
+        rows = list(iter_archive('api_logs', date(2024, 3, 1), date(2024, 3, 31)))
+        assert [r['create_time'] for r in rows] == ['2024-03-01T08:00:00', '2024-03-31T23:59:00']
+        assert rows[0]['request_body'] == 'x' * 100
+
+    def test_disabled_without_dir_or_retention(self, app, db, archive_dir):
+        from datetime import datetime
+        from app.services.log_archive import archive_expired
+        self._api_logs(db, [datetime(2020, 1, 1)])
+        app.config['LOG_RETENTION_DAYS'] = {'api_logs': 0}
+        assert archive_expired()['api_logs'] == 0
+        app.config['LOG_RETENTION_DAYS'] = {'api_logs': 30}
+        app.config['LOG_ARCHIVE_DIR'] = None
+        assert archive_expired()['api_logs'] == 0
+
+    def test_duplicate_append_is_deduplicated(self, app, db, archive_dir):
+        from datetime import date, datetime
+        from app.services.log_archive import _write_batch, iter_archive
+        rows = [{'id': i, 'create_time': datetime(2024, 1, 2, 10).isoformat()} for i in (1, 2, 3)]
+        _write_batch('operation_logs', rows)
+        _write_batch('operation_logs', rows[1:])  # 模拟删除前中断后重跑
+        _write_batch('operation_logs', [{'id': 4, 'create_time': '2024-01-02T11:00:00'}])
+        assert [r['id'] for r in iter_archive('operation_logs', date(2024, 1, 1), date(2024, 1, 3))] == [1, 2, 3, 4]
+
+    def test_ids_out_of_order_across_days(self, app, db, archive_dir):
+        from datetime import date, datetime
+        from app.models.api_log import ApiLog
+        from app.services.log_archive import archive_table, iter_archive
+        # 入队时间与主键分配顺序不同：午夜前的记录主键更大
+        db.session.add_all([
+            ApiLog(id=101, api_type='接单', request_method='POST', create_time=datetime(2024, 1, 1, 23, 59, 59, 900000)),
+            ApiLog(id=100, api_type='接单', request_method='POST', create_time=datetime(2024, 1, 2, 0, 0, 0, 100000)),
+        ])
+        db.session.commit()
+        assert archive_table('api_logs', now=datetime(2024, 5, 20)) == 2
+        assert [r['id'] for r in iter_archive('api_logs', date(2024, 1, 1), date(2024, 1, 2))] == [100, 101]
+
+    def test_archive_page(self, client, db, admin_user, shop, archive_dir):
+        from datetime import datetime, timedelta
+        from app.services.log_archive import archive_expired
+        base = (datetime.now() - timedelta(days=100)).replace(hour=10, minute=0)
+        self._api_logs(db, [base + timedelta(minutes=i) for i in range(35)], shop_id=shop.id)
+        self._api_logs(db, [base + timedelta(hours=2)], api_type='通用交易查询')
+        assert archive_expired()['api_logs'] == 36
+        login(client, 'admin', 'admin123')
+        day = base.strftime('%Y-%m-%d')
+        html = client.get(f'/api-log/?source=archive&start_date={day}&end_date={day}').data.decode('utf-8')
+        assert '归档数据' in html and '共 36 条' in html and '下一页' in html
+        html = client.get(f'/api-log/?source=archive&api_type=通用交易查询').data.decode('utf-8')
+        assert html.count('showApiDetail(') == 2  # 一行数据 + 函数定义
+        html = client.get('/api-log/').data.decode('utf-8')
+        assert html.count('showApiDetail(') == 1
+
+    def test_order_detail_reads_archived_events(self, client, db, admin_user, shop, archive_dir):
+        from datetime import datetime, timedelta
+        from app.models.order_event import OrderEvent
+        from app.services.log_archive import archive_table
+        created = datetime.now() - timedelta(days=120)
+        order = Order(order_no='ORDARCHIVE1', jd_order_no='JDARCH1', shop_id=shop.id, shop_type=1,
+                      order_type=1, amount=100, create_time=created, update_time=created + timedelta(days=1))
+        db.session.add(order)
+        db.session.flush()
+        for desc, t in (('已接单', created), ('已发货', created + timedelta(days=1))):
+            db.session.add(OrderEvent(order_id=order.id, order_no=order.order_no, event_type='order_created',
+                                      event_desc=desc, create_time=t))
+        db.session.commit()
+        assert archive_table('order_events') == 2
+        assert OrderEvent.query.count() == 0
+        login(client, 'admin', 'admin123')
+        html = client.get(f'/order/{order.id}/detail-html').data.decode('utf-8')
+        assert html.index('已发货') < html.index('已接单')
+
+
+# ---- 订单导出测试 ----
+
+class TestOrderExport:
+    @pytest.fixture
+    def export_dir(self, app, tmp_path):
+        app.config['EXPORT_DIR'] = str(tmp_path)
+        return tmp_path
+
+    def _orders(self, db, shop, n=12):
+        other = Shop(shop_name='其他店铺', shop_code='OTHER001', shop_type=2, is_enabled=1)
+        db.session.add(other)
+        db.session.flush()
+        for i in range(n):
+            db.session.add(Order(order_no=f'ORDEXP{i:03d}', jd_order_no=f'JDEXP{i:03d}',
+                                 shop_id=shop.id if i % 2 else other.id, shop_type=1, order_type=1,
+                                 amount=1234 + i, product_info=f'商品,"{i}"'))
+        db.session.commit()
+        return other
+
+    def test_stream_csv_without_per_row_queries(self, client, db, admin_user, shop):
+        import csv as _csv
+        import io as _io
+        from sqlalchemy import event
+        self._orders(db, shop)
+        login(client, 'admin', 'admin123')
+        statements = []
+        listener = lambda *args: statements.append(args[2])
+        event.listen(db.engine, 'before_cursor_execute', listener)
+        try:
+            text = client.get('/order/export').data.decode('utf-8')
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', listener)
+        assert text.startswith('\ufeff')
+        rows = list(_csv.reader(_io.StringIO(text[1:])))
+        assert rows[0][0] == '京东订单号' and len(rows) == 13
+        assert rows[1][:3] == ['JDEXP011', 'ORDEXP011', '测试店铺'] and rows[1][6] == '商品,"11"'
+        assert rows[2][2] == '其他店铺' and rows[1][7] == '12.45'
+        assert not [s for s in statements if 'FROM shops' in s]
+        assert len([s for s in statements if 'JOIN shops' in s]) == 1
+
+    def test_gzip_matches_csv(self, client, db, admin_user, shop):
+        import gzip
+        self._orders(db, shop)
+        login(client, 'admin', 'admin123')
+        plain = client.get('/order/export?format=csv&shop_id=%d' % shop.id).data
+        resp = client.get('/order/export?format=csv.gz&shop_id=%d' % shop.id)
+        assert resp.mimetype == 'application/gzip'
+        assert gzip.decompress(resp.data) == plain
+        assert plain.decode('utf-8').count('\n') == 7
+
+    def test_large_export_runs_as_job(self, app, client, db, admin_user, shop, export_dir):
+        import json as _json
+        from app.models.export_job import ExportJob
+        from app.services.order_export import run_pending_exports
+        self._orders(db, shop)
+        app.config['EXPORT_SYNC_MAX_ROWS'] = 5
+        app.config['EXPORT_PROGRESS_EVERY'] = 2
+        login(client, 'admin', 'admin123')
+        resp = client.get('/order/export?format=csv.gz&shop_id=%d&page=3' % shop.id)
+        assert resp.status_code == 302 and resp.location.endswith('/order/exports')
+        job = ExportJob.query.one()
+        assert job.status == ExportJob.STATUS_PENDING and job.total_rows == 6
+        assert _json.loads(job.filters) == {'shop_id': str(shop.id)}
+        assert run_pending_exports() == 1
+        db.session.refresh(job)
+        assert job.status == ExportJob.STATUS_DONE and job.processed_rows == 6 and job.progress == 100
+        assert job.file_path.startswith(str(export_dir))
+        status = _json.loads(client.get(f'/order/exports/{job.id}').data)
+        assert status['job']['status_label'] == '已完成'
+        import gzip
+        data = client.get(f'/order/exports/{job.id}/download').data
+        assert gzip.decompress(data).decode('utf-8').count('\n') == 7
+        assert '导出任务' in client.get('/order/exports').data.decode('utf-8')
+
+    def test_xlsx_export(self, app, client, db, admin_user, shop, export_dir):
+        import zipfile
+        import xml.etree.ElementTree as ET
+        from app.models.export_job import ExportJob
+        from app.services.order_export import run_pending_exports
+        self._orders(db, shop)
+        login(client, 'admin', 'admin123')
+        assert client.get('/order/export?format=xlsx').status_code == 302
+        run_pending_exports()
+        job = ExportJob.query.one()
+        assert job.status == ExportJob.STATUS_DONE and job.file_name.endswith('.xlsx')
+        with zipfile.ZipFile(job.file_path) as zf:
+            assert '[Content_Types].xml' in zf.namelist()
+            sheet = ET.fromstring(zf.read('xl/worksheets/sheet1.xml'))
+        ns = {'m': 'http://schemas.openxmlformats.org/spreadsheetml/2006/main'}
+        rows = sheet.findall('.//m:row', ns)
+        assert len(rows) == 13
+        first = rows[1].findall('m:c', ns)
+        assert first[0].find('.//m:t', ns).text == 'JDEXP011'
+        assert first[7].find('m:v', ns).text == '12.45'
+
+    def test_export_respects_permissions(self, app, client, db, admin_user, operator_user, shop, export_dir):
+        from app.models.user import UserShopPermission
+        from app.services.order_export import run_pending_exports
+        from app.models.export_job import ExportJob
+        self._orders(db, shop)
+        db.session.add(UserShopPermission(user_id=operator_user.id, shop_id=shop.id))
+        db.session.commit()
+        login(client, 'operator', 'op123')
+        text = client.get('/order/export').data.decode('utf-8')
+        assert '测试店铺' in text and '其他店铺' not in text
+        client.get('/order/export?format=xlsx')
+        run_pending_exports()
+        job = ExportJob.query.one()
+        assert job.processed_rows == 6
+        client.get('/logout')
+        login(client, 'admin', 'admin123')
+        assert client.get(f'/order/exports/{job.id}').status_code == 200
+        admin_job = ExportJob(user_id=admin_user.id, username='admin', export_format='csv', status=2)
+        db.session.add(admin_job)
+        db.session.commit()
+        client.get('/logout')
+        login(client, 'operator', 'op123')
+        assert client.get(f'/order/exports/{admin_job.id}').status_code == 404
+
+    def test_stale_running_export_requeued(self, app, db, admin_user, shop, export_dir):
+        """worker 重启后卡在导出中的任务超时重新排队执行"""
+        from datetime import datetime, timedelta
+        from app.models.export_job import ExportJob
+        from app.services.order_export import LOCK_TIMEOUT, run_pending_exports
+        self._orders(db, shop)
+        now = datetime.now()
+        stale = ExportJob(user_id=admin_user.id, username='admin', export_format='csv', status=1,
+                          locked_by='dead:1', locked_at=now - timedelta(seconds=LOCK_TIMEOUT + 1),
+                          processed_rows=4)
+        alive = ExportJob(user_id=admin_user.id, username='admin', export_format='csv', status=1,
+                          locked_by='alive:2', locked_at=now)
+        db.session.add_all([stale, alive])
+        db.session.commit()
+        assert run_pending_exports() == 1
+        db.session.refresh(stale)
+        db.session.refresh(alive)
+        assert stale.status == ExportJob.STATUS_DONE and stale.processed_rows == 12
+        assert alive.status == ExportJob.STATUS_RUNNING
+
+
+# ---- SQL 统计与查询预算测试 ----
+
+class TestSqlProfiler:
+    def _orders(self, db, shop, start, n):
+        for i in range(start, start + n):
+            db.session.add(Order(order_no=f'SQL{i:03d}', jd_order_no=f'JDSQL{i:03d}', shop_id=shop.id,
+                                 shop_type=1, order_type=1, amount=100, quantity=1))
+        db.session.commit()
+
+    def test_response_headers(self, app, client, db, admin_user):
+        login(client, 'admin', 'admin123')
+        assert 'X-DB-Query-Count' not in client.get('/order/').headers
+        app.config['SQL_PROFILER_HEADERS'] = True
+        resp = client.get('/order/')
+        assert int(resp.headers['X-DB-Query-Count']) > 0
+        assert float(resp.headers['X-DB-Time-Ms']) >= 0
+
+    def test_endpoint_stats_page(self, app, client, db, admin_user, order):
+        from app.services.sql_profiler import get_sql_profiler
+        login(client, 'admin', 'admin123')
+        get_sql_profiler().reset()
+        client.get('/order/')
+        client.get('/order/')
+        stats = {s['endpoint']: s for s in get_sql_profiler().snapshot()}
+        assert stats['order.order_list']['requests'] == 2
+        assert stats['order.order_list']['max_queries'] > 0
+        assert all(stmt.startswith('SELECT') for _, stmt in stats['order.order_list']['slowest'])
+        html = client.get('/statistics/sql-profile').data.decode('utf-8')
+        assert 'order.order_list' in html
+        client.post('/statistics/sql-profile/reset')
+        assert 'order.order_list' not in {s['endpoint'] for s in get_sql_profiler().snapshot()}
+
+    def test_stats_merge_across_workers(self, app, tmp_path):
+        from app.services.sql_profiler import SqlProfiler, QueryCollector
+        app.config['SQL_PROFILER_DB'] = str(tmp_path / 'profile.db')
+        workers = [SqlProfiler(app), SqlProfiler(app)]
+        for n, profiler in enumerate(workers, start=1):
+            collector = QueryCollector()
+            for i in range(n * 2):
+                collector.add(f'SELECT {n}', float(n))
+            profiler.record('order.order_list', collector, 10.0)
+            profiler.flush()
+        stat = workers[0].snapshot()[0]
+        assert stat['requests'] == 2
+        assert stat['queries'] == 6
+        assert stat['max_queries'] == 4
+        assert stat['avg_queries'] == 3.0
+        assert stat['slowest'][0] == [2.0, 'SELECT 2']
+
+    def test_failed_statement_not_counted(self, db, shop):
+        from sqlalchemy.exc import IntegrityError
+        from app.services.sql_profiler import capture_queries
+        with capture_queries() as collector:
+            db.session.add(Order(order_no='DUP', jd_order_no='JDDUP1', shop_id=shop.id, shop_type=1,
+                                 order_type=1, order_status=1, amount=100, quantity=1))
+            db.session.commit()
+            db.session.add(Order(order_no='DUP', jd_order_no='JDDUP2', shop_id=shop.id, shop_type=1,
+                                 order_type=1, order_status=1, amount=100, quantity=1))
+            with pytest.raises(IntegrityError):
+                db.session.commit()
+            db.session.rollback()
+            before = collector.count
+            Order.query.count()
+        # 报错的语句不计入，后续语句的耗时也不会错用残留的起始时间
+        assert collector.count == before + 1
+        assert collector.statements[-1].startswith('SELECT count(*)')
+        with db.engine.connect() as conn:
+            assert 'sql_profiler_start' not in conn.info
+
+    def test_order_list_query_count_is_constant(self, app, client, db, admin_user, shop):
+        from app.utils.pagination import get_count_cache
+        login(client, 'admin', 'admin123')
+        self._orders(db, shop, 0, 3)
+        get_count_cache().clear()
+        with query_budget(10) as small:
+            client.get('/order/')
+        self._orders(db, shop, 3, 30)
+        get_count_cache().clear()
+        with query_budget(10) as large:
+            client.get('/order/')
+        assert large.count == small.count
+
+    def test_jd_query_budget(self, client, db, order):
+        form = jd_query_form(order.jd_order_no)
+        client.post('/api/game/query', data=form)
+        with query_budget(2):
+            resp = client.post('/api/game/query', data=form)
+        assert json.loads(resp.data)['retCode'] == '100'
+        with pytest.raises(AssertionError, match='预算 0 条'):
+            with query_budget(0):
+                Order.query.count()
+
+
+# ---- 店铺权限请求内缓存测试 ----
+
+class TestPermissionCache:
+    def _grant(self, db, user, shop):
+        db.session.add(UserShopPermission(user_id=user.id, shop_id=shop.id))
+        db.session.commit()
+
+    def _permission_selects(self, collector):
+        return len([s for s in collector.statements if 'FROM user_shop_permissions' in s])
+
+    def test_loaded_once_per_request(self, app, db, operator_user, shop):
+        self._grant(db, operator_user, shop)
+        shop_id = shop.id
+        with app.test_request_context('/'):
+            assert not operator_user.is_admin
+            with query_budget(1):
+                assert operator_user.permitted_shop_set() == frozenset({shop_id})
+                assert operator_user.has_shop_permission(shop_id)
+                assert not operator_user.has_shop_permission(shop_id + 1)
+                assert operator_user.get_permitted_shop_ids() == [shop_id]
+
+    def test_batch_notify_checks_permissions_once(self, client, db, operator_user, shop):
+        from app.services.sql_profiler import capture_queries
+        self._grant(db, operator_user, shop)
+        ids = []
+        for i in range(5):
+            o = Order(order_no=f'PERM{i}', jd_order_no=f'JDPERM{i}', shop_id=shop.id, shop_type=1,
+                      order_type=1, order_status=2, amount=100, quantity=1)
+            db.session.add(o)
+            db.session.commit()
+            ids.append(o.id)
+        from app.services.bulk_actions import run_pending_bulk_jobs
+        login(client, 'operator', 'op123')
+        job_id = client.post('/order/batch-notify-success', json={'order_ids': ids}).get_json()['job']['id']
+        with capture_queries() as collector:
+            run_pending_bulk_jobs()
+        reasons = {f['reason'] for f in client.get(f'/order/bulk-jobs/{job_id}').get_json()['job']['failures']}
+        assert reasons == {'状态不符'}
+        assert self._permission_selects(collector) == 1
+
+    def test_new_order_count_checks_permissions_once(self, client, db, operator_user, shop, order):
+        from app.services.sql_profiler import capture_queries
+        self._grant(db, operator_user, shop)
+        login(client, 'operator', 'op123')
+        with capture_queries() as collector:
+            resp = client.get('/api/new-order-count')
+        assert resp.status_code == 200
+        assert self._permission_selects(collector) == 1
+
+    def test_permission_change_within_request(self, app, db, operator_user, shop):
+        with app.test_request_context('/'):
+            assert not operator_user.has_shop_permission(shop.id)
+            self._grant(db, operator_user, shop)
+            assert operator_user.has_shop_permission(shop.id)
+            UserShopPermission.query.filter_by(user_id=operator_user.id).delete()
+            db.session.commit()
+            assert operator_user.has_shop_permission(shop.id)
+            from app.models.user import clear_permission_cache
+            clear_permission_cache(operator_user.id)
+            assert not operator_user.has_shop_permission(shop.id)
+
+    def test_user_edit_takes_effect_next_request(self, client, db, admin_user, operator_user, shop, order):
+        self._grant(db, operator_user, shop)
+        login(client, 'operator', 'op123')
+        assert client.get(f'/order/detail/{order.id}').status_code == 200
+        client.get('/logout')
+        login(client, 'admin', 'admin123')
+        client.post(f'/user/edit/{operator_user.id}', data={'name': 'Operator', 'role': 'operator'})
+        client.get('/logout')
+        login(client, 'operator', 'op123')
+        resp = client.get(f'/order/detail/{order.id}')
+        assert resp.status_code == 302 or '无权限' in resp.data.decode('utf-8')
+
+
+# ---- 新订单提醒推送测试 ----
+
+class TestOrderAlerts:
+    def _order(self, db, shop, no, status=0):
+        o = Order(order_no=f'ALERT{no}', jd_order_no=f'JDALERT{no}', shop_id=shop.id, shop_type=1,
+                  order_type=1, order_status=status, amount=100, quantity=1)
+        db.session.add(o)
+        db.session.commit()
+        return o
+
+    def _other_shop(self, db):
+        s = Shop(shop_name='其他店铺', shop_code='ALERT002', shop_type=1, is_enabled=1)
+        db.session.add(s)
+        db.session.commit()
+        return s
+
+    def test_publish_after_commit_only(self, app, db, shop):
+        from app.services.order_alerts import get_order_alerts
+        hub = get_order_alerts()
+        sub = hub.subscribe()
+        db.session.add(Order(order_no='ALERTRB', jd_order_no='JDALERTRB', shop_id=shop.id, shop_type=1,
+                             order_type=1, amount=100, quantity=1))
+        db.session.flush()
+        db.session.rollback()
+        assert sub.get(timeout=0) == []
+        o = self._order(db, shop, 1)
+        assert sub.get(timeout=0) == [('new', shop.id, o.id)]
+        o.remark = '备注'
+        db.session.commit()
+        assert sub.get(timeout=0) == []
+        o.order_status = 2
+        db.session.commit()
+        assert sub.get(timeout=0) == [('pending', shop.id, o.id)]
+        hub.unsubscribe(sub)
+
+    def test_pending_counts_maintained(self, app, db, shop):
+        from datetime import datetime
+        from app.services.order_stats import pending_counts, rebuild_rollups
+        other = self._other_shop(db)
+        a = self._order(db, shop, 1, status=0)
+        self._order(db, shop, 2, status=1)
+        self._order(db, shop, 3, status=2)
+        c = self._order(db, other, 4, status=0)
+        a.order_status = 2
+        db.session.delete(c)
+        db.session.commit()
+        assert pending_counts() == {shop.id: 1}
+        assert pending_counts([other.id]) == {}
+        rebuild_rollups()
+        assert pending_counts() == {shop.id: 1}
+        rebuild_rollups(since=datetime.now())
+        assert pending_counts() == {shop.id: 1}
+
+    def test_event_stream(self, app, client, db, admin_user, shop):
+        app.config.update(SSE_STREAM_SECONDS=1, SSE_HEARTBEAT_SECONDS=1)
+        self._order(db, shop, 1)
+        login(client, 'admin', 'admin123')
+        resp = client.get('/api/order-events', buffered=False)
+        assert resp.mimetype == 'text/event-stream'
+        chunks = iter(resp.response)
+        assert next(chunks).startswith(b'retry: ')
+        assert next(chunks) == b'event: pending\ndata: {"pending": 1}\n\n'
+        # 推送前已关闭请求会话，不再持有数据库连接 / 事务（测试与请求共用应用上下文，需重新关联对象）
+        assert not db.session().in_transaction()
+        db.session.add(shop)
+        self._order(db, shop, 2)
+        assert next(chunks) == b'event: orders\ndata: {"count": 1}\n\n'
+        assert next(chunks) == b'event: pending\ndata: {"pending": 2}\n\n'
+        resp.close()
+        from app.services.order_alerts import get_order_alerts
+        assert get_order_alerts().connection_count == 0
+
+    def test_stream_filters_by_permission(self, app, client, db, operator_user, shop):
+        app.config.update(SSE_STREAM_SECONDS=1, SSE_HEARTBEAT_SECONDS=1)
+        other = self._other_shop(db)
+        db.session.add(UserShopPermission(user_id=operator_user.id, shop_id=shop.id))
+        db.session.commit()
+        self._order(db, other, 1)
+        login(client, 'operator', 'op123')
+        resp = client.get('/api/order-events', buffered=False)
+        chunks = iter(resp.response)
+        next(chunks)
+        assert next(chunks) == b'event: pending\ndata: {"pending": 0}\n\n'
+        db.session.add(other)
+        self._order(db, other, 2)
+        rest = b''.join(chunks)
+        resp.close()
+        assert b'event: orders' not in rest
+        assert client.get('/api/new-order-count').get_json()['pending'] == 0
+
+    def test_cross_worker_and_connection_limit(self, app, client, db, admin_user, tmp_path):
+        from app.services.order_alerts import OrderAlertHub, get_order_alerts
+        app.config.update(ORDER_ALERT_DB=str(tmp_path / 'alerts.db'), SSE_MAX_CONNECTIONS=1)
+        publisher, listener = OrderAlertHub(app), OrderAlertHub(app)
+        listener._listener = True  # 测试中手动读取，不启动后台线程
+        listener._poll()
+        sub = listener.subscribe()
+        assert listener.subscribe() is None
+        publisher.publish([('new', 1, 10), ('pending', 1, 11)])
+        listener._poll()
+        assert sub.get(timeout=0) == [('new', 1, 10), ('pending', 1, 11)]
+
+        login(client, 'admin', 'admin123')
+        get_order_alerts().max_connections = 0
+        assert client.get('/api/order-events').status_code == 503
+
+
+# ---- 结构迁移与热点查询索引测试 ----
+
+class TestSchemaMigrations:
+    def test_hot_queries_use_indexes(self, app, db):
+        from app.services.schema_migrations import audit_hot_queries
+        missing = [item for item in audit_hot_queries() if not item['ok']]
+        assert missing == []
+
+    def test_order_list_query_uses_index(self, app, db):
+        from app.services.order_search import apply_order_filters
+        from app.services.schema_migrations import explain_indexes
+        query = apply_order_filters(Order.query, {}, [1, 2]).filter(Order.id < 1000)
+        assert 'idx_order_shop_id' in explain_indexes(query.order_by(Order.id.desc()).limit(21).statement)
+        query = apply_order_filters(Order.query, {'order_status': '1'})
+        assert 'idx_order_status_id' in explain_indexes(query.order_by(Order.id.desc()).limit(21).statement)
+
+    def test_apply_records_versions_once(self, app, db):
+        from app.models.schema_migration import SchemaMigration
+        from app.services.schema_migrations import MIGRATIONS, apply_migrations, pending_migrations
+        assert apply_migrations() == [m.version for m in MIGRATIONS]
+        assert pending_migrations() == []
+        assert apply_migrations() == []
+        assert SchemaMigration.query.count() == len(MIGRATIONS)
+
+    def test_upgrade_legacy_indexes(self, app, db):
+        from sqlalchemy import inspect, text
+        from app.models.schema_migration import SchemaMigration
+        from app.services.schema_migrations import apply_migrations, audit_hot_queries
+        apply_migrations()
+        # 模拟旧库：没有热点索引，商品表仍是旧索引
+        for name in ('idx_order_shop_id', 'idx_order_status_id', 'idx_api_type_id', 'idx_product_match'):
+            db.session.execute(text(f'DROP INDEX {name}'))
+        db.session.execute(text('CREATE INDEX idx_shop_sku ON products (shop_id, sku_id)'))
+        SchemaMigration.query.filter_by(version='0004').delete()
+        db.session.commit()
+        assert not all(item['ok'] for item in audit_hot_queries())
+
+        logs = []
+        assert apply_migrations(log=logs.append) == ['0004']
+        assert len(logs) == 5
+        names = {i['name'] for i in inspect(db.engine).get_indexes('products')}
+        assert 'idx_product_match' in names and 'idx_shop_sku' not in names
+        assert all(item['ok'] for item in audit_hot_queries())
+
+    def test_drop_legacy_order_indexes(self, app, db):
+        from sqlalchemy import inspect, text
+        from app.models.schema_migration import SchemaMigration
+        from app.services.schema_migrations import apply_migrations
+        apply_migrations()
+        # 模拟旧版 init.sql 建的库
+        db.session.execute(text('CREATE INDEX idx_jd_order ON orders (jd_order_no, shop_type)'))
+        db.session.execute(text('CREATE INDEX idx_shop ON orders (shop_id, order_status)'))
+        SchemaMigration.query.filter_by(version='0009').delete()
+        db.session.commit()
+
+        assert apply_migrations() == ['0009']
+        names = {i['name'] for i in inspect(db.engine).get_indexes('orders')}
+        assert 'idx_jd_order' not in names and 'idx_shop' not in names
+        assert 'idx_jd_order_shop' in names
+
+    def test_failed_migration_stops(self, app, db, monkeypatch):
+        from app.services import schema_migrations as sm
+        monkeypatch.setattr(sm, 'MIGRATIONS', sm.MIGRATIONS + [
+            sm.Migration('9001', '错误的迁移', [sm.AddIndex('orders', 'idx_bad', ('no_such_column',))]),
+            sm.Migration('9002', '之后的迁移', [sm.AddIndex('orders', 'idx_later', ('remark',))]),
+        ])
+        with pytest.raises(Exception):
+            sm.apply_migrations()
+        assert '9001' not in sm.applied_versions()
+        assert [m.version for m in sm.pending_migrations()] == ['9001', '9002']
+        assert 'ALGORITHM=INPLACE, LOCK=NONE' in sm.AddIndex('orders', 'idx_x', ('remark',)).sql('mysql')
+        assert sm.AddColumn('shops', 'x', 'VARCHAR(10) COMMENT "说明"').sql('sqlite') == \
+            'ALTER TABLE shops ADD COLUMN x VARCHAR(10)'
+
+
+# ---- 订单批量操作任务测试 ----
+
+class TestBulkActions:
+    def _orders(self, db, shop, n, prefix='BULK', **fields):
+        values = dict(shop_type=shop.shop_type, order_type=1, order_status=0, amount=100, quantity=1)
+        values.update(fields)
+        orders = [Order(order_no=f'{prefix}{i}', jd_order_no=f'JD{prefix}{i}', shop_id=shop.id, **values)
+                  for i in range(n)]
+        db.session.add_all(orders)
+        db.session.commit()
+        return [o.id for o in orders]
+
+    def test_small_batch_runs_in_worker(self, client, db, admin_user, shop, monkeypatch):
+        from app.models.callback_outbox import CallbackOutbox
+        from app.models.bulk_job import BulkJob
+        from app.services import bulk_actions
+        ids = self._orders(db, shop, 3)
+        done_id = self._orders(db, shop, 1, prefix='DONE', order_status=2)[0]
+        monkeypatch.setattr(bulk_actions, 'send_callback',
+                            lambda s, o, t: (o.order_no != 'BULK2', '回调成功' if o.order_no != 'BULK2' else '超时'))
+        login(client, 'admin', 'admin123')
+        # 少量订单也不在请求中回调
+        data = client.post('/order/batch-notify-success', json={'order_ids': ids + [done_id, 99999]}).get_json()
+        assert data['background'] is True and data['job']['status'] == BulkJob.STATUS_PENDING
+        assert Order.query.filter(Order.id.in_(ids), Order.order_status == 2).count() == 0
+
+        assert bulk_actions.run_pending_bulk_jobs() == 1
+        job = client.get(f'/order/bulk-jobs/{data["job"]["id"]}').get_json()['job']
+        assert job['status'] == BulkJob.STATUS_DONE
+        assert (job['succeeded'], job['failed']) == (2, 3)
+        assert {f['id']: f['reason'] for f in job['failures']} == {ids[2]: '超时', done_id: '状态不符', 99999: '订单不存在'}
+        db.session.expire_all()
+        assert [db.session.get(Order, i).order_status for i in ids] == [2, 2, 0]
+        assert CallbackOutbox.query.filter_by(order_id=ids[2], callback_type='deliver').count() == 1
+
+    def test_large_batch_runs_in_worker(self, app, client, db, admin_user, shop, monkeypatch):
+        from app.services import bulk_actions
+        app.config['BULK_ACTION_COMMIT_EVERY'] = 40
+        ids = self._orders(db, shop, 150)
+        commits = []
+        original = bulk_actions._apply_batch
+        monkeypatch.setattr(bulk_actions, '_apply_batch',
+                            lambda *a: (commits.append(len(a[2])), original(*a)))
+        monkeypatch.setattr(bulk_actions, 'send_callback', lambda s, o, t: (True, '回调成功'))
+        login(client, 'admin', 'admin123')
+        data = client.post('/order/batch-notify-success', json={'order_ids': ids}).get_json()
+        assert data['background'] is True and data['job']['status'] == 0
+        assert Order.query.filter(Order.order_status == 2).count() == 0
+
+        assert bulk_actions.run_pending_bulk_jobs() == 1
+        assert bulk_actions.run_pending_bulk_jobs() == 0
+        job = client.get(f'/order/bulk-jobs/{data["job"]["id"]}').get_json()['job']
+        assert (job['progress'], job['processed'], job['succeeded']) == (100, 150, 150)
+        assert sum(commits) == 150 and max(commits) <= 40 + 8
+        assert Order.query.filter(Order.order_status == 2).count() == 150
+
+    def test_shop_concurrency_bounded(self, app, db, admin_user, shop, monkeypatch):
+        import threading
+        import time
+        from collections import Counter
+        from app.services import bulk_actions
+        other = Shop(shop_name='另一店铺', shop_code='TEST002', shop_type=2, is_enabled=1, notify_enabled=0)
+        db.session.add(other)
+        db.session.commit()
+        ids = self._orders(db, shop, 6, prefix='A') + self._orders(db, other, 6, prefix='B')
+        app.config.update(BULK_ACTION_THREADS=8, BULK_ACTION_SHOP_CONCURRENCY=2)
+        lock = threading.Lock()
+        running, peak = Counter(), Counter()
+
+        def fake_callback(s, o, t):
+            with lock:
+                running[s.id] += 1
+                peak[s.id] = max(peak[s.id], running[s.id])
+                peak['all'] = max(peak['all'], sum(running[k] for k in (shop.id, other.id)))
+            time.sleep(0.05)
+            with lock:
+                running[s.id] -= 1
+            return True, '回调成功'
+
+        monkeypatch.setattr(bulk_actions, 'send_callback', fake_callback)
+        job = bulk_actions.create_bulk_job(admin_user, 'notify_success', ids, start=True)
+        assert bulk_actions.run_bulk_job(job)
+        assert job.succeeded == 12
+        assert peak[shop.id] <= 2 and peak[other.id] <= 2
+        assert peak['all'] > 2
+
+    def test_permissions(self, client, db, operator_user, admin_user, shop):
+        from app.services.bulk_actions import create_bulk_job, run_pending_bulk_jobs
+        other = Shop(shop_name='另一店铺', shop_code='TEST002', shop_type=1, is_enabled=1, notify_enabled=0)
+        db.session.add(other)
+        db.session.add(UserShopPermission(user_id=operator_user.id, shop_id=shop.id))
+        db.session.commit()
+        ids = self._orders(db, other, 2)
+        login(client, 'operator', 'op123')
+        assert client.post('/order/batch-refund', json={'order_ids': ids}).status_code == 403
+        data = client.post('/order/batch-notify-success', json={'order_ids': ids}).get_json()
+        run_pending_bulk_jobs()
+        job = client.get(f'/order/bulk-jobs/{data["job"]["id"]}').get_json()['job']
+        assert {f['reason'] for f in job['failures']} == {'无店铺权限'}
+        admin_job = create_bulk_job(admin_user, 'refund', ids)
+        assert client.get(f'/order/bulk-jobs/{admin_job.id}').status_code == 404
+
+    def test_card91_deliver(self, client, db, admin_user, shop, monkeypatch):
+        from app.models.order_event import OrderEvent
+        from app.models.product import Product
+        from app.services import bulk_actions
+        shop.card91_api_key = 'key'
+        db.session.add(Product(shop_id=shop.id, product_name='点卡', sku_id='SKU1', deliver_type=1,
+                               card91_card_type_id='T1', is_enabled=1))
+        db.session.commit()
+        matched = self._orders(db, shop, 2, prefix='CARD', order_type=2, sku_id='SKU1')
+        unmatched = self._orders(db, shop, 1, prefix='NOSKU', order_type=2, sku_id='SKU9')
+        monkeypatch.setattr(bulk_actions, 'card91_auto_deliver',
+                            lambda s, o, p, detail=None: (True, '成功提取1张卡密', [{'cardNo': o.order_no, 'cardPwd': 'p'}]))
+        monkeypatch.setattr(bulk_actions, 'callback_game_card_deliver', lambda s, o, cards: (True, '卡密回调成功'))
+        login(client, 'admin', 'admin123')
+        data = client.post('/order/batch-card91-deliver', json={'order_ids': matched + unmatched}).get_json()
+        assert bulk_actions.run_pending_bulk_jobs() == 1
+        job = client.get(f'/order/bulk-jobs/{data["job"]["id"]}').get_json()['job']
+        assert job['succeeded'] == 2
+        assert job['failures'] == [{'id': unmatched[0], 'reason': '未找到匹配的91卡券商品配置'}]
+        db.session.expire_all()
+        order = db.session.get(Order, matched[0])
+        assert order.order_status == 2 and order.card_info_parsed == [{'cardNo': 'CARD0', 'cardPwd': 'p'}]
+        assert OrderEvent.query.filter_by(order_id=order.id, event_type='card91_deliver').count() == 1
+
+    def test_stale_running_job_failed(self, app, db, admin_user, shop, monkeypatch):
+        """worker 重启后卡在执行中的任务超时标记为失败，不重新执行"""
+        from datetime import datetime, timedelta
+        from app.models.bulk_job import BulkJob
+        from app.services import bulk_actions
+        ids = self._orders(db, shop, 2)
+        sent = []
+        monkeypatch.setattr(bulk_actions, 'send_callback', lambda s, o, t: (sent.append(o.id), (True, '回调成功'))[1])
+        monkeypatch.setattr(bulk_actions, 'HEARTBEAT_SECONDS', 0)
+        now = datetime.now()
+        stale = BulkJob(user_id=admin_user.id, action='notify_success', order_ids=json.dumps(ids), total=2,
+                        status=1, locked_by='dead:1', locked_at=now - timedelta(seconds=bulk_actions.LOCK_TIMEOUT + 1))
+        pending = BulkJob(user_id=admin_user.id, action='notify_success', order_ids=json.dumps(ids[:1]), total=1)
+        db.session.add_all([stale, pending])
+        db.session.commit()
+        assert bulk_actions.run_pending_bulk_jobs() == 1
+        db.session.refresh(stale)
+        db.session.refresh(pending)
+        assert stale.status == BulkJob.STATUS_FAILED and '部分执行' in stale.error
+        assert pending.status == BulkJob.STATUS_DONE and pending.locked_at is not None
+        assert sent == ids[:1]
+
+
+# ---- 通知分发队列测试 ----
+
+class TestNotificationDispatcher:
+    def _dispatcher(self, app, **config):
+        from app.services.notification import NotificationDispatcher
+        app.config.update(config)
+        return NotificationDispatcher(app)
+
+    def _fake_send(self, monkeypatch, results):
+        from app.services import notification
+        calls = []
+
+        def fake(webhook, secret, message):
+            calls.append(webhook)
+            ok = results.pop(0) if results else True
+            return ok, '{"errcode":0}' if ok else '', None if ok else '发送失败'
+
+        monkeypatch.setattr(notification, 'send_dingtalk', fake)
+        return calls
+
+    def test_send_and_mark_notified(self, app, db, shop_with_notify, monkeypatch):
+        from app.services.notification import send_order_notification
+        calls = self._fake_send(monkeypatch, [True])
+        o = Order(order_no='N1', jd_order_no='JDN1', shop_id=shop_with_notify.id, shop_type=1,
+                  order_type=1, amount=100, quantity=1)
+        db.session.add(o)
+        db.session.commit()
+        send_order_notification(o, shop_with_notify)
+        assert len(calls) == 1
+        log = NotificationLog.query.one()
+        assert (log.notify_type, log.notify_status) == ('dingtalk', 1)
+        db.session.expire_all()
+        assert o.notified == 1 and o.notify_send_time is not None
+
+    def _drain(self, dispatcher):
+        while not dispatcher.queue.empty():
+            dispatcher._execute(dispatcher.queue.get_nowait())
+
+    def test_retry_is_delayed_not_slept(self, app, db, shop_with_notify, order, monkeypatch):
+        import time
+        from app.services.notification import NotificationDispatcher
+        calls = self._fake_send(monkeypatch, [False, True])
+        monkeypatch.setattr(NotificationDispatcher, '_ensure_threads', lambda self: None)
+        dispatcher = self._dispatcher(app, NOTIFY_ASYNC=True)
+        started = time.monotonic()
+        dispatcher.submit(order.id, shop_with_notify, '消息', ['dingtalk'])
+        self._drain(dispatcher)
+        assert time.monotonic() - started < 0.5
+        assert dispatcher.stats()['delayed'] == 1 and dispatcher.retried == 1
+        assert NotificationLog.query.count() == 0
+        assert dispatcher.release_due() == 0
+        assert dispatcher.release_due(now=time.monotonic() + 10) == 1
+        self._drain(dispatcher)
+        dispatcher.flush_marks()
+        assert len(calls) == 2
+        assert NotificationLog.query.one().notify_status == 1
+        db.session.expire_all()
+        assert order.notified == 1
+
+    def test_gives_up_after_retries(self, app, db, shop_with_notify, order, monkeypatch):
+        from app.services.notification import RETRY_INTERVALS
+        calls = self._fake_send(monkeypatch, [False] * 10)
+        dispatcher = self._dispatcher(app)
+        # 同步模式没有定时线程，立即重试，不放入延时堆
+        dispatcher.submit(order.id, shop_with_notify, '消息', ['dingtalk'])
+        assert len(calls) == len(RETRY_INTERVALS)
+        assert dispatcher.stats()['delayed'] == 0
+        log = NotificationLog.query.one()
+        assert log.notify_status == 0 and log.error_message == '发送失败'
+        assert dispatcher.stats()['failed'] == 1
+        db.session.expire_all()
+        assert order.notified == 1
+
+    def test_sync_retry_succeeds_inline(self, app, db, shop_with_notify, order, monkeypatch):
+        calls = self._fake_send(monkeypatch, [False, True])
+        dispatcher = self._dispatcher(app)
+        dispatcher.submit(order.id, shop_with_notify, '消息', ['dingtalk'])
+        assert len(calls) == 2 and dispatcher.retried == 1
+        assert NotificationLog.query.one().notify_status == 1
+        db.session.expire_all()
+        assert order.notified == 1
+
+    def test_bounded_queue_drops_oldest(self, app, client, db, admin_user, shop_with_notify, order, monkeypatch):
+        from app.services.notification import NotificationDispatcher
+        dispatcher = self._dispatcher(app, NOTIFY_ASYNC=True, NOTIFY_QUEUE_SIZE=2,
+                                      NOTIFY_OVERFLOW_POLICY='drop_oldest')
+        monkeypatch.setattr(NotificationDispatcher, '_ensure_threads', lambda self: None)
+        for i in range(3):
+            dispatcher.submit(order.id, shop_with_notify, f'消息{i}', ['dingtalk'])
+        stats = dispatcher.stats()
+        assert (stats['queue_size'], stats['dropped']) == (2, 1)
+        assert [t.message for t in list(dispatcher.queue.queue)] == ['消息1', '消息2']
+        log = NotificationLog.query.one()
+        assert log.notify_status == 0 and '已丢弃' in log.error_message
+
+        app.extensions['notification_dispatcher'] = dispatcher
+        login(client, 'admin', 'admin123')
+        assert client.get('/notification/dispatcher-stats').get_json()['dropped'] == 1
+
+    def test_fixed_worker_pool(self, app, db, shop_with_notify, monkeypatch):
+        import threading
+        import time
+        from app.services import notification
+        orders = [Order(order_no=f'P{i}', jd_order_no=f'JDP{i}', shop_id=shop_with_notify.id, shop_type=1,
+                        order_type=1, amount=100, quantity=1) for i in range(20)]
+        db.session.add_all(orders)
+        db.session.commit()
+        peak = []
+
+        def fake(webhook, secret, message):
+            peak.append(len([t for t in threading.enumerate() if t.name.startswith('notify-')]))
+            time.sleep(0.01)
+            return True, '{"errcode":0}', None
+
+        monkeypatch.setattr(notification, 'send_dingtalk', fake)
+        dispatcher = self._dispatcher(app, NOTIFY_ASYNC=True, NOTIFY_WORKER_THREADS=2,
+                                      NOTIFY_FLUSH_INTERVAL_MS=50)
+        for o in orders:
+            dispatcher.submit(o.id, shop_with_notify, '消息', ['dingtalk'])
+        deadline = time.monotonic() + 5
+        while dispatcher.sent < 20 and time.monotonic() < deadline:
+            time.sleep(0.02)
+        dispatcher.shutdown()
+        assert dispatcher.sent == 20
+        assert max(peak) == 3  # 2 个发送线程 + 1 个定时线程
+        assert Order.query.filter(Order.notified == 1).count() == 20
+
+
+# ---- 通知汇总与 webhook 限流测试 ----
+
+class TestNotificationDigest:
+    def _orders(self, db, shop, n, **fields):
+        orders = [Order(order_no=f'DG{i}', jd_order_no=f'JDDG{i}', shop_id=shop.id, shop_type=1, order_type=1,
+                        amount=fields.get('amount', 1000), quantity=1, product_info=f'商品{i % 2}')
+                  for i in range(n)]
+        db.session.add_all(orders)
+        db.session.commit()
+        return orders
+
+    def _fake_send(self, monkeypatch):
+        from app.services import notification
+        messages = []
+        monkeypatch.setattr(notification, 'send_dingtalk',
+                            lambda webhook, secret, message: (messages.append(message), (True, '{}', None))[1])
+        return messages
+
+    def test_token_bucket(self, tmp_path):
+        from app.services.rate_limit import TokenBucketLimiter
+        limiter = TokenBucketLimiter(60, 2)
+        assert [limiter.acquire('hook', now=100) for _ in range(2)] == [0, 0]
+        assert limiter.acquire('hook', now=100) == pytest.approx(1.0)
+        assert limiter.acquire('other', now=100) == 0
+        assert limiter.acquire('hook', now=101.5) == 0
+        assert TokenBucketLimiter(0, 1).acquire('hook') == 0
+
+        # SQLite 文件在 worker 间共享令牌
+        path = str(tmp_path / 'rate.db')
+        a, b = TokenBucketLimiter(60, 1, path), TokenBucketLimiter(60, 1, path)
+        assert a.acquire('hook', now=100) == 0
+        assert b.acquire('hook', now=100) == pytest.approx(1.0)
+
+    def test_throttled_send_is_delayed(self, app, db, shop_with_notify, order, monkeypatch):
+        import time
+        messages = self._fake_send(monkeypatch)
+        app.config.update(NOTIFY_RATE_PER_MINUTE=60, NOTIFY_RATE_BURST=1)
+        dispatcher = self._async_dispatcher(app, monkeypatch)
+        dispatcher.submit(order.id, shop_with_notify, '消息1', ['dingtalk'])
+        dispatcher.submit(order.id, shop_with_notify, '消息2', ['dingtalk'])
+        self._drain(dispatcher)
+        assert messages == ['消息1']
+        stats = dispatcher.stats()
+        assert (stats['throttled'], stats['delayed'], stats['retried']) == (1, 1, 0)
+        dispatcher.limiter.acquire = lambda key: 0
+        assert dispatcher.release_due(now=time.monotonic() + 2) == 1
+        self._drain(dispatcher)
+        assert messages == ['消息1', '消息2']
+
+    def test_sync_throttled_send_fails(self, app, db, shop_with_notify, order, monkeypatch):
+        from app.services.notification import NotificationDispatcher
+        messages = self._fake_send(monkeypatch)
+        app.config.update(NOTIFY_RATE_PER_MINUTE=60, NOTIFY_RATE_BURST=1)
+        dispatcher = NotificationDispatcher(app)
+        dispatcher.submit(order.id, shop_with_notify, '消息1', ['dingtalk'])
+        dispatcher.submit(order.id, shop_with_notify, '消息2', ['dingtalk'])
+        # 同步模式不放入延时堆，限流的通知记失败，订单仍标记已通知
+        assert messages == ['消息1'] and dispatcher.stats()['delayed'] == 0
+        failed = NotificationLog.query.filter_by(notify_status=0).one()
+        assert failed.error_message == 'webhook 发送频率超限'
+        db.session.expire_all()
+        assert order.notified == 1
+
+    def _async_dispatcher(self, app, monkeypatch):
+        # 异步模式但不启动线程，测试中手动执行队列中的任务
+        from app.services.notification import NotificationDispatcher
+        monkeypatch.setattr(NotificationDispatcher, '_ensure_threads', lambda self: None)
+        app.config.update(NOTIFY_ASYNC=True)
+        dispatcher = NotificationDispatcher(app)
+        app.extensions['notification_dispatcher'] = dispatcher
+        return dispatcher
+
+    def _drain(self, dispatcher):
+        while not dispatcher.queue.empty():
+            dispatcher._execute(dispatcher.queue.get_nowait())
+
+    def test_burst_coalesced_into_digest(self, app, db, shop_with_notify, monkeypatch):
+        import time
+        from app.services.notification import send_order_notification
+        messages = self._fake_send(monkeypatch)
+        dispatcher = self._async_dispatcher(app, monkeypatch)
+        orders = self._orders(db, shop_with_notify, 5)
+        for o in orders:
+            send_order_notification(o, shop_with_notify)
+        self._drain(dispatcher)
+        assert len(messages) == 1 and 'JDDG0' in messages[0]
+        assert dispatcher.stats()['digest_pending'] == 4
+        assert dispatcher.flush_digests() == 0
+
+        assert dispatcher.flush_digests(now=time.time() + 11) == 1
+        self._drain(dispatcher)
+        dispatcher.flush_marks()
+        assert len(messages) == 2 and '新订单汇总（4单）' in messages[1]
+        digest_log = NotificationLog.query.filter(NotificationLog.order_ids.isnot(None)).one()
+        assert digest_log.covered_order_ids == [o.id for o in orders[1:]]
+        assert Order.query.filter(Order.notified == 1).count() == 5
+        # 下一个窗口没有新订单时关闭窗口，之后的订单立即通知
+        assert dispatcher.flush_digests(now=time.time() + 30) == 0
+        assert dispatcher.stats()['digest_pending'] == 0
+
+    def test_digest_windows_shared_across_workers(self, app, db, shop_with_notify, monkeypatch, tmp_path):
+        import time
+        from app.services.notification import NotificationDispatcher
+        messages = self._fake_send(monkeypatch)
+        monkeypatch.setattr(NotificationDispatcher, '_ensure_threads', lambda self: None)
+        app.config.update(NOTIFY_ASYNC=True, NOTIFY_RATE_DB=str(tmp_path / 'notify.db'))
+        workers = [NotificationDispatcher(app), NotificationDispatcher(app)]
+        orders = self._orders(db, shop_with_notify, 6)
+        for i, o in enumerate(orders):
+            workers[i % 2].notify_order(o, shop_with_notify, ['dingtalk'])
+        for w in workers:
+            self._drain(w)
+        # 两个 worker 共用一个窗口：只有第一单立即通知
+        assert len(messages) == 1 and 'JDDG0' in messages[0]
+        assert workers[1].stats()['digest_pending'] == 5
+
+        # 到期窗口只被一个 worker 取走；没有该店铺快照的 worker 从数据库读取
+        fresh = NotificationDispatcher(app)
+        assert fresh.flush_digests(now=time.time() + 11) == 1
+        assert workers[0].flush_digests(now=time.time() + 11) == 0
+        self._drain(fresh)
+        assert len(messages) == 2 and '新订单汇总（5单）' in messages[1]
+
+    def test_sync_mode_does_not_hold_orders(self, app, db, shop_with_notify, monkeypatch):
+        from app.services.notification import get_notification_dispatcher, send_order_notification
+        messages = self._fake_send(monkeypatch)
+        orders = self._orders(db, shop_with_notify, 3)
+        for o in orders:
+            send_order_notification(o, shop_with_notify)
+        # 同步模式没有定时线程发送汇总，每单立即通知并标记
+        assert len(messages) == 3
+        assert get_notification_dispatcher().stats()['digest_pending'] == 0
+        assert Order.query.filter(Order.notified == 1).count() == 3
+
+    def test_delayed_tasks_bounded(self, app, db, shop_with_notify, order, monkeypatch):
+        from app.services import notification
+        from app.services.notification import NotificationDispatcher
+        monkeypatch.setattr(notification, 'send_dingtalk', lambda webhook, secret, message: (False, '', '发送失败'))
+        app.config.update(NOTIFY_QUEUE_SIZE=2, NOTIFY_OVERFLOW_POLICY='drop_oldest')
+        dispatcher = self._async_dispatcher(app, monkeypatch)
+        for i in range(3):
+            dispatcher.submit(order.id, shop_with_notify, f'消息{i}', ['dingtalk'])
+            self._drain(dispatcher)
+        stats = dispatcher.stats()
+        assert (stats['delayed'], stats['dropped']) == (2, 1)
+        assert sorted(t.message for _, _, t in dispatcher._delayed) == ['消息1', '消息2']
+        assert '已丢弃' in NotificationLog.query.one().error_message
+
+        app.config.update(NOTIFY_OVERFLOW_POLICY='drop_new')
+        dispatcher = NotificationDispatcher(app)
+        for i in range(3):
+            dispatcher.submit(order.id, shop_with_notify, f'消息{i}', ['dingtalk'])
+            self._drain(dispatcher)
+        assert sorted(t.message for _, _, t in dispatcher._delayed) == ['消息0', '消息1']
+
+    def test_digest_message(self, app, db, shop_with_notify):
+        from app.services.notification import build_digest_message, summarize_order
+        orders = self._orders(db, shop_with_notify, 12, amount=1050)
+        msg = build_digest_message([summarize_order(o, shop_with_notify) for o in orders], shop_with_notify,
+                                   list_limit=3)
+        assert '新订单汇总（12单）' in msg
+        assert '¥126.00' in msg
+        assert '商品0 × 6' in msg and '商品1 × 6' in msg
+        assert 'JDDG0、JDDG1、JDDG2（共12单，仅列出前3单）' in msg
+        assert 'JDDG3' not in msg
+
+    def test_resend_digest(self, app, db, shop_with_notify, monkeypatch):
+        from app.services.notification import resend_notification
+        messages = self._fake_send(monkeypatch)
+        orders = self._orders(db, shop_with_notify, 3)
+        log = NotificationLog(order_id=orders[0].id, shop_id=shop_with_notify.id, notify_type='dingtalk',
+                              notify_status=0, order_ids=json.dumps([o.id for o in orders]))
+        db.session.add(log)
+        db.session.commit()
+        assert resend_notification(log.id) == (True, '发送成功')
+        assert '新订单汇总（3单）' in messages[0]
+        resent = NotificationLog.query.filter(NotificationLog.id != log.id).one()
+        assert resent.covered_order_ids == [o.id for o in orders]
+
+
+# ---- 91卡券本地库存测试 ----
+
+class TestCardPool:
+    @pytest.fixture
+    def pool_product(self, db, shop):
+        from app.models.product import Product
+        shop.card91_api_key = 'KEY'
+        shop.agiso_access_token = 'TOKEN'
+        product = Product(shop_id=shop.id, product_name='点卡', sku_id='SKU_POOL', deliver_type=1,
+                          card91_card_type_id='T1', is_enabled=1, card_pool_enabled=1)
+        db.session.add(product)
+        db.session.commit()
+        return product
+
+    def _stock(self, db, product, n):
+        from app.models.card_inventory import CardInventory
+        from app.services.card_pool import encrypt_cards
+        db.session.add_all([CardInventory(product_id=product.id, shop_id=product.shop_id, card_type_id='T1',
+                                          card_data=encrypt_cards({'cardNo': f'P{i}', 'cardPwd': f'W{i}'}))
+                            for i in range(n)])
+        db.session.commit()
+
+    def _order(self, db, shop, no, quantity=1):
+        order = Order(order_no=no, jd_order_no=f'JD{no}', shop_id=shop.id, shop_type=shop.shop_type,
+                      order_type=2, order_status=0, amount=100, quantity=quantity, sku_id='SKU_POOL')
+        db.session.add(order)
+        db.session.commit()
+        return order
+
+    def test_encrypt_roundtrip(self, app):
+        from app.services.card_pool import decrypt_cards, encrypt_cards
+        card = {'cardNo': 'NO1', 'cardPwd': '密码'}
+        data = encrypt_cards(card)
+        assert 'NO1' not in data and encrypt_cards(card) != data
+        assert decrypt_cards(data) == card
+        app.config['CARD_POOL_KEY'] = 'another-key'
+        with pytest.raises(ValueError):
+            decrypt_cards(data)
+
+    def test_claim_is_atomic_and_idempotent(self, app, db, shop, pool_product):
+        from app.models.card_inventory import CardInventory
+        from app.services.card_pool import available_counts, claim_pool_cards
+        self._stock(db, pool_product, 3)
+        first = self._order(db, shop, 'POOL1', quantity=2)
+        cards = claim_pool_cards(pool_product, first)
+        db.session.commit()
+        assert [c['cardNo'] for c in cards] == ['P0', 'P1']
+        # 重试返回同一批卡密，不重复领取
+        assert claim_pool_cards(pool_product, first) == cards
+        assert available_counts() == {pool_product.id: 1}
+
+        # 库存不足时不领取，已领取的部分退回库存
+        second = self._order(db, shop, 'POOL2', quantity=2)
+        assert claim_pool_cards(pool_product, second) is None
+        db.session.commit()
+        assert available_counts() == {pool_product.id: 1}
+        assert CardInventory.query.filter_by(order_id=second.id).count() == 0
+
+    def test_requires_dedicated_key(self, app, db, shop, pool_product, monkeypatch):
+        from app.services import card_pool
+        monkeypatch.setattr(card_pool, 'card91_hand_pick', lambda *a: pytest.fail('未配置密钥不应补货'))
+        app.config['CARD_POOL_KEY'] = ''
+        assert not card_pool.pool_enabled(pool_product)
+        assert card_pool.claim_pool_cards(pool_product, self._order(db, shop, 'POOLK')) is None
+        assert card_pool.replenish_pools() == {}
+        with pytest.raises(ValueError):
+            card_pool.encrypt_cards({'cardNo': 'NO1'})
+
+    def test_undecryptable_cards_quarantined(self, app, db, shop, pool_product):
+        from app.models.card_inventory import CardInventory
+        from app.services.card_pool import available_counts, claim_pool_cards
+        self._stock(db, pool_product, 3)
+        app.config['CARD_POOL_KEY'] = 'rotated-key'
+        order = self._order(db, shop, 'POOLQ', quantity=2)
+        # 解密失败时不报错，返回 None 改走远程提卡
+        assert claim_pool_cards(pool_product, order) is None
+        db.session.commit()
+        assert CardInventory.query.filter_by(status=CardInventory.STATUS_INVALID).count() == 2
+        assert CardInventory.query.filter_by(order_id=order.id).count() == 0
+        assert available_counts() == {pool_product.id: 1}
+
+    def test_fallback_to_remote(self, app, db, shop, pool_product, monkeypatch):
+        from app.services import card_pool
+        calls = []
+        monkeypatch.setattr(card_pool, 'card91_auto_deliver',
+                            lambda s, o, p, detail=None: (calls.append(o.order_no), (True, '成功提取1张卡密', [{'cardNo': 'R'}]))[1])
+        self._stock(db, pool_product, 1)
+        detail = {}
+        ok, msg, cards = card_pool.deliver_cards(shop, self._order(db, shop, 'POOLA'), pool_product, detail)
+        assert ok and cards[0]['cardNo'] == 'P0' and detail['source'] == 'pool' and calls == []
+        detail = {}
+        ok, msg, cards = card_pool.deliver_cards(shop, self._order(db, shop, 'POOLB'), pool_product, detail)
+        assert ok and cards == [{'cardNo': 'R'}] and detail['source'] == 'remote' and calls == ['POOLB']
+
+    def test_replenish_watermarks(self, app, db, shop, pool_product, monkeypatch):
+        from app.services import card_pool
+        app.config.update(CARD_POOL_MIN_STOCK=5, CARD_POOL_RATE_WINDOW_MINUTES=10, CARD_POOL_LOW_MINUTES=10,
+                          CARD_POOL_HIGH_MINUTES=30, CARD_POOL_FETCH_MAX=25)
+        fetches = []
+
+        def fake_fetch(s, card_type_id, num, order_no):
+            fetches.append((num, order_no))
+            return True, 'ok', [{'cardNo': f'{order_no}-{i}'} for i in range(num)], False
+
+        monkeypatch.setattr(card_pool, 'card91_hand_pick', fake_fetch)
+        # 空库存、无销量：补到最低库存
+        assert card_pool.replenish_pools() == {pool_product.id: 5}
+        # 库存达到低水位时不补货
+        assert card_pool.replenish_pools() == {}
+
+        # 最近10分钟卖出20张（每分钟2张）：低水位20，高水位60
+        for i in range(20):
+            self._order(db, shop, f'SOLD{i}')
+        assert card_pool.watermarks(pool_product, 2) == (20, 60)
+        assert card_pool.replenish_pools() == {pool_product.id: 55}
+        assert [n for n, _ in fetches[1:]] == [25, 25, 5]
+        assert len({order_no for _, order_no in fetches}) == len(fetches)
+        assert card_pool.available_counts() == {pool_product.id: 60}
+
+        # 商品库存上限
+        pool_product.card_pool_max = 40
+        assert card_pool.watermarks(pool_product, 2) == (20, 40)
+
+    def test_replenish_replays_uncertain_batch(self, app, db, shop, pool_product, monkeypatch):
+        from app.models.card_pool_batch import CardPoolBatch
+        from app.services import card_pool
+        app.config.update(CARD_POOL_MIN_STOCK=3)
+        picks, results = [], [(False, '请求超时', [], True)]
+
+        def fake_pick(s, card_type_id, num, batch_id):
+            picks.append(batch_id)
+            if results:
+                return results.pop(0)
+            return True, 'ok', [{'cardNo': f'{batch_id}-{i}'} for i in range(num)], False
+
+        monkeypatch.setattr(card_pool, 'card91_hand_pick', fake_pick)
+        # 超时：批次保持提卡中，下一轮用同一个提卡单号重放，不提新批次
+        assert card_pool.replenish_pools() == {pool_product.id: 0}
+        batch = CardPoolBatch.query.one()
+        assert (batch.status, batch.attempts) == (CardPoolBatch.STATUS_PENDING, 1)
+        assert card_pool.replenish_pools() == {pool_product.id: 3}
+        assert picks == [batch.batch_id, batch.batch_id]
+        db.session.refresh(batch)
+        assert (batch.status, batch.received) == (CardPoolBatch.STATUS_DONE, 3)
+
+        # 入库失败（卡密已出）：批次仍为提卡中，下一轮重放
+        db.session.execute(db.text('UPDATE card_inventory SET status = 1'))
+        db.session.commit()
+        encrypt = card_pool.encrypt_cards
+        monkeypatch.setattr(card_pool, 'encrypt_cards', lambda card: (_ for _ in ()).throw(RuntimeError('写入失败')))
+        assert card_pool.replenish_pools() == {}
+        pending = CardPoolBatch.query.filter_by(status=CardPoolBatch.STATUS_PENDING).one()
+        monkeypatch.setattr(card_pool, 'encrypt_cards', encrypt)
+        assert card_pool.replenish_pools() == {pool_product.id: 3}
+        assert picks[-2:] == [pending.batch_id, pending.batch_id]
+
+        # 91卡券明确拒绝：批次失败，下一轮使用新的提卡单号
+        db.session.execute(db.text('UPDATE card_inventory SET status = 1'))
+        db.session.commit()
+        results.append((False, '库存不足', [], False))
+        assert card_pool.replenish_pools() == {pool_product.id: 0}
+        assert CardPoolBatch.query.filter_by(status=CardPoolBatch.STATUS_FAILED).count() == 1
+        assert card_pool.replenish_pools() == {pool_product.id: 3}
+        assert picks[-1] != picks[-2]
+
+    def test_fulfillment_uses_pool(self, app, client, db, shop, pool_product, monkeypatch):
+        import app.services.fulfillment as fulfillment
+        from app.models.card_inventory import CardInventory
+        from app.models.order_event import OrderEvent
+        shop.game_customer_id = 'C001'
+        db.session.commit()
+        self._stock(db, pool_product, 2)
+        monkeypatch.setattr(fulfillment, 'card91_auto_deliver', lambda *a, **k: pytest.fail('不应远程提卡'))
+        monkeypatch.setattr(fulfillment, 'callback_game_card_deliver', lambda s, o, cards: (True, 'ok'))
+        client.post('/api/game/card', data=jd_game_push('JD_POOL_JOB', skuId='SKU_POOL'))
+        assert fulfillment.run_pending_jobs(app) == 1
+        order = Order.query.filter_by(jd_order_no='JD_POOL_JOB').first()
+        assert order.order_status == 2 and order.card_info_parsed == [{'cardNo': 'P0', 'cardPwd': 'W0'}]
+        assert CardInventory.query.filter_by(order_id=order.id, status=1).count() == 1
+        event = OrderEvent.query.filter_by(order_id=order.id, event_type='card91_fetch').one()
+        assert json.loads(event.event_data)['source'] == 'pool'
+
+
+# ---- 91卡券商品路由表测试 ----
+
+class TestProductRouter:
+    def _product(self, db, shop, name, sku_id=None, **fields):
+        from app.models.product import Product
+        values = dict(deliver_type=1, card91_card_type_id='T1', is_enabled=1)
+        values.update(fields)
+        product = Product(shop_id=shop.id, product_name=name, sku_id=sku_id, **values)
+        db.session.add(product)
+        db.session.commit()
+        return product
+
+    def test_sku_lookup(self, app, db, shop):
+        from app.services.product_router import get_product_router
+        first = self._product(db, shop, '爱奇艺月卡', 'SKU1')
+        self._product(db, shop, '重复SKU', 'SKU1')
+        self._product(db, shop, '手动发货', 'SKU2', deliver_type=0)
+        self._product(db, shop, '已禁用', 'SKU3', is_enabled=0)
+        router = get_product_router()
+        assert router.by_sku(shop.id, 'SKU1').id == first.id
+        assert router.by_sku(shop.id, 'SKU2') is None
+        assert router.by_sku(shop.id, 'SKU3') is None
+        assert router.by_sku(shop.id + 1, 'SKU1') is None
+        assert router.by_sku(shop.id, None) is None
+
+    def test_name_match(self, app, db, shop):
+        from app.services.product_router import get_product_router
+        self._product(db, shop, '腾讯视频VIP月卡')
+        annual = self._product(db, shop, 'Steam 钱包充值卡 100元')
+        router = get_product_router()
+        assert router.by_name(shop.id, 'steam 钱包').id == annual.id
+        assert router.by_name(shop.id, '视频VIP').product_name == '腾讯视频VIP月卡'
+        assert router.by_name(shop.id, '月').product_name == '腾讯视频VIP月卡'
+        assert router.by_name(shop.id, '视频SVIP') is None
+        assert router.by_name(shop.id, '钱包月卡') is None
+        # SKU 未匹配时按订单商品信息前20个字符匹配
+        assert router.match(shop.id, 'SKU9', 'Steam 钱包充值卡').id == annual.id
+        assert router.match(shop.id, 'SKU9', 'Steam 钱包充值卡 100元（自动发货）') is None
+
+    def test_no_query_on_hit(self, app, db, shop):
+        from sqlalchemy import event
+        from app.services.fulfillment import find_card91_product
+        from app.services.product_router import get_product_router
+        self._product(db, shop, '爱奇艺月卡', 'SKU1')
+        find_card91_product(shop.id, 'SKU1')
+        statements = []
+        listener = lambda *args: statements.append(args[2])
+        event.listen(db.engine, 'before_cursor_execute', listener)
+        try:
+            for _ in range(10):
+                assert find_card91_product(shop.id, 'SKU1') is not None
+                assert get_product_router().match(shop.id, None, '爱奇艺') is not None
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', listener)
+        assert statements == []
+
+    def test_invalidated_by_product_routes(self, client, admin_user, db, shop):
+        from app.models.product import Product
+        from app.services.product_router import get_product_router
+        router = get_product_router()
+        login(client, 'admin', 'admin123')
+        client.post('/product/create', data={'shop_id': str(shop.id), 'product_name': '爱奇艺月卡',
+                                             'sku_id': 'SKU1', 'deliver_type': '1',
+                                             'card91_card_type_id': 'T1', 'is_enabled': '1'})
+        product = router.by_sku(shop.id, 'SKU1')
+        assert product.card91_card_type_id == 'T1'
+        client.post(f'/product/edit/{product.id}', data={'shop_id': str(shop.id), 'product_name': '爱奇艺月卡',
+                                                         'sku_id': 'SKU1', 'deliver_type': '1',
+                                                         'card91_card_type_id': 'T2', 'is_enabled': '1'})
+        assert router.by_sku(shop.id, 'SKU1').card91_card_type_id == 'T2'
+        client.post(f'/product/delete/{product.id}')
+        assert db.session.get(Product, product.id) is None
+        assert router.by_sku(shop.id, 'SKU1') is None
+
+    def test_manual_deliver_matches_by_name(self, client, admin_user, db, shop, monkeypatch):
+        from app.services import card_pool
+        shop.card91_api_key = 'KEY'
+        self._product(db, shop, '爱奇艺黄金VIP月卡 官方直充', 'SKU1')
+        order = Order(order_no='ROUTE1', jd_order_no='JDROUTE1', shop_id=shop.id, shop_type=shop.shop_type,
+                      order_type=2, order_status=0, amount=100, quantity=1, product_info='爱奇艺黄金vip月卡')
+        db.session.add(order)
+        db.session.commit()
+        picked = []
+        monkeypatch.setattr(card_pool, 'card91_auto_deliver',
+                            lambda s, o, p, detail=None: (picked.append(p.product_name), (False, '库存不足', []))[1])
+        login(client, 'admin', 'admin123')
+        data = client.post(f'/order/{order.id}/card91-deliver').get_json()
+        assert data == {'success': False, 'message': '库存不足'}
+        assert picked == ['爱奇艺黄金VIP月卡 官方直充']
+
+
+# ---- 直充引擎测试 ----
+
+class TestDirectCharge:
+    def _product(self, db, shop, sku_id='SKU_DC', **config):
+        from app.models.product import Product
+        product = Product(shop_id=shop.id, product_name='游戏直充', sku_id=sku_id, deliver_type=2, is_enabled=1,
+                          direct_charge_api_type='mock', direct_charge_api_config=json.dumps(config))
+        db.session.add(product)
+        db.session.commit()
+        return product
+
+    def _orders(self, db, shop, product, n, prefix='DC', **fields):
+        from app.services.direct_charge import build_direct_charge_task
+        orders = []
+        for i in range(n):
+            order = Order(order_no=f'{prefix}{i}', jd_order_no=f'JD{prefix}{i}', shop_id=shop.id,
+                          shop_type=shop.shop_type, order_type=1, order_status=0, amount=100, quantity=1,
+                          sku_id=product.sku_id, produce_account=fields.get('account', f'acc{i}'))
+            db.session.add_all([order, build_direct_charge_task(order, shop, product)])
+            orders.append(order)
+        db.session.commit()
+        return orders
+
+    def _due(self, db):
+        from datetime import datetime, timedelta
+        from app.models.direct_charge import DirectChargeTask
+        DirectChargeTask.query.update({'next_run_time': datetime.now() - timedelta(seconds=1)})
+        db.session.commit()
+
+    def _patch_callback(self, monkeypatch, ok=True):
+        from app.services import direct_charge
+        calls = []
+        monkeypatch.setattr(direct_charge, 'send_callback',
+                            lambda s, o, t: (calls.append(o.order_no), (ok, '回调成功' if ok else '回调超时'))[1])
+        return calls
+
+    def test_ingest_creates_task(self, client, admin_user, db, shop):
+        from app.models.direct_charge import DirectChargeTask
+        from app.models.product import Product
+        shop.game_customer_id = 'C001'
+        self._product(db, shop)
+        client.post('/api/game/direct', data=jd_game_push('JD_DC_1', skuId='SKU_DC'))
+        client.post('/api/game/direct', data=jd_game_push('JD_DC_2', skuId='SKU_OTHER'))
+        order = Order.query.filter_by(jd_order_no='JD_DC_1').one()
+        task = DirectChargeTask.query.one()
+        assert task.order_id == order.id and task.supplier == 'mock' and task.status == 0
+
+        # 供应商配置不完整时不能保存
+        login(client, 'admin', 'admin123')
+        resp = client.post('/product/create', data={'shop_id': str(shop.id), 'product_name': '直充商品',
+                                                    'deliver_type': '2', 'direct_charge_api_type': 'http_json',
+                                                    'direct_charge_api_config': '{"app_key": "K"}'})
+        assert '缺少配置项' in resp.get_data(as_text=True)
+        assert Product.query.filter_by(product_name='直充商品').count() == 0
+
+    def test_mock_supplier_only_in_testing(self, app, db, shop):
+        from app.services.direct_charge import find_direct_charge_product
+        from app.services.direct_charge_suppliers import (
+            MockSupplier, ChargeRequest, supplier_choices, validate_product_config,
+        )
+        self._product(db, shop)
+        assert 'mock' in dict(supplier_choices())
+        app.config.update(TESTING=False, DIRECT_CHARGE_MOCK_ENABLED=False)
+        assert 'mock' not in dict(supplier_choices()) and 'http_json' in dict(supplier_choices())
+        assert '未知的直充供应商类型' in validate_product_config('mock', '{}')
+        assert find_direct_charge_product(shop.id, 'SKU_DC') is None
+        app.config['DIRECT_CHARGE_MOCK_ENABLED'] = True
+        assert find_direct_charge_product(shop.id, 'SKU_DC') is not None
+
+        # 调用记录有上限
+        supplier = MockSupplier({})
+        for i in range(MockSupplier.CALL_LOG_SIZE + 10):
+            supplier.submit(ChargeRequest(f'M{i}', None, 'acc', 1, 100, None, None, None))
+        assert len(supplier.calls) == MockSupplier.CALL_LOG_SIZE
+        supplier.close()
+
+    def test_immediate_success_notifies_jd(self, app, db, shop, monkeypatch):
+        from app.models.direct_charge import DirectChargeTask
+        from app.models.order_event import OrderEvent
+        from app.services.direct_charge import run_direct_charge_cycle
+        calls = self._patch_callback(monkeypatch)
+        product = self._product(db, shop)
+        orders = self._orders(db, shop, product, 3)
+        stats = run_direct_charge_cycle()
+        assert (stats['submitted'], stats['succeeded'], stats['notified']) == (3, 3, 3)
+        assert sorted(calls) == ['DC0', 'DC1', 'DC2']
+        db.session.expire_all()
+        for order in orders:
+            assert (order.order_status, order.notify_status) == (2, 1)
+            assert OrderEvent.query.filter_by(order_id=order.id, event_type='direct_charge', result='success').count() == 1
+        assert {t.status for t in DirectChargeTask.query} == {DirectChargeTask.STATUS_SUCCESS}
+        assert DirectChargeTask.query.first().supplier_order_no == 'MOCK' + orders[0].order_no
+        assert run_direct_charge_cycle() == {}
+
+    def test_batched_polling(self, app, db, shop, monkeypatch):
+        from app.models.direct_charge import DirectChargeTask
+        from app.services.direct_charge import get_direct_charge_engine, run_direct_charge_cycle
+        calls = self._patch_callback(monkeypatch)
+        config = {'pending_polls': 2, 'query_batch_size': 2}
+        product = self._product(db, shop, **config)
+        orders = self._orders(db, shop, product, 5)
+        run_direct_charge_cycle()
+        assert {t.status for t in DirectChargeTask.query} == {DirectChargeTask.STATUS_CHARGING}
+        assert orders[0].order_status == 1
+        # 未到查询时间不查询
+        assert run_direct_charge_cycle() == {}
+
+        self._due(db)
+        assert run_direct_charge_cycle()['polled'] == 5
+        self._due(db)
+        stats = run_direct_charge_cycle()
+        assert stats['succeeded'] == 5 and len(calls) == 5
+        supplier = get_direct_charge_engine().supplier('mock', config)[1]
+        assert [len(nos) for kind, nos in supplier.calls if kind == 'query'] == [2, 2, 1, 2, 2, 1]
+        assert {t.polls for t in DirectChargeTask.query} == {2}
+
+    def test_gives_up_after_max_polls(self, app, db, shop, monkeypatch):
+        from app.models.direct_charge import DirectChargeTask
+        from app.models.order_event import OrderEvent
+        from app.services.direct_charge import run_direct_charge_cycle
+        calls = self._patch_callback(monkeypatch)
+        app.config['DIRECT_CHARGE_MAX_POLLS'] = 2
+        # 上游一直充值中
+        product = self._product(db, shop, pending_polls=100)
+        order = self._orders(db, shop, product, 1)[0]
+        run_direct_charge_cycle()
+        for _ in range(2):
+            self._due(db)
+            run_direct_charge_cycle()
+        task = DirectChargeTask.query.one()
+        db.session.expire_all()
+        assert task.status == DirectChargeTask.STATUS_FAILED and task.polls == 2
+        assert '已查询2次仍未确认充值结果' in task.last_error
+        assert order.order_status == 5 and calls == []
+        assert OrderEvent.query.filter_by(order_id=order.id, event_type='error').count() == 1
+        self._due(db)
+        assert run_direct_charge_cycle() == {}
+
+    def test_supplier_concurrency_bounded(self, app, db, shop, monkeypatch):
+        import threading
+        from collections import Counter
+        from app.services.direct_charge import run_direct_charge_cycle
+        from app.services.direct_charge_suppliers import MockSupplier
+        self._patch_callback(monkeypatch)
+        app.config['DIRECT_CHARGE_THREADS'] = 8
+        a = self._product(db, shop, 'SKU_A', delay_ms=50, max_concurrency=2, account_prefix='a')
+        b = self._product(db, shop, 'SKU_B', delay_ms=50, max_concurrency=2, account_prefix='b')
+        self._orders(db, shop, a, 6, prefix='A')
+        self._orders(db, shop, b, 6, prefix='B')
+        lock = threading.Lock()
+        running, peak = Counter(), Counter()
+        original = MockSupplier.submit
+
+        def tracked(supplier, request):
+            key = supplier.config['account_prefix']
+            with lock:
+                running[key] += 1
+                peak[key] = max(peak[key], running[key])
+                peak['all'] = max(peak['all'], running['a'] + running['b'])
+            try:
+                return original(supplier, request)
+            finally:
+                with lock:
+                    running[key] -= 1
+
+        monkeypatch.setattr(MockSupplier, 'submit', tracked)
+        assert run_direct_charge_cycle()['succeeded'] == 12
+        assert peak['a'] <= 2 and peak['b'] <= 2
+        assert peak['all'] > 2
+
+    def test_failures(self, app, db, shop, monkeypatch):
+        from app.models.callback_outbox import CallbackOutbox
+        from app.models.direct_charge import DirectChargeTask
+        from app.services.direct_charge import run_direct_charge_cycle
+        from app.services.direct_charge_suppliers import MockSupplier
+        self._patch_callback(monkeypatch, ok=False)
+        product = self._product(db, shop, fail_accounts=['bad'])
+        bad = self._orders(db, shop, product, 1, prefix='BAD', account='bad')[0]
+        lost = self._orders(db, shop, product, 1, prefix='LOST')[0]
+
+        # 提交超时：不确定上游是否受理，先查询，上游无此订单时才重新提交
+        original = MockSupplier.submit
+        timeouts = []
+
+        def flaky(supplier, request):
+            if request.order_no == 'LOST0' and not timeouts:
+                timeouts.append(request.order_no)
+                raise TimeoutError('read timeout')
+            return original(supplier, request)
+
+        monkeypatch.setattr(MockSupplier, 'submit', flaky)
+        assert run_direct_charge_cycle()['failed'] == 1
+        db.session.expire_all()
+        assert bad.order_status == 5
+        assert DirectChargeTask.query.filter_by(order_id=bad.id).one().status == DirectChargeTask.STATUS_FAILED
+        task = DirectChargeTask.query.filter_by(order_id=lost.id).one()
+        assert task.status == DirectChargeTask.STATUS_CHARGING
+
+        self._due(db)
+        run_direct_charge_cycle()
+        assert task.status == DirectChargeTask.STATUS_PENDING and task.attempts == 1
+        run_direct_charge_cycle()
+        db.session.expire_all()
+        assert task.status == DirectChargeTask.STATUS_SUCCESS and task.attempts == 2
+        # 充值成功但回调京东失败：登记回调发件箱
+        assert lost.notify_status == 2
+        assert CallbackOutbox.query.filter_by(order_id=lost.id, callback_type='deliver').count() == 1
@@ -0,0 +1,34 @@
+"""发货 worker 进程：领取 fulfillment_jobs 中的任务执行91卡券提卡与京东回调，
+定时重发 callback_outbox 中失败的京东回调，执行订单后台导出任务和批量操作任务，为开启本地库存的91卡券商品补货，
+提交直充订单到上游供应商并查询充值结果，并每天归档过期日志。
+
+    python worker.py
+"""
+import logging
+
+from dotenv import load_dotenv
+load_dotenv()  # 必须在导入app之前加载环境变量
+
+from app import create_app
+from app.services.fulfillment import run_worker
+from app.services.callback_outbox import start_outbox_scheduler
+from app.services.log_archive import schedule_log_archive
+from app.services.order_export import schedule_export_jobs
+from app.services.bulk_actions import schedule_bulk_jobs
+from app.services.card_pool import schedule_card_pool
+from app.services.direct_charge import schedule_direct_charge
+
+app = create_app()
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(name)s: %(message)s')
+    scheduler = start_outbox_scheduler(app)
+    schedule_log_archive(scheduler, app)
+    schedule_export_jobs(scheduler, app)
+    schedule_bulk_jobs(scheduler, app)
+    schedule_card_pool(scheduler, app)
+    schedule_direct_charge(scheduler, app)
+    try:
+        run_worker(app)
+    finally:
+        scheduler.shutdown(wait=False)